@@ -0,0 +1,155 @@
+"""
+Arranque del bot: migraciones del esquema (db_manager.MIGRACIONES) e imports.
+
+Sobre un libro sintético (datos.py):
+  1. mide setup_database en una BD anterior al versionado (user_version 0:
+     aplica todas las migraciones) y en los arranques siguientes, que con el
+     esquema al día no deben aplicar ninguna
+  2. vuelve a aplicar las migraciones sobre la BD ya migrada y comprueba que
+     el esquema y los datos no cambian (un paso cortado se repite al arrancar)
+  3. en un proceso nuevo mide el import de bot.py y crear_aplicacion(), y
+     comprueba que los módulos de comandos no se cargaron todavía
+
+Uso:
+    python benchmarks/arranque.py [--movimientos 300000] [--repeticiones 5]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from comun import RAIZ
+from datos import generar
+import db_manager
+from db_manager import ESQUEMA_VERSION, setup_database
+
+# Módulos que bot.py importa recién con el primer comando que los usa
+PEREZOSOS = ("handlers.contabilidad", "handlers.inventario", "handlers.lote")
+
+# Se ejecuta en un proceso nuevo: imports en frío (con los .pyc ya compilados)
+_MEDIR_IMPORTS = """
+import json, sys, time, types
+inicio = time.perf_counter()
+sys.modules.setdefault("config_secret", types.SimpleNamespace(TOKEN="123456:ARRANQUE", ADMIN_USER_IDS=[1]))
+import bot
+importado = time.perf_counter()
+bot.crear_aplicacion("123456:ARRANQUE")
+fin = time.perf_counter()
+print(json.dumps({
+    "imports_ms": (importado - inicio) * 1000,
+    "aplicacion_ms": (fin - importado) * 1000,
+    "cargados": sorted(m for m in sys.modules if m.startswith("handlers.")),
+}))
+"""
+
+
+def _version(db_path: str) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _poner_version(db_path: str, version: int) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA user_version = {version}")
+    conn.close()
+
+
+def _estado(db_path: str) -> tuple:
+    """Esquema completo y filas por tabla."""
+    conn = sqlite3.connect(db_path)
+    try:
+        esquema = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY type, name"
+        ).fetchall()
+        filas = {
+            nombre: conn.execute(f"SELECT COUNT(*) FROM {nombre}").fetchone()[0]
+            for tipo, nombre, _ in esquema if tipo == "table"
+        }
+        return esquema, filas
+    finally:
+        conn.close()
+
+
+def _contar_migraciones() -> list:
+    """Envuelve cada paso de MIGRACIONES para registrar cuáles se ejecutan."""
+    ejecutadas = []
+    for i, (descripcion, migrar) in enumerate(db_manager.MIGRACIONES):
+        def _contada(conn, ruta, _descripcion=descripcion, _migrar=migrar):
+            ejecutadas.append(_descripcion)
+            _migrar(conn, ruta)
+        db_manager.MIGRACIONES[i] = (descripcion, _contada)
+    return ejecutadas
+
+
+def _setup(db_path: str) -> tuple:
+    inicio = time.perf_counter()
+    aplicadas = setup_database(db_path)
+    return (time.perf_counter() - inicio) * 1000, aplicadas
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movimientos", type=int, default=300_000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    opciones = parser.parse_args()
+
+    errores = []
+    ejecutadas = _contar_migraciones()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "arranque.db")
+        print(f"Generando {opciones.movimientos:,} movimientos...")
+        generar(db_path, opciones.movimientos)
+
+        # 1. BD anterior al versionado, y después los arranques de todos los días
+        _poner_version(db_path, 0)
+        ejecutadas.clear()
+        primera, aplicadas = _setup(db_path)
+        if aplicadas != ESQUEMA_VERSION or _version(db_path) != ESQUEMA_VERSION:
+            errores.append(f"la BD quedó en la versión {_version(db_path)} ({aplicadas} migraciones aplicadas)")
+        migrada = _estado(db_path)
+
+        ejecutadas.clear()
+        siguientes = [_setup(db_path) for _ in range(opciones.repeticiones)]
+        if ejecutadas or any(aplicadas for _, aplicadas in siguientes):
+            errores.append(f"con el esquema al día se aplicaron migraciones: {ejecutadas}")
+
+        # 2. Repetir las migraciones (como tras un corte a mitad) no cambia nada
+        _poner_version(db_path, 0)
+        repetida, _ = _setup(db_path)
+        if _estado(db_path) != migrada:
+            errores.append("repetir las migraciones cambió el esquema o los datos")
+
+        print(f"esquema v{ESQUEMA_VERSION} ({len(db_manager.MIGRACIONES)} migraciones), {opciones.movimientos:,} movimientos")
+        print(f"  setup_database desde v0:        {primera:8.1f} ms")
+        print(f"  setup_database con v al día:    {statistics.median(ms for ms, _ in siguientes):8.1f} ms (mediana)")
+        print(f"  migraciones repetidas sobre v{ESQUEMA_VERSION}: {repetida:8.1f} ms")
+
+    # 3. Imports y registro de handlers en un proceso nuevo
+    mediciones = []
+    for _ in range(opciones.repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", _MEDIR_IMPORTS], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout
+        mediciones.append(json.loads(salida.strip().splitlines()[-1]))
+    cargados = set(mediciones[0]["cargados"])
+    for modulo in PEREZOSOS:
+        if modulo in cargados:
+            errores.append(f"{modulo} se importó al arrancar")
+    print(f"  import bot:                     {min(m['imports_ms'] for m in mediciones):8.1f} ms (mínimo)")
+    print(f"  crear_aplicacion:               {min(m['aplicacion_ms'] for m in mediciones):8.1f} ms (mínimo)")
+    print(f"  módulos de comandos sin cargar: {', '.join(m for m in PEREZOSOS if m not in cargados) or '-'}")
+
+    for error in errores[:20]:
+        print(f"  ✗ {error}")
+    print("  ✓ migraciones solo cuando hacen falta e idempotentes" if not errores else f"  {len(errores)} errores")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
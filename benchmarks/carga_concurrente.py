@@ -0,0 +1,164 @@
+"""
+Prueba de carga: dispara /balance y /venta concurrentes mientras corren
+reportes pesados (/ganancia con rango, /exportar) y reporta la latencia
+p50/p99 por comando.
+
+Uso:
+    python benchmarks/carga_concurrente.py [--movimientos 200000] [--peticiones 200] [--limite-p99-ms 1000]
+
+Se ejecuta dos veces sobre una BD temporal con datos sintéticos:
+  - "antes":   el trabajo de SQLite corre dentro del event loop (ejecutor en línea)
+  - "después": los comandos cortos corren en los hilos de db_executor y los
+               reportes en los de db_reportes
+En "después" el p99 de /balance y /venta debe quedar por debajo de
+--limite-p99-ms aunque los reportes ocupen todos sus hilos.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import Executor, Future
+
+from comun import ADMIN_ID, contexto_falso, update_falso, usar_bd, cerrar_bd
+from handlers import db_utils
+from handlers.contabilidad import balance_command, exportar_command
+from handlers.inventario import venta_command, ganancia_command
+
+
+class _EjecutorEnLinea(Executor):
+    """Ejecuta las tareas en el hilo que las envía (simula el acceso a BD bloqueante)."""
+
+    def submit(self, fn, *args, **kwargs):
+        futuro = Future()
+        try:
+            futuro.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            futuro.set_exception(e)
+        return futuro
+
+    def shutdown(self, wait=True, **kwargs):
+        pass
+
+
+def _poblar_bd(db_path: str, n_movimientos: int) -> None:
+    """Crea el esquema y genera movimientos y un producto con stock (y su lote) de sobra."""
+    usar_bd(db_path)
+    conn = sqlite3.connect(db_path)
+    tipos = ['ingreso', 'gasto', 'venta']
+    filas = []
+    for i in range(n_movimientos):
+        tipo = random.choice(tipos)
+        descripcion = (
+            f"VENTA: 1 x PROD01 | REVENUE: 10.00 USD | CMV: 6.00 USD | CAJA: cfg | NOTA: carga {i}"
+            if tipo == 'venta' else "carga"
+        )
+        filas.append((tipo, random.uniform(1, 100), random.choice(['usd', 'cup']),
+                      random.choice(['cfg', 'sc', 'trd']), ADMIN_ID, descripcion))
+    conn.executemany(
+        "INSERT INTO Movimientos (tipo, monto, moneda, caja, user_id, descripcion) VALUES (?, ?, ?, ?, ?, ?)",
+        filas
+    )
+    conn.execute(
+        "INSERT INTO Productos (codigo, nombre, costo_unitario, moneda_costo, stock) VALUES ('PROD01', 'PROD01', 6, 'usd', 1e9)"
+    )
+    # Su lote de costo: sin él cada /venta costearía al promedio y avisaría en el log
+    conn.execute("""
+        INSERT INTO LotesInventario (codigo, cantidad_inicial, cantidad_restante, costo_unitario, moneda_costo)
+        VALUES ('PROD01', 1e9, 1e9, 6, 'usd')
+    """)
+    db_utils.MovimientoManager.reconstruir_saldos(conn)
+    conn.commit()
+    conn.close()
+
+
+async def _medir(nombre: str, handler, args: list, latencias: dict) -> None:
+    inicio = time.perf_counter()
+    await handler(update_falso(), contexto_falso(args))
+    latencias.setdefault(nombre, []).append((time.perf_counter() - inicio) * 1000)
+
+
+def _percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+async def _medir_event_loop(latencias: dict, fin: asyncio.Event) -> None:
+    """Mide el retraso del event loop (lo que sufre cualquier comando sin BD)."""
+    while not fin.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(0.01)
+        latencias.setdefault("event_loop", []).append((time.perf_counter() - inicio - 0.01) * 1000)
+
+
+async def _escenario(peticiones: int) -> dict:
+    latencias = {}
+    fin = asyncio.Event()
+    monitor = asyncio.create_task(_medir_event_loop(latencias, fin))
+    tareas = []
+    # Reportes pesados en paralelo con las peticiones cortas
+    for _ in range(4):
+        tareas.append(_medir("ganancia", ganancia_command, ["2000-01-01", "2100-12-31"], latencias))
+        tareas.append(_medir("exportar", exportar_command, [], latencias))
+    for _ in range(peticiones):
+        tareas.append(_medir("balance", balance_command, [], latencias))
+        tareas.append(_medir("venta", venta_command, ["PROD01", "1", "10", "usd", "cfg", "carga"], latencias))
+    random.shuffle(tareas)
+    await asyncio.gather(*tareas)
+    fin.set()
+    await monitor
+    return latencias
+
+
+# Comandos cortos cuya latencia no debe depender de los reportes
+CORTOS = ("balance", "venta")
+
+
+def _ejecutar(modo: str, peticiones: int) -> dict:
+    cerrar_bd()
+    if modo == "antes":
+        db_utils.db_executor._executor = _EjecutorEnLinea()
+        db_utils.db_reportes._executor = _EjecutorEnLinea()
+
+    latencias = asyncio.run(_escenario(peticiones))
+
+    cerrar_bd()
+    print(f"\n=== {modo.upper()} ===")
+    print(f"{'comando':<10} {'n':>6} {'p50 ms':>10} {'p99 ms':>10}")
+    for nombre in ("balance", "venta", "ganancia", "exportar", "event_loop"):
+        valores = latencias.get(nombre, [])
+        if valores:
+            print(f"{nombre:<10} {len(valores):>6} {statistics.median(valores):>10.1f} {_percentil(valores, 99):>10.1f}")
+    return latencias
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movimientos", type=int, default=200_000)
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--limite-p99-ms", type=float, default=1000.0)
+    opciones = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "carga.db")
+        _poblar_bd(db_path, opciones.movimientos)
+        _ejecutar("antes", opciones.peticiones)
+        latencias = _ejecutar("después", opciones.peticiones)
+
+    errores = [
+        f"{nombre}: p99 {_percentil(latencias[nombre], 99):.1f} ms (límite {opciones.limite_p99_ms:.0f} ms)"
+        for nombre in CORTOS if _percentil(latencias[nombre], 99) > opciones.limite_p99_ms
+    ]
+    for error in errores:
+        print(f"  ✗ {error}")
+    print("\n  ✓ comandos cortos acotados con los reportes corriendo" if not errores else f"  {len(errores)} errores")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Cierre de periodos (/cierre): tamaño de la tabla caliente y latencia de los
+comandos que recorren Movimientos, antes y después de archivar.
+
+Sobre un libro sintético de un año (datos.py):
+  1. mide /verificar_saldos, /historial 7, /historial 365 y /exportar
+  2. simula un cierre cortado entre la copia al archivo y el borrado (con un
+     corte posterior, así la copia sobra) y reinicia: lo deshace el próximo /cierre
+  3. cierra con /cierre (por defecto, todo hasta el mes anterior) y vuelve a medir
+  4. verifica que nada cambió para el usuario: SaldosCaja, cuadre contra el
+     libro, GananciaDiaria reconstruida, filas exportadas y una /venta posterior
+
+Uso:
+    python benchmarks/cierre.py [--movimientos 200000] [--periodo 2025-06] [--repeticiones 5]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from comun import contexto_falso, update_falso, usar_bd, cerrar_bd
+from datos import generar, PRODUCTO_VENTA
+from db_manager import setup_database
+from handlers import db_utils
+from handlers.contabilidad import (
+    verificar_saldos_command, historial_command, exportar_command, cierre_command, ARGS_CIERRE
+)
+from handlers.inventario import venta_command
+
+COMANDOS = [
+    ("verificar_saldos", verificar_saldos_command, []),
+    ("historial_7", historial_command, ["7"]),
+    ("historial_365", historial_command, ["365"]),
+    ("exportar", exportar_command, ["movimientos"]),
+]
+
+
+def _estado(db_path: str) -> dict:
+    conn = db_utils.adjuntar_archivo(sqlite3.connect(db_path), db_path)
+    estado = {
+        "caliente": conn.execute("SELECT COUNT(*) FROM main.Movimientos").fetchone()[0],
+        "archivo": conn.execute("SELECT COUNT(*) FROM archivo.Movimientos").fetchone()[0],
+        "reales": conn.execute("SELECT COUNT(*) FROM MovimientosTodos WHERE tipo != 'apertura'").fetchone()[0],
+        "saldos": conn.execute("SELECT caja, moneda, ROUND(saldo, 4) FROM SaldosCaja ORDER BY 1, 2").fetchall(),
+        "ganancia": conn.execute(
+            "SELECT fecha, codigo, moneda_ingreso, moneda_cmv, ROUND(ingreso, 4), ROUND(cmv_usd, 4), ventas "
+            "FROM GananciaDiaria ORDER BY 1, 2, 3, 4"
+        ).fetchall(),
+    }
+    conn.close()
+    return estado
+
+
+async def _medir(repeticiones: int) -> dict:
+    resultados = {}
+    for nombre, handler, args in COMANDOS:
+        await handler(update_falso(), contexto_falso(args))  # calentamiento
+        latencias = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            await handler(update_falso(), contexto_falso(args))
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        resultados[nombre] = statistics.median(latencias)
+    return resultados
+
+
+async def _cerrar(periodo: list) -> str:
+    update = update_falso()
+    await cierre_command(update, contexto_falso(periodo + ["confirmar"]))
+    return update.message.respuestas[-1]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movimientos", type=int, default=200_000)
+    parser.add_argument("--periodo", help="AAAA-MM o AAAA-MM-DD a cerrar (por defecto, hasta el mes anterior)")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    opciones = parser.parse_args()
+    periodo = [opciones.periodo] if opciones.periodo else []
+    # Mismo corte que calcula /cierre (sin periodo: el primer día del mes en curso)
+    corte = (ARGS_CIERRE.parsear(periodo).corte or date.today().replace(day=1)).isoformat()
+
+    errores = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cierre.db")
+        print(f"Generando {opciones.movimientos:,} movimientos...")
+        generar(db_path, opciones.movimientos)
+        usar_bd(db_path)
+        antes = _estado(db_path)
+        try:
+            tiempos_antes = asyncio.run(_medir(opciones.repeticiones))
+
+            # Cierre cortado después de la fase 1, con un corte posterior: si el próximo /cierre no
+            # descartara la copia, lo que queda en la tabla caliente se vería dos veces
+            cerrar_bd()
+            with db_utils.get_db_connection() as conn:
+                copiados = db_utils.CierreManager.copiar_al_archivo(conn, (date.today() + timedelta(days=1)).isoformat())
+            cerrar_bd()
+            setup_database(db_path)
+            print(f"Cierre interrumpido: {copiados:,} copiados al archivo antes de reiniciar")
+
+            inicio = time.perf_counter()
+            print(asyncio.run(_cerrar(periodo)).replace("<b>", "").replace("</b>", ""))
+            print(f"/cierre en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+            tiempos_despues = asyncio.run(_medir(opciones.repeticiones))
+
+            despues = _estado(db_path)
+            cerrar_bd()
+            # La ganancia histórica se puede reconstruir también con las ventas archivadas
+            setup_database(db_path)
+            with db_utils.get_db_connection() as conn:
+                db_utils.VentaManager.reconstruir_ganancia_diaria(conn)
+                diferencias = db_utils.MovimientoManager.verificar_saldos(conn)
+            reconstruido = _estado(db_path)
+
+            update = update_falso()
+            asyncio.run(venta_command(update, contexto_falso([PRODUCTO_VENTA, "1", "10", "usd", "sc", "post cierre"])))
+            with db_utils.get_db_connection() as conn:
+                diferencias += db_utils.MovimientoManager.verificar_saldos(conn)
+        finally:
+            cerrar_bd()
+
+    print(f"\nMovimientos en la tabla caliente: {antes['caliente']:,} -> {despues['caliente']:,} "
+          f"(archivo: {despues['archivo']:,})")
+    print(f"{'comando':<18} {'antes ms':>9} {'después ms':>11}")
+    for nombre, _, _ in COMANDOS:
+        print(f"{nombre:<18} {tiempos_antes[nombre]:>9.2f} {tiempos_despues[nombre]:>11.2f}")
+
+    if despues["saldos"] != antes["saldos"]:
+        errores.append("SaldosCaja cambió con el cierre")
+    if despues["reales"] != antes["reales"]:
+        errores.append(f"movimientos visibles {despues['reales']} != {antes['reales']}")
+    if reconstruido["ganancia"] != antes["ganancia"]:
+        errores.append("GananciaDiaria reconstruida no coincide con la original")
+    if diferencias:
+        errores.append(f"SaldosCaja no cuadra con el libro: {diferencias}")
+    if "✅" not in update.message.respuestas[-1]:
+        errores.append(f"/venta después del cierre falló: {update.message.respuestas[-1]}")
+
+    for error in errores:
+        print(f"  ✗ {error}")
+    print("  ✓ invariantes OK" if not errores else f"  {len(errores)} invariantes violados")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
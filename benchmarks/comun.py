@@ -0,0 +1,94 @@
+"""
+Utilidades compartidas por los scripts de benchmarks/: objetos Update/Context
+falsos y una BD temporal con el esquema del bot.
+
+Los scripts se ejecutan desde la raíz del repositorio:
+    python benchmarks/<script>.py
+"""
+import os
+import sys
+import types
+from types import SimpleNamespace
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+# Los handlers importan TOKEN/ADMIN_USER_IDS de config_secret (no versionado)
+try:
+    import config_secret  # noqa: F401
+except ImportError:
+    sys.modules["config_secret"] = types.SimpleNamespace(TOKEN="", ADMIN_USER_IDS=[1])
+    import config_secret  # noqa: F401
+
+from db_manager import setup_database  # noqa: E402
+from handlers import db_utils  # noqa: E402
+
+ADMIN_ID = config_secret.ADMIN_USER_IDS[0]
+
+
+class MensajeFalso:
+    """Sustituto mínimo de telegram.Message que guarda las respuestas."""
+
+    def __init__(self):
+        self.respuestas = []
+
+    async def reply_html(self, text, **kwargs):
+        self.respuestas.append(text)
+
+    async def reply_text(self, text, **kwargs):
+        self.respuestas.append(text)
+
+    async def reply_document(self, document=None, **kwargs):
+        self.respuestas.append(kwargs.get("filename", ""))
+
+
+class CallbackQueryFalsa:
+    """Sustituto mínimo de telegram.CallbackQuery (botones inline)."""
+
+    def __init__(self, data: str, user_id: int = ADMIN_ID):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.respuestas = []
+        self.reply_markup = None
+
+    async def answer(self, text=None, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.respuestas.append(text)
+        self.reply_markup = reply_markup
+
+
+def update_falso(user_id: int = ADMIN_ID, callback_data: str = None, update_id: int = None) -> SimpleNamespace:
+    mensaje = MensajeFalso()
+    mensaje.message_id = update_id
+    return SimpleNamespace(
+        update_id=update_id,
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+        effective_message=mensaje,
+        message=mensaje,
+        callback_query=CallbackQueryFalsa(callback_data, user_id) if callback_data else None,
+    )
+
+
+def contexto_falso(args: list) -> SimpleNamespace:
+    return SimpleNamespace(args=list(args), bot_data={}, chat_data={}, user_data={})
+
+
+def usar_bd(db_path: str, pool: "db_utils.ConnectionPool" = None) -> None:
+    """Crea el esquema en db_path y apunta el pool de los handlers a esa BD."""
+    setup_database(db_path)
+    db_utils.db_executor.cerrar()
+    db_utils.db_reportes.cerrar()
+    db_utils.db_pool.cerrar()
+    db_utils.DB_PATH = db_path
+    if pool is not None:
+        db_utils.db_pool = pool
+
+
+def cerrar_bd() -> None:
+    db_utils.db_executor.cerrar()
+    db_utils.db_reportes.cerrar()
+    db_utils.db_pool.cerrar()
@@ -0,0 +1,165 @@
+"""
+Generador de BDs sintéticas con el esquema del bot para los benchmarks.
+
+El volumen se da en movimientos; el resto de tablas escala en proporción:
+  - Productos:      1 por cada 100 movimientos (mínimo 100), con un lote de costo si tienen stock
+  - Deudas:         1 actor por cada 200 movimientos (mínimo 50), con deuda por pagar y por cobrar
+  - Consignaciones: 50 vendedores, un producto consignado por cada 20 productos
+  - Ventas:         1 de cada 3 movimientos, con su VentaDetalle y el resumen GananciaDiaria
+
+Uso directo (deja la BD lista para reutilizar con --datos en escalado.py):
+    python benchmarks/datos.py 1000000 /tmp/sintetico_1000000.db
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+from comun import ADMIN_ID  # (también añade la raíz del repo a sys.path)
+from config_vars import TASA_USD_CUP
+from db_manager import setup_database
+from handlers.db_utils import MovimientoManager, VentaManager, DeudaManager, adjuntar_archivo
+
+LOTE = 50_000  # Filas por executemany (memoria acotada incluso con 10M filas)
+VENDEDORES = [f"V{i:03d}" for i in range(50)]
+DIAS_HISTORIA = 365
+
+# Producto con stock de sobra para que /venta siempre tenga existencias
+PRODUCTO_VENTA = "BENCH01"
+
+
+def _en_lotes(filas, tamano: int = LOTE):
+    iterador = iter(filas)
+    while True:
+        lote = list(islice(iterador, tamano))
+        if not lote:
+            return
+        yield lote
+
+
+def _movimientos(n: int, n_productos: int, rnd: random.Random, inicio: datetime):
+    """Genera (fila_movimiento, fila_venta_detalle | None) en orden cronológico."""
+    paso = timedelta(days=DIAS_HISTORIA) / max(n, 1)
+    for i in range(n):
+        movimiento_id = i + 1
+        fecha = (inicio + paso * i).strftime('%Y-%m-%d %H:%M:%S')
+        caja = rnd.choice(('cfg', 'sc', 'trd'))
+        r = i % 3
+        if r == 0:
+            codigo = f"P{rnd.randrange(n_productos):06d}"
+            unidades = float(rnd.randint(1, 5))
+            moneda = rnd.choice(('usd', 'cup'))
+            ingreso = round(rnd.uniform(5, 200) * (TASA_USD_CUP if moneda == 'cup' else 1), 2)
+            cmv = round(unidades * rnd.uniform(1, 50), 2)
+            descripcion = (
+                f"VENTA: {unidades} x {codigo} | REVENUE: {ingreso:.2f} {moneda.upper()} | "
+                f"CMV: {cmv:.2f} USD | CAJA: {caja} | NOTA: sintética"
+            )
+            yield (
+                (movimiento_id, fecha, 'venta', ingreso, moneda, caja, ADMIN_ID, descripcion, TASA_USD_CUP),
+                (movimiento_id, codigo, unidades, None, 0, ingreso, moneda, cmv, 'usd'),
+            )
+        else:
+            tipo = 'ingreso' if r == 1 else 'gasto'
+            moneda = rnd.choice(('usd', 'cup', 'cup-t'))
+            monto = round(rnd.uniform(1, 500), 2)
+            yield (
+                (movimiento_id, fecha, tipo, monto, moneda, caja, ADMIN_ID, f"{tipo} sintético {i}", TASA_USD_CUP),
+                None,
+            )
+
+
+def generar(db_path: str, n_movimientos: int, semilla: int = 42) -> dict:
+    """
+    Crea el esquema en db_path y lo llena con datos sintéticos.
+    Retorna el conteo de filas por tabla.
+    """
+    rnd = random.Random(semilla)
+    setup_database(db_path)
+    conn = adjuntar_archivo(sqlite3.connect(db_path), db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    n_productos = max(100, n_movimientos // 100)
+    n_actores = max(50, n_movimientos // 200)
+    inicio = datetime.now() - timedelta(days=DIAS_HISTORIA)
+
+    # Productos (la mitad sin stock, como un catálogo real con artículos agotados)
+    conn.executemany(
+        "INSERT INTO Productos (codigo, nombre, costo_unitario, moneda_costo, stock) VALUES (?, ?, ?, 'usd', ?)",
+        ((f"P{i:06d}", f"Producto {i}", round(rnd.uniform(1, 50), 2), float(rnd.randint(0, 1) * rnd.randint(1, 100)))
+         for i in range(n_productos))
+    )
+    conn.execute(
+        "INSERT INTO Productos (codigo, nombre, costo_unitario, moneda_costo, stock) VALUES (?, ?, 6, 'usd', 1e12)",
+        (PRODUCTO_VENTA, PRODUCTO_VENTA)
+    )
+    # Un lote de costo por producto con stock (como tras la migración a LotesInventario)
+    conn.execute("""
+        INSERT INTO LotesInventario (codigo, fecha, cantidad_inicial, cantidad_restante, costo_unitario, moneda_costo, tasa_usd_cup)
+        SELECT codigo, ?, stock, stock, costo_unitario, moneda_costo, ? FROM Productos WHERE stock > 0
+    """, (inicio.strftime('%Y-%m-%d %H:%M:%S'), TASA_USD_CUP))
+
+    # Deudas: proveedores (POR_PAGAR) y vendedores (POR_COBRAR); una de cada tres ya saldada
+    conn.executemany(
+        "INSERT INTO Deudas (actor_id, tipo, monto_pendiente, moneda) VALUES (?, ?, ?, 'usd')",
+        ((f"A{i:06d}", tipo, 0.0 if i % 3 == 0 else round(rnd.uniform(1, 1000), 2))
+         for i in range(n_actores) for tipo in ('POR_PAGAR', 'POR_COBRAR'))
+    )
+
+    # Consignaciones
+    conn.executemany(
+        "INSERT INTO Consignaciones (codigo, vendedor, stock, precio_unitario, moneda, costo_unitario, moneda_costo) "
+        "VALUES (?, ?, ?, ?, 'usd', ?, 'usd')",
+        ((f"P{i:06d}", VENDEDORES[i % len(VENDEDORES)], float(rnd.randint(0, 10)), round(rnd.uniform(5, 80), 2),
+          round(rnd.uniform(1, 5), 2))
+         for i in range(0, n_productos, 20))
+    )
+
+    # Movimientos + VentaDetalle, por lotes
+    for lote in _en_lotes(_movimientos(n_movimientos, n_productos, rnd, inicio)):
+        conn.executemany("""
+            INSERT INTO Movimientos (id, fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (mov for mov, _ in lote))
+        conn.executemany("""
+            INSERT INTO VentaDetalle (
+                movimiento_id, codigo, unidades, vendedor, es_consignada,
+                ingreso, moneda_ingreso, cmv, moneda_cmv
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (detalle for _, detalle in lote if detalle is not None))
+        conn.commit()
+
+    # Tablas derivadas, igual que las dejaría el bot
+    conn.row_factory = sqlite3.Row
+    MovimientoManager.reconstruir_saldos(conn)
+    VentaManager.reconstruir_ganancia_diaria(conn)
+    DeudaManager.inicializar_diario(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    conteos = {
+        tabla: conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+        for tabla in ("Movimientos", "Productos", "LotesInventario", "Deudas", "Consignaciones", "VentaDetalle")
+    }
+    conn.close()
+    return conteos
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("movimientos", type=int)
+    parser.add_argument("db_path")
+    parser.add_argument("--semilla", type=int, default=42)
+    opciones = parser.parse_args()
+
+    inicio = time.perf_counter()
+    conteos = generar(opciones.db_path, opciones.movimientos, opciones.semilla)
+    print(f"BD generada en {time.perf_counter() - inicio:.1f} s: {conteos}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Cola de envíos (handlers/envios.py) contra una Bot API falsa con flood control.
+
+La Bot API falsa (aiohttp, localhost) acepta sendMessage y responde 429 con
+retry_after, como Telegram, si un chat recibe más de --chat-max mensajes en 1 s
+o el bot envía más de --global-max en 1 s. Con un BotEncolado real apuntando a
+ella se miden tres cosas:
+
+  1. Rendimiento: --chats chats con --mensajes respuestas cada uno, encoladas de
+     golpe. Todo debe llegar, en orden dentro de cada chat y sin ningún 429
+     (las cubetas de la cola ya respetan la cuota).
+  2. Flood control: la API responde un 429 (retry_after --flood-seg) a mitad
+     de camino. La cola debe pausar todo el envío ese tiempo, reintentar y no
+     perder ni desordenar nada.
+  3. Latencia del handler con --rtt-ms de demora en la API: tiempo que tarda
+     un handler en "responder" esperando a Telegram (ExtBot) frente a encolar.
+
+Uso:
+    python benchmarks/envios.py [--chats 20] [--mensajes 5] [--rtt-ms 150] [--flood-seg 1]
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import socket
+import sys
+import time
+
+from aiohttp import web
+
+import comun  # noqa: F401  (rutas y config_secret de prueba)
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from config_vars import ENVIOS_GLOBAL_POR_SEG, ENVIOS_CHAT_POR_SEG, ENVIOS_CHAT_RAFAGA
+from handlers.envios import BotEncolado, ColaEnvios, enviar_mensaje
+
+TOKEN_FALSO = "123456:BENCHMARK"
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BotAPIConCuota:
+    """Bot API mínima que aplica flood control por chat y global con ventanas de 1 s."""
+
+    def __init__(self, chat_max: int, global_max: int, rtt_ms: float = 0):
+        self.chat_max = chat_max
+        self.global_max = global_max
+        self.rtt = rtt_ms / 1000
+        self.recibidos = collections.defaultdict(list)  # chat_id -> textos aceptados, en orden de llegada
+        self.aceptados = collections.deque()  # (instante, chat_id) del último segundo
+        self.instantes = []  # instante de cada mensaje aceptado
+        self.rechazos_429 = 0
+        self.flood_tras = None  # (aceptados, retry_after): 429 forzado al llegar a esa cantidad de aceptados
+        self.pausa_hasta = 0.0
+
+    def _rechazar(self, retry_after: float) -> web.Response:
+        self.rechazos_429 += 1
+        return web.json_response({
+            "ok": False, "error_code": 429,
+            "description": f"Too Many Requests: retry after {retry_after:g}",
+            "parameters": {"retry_after": retry_after},
+        }, status=429)
+
+    async def manejar(self, request: web.Request) -> web.Response:
+        metodo = request.match_info["metodo"]
+        parametros = await request.json() if request.content_type == "application/json" else dict(await request.post())
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        if metodo == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "ContaBot", "username": "contabot_test"}})
+        if metodo != "sendMessage":
+            return web.json_response({"ok": True, "result": True})
+
+        ahora = time.monotonic()
+        chat_id = int(parametros["chat_id"])
+        if self.flood_tras and len(self.instantes) >= self.flood_tras[0]:
+            espera, self.flood_tras = self.flood_tras[1], None
+            self.pausa_hasta = ahora + espera
+            return self._rechazar(espera)
+        if ahora < self.pausa_hasta:
+            return self._rechazar(self.pausa_hasta - ahora)
+        while self.aceptados and self.aceptados[0][0] < ahora - 1:
+            self.aceptados.popleft()
+        if len(self.aceptados) >= self.global_max:
+            return self._rechazar(1)
+        if sum(1 for _, chat in self.aceptados if chat == chat_id) >= self.chat_max:
+            return self._rechazar(1)
+
+        self.aceptados.append((ahora, chat_id))
+        self.instantes.append(ahora)
+        self.recibidos[chat_id].append(parametros["text"])
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.instantes), "date": int(time.time()), "text": parametros["text"],
+            "chat": {"id": chat_id, "type": "private"},
+        }})
+
+    async def iniciar(self) -> tuple:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{metodo}", self.manejar)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        puerto = _puerto_libre()
+        await web.TCPSite(runner, "127.0.0.1", puerto).start()
+        return runner, f"http://127.0.0.1:{puerto}/bot"
+
+
+def _verificar_entrega(api: BotAPIConCuota, chats: int, mensajes: int) -> list:
+    errores = []
+    for chat_id in range(1, chats + 1):
+        esperados = [f"chat {chat_id} mensaje {i}" for i in range(mensajes)]
+        if api.recibidos.get(chat_id, []) != esperados:
+            errores.append(f"chat {chat_id}: {len(api.recibidos.get(chat_id, []))}/{mensajes} mensajes o fuera de orden")
+    return errores
+
+
+async def _rendimiento(base_url: str, api: BotAPIConCuota, chats: int, mensajes: int, flood_seg: float) -> dict:
+    bot = BotEncolado(
+        token=TOKEN_FALSO, base_url=base_url, request=HTTPXRequest(connection_pool_size=32), cola=ColaEnvios()
+    )
+    async with bot:
+        if flood_seg:
+            api.flood_tras = (chats * mensajes // 2, flood_seg)
+        inicio = time.monotonic()
+        for i in range(mensajes):
+            for chat_id in range(1, chats + 1):
+                bot.encolar_mensaje(chat_id, f"chat {chat_id} mensaje {i}")
+        encolado = time.monotonic() - inicio
+        await bot.cola.vaciar(120)
+        total = time.monotonic() - inicio
+        await bot.cola.cerrar()
+    return {"encolado_ms": encolado * 1000, "total_s": total, "flood": bot.cola.flood}
+
+
+async def _latencia_handler(base_url: str, n: int) -> dict:
+    """Un handler que envía una respuesta: cuánto tarda en volver esperando a Telegram y encolando."""
+    resultados = {}
+    for nombre, clase in (("ExtBot (espera a Telegram)", ExtBot), ("BotEncolado (encola)", BotEncolado)):
+        bot = clase(token=TOKEN_FALSO, base_url=base_url, request=HTTPXRequest(connection_pool_size=32))
+        async with bot:
+            tiempos = []
+            for i in range(n):
+                inicio = time.perf_counter()
+                await enviar_mensaje(bot, 10_000 + i, "✅ listo")
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            if isinstance(bot, BotEncolado):
+                await bot.cola.vaciar(60)
+                await bot.cola.cerrar()
+        resultados[nombre] = sorted(tiempos)[len(tiempos) // 2]
+    return resultados
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--mensajes", type=int, default=5, help="respuestas por chat")
+    parser.add_argument("--rtt-ms", type=float, default=150, help="demora de la Bot API en la prueba de latencia")
+    parser.add_argument("--flood-seg", type=float, default=1, help="retry_after del 429 forzado")
+    # Límites de la API falsa: lo que permite la cuota de la cola en cualquier ventana de 1 s
+    parser.add_argument("--chat-max", type=int, default=int(ENVIOS_CHAT_RAFAGA + ENVIOS_CHAT_POR_SEG))
+    parser.add_argument("--global-max", type=int, default=int(ENVIOS_GLOBAL_POR_SEG) + 1)
+    opciones = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    total = opciones.chats * opciones.mensajes
+
+    async def _correr():
+        resultados = {}
+        for nombre, flood in (("rendimiento", 0.0), ("flood", opciones.flood_seg)):
+            api = BotAPIConCuota(opciones.chat_max, opciones.global_max)
+            runner, base_url = await api.iniciar()
+            try:
+                r = await _rendimiento(base_url, api, opciones.chats, opciones.mensajes, flood)
+            finally:
+                await runner.cleanup()
+            r["api"] = api
+            resultados[nombre] = r
+
+        api = BotAPIConCuota(10 ** 6, 10 ** 6, opciones.rtt_ms)
+        runner, base_url = await api.iniciar()
+        try:
+            resultados["latencia"] = await _latencia_handler(base_url, 20)
+        finally:
+            await runner.cleanup()
+        return resultados
+
+    resultados = asyncio.run(_correr())
+    errores = []
+
+    r = resultados["rendimiento"]
+    api = r["api"]
+    print(f"{total} mensajes a {opciones.chats} chats: encolados en {r['encolado_ms']:.1f} ms, "
+          f"entregados en {r['total_s']:.2f} s ({total / r['total_s']:.1f} msg/s, cuota {ENVIOS_GLOBAL_POR_SEG}/s), "
+          f"429 recibidos: {api.rechazos_429}")
+    errores += _verificar_entrega(api, opciones.chats, opciones.mensajes)
+    if api.rechazos_429:
+        errores.append(f"la cola excedió la cuota: {api.rechazos_429} respuestas 429")
+
+    r = resultados["flood"]
+    api = r["api"]
+    huecos = [b - a for a, b in zip(api.instantes, api.instantes[1:])]
+    print(f"con un 429 (retry_after {opciones.flood_seg:g} s) a mitad: entregados en {r['total_s']:.2f} s, "
+          f"429 recibidos: {api.rechazos_429}, pausa más larga entre envíos {max(huecos, default=0):.2f} s")
+    errores += [f"flood: {e}" for e in _verificar_entrega(api, opciones.chats, opciones.mensajes)]
+    if api.rechazos_429 != 1:
+        errores.append(f"flood: se esperaba un solo 429 (la cola no respetó retry_after): {api.rechazos_429}")
+    if max(huecos, default=0) < opciones.flood_seg * 0.95:
+        errores.append("flood: la cola no pausó los envíos el tiempo pedido")
+
+    print(f"latencia de un handler que responde (API con {opciones.rtt_ms:g} ms de demora, p50):")
+    for nombre, ms in resultados["latencia"].items():
+        print(f"  {nombre:<28} {ms:8.2f} ms")
+
+    for error in errores[:20]:
+        print(f"  ✗ {error}")
+    print("  ✓ todo entregado, en orden y dentro de la cuota" if not errores else f"  {len(errores)} errores")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+Benchmark de escalado: mide cada comando del bot contra BDs sintéticas de
+distintos tamaños (10k a 10M movimientos) invocando los handlers reales con
+Update/Context falsos.
+
+Por comando y tamaño reporta:
+  - latencia p50 / p95 / máx (ms)
+  - pasos de la VM de SQLite por ejecución (proporcional a las filas recorridas)
+  - pico de memoria Python durante el comando (tracemalloc) y RSS máximo del proceso
+  - tamaño de la respuesta (bytes)
+
+Uso:
+    python benchmarks/escalado.py [--tamanos 10000 100000 1000000] [--repeticiones 5]
+                                  [--comandos balance ganancia ...] [--datos DIR]
+                                  [--salida resultados.json] [--comparar anterior.json]
+
+--datos guarda/reutiliza las BDs generadas (generar 10M filas lleva minutos).
+Ojo: /venta escribe, así que una BD reutilizada crece unas filas por corrida.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from comun import contexto_falso, update_falso, usar_bd, cerrar_bd
+from datos import generar, PRODUCTO_VENTA, VENDEDORES
+from handlers import db_utils
+from handlers import contabilidad, inventario
+
+# Nombre -> (handler, args)
+COMANDOS = {
+    "balance": (contabilidad.balance_command, []),
+    "ganancia": (inventario.ganancia_command, []),
+    "ganancia_mes": (inventario.ganancia_command, ["mes"]),
+    "historial": (contabilidad.historial_command, ["30"]),
+    "historial_365": (contabilidad.historial_command, ["365"]),
+    "stock": (inventario.stock_command, []),
+    "stock_consignado": (inventario.stock_consignado_command, [VENDEDORES[0]]),
+    "deudas": (contabilidad.deudas_command, []),
+    "venta": (inventario.venta_command, [PRODUCTO_VENTA, "1", "10", "usd", "cfg", "benchmark"]),
+    "exportar_mes": (contabilidad.exportar_command, []),  # args con fechas se calculan al correr
+}
+
+# Cada cuántas instrucciones de la VM se invoca el progress handler
+PASOS_POR_AVISO = 100
+
+
+class PoolMedido(db_utils.ConnectionPool):
+    """Pool que cuenta las instrucciones de la VM de SQLite ejecutadas por los handlers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.avisos = 0
+
+    def _contar(self) -> int:
+        self.avisos += 1
+        return 0  # 0 = continuar la consulta
+
+    def _crear_conexion(self) -> sqlite3.Connection:
+        conn = super()._crear_conexion()
+        conn.set_progress_handler(self._contar, PASOS_POR_AVISO)
+        return conn
+
+    @property
+    def pasos_vm(self) -> int:
+        return self.avisos * PASOS_POR_AVISO
+
+
+def _args_exportar_mes() -> list:
+    hoy = datetime.now().date()
+    return [hoy.replace(day=1).isoformat(), hoy.isoformat(), "movimientos"]
+
+
+def _percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def _rss_max_kib() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss  # macOS reporta bytes
+
+
+async def _medir_comando(nombre: str, pool: PoolMedido, repeticiones: int) -> dict:
+    handler, args = COMANDOS[nombre]
+    if nombre == "exportar_mes":
+        args = _args_exportar_mes()
+
+    # Calentamiento (caché de páginas, tasa vigente, conexiones del pool)
+    await handler(update_falso(), contexto_falso(args))
+
+    latencias = []
+    pasos = []
+    respuesta_bytes = 0
+    for _ in range(repeticiones):
+        update = update_falso()
+        pool.avisos = 0
+        inicio = time.perf_counter()
+        await handler(update, contexto_falso(args))
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        pasos.append(pool.pasos_vm)
+        respuesta_bytes = sum(len(r.encode()) for r in update.message.respuestas)
+
+    # Memoria en una pasada aparte: tracemalloc encarece la latencia
+    tracemalloc.start()
+    await handler(update_falso(), contexto_falso(args))
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "comando": nombre,
+        "p50_ms": round(statistics.median(latencias), 3),
+        "p95_ms": round(_percentil(latencias, 95), 3),
+        "max_ms": round(max(latencias), 3),
+        "pasos_vm": int(statistics.median(pasos)),
+        "pico_python_kib": pico // 1024,
+        "rss_max_kib": _rss_max_kib(),
+        "respuesta_bytes": respuesta_bytes,
+    }
+
+
+def _preparar_bd(tamano: int, directorio: str) -> str:
+    db_path = os.path.join(directorio, f"sintetico_{tamano}.db")
+    if os.path.exists(db_path):
+        print(f"  reutilizando {db_path}")
+        return db_path
+    inicio = time.perf_counter()
+    conteos = generar(db_path, tamano)
+    print(f"  generada en {time.perf_counter() - inicio:.1f} s: {conteos}")
+    return db_path
+
+
+def _ejecutar_tamano(tamano: int, directorio: str, comandos: list, repeticiones: int) -> list:
+    print(f"\n=== {tamano:,} movimientos ===")
+    db_path = _preparar_bd(tamano, directorio)
+    pool = PoolMedido()
+    usar_bd(db_path, pool)
+
+    async def _todos():
+        return [await _medir_comando(nombre, pool, repeticiones) for nombre in comandos]
+
+    try:
+        resultados = asyncio.run(_todos())
+    finally:
+        cerrar_bd()
+
+    print(f"{'comando':<18} {'p50 ms':>9} {'p95 ms':>9} {'pasos VM':>12} {'pico KiB':>9} {'resp B':>8}")
+    for r in resultados:
+        r["movimientos"] = tamano
+        print(f"{r['comando']:<18} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['pasos_vm']:>12,} "
+              f"{r['pico_python_kib']:>9,} {r['respuesta_bytes']:>8,}")
+    return resultados
+
+
+def _comparar(actuales: list, ruta_anterior: str) -> None:
+    with open(ruta_anterior, encoding="utf-8") as f:
+        anteriores = {(r["movimientos"], r["comando"]): r for r in json.load(f)["resultados"]}
+
+    print(f"\n=== Comparación con {ruta_anterior} (p50) ===")
+    print(f"{'movimientos':>12} {'comando':<18} {'antes ms':>9} {'ahora ms':>9} {'cambio':>8}")
+    for r in actuales:
+        previo = anteriores.get((r["movimientos"], r["comando"]))
+        if previo is None:
+            continue
+        cambio = (r["p50_ms"] - previo["p50_ms"]) / previo["p50_ms"] * 100 if previo["p50_ms"] else 0.0
+        print(f"{r['movimientos']:>12,} {r['comando']:<18} {previo['p50_ms']:>9.2f} {r['p50_ms']:>9.2f} {cambio:>+7.1f}%")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--comandos", nargs="+", choices=sorted(COMANDOS), default=list(COMANDOS))
+    parser.add_argument("--datos", help="directorio donde guardar/reutilizar las BDs generadas")
+    parser.add_argument("--salida", default="resultados_escalado.json")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    opciones = parser.parse_args()
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as tmp:
+        directorio = opciones.datos or tmp
+        os.makedirs(directorio, exist_ok=True)
+        for tamano in opciones.tamanos:
+            resultados.extend(_ejecutar_tamano(tamano, directorio, opciones.comandos, opciones.repeticiones))
+
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "plataforma": platform.platform(),
+        "repeticiones": opciones.repeticiones,
+        "resultados": resultados,
+    }
+    with open(opciones.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {opciones.salida}")
+
+    if opciones.comparar:
+        _comparar(resultados, opciones.comparar)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
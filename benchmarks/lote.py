@@ -0,0 +1,96 @@
+"""
+Rendimiento de /lote frente a los comandos individuales equivalentes.
+
+Aplica N ventas (precedidas de una entrada con stock suficiente) de dos formas
+sobre BDs nuevas y compara el tiempo total y el estado final:
+  - N comandos /venta, cada uno con su transacción y su commit
+  - un solo /lote con las mismas N líneas
+
+No incluye la ida y vuelta a Telegram de cada mensaje, que en producción
+domina el costo de los comandos individuales.
+
+Uso:
+    python benchmarks/lote.py [--lineas 500]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from comun import contexto_falso, update_falso, usar_bd, cerrar_bd
+from handlers.inventario import entrada_command, venta_command
+from handlers.lote import lote_command
+
+
+def _lineas(n: int) -> list:
+    # Varias entradas (con costos y monedas distintas) intercaladas con ventas: las
+    # ventas consumen los lotes en orden FIFO
+    return [
+        f"entrada LOTE01 100 {i % 7 + 1} {'cup' if i % 200 == 100 else 'usd'} cfg PROV carga" if i % 100 == 0
+        else f"venta LOTE01 1 {i % 50 + 1} usd sc cliente {i}"
+        for i in range(n)
+    ]
+
+
+async def _individuales(lineas: list) -> None:
+    handlers = {"entrada": entrada_command, "venta": venta_command}
+    for linea in lineas:
+        tokens = linea.split()
+        await handlers[tokens[0]](update_falso(), contexto_falso(tokens[1:]))
+
+
+async def _lote(lineas: list) -> None:
+    update = update_falso()
+    update.message.text = "/lote\n" + "\n".join(lineas)
+    await lote_command(update, contexto_falso([]))
+    if not update.message.respuestas[0].startswith("✅"):
+        raise RuntimeError(update.message.respuestas[0])
+
+
+def _medir(db_path: str, corrutina) -> float:
+    usar_bd(db_path)
+    inicio = time.perf_counter()
+    asyncio.run(corrutina)
+    transcurrido = time.perf_counter() - inicio
+    cerrar_bd()
+    return transcurrido
+
+
+def _estado(db_path: str) -> tuple:
+    conn = sqlite3.connect(db_path)
+    estado = tuple(
+        conn.execute(sql).fetchall() for sql in (
+            "SELECT codigo, stock, ROUND(costo_unitario, 6), moneda_costo FROM Productos ORDER BY codigo",
+            "SELECT codigo, cantidad_inicial, cantidad_restante, costo_unitario, moneda_costo FROM LotesInventario ORDER BY id",
+            "SELECT caja, moneda, ROUND(saldo, 6) FROM SaldosCaja ORDER BY caja, moneda",
+            "SELECT COUNT(*), SUM(monto) FROM Movimientos",
+            "SELECT SUM(ingreso), ROUND(SUM(cmv), 6), SUM(ventas) FROM GananciaDiaria",
+        )
+    )
+    conn.close()
+    return estado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lineas", type=int, default=500)
+    opciones = parser.parse_args()
+    lineas = _lineas(opciones.lineas)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_individual = os.path.join(tmp, "individual.db")
+        db_lote = os.path.join(tmp, "lote.db")
+        t_individual = _medir(db_individual, _individuales(lineas))
+        t_lote = _medir(db_lote, _lote(lineas))
+        iguales = _estado(db_individual) == _estado(db_lote)
+
+    print(f"{len(lineas)} operaciones")
+    print(f"  comandos individuales: {t_individual * 1000:9.1f} ms ({len(lineas) / t_individual:,.0f} op/s)")
+    print(f"  un /lote:              {t_lote * 1000:9.1f} ms ({len(lineas) / t_lote:,.0f} op/s)")
+    print(f"  aceleración: x{t_individual / t_lote:.1f} — estado final {'idéntico' if iguales else 'DISTINTO'}")
+
+
+if __name__ == "__main__":
+    main()
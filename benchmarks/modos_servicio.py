@@ -0,0 +1,304 @@
+"""
+Latencia de punta a punta de los comandos en modo polling frente a modo webhook,
+sin acceso a la red de Telegram.
+
+Levanta una Bot API falsa (aiohttp) en localhost a la que apunta el bot
+(TELEGRAM_API_URL): responde getMe/setWebhook/deleteWebhook, entrega updates por
+getUpdates (long polling) y registra cada sendMessage. Para cada modo se
+inyectan los mismos updates y se mide desde que el update está disponible
+(encolado para getUpdates, o justo antes del POST al webhook) hasta que la
+respuesta del bot llega a la Bot API falsa.
+
+Cada update llega desde un chat distinto y la cola de envíos corre sin límite
+global (--cuota la activa): se mide el modo de servicio, no la cuota de Telegram
+(benchmarks/envios.py mide la cola).
+
+--rtt-ms añade una demora a cada llamada a la Bot API (simula la distancia a
+Telegram): el polling la paga en cada getUpdates, el webhook no.
+
+Uso:
+    python benchmarks/modos_servicio.py [--updates 300] [--concurrencia 20] [--rtt-ms 0] [--cuota]
+                                        [--grabados updates.json]
+    python benchmarks/modos_servicio.py --enviar http://127.0.0.1:8443/telegram --secreto ... --grabados updates.json
+
+--grabados usa un JSON con una lista de updates reales (p. ej. copiados de un
+getUpdates); --enviar los POSTea a un bot ya corriendo en modo webhook.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+from comun import ADMIN_ID, usar_bd, cerrar_bd
+import bot
+from handlers.envios import TokenBucket
+from servidor_webhook import CABECERA_SECRETO, iniciar_webhook, detener_webhook
+
+TOKEN_FALSO = "123456:BENCHMARK"
+RUTA_WEBHOOK = "/telegram"
+SECRETO_WEBHOOK = "secreto-benchmark"
+
+# Comandos medidos (lecturas y escrituras) y los que preparan la BD antes de medir
+COMANDOS = ["/balance", "/stock", "/deudas", "/venta BENCH 1 10 usd sc cliente", "/historial 1"]
+PREPARACION = ["/ingreso 1000 usd cfg", "/entrada BENCH 100000 1 usd cfg PROV carga"]
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _update(update_id: int, chat_id: int, texto: str) -> dict:
+    """Update de Telegram con un mensaje de texto (el comando lleva su entidad bot_command)."""
+    comando = texto.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "Admin"},
+            "text": texto,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(comando)}],
+        },
+    }
+
+
+def _renumerar(updates: list, desde: int) -> list:
+    """Copia los updates con update_id y chat propios: cada respuesta se asocia a su update por el chat."""
+    resultado = []
+    for i, original in enumerate(updates):
+        update = copy.deepcopy(original)
+        update["update_id"] = desde + i
+        mensaje = update.get("message") or update.get("edited_message")
+        if mensaje:
+            mensaje["chat"]["id"] = desde + i
+            mensaje.setdefault("from", {"id": ADMIN_ID, "is_bot": False, "first_name": "Admin"})["id"] = ADMIN_ID
+        resultado.append(update)
+    return resultado
+
+
+class BotAPIFalsa:
+    """Bot API mínima: lo justo para que python-telegram-bot arranque, reciba updates y responda."""
+
+    def __init__(self, rtt_ms: float = 0):
+        self.rtt = rtt_ms / 1000
+        self.pendientes: list = []
+        self.hay_pendientes = asyncio.Event()
+        self.esperando: dict = {}  # chat_id -> Future con el instante de la respuesta
+        self.llamadas: dict = {}
+
+    def esperar_respuesta(self, chat_id: int) -> asyncio.Future:
+        futuro = asyncio.get_running_loop().create_future()
+        self.esperando[chat_id] = futuro
+        return futuro
+
+    def encolar(self, updates: list) -> None:
+        self.pendientes.extend(updates)
+        self.hay_pendientes.set()
+
+    async def _parametros(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    async def manejar(self, request: web.Request) -> web.Response:
+        metodo = request.match_info["metodo"]
+        parametros = await self._parametros(request)
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+
+        if metodo == "getMe":
+            resultado = {"id": 1, "is_bot": True, "first_name": "ContaBot", "username": "contabot_test"}
+        elif metodo == "getUpdates":
+            resultado = await self._get_updates(int(parametros.get("offset") or 0), float(parametros.get("timeout") or 0))
+        elif metodo in ("sendMessage", "sendDocument", "editMessageText"):
+            chat_id = int(parametros.get("chat_id", 0))
+            futuro = self.esperando.pop(chat_id, None)
+            if futuro is not None and not futuro.done():
+                futuro.set_result(time.perf_counter())
+            resultado = {
+                "message_id": 1, "date": int(time.time()), "text": parametros.get("text", ""),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+        else:  # setWebhook, deleteWebhook, answerCallbackQuery, ...
+            resultado = True
+        return web.json_response({"ok": True, "result": resultado})
+
+    async def _get_updates(self, offset: int, timeout: float) -> list:
+        self.pendientes = [u for u in self.pendientes if u["update_id"] >= offset]
+        if not self.pendientes and timeout:
+            self.hay_pendientes.clear()
+            try:
+                await asyncio.wait_for(self.hay_pendientes.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [u for u in self.pendientes if u["update_id"] >= offset][:100]
+
+    async def iniciar(self) -> tuple:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{metodo}", self.manejar)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        puerto = _puerto_libre()
+        await web.TCPSite(runner, "127.0.0.1", puerto).start()
+        return runner, f"http://127.0.0.1:{puerto}/bot"
+
+
+async def _medir(api: BotAPIFalsa, updates: list, entregar, concurrencia: int) -> dict:
+    """Entrega los updates (con a lo sumo `concurrencia` en vuelo) y mide cada latencia."""
+    latencias = []
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def _uno(update: dict) -> None:
+        async with semaforo:
+            futuro = api.esperar_respuesta(update["message"]["chat"]["id"])
+            inicio = time.perf_counter()
+            await entregar(update)
+            fin = await asyncio.wait_for(futuro, 30)
+            latencias.append((fin - inicio) * 1000)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(_uno(u) for u in updates))
+    total = time.perf_counter() - inicio
+    ordenadas = sorted(latencias)
+    return {
+        "p50_ms": statistics.median(ordenadas),
+        "p95_ms": ordenadas[int(0.95 * (len(ordenadas) - 1))],
+        "max_ms": ordenadas[-1],
+        "updates_s": len(updates) / total,
+    }
+
+
+def _crear_aplicacion(base_url: str, cuota: bool):
+    application = bot.crear_aplicacion(TOKEN_FALSO, base_url)
+    if not cuota:
+        application.bot.cola.global_ = TokenBucket(1e9, 1e9)
+    return application
+
+
+async def _modo_polling(api: BotAPIFalsa, base_url: str, preparacion: list, updates: list, concurrencia: int,
+                        cuota: bool) -> dict:
+    application = _crear_aplicacion(base_url, cuota)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    async def _entregar(update: dict) -> None:
+        api.encolar([update])
+
+    try:
+        await _medir(api, preparacion, _entregar, 1)
+        return await _medir(api, updates, _entregar, concurrencia)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+
+async def _modo_webhook(api: BotAPIFalsa, base_url: str, preparacion: list, updates: list, concurrencia: int,
+                        cuota: bool) -> dict:
+    application = _crear_aplicacion(base_url, cuota)
+    puerto = _puerto_libre()
+    runner = await iniciar_webhook(
+        application, host="127.0.0.1", puerto=puerto, ruta=RUTA_WEBHOOK, url_publica="", secreto=SECRETO_WEBHOOK
+    )
+    url = f"http://127.0.0.1:{puerto}{RUTA_WEBHOOK}"
+
+    async with ClientSession(headers={CABECERA_SECRETO: SECRETO_WEBHOOK}) as sesion:
+        async def _entregar(update: dict) -> None:
+            async with sesion.post(url, json=update) as respuesta:
+                respuesta.raise_for_status()
+
+        try:
+            await _medir(api, preparacion, _entregar, 1)
+            return await _medir(api, updates, _entregar, concurrencia)
+        finally:
+            await detener_webhook(application, runner)
+
+
+def _comparar(opciones) -> int:
+    if opciones.grabados:
+        with open(opciones.grabados, encoding="utf-8") as f:
+            base = json.load(f)
+    else:
+        base = [_update(0, 0, COMANDOS[i % len(COMANDOS)]) for i in range(opciones.updates)]
+
+    resultados = {}
+    for nombre, modo in (("polling", _modo_polling), ("webhook", _modo_webhook)):
+        with tempfile.TemporaryDirectory() as tmp:
+            usar_bd(os.path.join(tmp, f"{nombre}.db"))
+
+            async def _correr():
+                api = BotAPIFalsa(opciones.rtt_ms)
+                runner, base_url = await api.iniciar()
+                try:
+                    preparacion = [_update(0, 0, texto) for texto in PREPARACION]
+                    return await modo(
+                        api, base_url, _renumerar(preparacion, 1), _renumerar(base, 1000), opciones.concurrencia,
+                        opciones.cuota,
+                    )
+                finally:
+                    await runner.cleanup()
+
+            try:
+                resultados[nombre] = asyncio.run(_correr())
+            finally:
+                cerrar_bd()
+
+    print(f"{len(base)} updates, concurrencia {opciones.concurrencia}, RTT simulado {opciones.rtt_ms:g} ms")
+    print(f"{'modo':<9} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8} {'updates/s':>10}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<9} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['max_ms']:>8.1f} {r['updates_s']:>10.1f}")
+    return 0
+
+
+def _enviar(opciones) -> int:
+    """POSTea updates grabados a un bot corriendo en modo webhook."""
+    if not opciones.grabados:
+        print("--enviar requiere --grabados")
+        return 2
+    with open(opciones.grabados, encoding="utf-8") as f:
+        updates = json.load(f)
+
+    async def _todos():
+        async with ClientSession(headers={CABECERA_SECRETO: opciones.secreto}) as sesion:
+            for update in updates:
+                async with sesion.post(opciones.enviar, json=update) as respuesta:
+                    print(f"update {update.get('update_id')}: HTTP {respuesta.status}")
+
+    asyncio.run(_todos())
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=300, help="updates sintéticos a medir por modo")
+    parser.add_argument("--concurrencia", type=int, default=20, help="updates en vuelo a la vez")
+    parser.add_argument("--rtt-ms", type=float, default=0, help="demora simulada de cada llamada a la Bot API")
+    parser.add_argument("--cuota", action="store_true", help="aplicar el límite global de envíos de Telegram")
+    parser.add_argument("--grabados", help="JSON con una lista de updates grabados")
+    parser.add_argument("--enviar", metavar="URL", help="solo POSTear --grabados a un webhook ya corriendo")
+    parser.add_argument("--secreto", default="", help="WEBHOOK_SECRET del bot al que se envía con --enviar")
+    opciones = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    return _enviar(opciones) if opciones.enviar else _comparar(opciones)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Varios negocios en un mismo proceso (handlers/negocios.py, PoolNegocios).
+
+Asigna --negocios chats a otros tantos negocios (una BD cada uno) y, con un
+máximo de --abiertos BDs abiertas a la vez, registra en cada negocio un
+/ingreso, una /entrada y un /gasto con montos propios, todos los negocios a la
+vez (--concurrencia updates en paralelo), y pide /balance y /stock. Verifica:
+  - cada negocio ve solo lo suyo (saldo, stock y caché de inventario)
+  - la BD principal no recibe nada
+  - nunca hay más de --abiertos pools abiertos ni crecen los descriptores
+y mide el costo de abrir un negocio por primera vez (crear el esquema), de
+reabrir uno que se cerró por el LRU y de atender uno ya abierto.
+
+Uso:
+    python benchmarks/negocios.py [--negocios 200] [--abiertos 16] [--concurrencia 8]
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from comun import contexto_falso, update_falso, usar_bd, cerrar_bd
+import config_vars
+from handlers import db_utils, negocios
+from handlers.contabilidad import balance_command, gasto_command, ingreso_command
+from handlers.inventario import entrada_command, stock_command
+from handlers.negocios import con_negocio
+
+CHAT_BASE = -1_000_000  # chats (grupos) de los negocios: CHAT_BASE - i
+
+
+def _descriptores() -> int:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+
+async def _comando(handler, chat_id: int, args: list) -> tuple:
+    update = update_falso()
+    update.effective_chat = SimpleNamespace(id=chat_id)
+    inicio = time.perf_counter()
+    await con_negocio(handler)(update, contexto_falso(args))
+    return (time.perf_counter() - inicio) * 1000, update.message.respuestas
+
+
+async def _operar(i: int) -> float:
+    """Las escrituras del negocio i: montos que lo identifican."""
+    chat = CHAT_BASE - i
+    inicio = time.perf_counter()
+    await _comando(ingreso_command, chat, [str(1000 + i), "usd", "cfg"])
+    await _comando(entrada_command, chat, [f"N{i:04d}", str(10 + i), "1", "usd", "cfg", "PROV", "lote"])
+    await _comando(gasto_command, chat, ["1", "usd", "cfg", "'flete'"])
+    return (time.perf_counter() - inicio) * 1000
+
+
+def _verificar(i: int, balance: list, stock: list) -> list:
+    errores = []
+    texto_balance, texto_stock = "".join(balance), "".join(stock)
+    # ingreso 1000+i y gasto 1 (la /entrada queda como deuda con el proveedor, no sale de la caja)
+    esperado = f"{1000 + i - 1:,.2f} USD"
+    if esperado not in texto_balance:
+        errores.append(f"negocio {i}: balance sin {esperado}: {texto_balance[:80]!r}")
+    codigos = set(re.findall(r"N\d{4}", texto_stock))
+    if codigos != {f"N{i:04d}"}:
+        errores.append(f"negocio {i}: /stock muestra {sorted(codigos)[:5]}")
+    return errores
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--negocios", type=int, default=200)
+    parser.add_argument("--abiertos", type=int, default=16, help="NEGOCIOS_ABIERTOS_MAX")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    opciones = parser.parse_args()
+    n = opciones.negocios
+
+    errores = []
+    with tempfile.TemporaryDirectory() as tmp:
+        usar_bd(os.path.join(tmp, "principal.db"))
+        negocios.NEGOCIOS_DIR = os.path.join(tmp, "negocios")
+        config_vars.NEGOCIOS.update({CHAT_BASE - i: f"negocio{i:04d}" for i in range(n)})
+        pool = db_utils.pool_negocios
+        pool.maximo = opciones.abiertos
+
+        async def _correr():
+            descriptores_inicio = _descriptores()
+            maximo_abiertos = 0
+            semaforo = asyncio.Semaphore(opciones.concurrencia)
+
+            async def _limitado(coro):
+                nonlocal maximo_abiertos
+                async with semaforo:
+                    resultado = await coro
+                maximo_abiertos = max(maximo_abiertos, len(pool.abiertos()))
+                return resultado
+
+            inicio = time.perf_counter()
+            primeras = await asyncio.gather(*(_limitado(_operar(i)) for i in range(n)))
+            total_escrituras = time.perf_counter() - inicio
+
+            # Un negocio abierto (el último) frente a uno desalojado por el LRU (el primero)
+            abierto, _ = await _comando(balance_command, CHAT_BASE - (n - 1), [])
+            desalojado, _ = await _comando(balance_command, CHAT_BASE, [])
+
+            lecturas = await asyncio.gather(*(
+                _limitado(asyncio.gather(
+                    _comando(balance_command, CHAT_BASE - i, []), _comando(stock_command, CHAT_BASE - i, [])
+                )) for i in range(n)
+            ))
+            for i, ((_, balance), (_, stock)) in enumerate(lecturas):
+                errores.extend(_verificar(i, balance, stock))
+
+            _, principal = await _comando(balance_command, 424242, [])
+            if "No hay ningún movimiento" not in "".join(principal):
+                errores.append(f"la BD principal recibió movimientos: {principal}")
+            if maximo_abiertos > opciones.abiertos:
+                errores.append(f"hubo {maximo_abiertos} BDs abiertas (máximo {opciones.abiertos})")
+
+            descriptores_fin = _descriptores()
+            primeras.sort()
+            print(f"{n} negocios, hasta {opciones.abiertos} BDs abiertas, {opciones.concurrencia} updates a la vez")
+            print(f"  primera vez (crea el esquema + 3 escrituras): p50 {primeras[n // 2]:.1f} ms, "
+                  f"total {total_escrituras:.2f} s")
+            print(f"  /balance de un negocio abierto:   {abierto:8.2f} ms")
+            print(f"  /balance tras cerrarse por LRU:   {desalojado:8.2f} ms")
+            print(f"  BDs abiertas: máximo {maximo_abiertos}, al final {len(pool.abiertos())}; "
+                  f"descriptores {descriptores_inicio} -> {descriptores_fin}")
+            # Cada conexión abre ~6 descriptores (BD, archivo y sus -wal/-shm)
+            limite = descriptores_inicio + opciones.abiertos * pool.size * 6 + 50
+            if descriptores_fin > limite:
+                errores.append(f"descriptores abiertos: {descriptores_fin} (esperado <= {limite})")
+
+        try:
+            asyncio.run(_correr())
+        finally:
+            cerrar_bd()
+            db_utils.pool_negocios.cerrar()
+
+    for error in errores[:20]:
+        print(f"  ✗ {error}")
+    print("  ✓ cada negocio aislado en su BD y con las BDs abiertas acotadas" if not errores else f"  {len(errores)} errores")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
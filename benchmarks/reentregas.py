@@ -0,0 +1,110 @@
+"""
+Reentregas de updates: cada comando que escribe se aplica una sola vez.
+
+Sobre una BD nueva se disparan --updates /gasto de 1 USD distintos, cada uno
+entregado --copias veces a la vez (como cuando Telegram reintenta un webhook
+que no respondió a tiempo). Luego se vuelven a entregar todos:
+  - tras "reiniciar" sin memoria (LRU vacío): los descarta el INSERT en ProcesadosUpdates
+  - tras reabrir el pool (su primera conexión carga el LRU): se descartan sin tocar la BD
+En todos los casos deben quedar exactamente --updates gastos aplicados.
+
+También compara el tiempo de los mismos gastos con y sin el envoltorio idempotente.
+
+Uso:
+    python benchmarks/reentregas.py [--updates 300] [--copias 3]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from comun import contexto_falso, update_falso, usar_bd, cerrar_bd
+from handlers import db_utils
+from handlers.contabilidad import ingreso_command, gasto_command
+from handlers.idempotencia import idempotente, procesados
+
+gasto_idempotente = idempotente("gasto", gasto_command)
+
+
+def _gasto(update_id):
+    return gasto_idempotente(update_falso(update_id=update_id), contexto_falso(["1", "usd", "cfg", f"update {update_id}"]))
+
+
+async def _entregar(ids: list) -> float:
+    inicio = time.perf_counter()
+    await asyncio.gather(*(_gasto(update_id) for update_id in ids))
+    return (time.perf_counter() - inicio) * 1000
+
+
+async def _escenario(n: int, copias: int) -> dict:
+    await ingreso_command(update_falso(), contexto_falso(["1000000", "usd", "cfg"]))
+
+    ids = [update_id for update_id in range(1, n + 1) for _ in range(copias)]
+    random.shuffle(ids)
+    tiempos = {"concurrentes": await _entregar(ids)}
+
+    procesados.reemplazar([])  # reinicio sin memoria: decide la tabla
+    tiempos["sin_lru"] = await _entregar(list(range(1, n + 1)))
+
+    procesados.reemplazar([])
+    db_utils.db_pool.cerrar()  # reinicio normal: la primera conexión del pool carga el LRU
+    tiempos["con_lru"] = await _entregar(list(range(1, n + 1)))
+
+    # Referencia: los mismos gastos, nuevos, con y sin el envoltorio
+    inicio = time.perf_counter()
+    for update_id in range(n + 1, 2 * n + 1):
+        await _gasto(update_id)
+    tiempos["idempotente"] = (time.perf_counter() - inicio) * 1000
+    inicio = time.perf_counter()
+    for i in range(n):
+        await gasto_command(update_falso(), contexto_falso(["1", "usd", "cfg", f"directo {i}"]))
+    tiempos["directo"] = (time.perf_counter() - inicio) * 1000
+    return tiempos
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--copias", type=int, default=3, help="entregas simultáneas de cada update")
+    opciones = parser.parse_args()
+    n = opciones.updates
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "reentregas.db")
+        usar_bd(db_path)
+        try:
+            tiempos = asyncio.run(_escenario(n, opciones.copias))
+        finally:
+            cerrar_bd()
+
+        conn = sqlite3.connect(db_path)
+        aplicados = conn.execute(
+            "SELECT COUNT(*) FROM Movimientos WHERE tipo = 'gasto' AND descripcion LIKE 'update %'"
+        ).fetchone()[0]
+        registrados = conn.execute("SELECT COUNT(*) FROM ProcesadosUpdates").fetchone()[0]
+        conn.close()
+
+    print(f"{n} updates x {opciones.copias} entregas simultáneas: {tiempos['concurrentes']:.0f} ms")
+    print(f"reentrega sin LRU (la decide la BD): {tiempos['sin_lru']:.0f} ms")
+    print(f"reentrega con LRU cargado:           {tiempos['con_lru']:.0f} ms")
+    print(f"{n} gastos nuevos idempotentes: {tiempos['idempotente']:.0f} ms; "
+          f"sin envoltorio: {tiempos['directo']:.0f} ms")
+    print(f"  gastos aplicados: {aplicados} (esperado {2 * n}), updates registrados: {registrados} (esperado {2 * n})")
+
+    errores = []
+    if aplicados != 2 * n:
+        errores.append(f"gastos aplicados {aplicados} != {2 * n}")
+    if registrados != 2 * n:
+        errores.append(f"updates registrados {registrados} != {2 * n}")
+    for error in errores:
+        print(f"  ✗ {error}")
+    print("  ✓ cada update aplicado una sola vez" if not errores else f"  {len(errores)} invariantes violados")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Reportes largos: partición en mensajes de 4096 caracteres y fragmentos memorizados.
+
+Sobre una BD con --filas productos con stock, deudas pendientes, artículos
+consignados a un vendedor y movimientos (con descripciones que llevan <, > y &)
+ejecuta /stock, /deudas, /stock_consignado y /historial dos veces: en frío (sin
+fragmentos memorizados) y en caliente (las filas no cambiaron; /stock_consignado
+no memoriza sus líneas). Verifica que:
+  - cada mensaje enviado mide a lo sumo 4096 caracteres
+  - cada mensaje es HTML válido por sí solo (etiquetas balanceadas, sin entidades partidas)
+  - no se pierde ninguna fila al partir
+
+Uso:
+    python benchmarks/reportes.py [--filas 2000]
+"""
+import argparse
+import gc
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from html.parser import HTMLParser
+
+from comun import contexto_falso, update_falso, usar_bd, cerrar_bd
+from config_vars import HISTORIAL_PAGE_SIZE
+from handlers import db_utils
+from handlers.contabilidad import deudas_command, historial_command, _formatear_movimiento, _linea_deuda
+from handlers.inventario import stock_command, stock_consignado_command, _bloque_producto
+from handlers.respuestas import LIMITE_MENSAJE
+
+FRAGMENTOS = (_bloque_producto, _linea_deuda, _formatear_movimiento)
+
+
+class _Validador(HTMLParser):
+    """Comprueba que cada etiqueta abierta se cierre dentro del mismo mensaje."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.abiertas = []
+        self.errores = []
+
+    def handle_starttag(self, tag, attrs):
+        self.abiertas.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.abiertas or self.abiertas.pop() != tag:
+            self.errores.append(f"</{tag}> sin abrir")
+
+    def handle_data(self, data):
+        if "<" in data or ">" in data:
+            self.errores.append(f"texto sin escapar: {data[:40]!r}")
+
+
+def _poblar(db_path: str, n: int) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO Productos (codigo, nombre, costo_unitario, moneda_costo, stock) VALUES (?, ?, ?, ?, ?)",
+        [(f"P{i:05d}", f"Producto <{i}> & cía", 1 + i % 9, ('usd', 'cup')[i % 2], 1 + i % 40) for i in range(n)]
+    )
+    conn.executemany(
+        "INSERT INTO Deudas (actor_id, tipo, monto_pendiente, moneda) VALUES (?, ?, ?, 'usd')",
+        [(f"A{i:05d}", ('POR_PAGAR', 'POR_COBRAR')[i % 2], 1 + i % 7) for i in range(n)]
+    )
+    conn.executemany(
+        "INSERT INTO Consignaciones (codigo, vendedor, stock, precio_unitario, moneda) VALUES (?, 'MARIA', ?, 1, 'usd')",
+        [(f"P{i:05d}", 1 + i % 5) for i in range(n)]
+    )
+    conn.executemany(
+        "INSERT INTO Movimientos (tipo, monto, moneda, caja, user_id, descripcion) VALUES ('gasto', 1, 'usd', 'cfg', 1, ?)",
+        [(f"compra <{i}> & envío",) for i in range(n)]
+    )
+    db_utils.MovimientoManager.reconstruir_saldos(conn)
+    db_utils.DeudaManager.inicializar_diario(conn)
+    conn.commit()
+    conn.close()
+    db_utils.InventarioManager.invalidar()
+
+
+def _verificar(nombre: str, respuestas: list, filas_esperadas: int, marca: str) -> list:
+    errores = []
+    for i, texto in enumerate(respuestas):
+        if len(texto) > LIMITE_MENSAJE:
+            errores.append(f"{nombre}: mensaje {i + 1} mide {len(texto)} caracteres")
+        validador = _Validador()
+        validador.feed(texto)
+        validador.close()
+        errores.extend(f"{nombre}: mensaje {i + 1}: {e}" for e in validador.errores)
+        if validador.abiertas:
+            errores.append(f"{nombre}: mensaje {i + 1} deja abiertas {validador.abiertas}")
+    filas = sum(texto.count(marca) for texto in respuestas)
+    if filas != filas_esperadas:
+        errores.append(f"{nombre}: {filas} filas en los mensajes (esperado {filas_esperadas})")
+    return errores
+
+
+async def _ejecutar(handler, args: list) -> tuple:
+    update = update_falso()
+    gc.collect()  # Que la basura del reporte anterior no se cobre en este
+    inicio = time.perf_counter()
+    await handler(update, contexto_falso(args))
+    return (time.perf_counter() - inicio) * 1000, update.message.respuestas
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=2000)
+    opciones = parser.parse_args()
+    n = opciones.filas
+
+    # (nombre, handler, args, filas esperadas, marca de una fila en el texto)
+    reportes = [
+        ("/stock", stock_command, [], n, "📦 <b>"),
+        ("/deudas", deudas_command, [], n, "  • A"),
+        ("/stock_consignado", stock_consignado_command, ["MARIA"], n, "  • <b>P"),
+        ("/historial", historial_command, ["30"], HISTORIAL_PAGE_SIZE, "🔴"),
+    ]
+
+    errores = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "reportes.db")
+        usar_bd(db_path)
+        _poblar(db_path, n)
+
+        async def _medir():
+            print(f"{'reporte':<20}{'mensajes':>9}{'frío ms':>10}{'caliente ms':>13}")
+            for nombre, handler, args, esperadas, marca in reportes:
+                for func in FRAGMENTOS:
+                    func.cache_clear()
+                frio, _ = await _ejecutar(handler, args)
+                caliente, respuestas = await _ejecutar(handler, args)
+                print(f"{nombre:<20}{len(respuestas):>9}{frio:>10.1f}{caliente:>13.1f}")
+                errores.extend(_verificar(nombre, respuestas, esperadas, marca))
+
+        try:
+            asyncio.run(_medir())
+        finally:
+            cerrar_bd()
+
+    for error in errores[:20]:
+        print(f"  ✗ {error}")
+    print("  ✓ mensajes dentro del límite, HTML válido y sin filas perdidas"
+          if not errores else f"  {len(errores)} errores")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Reportes cacheados (handlers/reportes.py): /balance, /deudas, /stock y /ganancia.
+
+Sobre una BD con --filas productos, ventas, deudas y movimientos registrados
+con los comandos del bot:
+  1. Mide cada reporte generado (caché vacío) y servido desde ReportesCache;
+     el texto debe ser idéntico y la segunda vez no debe generarse.
+  2. Registra un /gasto y un /set_tasa: solo deben regenerarse los reportes
+     cuyas tablas cambiaron (balance y ganancia), y con los datos nuevos.
+  3. Corre el job diario con un bot falso: cada admin recibe cada reporte de
+     REPORTES_PROGRAMADOS, sin volver a generar los que siguen vigentes.
+
+Uso:
+    python benchmarks/reportes_cache.py [--filas 2000]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from comun import ADMIN_ID, contexto_falso, update_falso, usar_bd, cerrar_bd
+from config_secret import ADMIN_USER_IDS
+from config_vars import REPORTES_PROGRAMADOS
+from handlers import reportes
+from handlers.contabilidad import balance_command, deudas_command, gasto_command, ingreso_command, set_tasa_command
+from handlers.inventario import entrada_command, ganancia_command, stock_command, venta_command
+
+COMANDOS = {
+    "balance": balance_command,
+    "deudas": deudas_command,
+    "stock": stock_command,
+    "ganancia": ganancia_command,
+}
+
+
+class BotFalso:
+    """Guarda los send_message del job de reportes por chat."""
+
+    def __init__(self):
+        self.enviados = collections.defaultdict(list)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.enviados[chat_id].append(text)
+
+
+def _contar_generaciones() -> collections.Counter:
+    """Envuelve la función de cada reporte registrado para contar cuántas veces se genera."""
+    generados = collections.Counter()
+    for nombre, (dominios, generar) in list(reportes._REPORTES.items()):
+        def _contado(*args, _nombre=nombre, _generar=generar):
+            generados[_nombre] += 1
+            return _generar(*args)
+        reportes._REPORTES[nombre] = (dominios, _contado)
+    return generados
+
+
+async def _ejecutar(handler, args: list = ()) -> tuple:
+    update = update_falso()
+    inicio = time.perf_counter()
+    await handler(update, contexto_falso(args))
+    return (time.perf_counter() - inicio) * 1000, update.message.respuestas
+
+
+async def _poblar(n: int) -> None:
+    await _ejecutar(ingreso_command, ["100000", "usd", "cfg"])
+    for i in range(n):
+        await _ejecutar(entrada_command, [f"P{i:05d}", "50", "1.5", "usd", "cfg", f"PROV{i % 50:03d}", "lote"])
+    for i in range(0, n, 4):
+        await _ejecutar(venta_command, [f"P{i:05d}", "5", "12", "usd", "sc", "cliente"])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=2000)
+    opciones = parser.parse_args()
+
+    errores = []
+    generados = _contar_generaciones()
+    with tempfile.TemporaryDirectory() as tmp:
+        usar_bd(os.path.join(tmp, "reportes_cache.db"))
+
+        async def _medir():
+            await _poblar(opciones.filas)
+
+            print(f"{'reporte':<12}{'mensajes':>9}{'generado ms':>13}{'caché ms':>10}")
+            antes = {}
+            for nombre, handler in COMANDOS.items():
+                generado, respuestas = await _ejecutar(handler)
+                cache, repetidas = await _ejecutar(handler)
+                print(f"{nombre:<12}{len(respuestas):>9}{generado:>13.2f}{cache:>10.2f}")
+                if repetidas != respuestas:
+                    errores.append(f"{nombre}: el reporte cacheado no es igual al generado")
+                if generados[nombre] != 1:
+                    errores.append(f"{nombre}: se generó {generados[nombre]} veces (esperado 1)")
+                antes[nombre] = respuestas
+
+            # Un gasto cambia SaldosCaja y una tasa nueva TasasCambio: solo balance y ganancia se regeneran
+            await _ejecutar(gasto_command, ["7", "usd", "cfg", "'flete'"])
+            await _ejecutar(set_tasa_command, ["1", "999"])
+            generados.clear()
+            for nombre, handler in COMANDOS.items():
+                _, respuestas = await _ejecutar(handler)
+                cambio = respuestas != antes[nombre]
+                debe_cambiar = nombre in ("balance", "ganancia")
+                if generados[nombre] != int(debe_cambiar) or cambio != debe_cambiar:
+                    errores.append(f"{nombre}: tras el gasto y la tasa se generó {generados[nombre]} veces "
+                                   f"y {'cambió' if cambio else 'no cambió'}")
+            _, ganancia = await _ejecutar(ganancia_command)
+            if "999" not in "".join(ganancia):
+                errores.append("ganancia: no muestra la tasa nueva")
+            print("tras /gasto y /set_tasa: regenerados "
+                  + ", ".join(n for n in COMANDOS if n in ("balance", "ganancia")) + "; el resto desde el caché")
+
+            # Job diario: todo vigente, así que se envía sin generar nada
+            generados.clear()
+            bot = BotFalso()
+            await reportes.enviar_reportes_programados(SimpleNamespace(bot=bot))
+            for admin_id in ADMIN_USER_IDS:
+                if len(bot.enviados[admin_id]) < len(REPORTES_PROGRAMADOS):
+                    errores.append(f"admin {admin_id}: recibió {len(bot.enviados[admin_id])} mensajes")
+            if sum(generados.values()):
+                errores.append(f"el job regeneró reportes vigentes: {dict(generados)}")
+            print(f"job diario: {len(bot.enviados[ADMIN_ID])} mensajes a cada uno de {len(ADMIN_USER_IDS)} admins, "
+                  f"{sum(generados.values())} reportes generados")
+
+        try:
+            asyncio.run(_medir())
+        finally:
+            cerrar_bd()
+
+    for error in errores[:20]:
+        print(f"  ✗ {error}")
+    print("  ✓ caché vigente servido tal cual e invalidado solo por sus tablas" if not errores else f"  {len(errores)} errores")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,29 @@
+import time
+_INICIO = time.perf_counter()  # Antes del resto de imports: el tiempo de arranque los incluye
+
+import asyncio
+import importlib
 import logging
+import sys
+import httpx
 from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+from telegram.request import HTTPXRequest
+import config_secret
 from config_secret import ( TOKEN, ADMIN_USER_IDS )
 from db_manager import setup_database
+from handlers.db_utils import db_executor, db_reportes, db_pool, pool_negocios
 from config_vars import (
-    VALID_MONEDAS, VALID_CAJAS, TASA_USD_CUP
+    VALID_MONEDAS, VALID_CAJAS, TASA_USD_CUP, CONCURRENT_UPDATES, BOT_MODO, TELEGRAM_API_URL,
+    METRICAS_HOST, METRICAS_PUERTO, ENVIOS_CONEXIONES, ENVIOS_VACIAR_SEG, HISTORIAL_CALLBACK,
 )
 
-# Importamos los handlers
-from handlers.contabilidad import (
-    ingreso_command, gasto_command, balance_command, 
-    cambio_command, pago_proveedor_command,
-    pago_vendedor_command, deudas_command, historial_command,
-    exportar_command, set_tasa_command,
-)
-from handlers.inventario import (
-    entrada_command, stock_command, venta_command, ganancia_command,
-    consignar_command, stock_consignado_command
-)
+from handlers.metricas import instrumentar, metrics_command, RequestMedido, iniciar_servidor_metricas
+from handlers.idempotencia import idempotente
+from handlers.negocios import con_negocio
+from handlers.envios import BotEncolado
+from handlers.reportes import programar_reportes
+# Los módulos de comandos se importan con el primer comando que los usa (ver perezoso())
 # -------------------------------
 
 # Configuración de logging (mantener)
@@ -27,36 +33,141 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main() -> None:
-    """Función principal que inicia el bot."""
-    setup_database()
-    
-    application = Application.builder().token(TOKEN).build()
+async def post_init(application: Application) -> None:
+    """Tareas de fondo que viven mientras corre el bot."""
+    if METRICAS_PUERTO:
+        application.bot_data['servidor_metricas'] = await iniciar_servidor_metricas(METRICAS_HOST, METRICAS_PUERTO)
+    logger.info(f"Bot listo para recibir updates a los {(time.perf_counter() - _INICIO) * 1000:.0f} ms del arranque.")
+
+
+async def post_stop(application: Application) -> None:
+    """Antes de cerrar la conexión con Telegram: enviar las respuestas que quedaron en la cola."""
+    cola = application.bot.cola
+    await cola.vaciar(ENVIOS_VACIAR_SEG)
+    await cola.cerrar()
+
+
+async def post_shutdown(application: Application) -> None:
+    # La reconciliación de la caché de inventario arranca con el primer uso de handlers.inventario
+    inventario = sys.modules.get("handlers.inventario")
+    if inventario is not None:
+        inventario.detener_reconciliacion()
+    servidor = application.bot_data.pop('servidor_metricas', None)
+    if servidor is not None:
+        await servidor.cleanup()
+
+
+def perezoso(modulo: str, funcion: str):
+    """
+    Callback que importa handlers.<modulo> la primera vez que se usa, así el
+    arranque no carga los módulos de comandos que todavía nadie pidió.
+    """
+    resuelta = None
+
+    async def _perezoso(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        nonlocal resuelta
+        if resuelta is None:
+            resuelta = getattr(importlib.import_module(f"handlers.{modulo}"), funcion)
+        return await resuelta(update, context)
+
+    _perezoso.__name__ = _perezoso.__qualname__ = funcion
+    return _perezoso
+
+
+def comando(nombre: str, callback, escribe: bool = False) -> CommandHandler:
+    """
+    CommandHandler con el callback instrumentado (tiempos, SQL y respuesta en /metrics)
+    que trabaja sobre la BD del negocio del chat (NEGOCIOS en config_vars).
+    Con escribe=True el comando es idempotente: un update reentregado no se aplica dos veces.
+    """
+    if escribe:
+        callback = idempotente(nombre, callback)
+    return CommandHandler(nombre, instrumentar(nombre, con_negocio(callback)))
+
+
+def crear_aplicacion(token: str = TOKEN, base_url: str = TELEGRAM_API_URL) -> Application:
+    """Construye la Application con todos los manejadores (sin arrancarla)."""
+    # Las respuestas de texto pasan por la cola de envíos (límites de Telegram, reintentos
+    # ante flood control): el handler no espera a la Bot API
+    # Un solo contexto TLS para las dos conexiones: cargar los certificados cuesta ~30 ms cada vez
+    tls = httpx.create_ssl_context()
+    bot_telegram = BotEncolado(
+        token=token,
+        base_url=base_url,
+        request=RequestMedido(connection_pool_size=ENVIOS_CONEXIONES, httpx_kwargs={"verify": tls}),
+        get_updates_request=HTTPXRequest(httpx_kwargs={"verify": tls}),
+    )
+    # Varios updates a la vez: una consulta lenta no frena al resto de usuarios
+    application = (
+        Application.builder().bot(bot_telegram)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # --- REGISTRO DE MANEJADORES ---
     # Contabilidad
-    application.add_handler(CommandHandler("set_tasa", set_tasa_command))
-    application.add_handler(CommandHandler("ingreso", ingreso_command))
-    application.add_handler(CommandHandler("gasto", gasto_command))
-    application.add_handler(CommandHandler("balance", balance_command))
-    application.add_handler(CommandHandler("cambio", cambio_command))
-    application.add_handler(CommandHandler("pago_vendedor", pago_vendedor_command))
-    application.add_handler(CommandHandler("pago_proveedor", pago_proveedor_command))
-    application.add_handler(CommandHandler("deudas", deudas_command))
-    application.add_handler(CommandHandler("historial", historial_command))
-    application.add_handler(CommandHandler("exportar", exportar_command))
+    application.add_handler(comando("set_tasa", perezoso("contabilidad", "set_tasa_command"), escribe=True))
+    application.add_handler(comando("ingreso", perezoso("contabilidad", "ingreso_command"), escribe=True))
+    application.add_handler(comando("gasto", perezoso("contabilidad", "gasto_command"), escribe=True))
+    application.add_handler(comando("balance", perezoso("contabilidad", "balance_command")))
+    application.add_handler(comando("verificar_saldos", perezoso("contabilidad", "verificar_saldos_command"), escribe=True))  # "reparar" reescribe SaldosCaja
+    application.add_handler(comando("cambio", perezoso("contabilidad", "cambio_command"), escribe=True))
+    application.add_handler(comando("pago_vendedor", perezoso("contabilidad", "pago_vendedor_command"), escribe=True))
+    application.add_handler(comando("pago_proveedor", perezoso("contabilidad", "pago_proveedor_command"), escribe=True))
+    application.add_handler(comando("deudas", perezoso("contabilidad", "deudas_command")))
+    application.add_handler(comando("historial", perezoso("contabilidad", "historial_command")))
+    application.add_handler(CallbackQueryHandler(instrumentar("historial_pagina", con_negocio(perezoso("contabilidad", "historial_pagina_callback"))), pattern=f"^{HISTORIAL_CALLBACK}:"))
+    application.add_handler(comando("exportar", perezoso("contabilidad", "exportar_command")))  # Solo lee
+    application.add_handler(comando("cierre", perezoso("contabilidad", "cierre_command"), escribe=True))
     
     # Inventario
-    application.add_handler(CommandHandler("entrada", entrada_command))
-    application.add_handler(CommandHandler("stock", stock_command))
-    application.add_handler(CommandHandler("venta", venta_command)) 
-    application.add_handler(CommandHandler("ganancia", ganancia_command))
-    application.add_handler(CommandHandler("consignar", consignar_command))
-    application.add_handler(CommandHandler("stock_consignado", stock_consignado_command))
+    application.add_handler(comando("entrada", perezoso("inventario", "entrada_command"), escribe=True))
+    application.add_handler(comando("stock", perezoso("inventario", "stock_command")))
+    application.add_handler(comando("venta", perezoso("inventario", "venta_command"), escribe=True)) 
+    application.add_handler(comando("ganancia", perezoso("inventario", "ganancia_command")))
+    application.add_handler(comando("consignar", perezoso("inventario", "consignar_command"), escribe=True))
+    application.add_handler(comando("stock_consignado", perezoso("inventario", "stock_consignado_command")))
+
+    # Lotes (texto o CSV)
+    application.add_handler(comando("lote", perezoso("lote", "lote_command"), escribe=True))
+    application.add_handler(MessageHandler(filters.Document.FileExtension("csv"), instrumentar("lote_csv", con_negocio(idempotente("lote_csv", perezoso("lote", "lote_documento_handler"))))))
+
+    # Métricas (admins)
+    application.add_handler(CommandHandler("metrics", metrics_command))
     # -------------------------------
-    
-    print("¡Bot corriendo! Presiona CTRL+C para detenerlo.")
-    application.run_polling()
+
+    # Reportes diarios a los admins (/balance, /deudas, /stock, /ganancia) si hay JobQueue
+    programar_reportes(application)
+    return application
+
+
+def main() -> None:
+    """Función principal que inicia el bot."""
+    inicio = time.perf_counter()
+    migraciones = setup_database()
+    esquema = time.perf_counter()
+    application = crear_aplicacion()
+    listo = time.perf_counter()
+    logger.info(
+        f"Arranque en {(listo - _INICIO) * 1000:.0f} ms: imports {(inicio - _INICIO) * 1000:.0f} ms, "
+        f"esquema {(esquema - inicio) * 1000:.0f} ms ({migraciones} migraciones), "
+        f"aplicación {(listo - esquema) * 1000:.0f} ms"
+    )
+
+    print(f"¡Bot corriendo en modo {BOT_MODO}! Presiona CTRL+C para detenerlo.")
+    if BOT_MODO == "webhook":
+        # Import diferido: aiohttp solo hace falta en modo webhook
+        from servidor_webhook import ejecutar_webhook
+        asyncio.run(ejecutar_webhook(application, secreto=getattr(config_secret, "WEBHOOK_SECRET", None)))
+    else:
+        application.run_polling()
+    db_executor.cerrar()
+    db_reportes.cerrar()
+    db_pool.cerrar()
+    pool_negocios.cerrar()
 
 
 if __name__ == '__main__':
@@ -1,5 +1,79 @@
 # config_vars.py
 
-TASA_USD_CUP = 410.0 
+TASA_USD_CUP = 410.0  # Tasa inicial: solo siembra TasasCambio en una BD nueva (luego manda /set_tasa)
 VALID_MONEDAS = ['usd', 'cup', 'cup-t']
-VALID_CAJAS = ['cfg', 'sc', 'trd']
\ No newline at end of file
+VALID_CAJAS = ['cfg', 'sc', 'trd']
+
+# Base de datos
+DB_PATH = "contabilidad.db"
+DB_MAX_WORKERS = 4  # Hilos dedicados a SQLite (fuera del event loop) para los comandos cortos
+DB_REPORTES_WORKERS = 2  # Hilos aparte para /exportar, /ganancia con rango, /verificar_saldos y /cierre
+DB_POOL_SIZE = DB_MAX_WORKERS + DB_REPORTES_WORKERS + 1  # Conexiones abiertas que se reutilizan entre comandos
+DB_CACHE_KIB = 20000  # Tamaño del page cache por conexión (KiB)
+DB_MMAP_BYTES = 256 * 1024 * 1024  # Lectura por mmap (256 MiB)
+DB_BUSY_TIMEOUT_MS = 5000  # Espera máxima por un lock de escritura
+DB_ARCHIVO_SUFIJO = "_archivo"  # /cierre mueve los periodos cerrados a contabilidad_archivo.db (junto a DB_PATH)
+
+# Varios negocios en un mismo bot: cada uno con su propia BD (NEGOCIOS_DIR/<nombre>.db)
+NEGOCIOS = {}  # chat_id o user_id -> nombre del negocio (ej: {-1001234: "bodega", 5678: "cafeteria"}); el resto usa DB_PATH
+NEGOCIOS_DIR = "negocios"
+NEGOCIOS_ABIERTOS_MAX = 32  # BDs de negocios con conexiones abiertas a la vez (se cierran las menos usadas)
+NEGOCIOS_POOL_SIZE = 2  # Conexiones por negocio (cada una abre ~6 descriptores: BD, archivo, -wal y -shm)
+NEGOCIOS_CACHE_KIB = 2000  # Page cache por conexión de un negocio (KiB)
+
+# Concurrencia
+CONCURRENT_UPDATES = 8  # Updates de Telegram procesados a la vez (los chequeos de saldo/stock usan locks por recurso)
+
+# Modo de servicio: "polling" (getUpdates) o "webhook" (Telegram llama a un endpoint HTTP del bot)
+BOT_MODO = "polling"
+TELEGRAM_API_URL = "https://api.telegram.org/bot"  # Se puede apuntar a una Bot API local o falsa para pruebas
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PUERTO = 8443
+WEBHOOK_RUTA = "/telegram"
+WEBHOOK_URL_PUBLICA = ""  # https://... que ve Telegram; vacío = no registrar el webhook (pruebas locales)
+WEBHOOK_MAX_CONEXIONES = 40  # Conexiones simultáneas que Telegram abre hacia el webhook (1-100)
+
+# Idempotencia: updates ya procesados (Telegram reentrega los no confirmados hasta 24 h)
+PROCESADOS_TTL_HORAS = 48  # Tiempo que se recuerda un update_id en ProcesadosUpdates
+PROCESADOS_CACHE = 20000  # update_id recientes en memoria (el chequeo caliente no toca la BD)
+PROCESADOS_PURGA_CADA = 1000  # Cada cuántos updates registrados se borran los vencidos
+
+# Envíos a Telegram (cola con los límites de la Bot API)
+ENVIOS_GLOBAL_POR_SEG = 30  # Mensajes por segundo para todo el bot
+ENVIOS_CHAT_POR_SEG = 1.0  # Mensajes por segundo a un mismo chat privado...
+ENVIOS_CHAT_RAFAGA = 3  # ...con ráfagas cortas de hasta este tamaño (un reporte partido en 3 sale junto)
+ENVIOS_GRUPO_POR_MIN = 20  # Mensajes por minuto a un mismo grupo
+ENVIOS_REINTENTOS = 5  # Reintentos ante errores de red (los RetryAfter se reintentan siempre)
+ENVIOS_CONEXIONES = 32  # Conexiones HTTP simultáneas hacia la Bot API
+ENVIOS_VACIAR_SEG = 10  # Espera máxima al detener el bot para enviar lo que quedó en cola
+
+# Métricas de los comandos (/metrics)
+METRICAS_LENTO_MS = 2000  # Comandos más lentos que esto se registran en el log con su desglose
+METRICAS_HOST = "127.0.0.1"
+METRICAS_PUERTO = 0  # >0 expone GET /metrics en formato Prometheus en ese puerto; 0 = desactivado
+
+# Inventario
+INVENTARIO_RECONCILIAR_SEG = 300  # Cada cuánto se compara la caché de inventario con Productos
+
+# Historial
+HISTORIAL_PAGE_SIZE = 15  # Movimientos por página de /historial (cabe en un mensaje de 4096 caracteres)
+HISTORIAL_MAX_DIAS = 36500  # Máximo N de /historial N (100 años; más allá la fecha límite desborda)
+HISTORIAL_CALLBACK = "hist"  # Prefijo del callback_data de los botones del historial (bot.py filtra por él)
+
+# Deudas
+DEUDAS_EXTRACTO_FILAS = 15  # Asientos mostrados por /deudas [actor], los más recientes
+
+# Reportes (/stock, /deudas, /historial, /stock_consignado)
+RESPUESTAS_CACHE_FRAGMENTOS = 8192  # Líneas formateadas que se recuerdan (por valores de la fila)
+
+# Reportes programados (JobQueue: requiere python-telegram-bot[job-queue])
+REPORTES_PROGRAMADOS = ["balance", "deudas", "stock", "ganancia"]  # Se envían a ADMIN_USER_IDS
+REPORTES_HORAS = ["07:30"]  # Horas del día (HH:MM) en que se generan y envían; [] = sin envíos
+REPORTES_ZONA_HORARIA = "America/Havana"
+
+# Exportación
+EXPORT_BATCH_SIZE = 1000  # Filas leídas del cursor por lote al generar el CSV
+
+# Lotes (/lote y CSV)
+LOTE_MAX_LINEAS = 5000  # Operaciones por lote
+LOTE_MAX_BYTES = 1024 * 1024  # Tamaño máximo del CSV recibido
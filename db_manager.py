@@ -1,27 +1,221 @@
+"""
+Esquema de la BD y sus migraciones.
+
+El esquema lleva versión en PRAGMA user_version: setup_database aplica solo
+los pasos de MIGRACIONES posteriores a la versión de la BD (cada uno deja la
+versión nueva al terminar) y, si ya está al día, no toca el esquema. Para
+cambiarlo se agrega un paso al final de MIGRACIONES, nunca se edita uno ya
+publicado; p. ej. un índice nuevo va en INDICES y en un paso que llame a
+crear_indices. Un paso cortado a mitad se repite en el próximo arranque, así
+que debe poder aplicarse dos veces (IF NOT EXISTS, agregar_columna, ...).
+ReportesCache se vacía solo cuando se aplica alguna migración: si cambia el
+formato de un reporte cacheado, el cambio lleva un paso (aunque no toque nada
+más) para que no se sirvan los reportes con el formato anterior.
+"""
+import os
 import sqlite3
 import logging
+import time
+from typing import Callable, List, Tuple
+
+from config_vars import DB_PATH, TASA_USD_CUP
+from handlers.db_utils import (
+    configurar_conexion, adjuntar_archivo, invalidar_caches, ruta_archivo, ESQUEMA_ARCHIVO,
+    MovimientoManager, VentaManager, CierreManager, DeudaManager,
+    ReportesManager,
+)
 
 # Configuración de logging (si la tenías en bot.py, cópiala aquí)
 logger = logging.getLogger(__name__)
 
-def setup_database():
-    """Crea la BD y las tablas 'Movimientos' y 'Productos' si no existen."""
-    conn = sqlite3.connect("contabilidad.db") 
-    cursor = conn.cursor()
-    
-    # Tabla Movimientos (Corregida: Eliminado 'N/A' de la restricción de caja)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS Movimientos (
+# Índices secundarios de las rutas de acceso calientes.
+# (nombre, sentencia) — se crean con IF NOT EXISTS, así que aplicarlos es idempotente.
+# Uno nuevo llega a las BDs existentes con un paso de MIGRACIONES que llame a crear_indices.
+INDICES = [
+    # /historial y /exportar: rango y orden por fecha (id desempata para paginar)
+    ("idx_movimientos_fecha",
+     "CREATE INDEX IF NOT EXISTS idx_movimientos_fecha ON Movimientos (fecha, id)"),
+    # Saldos por caja/moneda (verificación y reconstrucción de SaldosCaja): índice cubriente
+    ("idx_movimientos_caja_moneda",
+     "CREATE INDEX IF NOT EXISTS idx_movimientos_caja_moneda ON Movimientos (caja, moneda, tipo, monto)"),
+    # /ganancia: filtro por tipo = 'venta'
+    ("idx_movimientos_tipo",
+     "CREATE INDEX IF NOT EXISTS idx_movimientos_tipo ON Movimientos (tipo, fecha)"),
+    # /stock: sólo productos con existencias, ya ordenados por código
+    ("idx_productos_con_stock",
+     "CREATE INDEX IF NOT EXISTS idx_productos_con_stock ON Productos (codigo) WHERE stock > 0"),
+    # /deudas: sólo deudas pendientes, en el orden del reporte (tipo DESC evita el sort)
+    ("idx_deudas_pendientes",
+     "CREATE INDEX IF NOT EXISTS idx_deudas_pendientes ON Deudas (tipo DESC, moneda, actor_id) WHERE monto_pendiente > 0"),
+    # /deudas [actor]: asientos de un actor, el más reciente primero
+    ("idx_deuda_movimientos_actor",
+     "CREATE INDEX IF NOT EXISTS idx_deuda_movimientos_actor ON DeudaMovimientos (actor_id, id)"),
+    # Nota: /venta busca Consignaciones por (codigo, vendedor, stock > 0) y Deudas por
+    # (actor_id, moneda, tipo); ambas rutas ya las cubren los índices de sus UNIQUE.
+    # /stock_consignado: stock pendiente de un vendedor
+    ("idx_consignaciones_vendedor",
+     "CREATE INDEX IF NOT EXISTS idx_consignaciones_vendedor ON Consignaciones (vendedor, stock, codigo)"),
+    # Tasa vigente (la última) y tasa en una fecha: búsqueda por vigencia
+    ("idx_tasas_vigencia",
+     "CREATE INDEX IF NOT EXISTS idx_tasas_vigencia ON TasasCambio (vigente_desde, id)"),
+    # Purga de ProcesadosUpdates vencidos y carga de los recientes al arrancar
+    ("idx_procesados_fecha",
+     "CREATE INDEX IF NOT EXISTS idx_procesados_fecha ON ProcesadosUpdates (fecha)"),
+    # /venta y /consignar: lotes abiertos de un producto en orden FIFO (el más viejo primero)
+    ("idx_lotes_abiertos",
+     "CREATE INDEX IF NOT EXISTS idx_lotes_abiertos ON LotesInventario (codigo, fecha, id) WHERE cantidad_restante > 0"),
+]
+
+
+# Índices que ya no usa ninguna consulta (sólo encarecen las escrituras)
+INDICES_OBSOLETOS = [
+    "idx_venta_detalle_totales",  # /ganancia lee ahora GananciaDiaria
+]
+
+
+def crear_triggers_versiones(cursor: sqlite3.Cursor) -> None:
+    """
+    Un trigger por tabla y operación que sube el contador del dominio en
+    VersionesDatos: los reportes en ReportesCache saben así si sus datos cambiaron.
+    """
+    for dominio, tablas in ReportesManager.DOMINIOS.items():
+        cursor.execute("INSERT OR IGNORE INTO VersionesDatos (dominio, version) VALUES (?, 0)", (dominio,))
+        for tabla in tablas:
+            for operacion in ("INSERT", "UPDATE", "DELETE"):
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_version_{tabla.lower()}_{operacion.lower()}
+                    AFTER {operacion} ON {tabla}
+                    BEGIN
+                        UPDATE VersionesDatos SET version = version + 1 WHERE dominio = '{dominio}';
+                    END
+                """)
+
+
+def crear_indices(cursor: sqlite3.Cursor) -> None:
+    """Crea (si faltan) los índices secundarios y actualiza las estadísticas del planificador."""
+    for nombre in INDICES_OBSOLETOS:
+        cursor.execute(f"DROP INDEX IF EXISTS {nombre}")
+    for _, sentencia in INDICES:
+        cursor.execute(sentencia)
+    cursor.execute("PRAGMA optimize")
+
+
+def agregar_columna(cursor: sqlite3.Cursor, tabla: str, columna: str, definicion: str) -> bool:
+    """Añade una columna a una tabla existente si aún no la tiene. Retorna True si la añadió."""
+    cursor.execute(f"PRAGMA table_info({tabla})")
+    if any(fila[1] == columna for fila in cursor.fetchall()):
+        return False
+    cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+    return True
+
+
+# Movimientos: el libro mayor. 'apertura' es el saldo de una caja/moneda al
+# cierre del periodo anterior (lo demás quedó en la BD de archivo) y puede ser negativo.
+# Un /cambio son dos filas: 'traspaso' sale de la caja origen, 'traspaso_entrada' entra en la destino.
+SQL_TABLA_MOVIMIENTOS = """
+    CREATE TABLE IF NOT EXISTS {tabla} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        tipo TEXT NOT NULL CHECK (tipo IN ('ingreso', 'gasto', 'traspaso', 'venta', 'consignacion_finalizada')),
-        monto REAL NOT NULL CHECK (monto >= 0),
+        tipo TEXT NOT NULL CHECK (tipo IN ('ingreso', 'gasto', 'traspaso', 'traspaso_entrada', 'venta', 'consignacion_finalizada', 'apertura')),
+        monto REAL NOT NULL CHECK (monto >= 0 OR tipo = 'apertura'),
         moneda TEXT NOT NULL CHECK (moneda IN ('usd', 'cup', 'cup-t')),
         caja TEXT NOT NULL CHECK (caja IN ('cfg', 'sc', 'trd')), 
         user_id INTEGER NOT NULL,
-        descripcion TEXT NOT NULL DEFAULT ''
+        descripcion TEXT NOT NULL DEFAULT '',
+        tasa_usd_cup REAL             -- Tasa USD/CUP vigente al registrar el movimiento
     )
+"""
+
+
+def reconstruir_movimientos(cursor: sqlite3.Cursor) -> None:
+    """Reconstruye Movimientos con el CHECK de SQL_TABLA_MOVIMIENTOS (SQLite no permite alterarlo)."""
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Movimientos'")
+    fila = cursor.fetchone()
+    cursor.execute(SQL_TABLA_MOVIMIENTOS.format(tabla="Movimientos_nueva"))
+    cursor.execute("""
+        INSERT INTO Movimientos_nueva (id, fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup)
+        SELECT id, fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup FROM Movimientos
     """)
+    cursor.execute("DROP TABLE Movimientos")
+    # Sin reescribir las vistas temporales de la BD de archivo, si ya está adjunta
+    # (MovimientosTodos referencia main.Movimientos, que en este instante no existe)
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    cursor.execute("ALTER TABLE Movimientos_nueva RENAME TO Movimientos")
+    cursor.execute("PRAGMA legacy_alter_table = OFF")
+    if fila is not None:
+        # Conservar el contador de AUTOINCREMENT aunque las últimas filas se hayan borrado
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'Movimientos'", (fila[0],))
+
+
+# Versión del esquema de la BD de archivo (su propio PRAGMA user_version)
+ARCHIVO_VERSION = 1
+
+
+def crear_esquema_archivo(cursor: sqlite3.Cursor) -> None:
+    """
+    Tablas de la BD de archivo: mismas columnas que las calientes, sin
+    AUTOINCREMENT ni CHECKs. No hace nada si el archivo ya está en ARCHIVO_VERSION.
+    """
+    cursor.execute(f"PRAGMA {ESQUEMA_ARCHIVO}.user_version")
+    if cursor.fetchone()[0] >= ARCHIVO_VERSION:
+        return
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ESQUEMA_ARCHIVO}.Movimientos (
+            id INTEGER PRIMARY KEY,
+            fecha TIMESTAMP NOT NULL,
+            tipo TEXT NOT NULL,
+            monto REAL NOT NULL,
+            moneda TEXT NOT NULL,
+            caja TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            descripcion TEXT NOT NULL DEFAULT '',
+            tasa_usd_cup REAL
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ESQUEMA_ARCHIVO}.VentaDetalle (
+            movimiento_id INTEGER PRIMARY KEY,
+            codigo TEXT NOT NULL,
+            unidades REAL NOT NULL,
+            vendedor TEXT,
+            es_consignada INTEGER NOT NULL DEFAULT 0,
+            ingreso REAL NOT NULL,
+            moneda_ingreso TEXT NOT NULL,
+            cmv REAL NOT NULL DEFAULT 0,
+            moneda_cmv TEXT
+        )
+    """)
+    # /historial y /exportar recorren el archivo por fecha, igual que la tabla caliente
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {ESQUEMA_ARCHIVO}.idx_movimientos_fecha ON Movimientos (fecha, id)"
+    )
+    cursor.execute(f"PRAGMA {ESQUEMA_ARCHIVO}.user_version = {ARCHIVO_VERSION}")
+
+
+def archivo_adjunto(conn: sqlite3.Connection) -> bool:
+    """Si la BD de archivo ya está adjunta a la conexión."""
+    return any(fila[1] == ESQUEMA_ARCHIVO for fila in conn.execute("PRAGMA database_list"))
+
+
+def esquema_inicial(conn: sqlite3.Connection, db_path: str) -> None:
+    """
+    Migración 1: todas las tablas, índices y triggers, y la puesta al día de
+    las BDs creadas antes de versionar el esquema (todas están en la versión 0,
+    en cualquier estado anterior: por eso cada parte comprueba lo que falta).
+    """
+    cursor = conn.cursor()
+    
+    # Tabla Movimientos (Corregida: Eliminado 'N/A' de la restricción de caja)
+    cursor.execute(SQL_TABLA_MOVIMIENTOS.format(tabla="Movimientos"))
+    movimientos_sin_tasa = agregar_columna(cursor, "Movimientos", "tasa_usd_cup", "REAL")
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Movimientos'")
+    if "'apertura'" not in cursor.fetchone()[0]:
+        reconstruir_movimientos(cursor)
+        logger.info("Movimientos reconstruida para admitir filas de apertura (/cierre).")
+    # La BD de archivo se adjunta fuera de una transacción y después de reconstruir
+    # Movimientos (sus vistas temporales la referencian)
+    conn.commit()
+    adjuntar_archivo(conn, db_path)
     
     # 🌟 NUEVA TABLA: Productos (con columna moneda_costo) 
     cursor.execute("""
@@ -64,5 +258,324 @@ def setup_database():
         )
     """)
     
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    # **Saldos por caja y moneda mantenidos de forma incremental**
+    # (se actualizan en la misma transacción que cada movimiento)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS SaldosCaja (
+            caja TEXT NOT NULL,
+            moneda TEXT NOT NULL,
+            saldo REAL NOT NULL DEFAULT 0,
+            last_movimiento_id INTEGER,
+            PRIMARY KEY (caja, moneda)
+        )
+    """)
+
+    # **Detalle estructurado de ventas** (ingreso, CMV y producto en columnas tipadas;
+    # una fila por movimiento 'venta')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS VentaDetalle (
+            movimiento_id INTEGER PRIMARY KEY,
+            codigo TEXT NOT NULL,
+            unidades REAL NOT NULL,
+            vendedor TEXT,
+            es_consignada INTEGER NOT NULL DEFAULT 0,
+            ingreso REAL NOT NULL,
+            moneda_ingreso TEXT NOT NULL,
+            cmv REAL NOT NULL DEFAULT 0,
+            moneda_cmv TEXT
+        )
+    """)
+
+    # **Resumen diario de ganancia** (por día, producto y monedas), mantenido por cada /venta.
+    # La clave empieza por la fecha: /ganancia [desde] [hasta] es una lectura por rango.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS GananciaDiaria (
+            fecha TEXT NOT NULL,               -- 'YYYY-MM-DD'
+            codigo TEXT NOT NULL,
+            moneda_ingreso TEXT NOT NULL,
+            moneda_cmv TEXT NOT NULL DEFAULT '',  -- '' en ventas sin CMV
+            ingreso REAL NOT NULL DEFAULT 0,
+            cmv REAL NOT NULL DEFAULT 0,
+            ingreso_usd REAL NOT NULL DEFAULT 0,  -- Convertidos con la tasa de cada venta
+            cmv_usd REAL NOT NULL DEFAULT 0,
+            unidades REAL NOT NULL DEFAULT 0,
+            ventas INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, codigo, moneda_ingreso, moneda_cmv)
+        ) WITHOUT ROWID
+    """)
+    resumen_sin_usd = agregar_columna(cursor, "GananciaDiaria", "ingreso_usd", "REAL NOT NULL DEFAULT 0")
+    agregar_columna(cursor, "GananciaDiaria", "cmv_usd", "REAL NOT NULL DEFAULT 0")
+
+    # **Tasas de cambio USD -> CUP versionadas** (una fila por /set_tasa)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS TasasCambio (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tasa REAL NOT NULL CHECK (tasa > 0),      -- CUP por 1 USD
+            vigente_desde TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            user_id INTEGER
+        )
+    """)
+
+    # **Capas de costo del inventario** (un lote por /entrada, consumidas en orden FIFO)
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'LotesInventario')")
+    lotes_nuevos = not cursor.fetchone()[0]
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS LotesInventario (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT NOT NULL,
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            cantidad_inicial REAL NOT NULL CHECK (cantidad_inicial > 0),
+            cantidad_restante REAL NOT NULL CHECK (cantidad_restante >= 0),
+            costo_unitario REAL NOT NULL CHECK (costo_unitario >= 0),
+            moneda_costo TEXT NOT NULL,
+            tasa_usd_cup REAL,                 -- Tasa vigente al comprar (convierte costos en monedas mixtas)
+            proveedor TEXT,
+            FOREIGN KEY(codigo) REFERENCES Productos(codigo) ON DELETE RESTRICT
+        )
+    """)
+
+    # **Diario de deudas** (solo inserción): un asiento por cada cambio de saldo de una deuda
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS DeudaMovimientos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            actor_id TEXT NOT NULL,
+            tipo TEXT NOT NULL CHECK (tipo IN ('POR_PAGAR', 'POR_COBRAR')),
+            moneda TEXT NOT NULL,
+            monto REAL NOT NULL,               -- Positivo aumenta la deuda, negativo la reduce
+            saldo REAL NOT NULL,               -- Pendiente después del asiento
+            concepto TEXT
+        )
+    """)
+
+    # **Totales de deudas por tipo y moneda** (se actualizan en la misma transacción que cada asiento)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS DeudasTotales (
+            tipo TEXT NOT NULL,
+            moneda TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            actores INTEGER NOT NULL DEFAULT 0,  -- Actores con saldo pendiente
+            PRIMARY KEY (tipo, moneda)
+        ) WITHOUT ROWID
+    """)
+
+    # **Cierres de periodo** (/cierre): lo anterior a `corte` está en la BD de archivo
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Cierres (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            corte TEXT NOT NULL,               -- 'YYYY-MM-DD': movimientos con fecha anterior archivados
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            user_id INTEGER,
+            movimientos INTEGER NOT NULL,
+            ventas INTEGER NOT NULL
+        )
+    """)
+    crear_esquema_archivo(cursor)
+
+    # **Updates ya procesados** por los comandos que escriben (reentregas de Telegram)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ProcesadosUpdates (
+            update_id INTEGER PRIMARY KEY,
+            chat_id INTEGER,
+            message_id INTEGER,
+            comando TEXT NOT NULL,
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # **Reportes renderizados** (/balance, /deudas, /stock, /ganancia y sus envíos programados)
+    # y contadores de cambios de las tablas de las que salen
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS VersionesDatos (
+            dominio TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ReportesCache (
+            reporte TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,       -- suma de VersionesDatos de sus dominios al generarlo
+            fragmentos TEXT NOT NULL,       -- JSON: fragmentos HTML de la respuesta (handlers/respuestas.py)
+            generado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    crear_triggers_versiones(cursor)
+
+    # **Índices para las consultas críticas de los handlers**
+    crear_indices(cursor)
+
+    # Migración: tasa inicial (la de config_vars) vigente desde siempre
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM TasasCambio)")
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            "INSERT INTO TasasCambio (tasa, vigente_desde) VALUES (?, '0000-01-01 00:00:00')",
+            (TASA_USD_CUP,)
+        )
+        logger.info(f"TasasCambio inicializada con 1 USD = {TASA_USD_CUP} CUP.")
+
+    # Migración: el stock existente pasa a ser un lote inicial a su costo promedio
+    if lotes_nuevos:
+        cursor.execute("""
+            INSERT INTO LotesInventario (
+                codigo, fecha, cantidad_inicial, cantidad_restante, costo_unitario, moneda_costo, tasa_usd_cup
+            )
+            SELECT codigo, '0000-01-01 00:00:00', stock, stock, costo_unitario, moneda_costo,
+                   (SELECT tasa FROM TasasCambio ORDER BY vigente_desde DESC, id DESC LIMIT 1)
+            FROM Productos
+            WHERE stock > 0
+        """)
+        if cursor.rowcount:
+            logger.info(f"LotesInventario: {cursor.rowcount} productos con stock migrados a un lote inicial.")
+
+    # Migración: los movimientos anteriores guardan la tasa vigente en su fecha
+    if movimientos_sin_tasa:
+        cursor.execute("""
+            UPDATE Movimientos
+            SET tasa_usd_cup = (
+                SELECT t.tasa FROM TasasCambio t
+                WHERE t.vigente_desde <= Movimientos.fecha
+                ORDER BY t.vigente_desde DESC, t.id DESC
+                LIMIT 1
+            )
+            WHERE tasa_usd_cup IS NULL
+        """)
+        logger.info(f"Movimientos: tasa de cambio asignada a {cursor.rowcount} registros históricos.")
+
+    # Migración: poblar SaldosCaja la primera vez a partir del histórico
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM SaldosCaja)")
+    saldos_vacios = not cursor.fetchone()[0]
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM Movimientos)")
+    hay_movimientos = cursor.fetchone()[0]
+    if saldos_vacios and hay_movimientos:
+        filas = MovimientoManager.reconstruir_saldos(conn)
+        logger.info(f"SaldosCaja inicializada desde el histórico ({filas} cajas/monedas).")
+    
+    # Migración: diario y totales de las deudas existentes antes de DeudaMovimientos
+    asientos = DeudaManager.inicializar_diario(conn)
+    if asientos:
+        logger.info(f"DeudaMovimientos: {asientos} deudas existentes abiertas como saldo inicial.")
+
+    # Migración: detalle de las ventas registradas antes de VentaDetalle
+    ventas = VentaManager.backfill_detalle(conn)
+    if ventas:
+        logger.info(f"VentaDetalle: {ventas} ventas históricas migradas desde su descripción.")
+
+    # Migración: poblar GananciaDiaria a partir del detalle existente
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM GananciaDiaria)")
+    resumen_vacio = not cursor.fetchone()[0]
+    if ventas or resumen_vacio or resumen_sin_usd:
+        filas = VentaManager.reconstruir_ganancia_diaria(conn)
+        if filas:
+            logger.info(f"GananciaDiaria reconstruida ({filas} filas).")
+    
+
+
+def traspasos_de_entrada(conn: sqlite3.Connection, db_path: str) -> None:
+    """
+    Migración 2: la pata de entrada de cada /cambio pasa a 'traspaso_entrada'.
+    Antes las dos patas se guardaban como 'traspaso' y la de entrada restaba en
+    la caja destino: se corrigen las filas (calientes y archivadas), las
+    aperturas que resumen las archivadas y SaldosCaja.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Movimientos'")
+    if "'traspaso_entrada'" not in cursor.fetchone()[0]:
+        reconstruir_movimientos(cursor)
+    if not archivo_adjunto(conn):
+        conn.commit()
+        adjuntar_archivo(conn, db_path)
+    crear_esquema_archivo(cursor)
+
+    entrada = "tipo = 'traspaso' AND descripcion LIKE 'TRASPASO (Ingreso)%'"
+    # Una entrada archivada restó su monto en vez de sumarlo en la apertura de su
+    # caja/moneda (las que siguen en la tabla caliente son de un /cierre cortado)
+    archivada = f"""
+        FROM {ESQUEMA_ARCHIVO}.Movimientos a
+        WHERE a.{entrada} AND a.caja = Movimientos.caja AND a.moneda = Movimientos.moneda
+          AND NOT EXISTS (SELECT 1 FROM main.Movimientos m WHERE m.id = a.id)
+    """
+    cursor.execute(f"""
+        UPDATE Movimientos SET monto = monto + 2 * (SELECT SUM(a.monto) {archivada})
+        WHERE tipo = 'apertura' AND EXISTS (SELECT 1 {archivada})
+    """)
+    cursor.execute(f"UPDATE {ESQUEMA_ARCHIVO}.Movimientos SET tipo = 'traspaso_entrada' WHERE {entrada}")
+    archivadas = cursor.rowcount
+    cursor.execute(f"UPDATE Movimientos SET tipo = 'traspaso_entrada' WHERE {entrada}")
+    calientes = cursor.rowcount
+    if archivadas or calientes:
+        MovimientoManager.reconstruir_saldos(conn)
+        logger.info(f"{calientes + archivadas} entradas de /cambio corregidas ({archivadas} archivadas); SaldosCaja reconstruida.")
+
+
+def costo_consignaciones(conn: sqlite3.Connection, db_path: str) -> None:
+    """
+    Migración 3: Consignaciones guarda el costo de lo consignado (el de los
+    lotes que salieron al consignar), que pasa a ser el CMV de la venta al
+    liquidarse. Las consignaciones abiertas toman el costo promedio actual de
+    su producto; las ventas consignadas ya registradas siguen sin CMV.
+    """
+    cursor = conn.cursor()
+    agregar_columna(cursor, "Consignaciones", "costo_unitario", "REAL NOT NULL DEFAULT 0")
+    agregar_columna(cursor, "Consignaciones", "moneda_costo", "TEXT")
+    cursor.execute("""
+        UPDATE Consignaciones SET (costo_unitario, moneda_costo) = (
+            SELECT p.costo_unitario, p.moneda_costo FROM Productos p WHERE p.codigo = Consignaciones.codigo
+        )
+        WHERE moneda_costo IS NULL
+    """)
+
+
+# Pasos del esquema, en orden: el i-ésimo lleva la BD a la versión i + 1
+MIGRACIONES: List[Tuple[str, Callable[[sqlite3.Connection, str], None]]] = [
+    ("esquema inicial", esquema_inicial),
+    ("traspasos de entrada", traspasos_de_entrada),
+    ("costo de consignaciones", costo_consignaciones),
+]
+ESQUEMA_VERSION = len(MIGRACIONES)
+
+
+def setup_database(db_path: str = DB_PATH) -> int:
+    """
+    Lleva la BD a ESQUEMA_VERSION aplicando solo las migraciones pendientes.
+    Con el esquema al día solo lee la versión: la BD de archivo se adjunta en
+    cada conexión del pool, los updates procesados se cargan con la primera
+    conexión (ConnectionPool) y un /cierre cortado se recupera al repetirlo.
+    Retorna cuántas migraciones aplicó.
+    """
+    inicio = time.perf_counter()
+    conn = configurar_conexion(sqlite3.connect(db_path))
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version > ESQUEMA_VERSION:
+        logger.warning(
+            f"{db_path} está en la versión {version} del esquema y este código llega a la {ESQUEMA_VERSION}: "
+            "no se migra (¿se volvió a una versión anterior del bot?)."
+        )
+    for numero, (descripcion, migrar) in enumerate(MIGRACIONES[version:], start=version + 1):
+        migrar(conn, db_path)
+        cursor.execute(f"PRAGMA user_version = {numero}")
+        conn.commit()
+        logger.info(f"{db_path}: migración {numero} aplicada ({descripcion}).")
+    pendientes = max(ESQUEMA_VERSION - version, 0)
+
+    # El esquema de la BD de archivo cambia con las migraciones; también se crea si falta el archivo
+    if pendientes or not os.path.exists(ruta_archivo(db_path)):
+        if not archivo_adjunto(conn):
+            adjuntar_archivo(conn, db_path)
+        crear_esquema_archivo(cursor)
+        # Un /cierre cortado entre la copia al archivo y el borrado (también lo descarta el próximo /cierre)
+        duplicados = CierreManager.recuperar_interrumpido(conn)
+        if duplicados:
+            logger.warning(f"Cierre interrumpido: {duplicados} movimientos quitados del archivo (repetir /cierre).")
+        if pendientes:
+            # Los reportes guardados pueden tener el formato del código anterior
+            cursor.execute("DELETE FROM ReportesCache")
+        conn.commit()
+    conn.close()
+    # La tasa y el inventario cacheados de esta BD (si su pool ya estaba abierto) corresponden a un estado anterior
+    invalidar_caches(db_path)
+    logger.info(
+        f"{db_path}: esquema v{max(version, ESQUEMA_VERSION)} listo en {(time.perf_counter() - inicio) * 1000:.1f} ms"
+        + (f" ({pendientes} migraciones)" if pendientes else "")
+    )
+    return pendientes
@@ -0,0 +1,217 @@
+"""
+Gramáticas declarativas de los argumentos de los comandos.
+
+Cada comando describe sus argumentos posicionales una sola vez (al importar el
+módulo del handler) con Comando([...]); de ahí salen el validador, el texto de
+uso y la tupla tipada que recibe el handler:
+
+    ARGS_GASTO = Comando("gasto", [numero("monto"), moneda("moneda"), caja("caja"), texto("descripcion")])
+    a = ARGS_GASTO.parsear(context.args)   # a.monto (float), a.moneda, a.caja, a.descripcion
+    ...
+    except ValueError as e:
+        await responder_error(update, ARGS_GASTO, e)
+
+Los opcionales se llenan en orden; un token que no encaja en un opcional pasa
+al siguiente (así /exportar deudas no exige escribir antes las fechas).
+
+No depende de la BD: las gramáticas se pueden probar sin conexión.
+"""
+import html
+import math
+from collections import namedtuple
+from datetime import date
+from typing import Any, Callable, FrozenSet, Iterable, List, Optional, Sequence
+
+from telegram import Update
+
+from config_vars import VALID_MONEDAS, VALID_CAJAS
+
+MONEDAS: FrozenSet[str] = frozenset(VALID_MONEDAS)
+CAJAS: FrozenSet[str] = frozenset(VALID_CAJAS)
+
+
+class ErrorArgumentos(ValueError):
+    """Argumentos que no cumplen la gramática del comando."""
+
+
+class Arg:
+    """Un argumento posicional: nombre (campo del resultado), conversor y texto de uso."""
+
+    __slots__ = ("nombre", "convertir", "uso", "opcional", "defecto", "resto", "minimo", "literal")
+
+    def __init__(
+        self,
+        nombre: str,
+        convertir: Callable[[str], Any],
+        uso: Optional[str] = None,
+        opcional: bool = False,
+        defecto: Any = None,
+        resto: bool = False,
+        minimo: int = 0,
+        literal: bool = False,
+    ):
+        self.nombre = nombre
+        self.convertir = convertir
+        self.uso = uso or nombre
+        self.opcional = opcional
+        self.defecto = defecto
+        self.resto = resto      # Consume todos los tokens que quedan
+        self.minimo = minimo    # Tokens mínimos del resto
+        self.literal = literal  # Palabra fija: se muestra sin corchetes en el uso
+
+
+def _positivo(nombre: str, token: str, tipo: type, maximo: Optional[float] = None) -> Any:
+    try:
+        valor = tipo(token)
+    except ValueError:
+        valor = None
+    # inf y nan no son montos: pasarían el chequeo de saldo o romperían los cálculos
+    if valor is None or not math.isfinite(valor) or not valor > 0:
+        clase = "un entero positivo" if tipo is int else "un número positivo"
+        raise ErrorArgumentos(f"{nombre}: debe ser {clase} (recibido: {token}).")
+    if maximo is not None and valor > maximo:
+        raise ErrorArgumentos(f"{nombre}: el máximo es {maximo:g} (recibido: {token}).")
+    return valor
+
+
+def numero(nombre: str, uso: Optional[str] = None, maximo: Optional[float] = None, **kwargs) -> Arg:
+    """Número real positivo y finito (montos, precios, costos, unidades)."""
+    return Arg(nombre, lambda token: _positivo(uso or nombre, token, float, maximo), uso, **kwargs)
+
+
+def entero(nombre: str, uso: Optional[str] = None, maximo: Optional[int] = None, **kwargs) -> Arg:
+    """Entero positivo (cantidades enteras, días), opcionalmente acotado."""
+    return Arg(nombre, lambda token: _positivo(uso or nombre, token, int, maximo), uso, **kwargs)
+
+
+def fecha(nombre: str, uso: Optional[str] = None, **kwargs) -> Arg:
+    """Fecha AAAA-MM-DD (se convierte a datetime.date)."""
+    def _convertir(token: str) -> date:
+        try:
+            return date.fromisoformat(token)
+        except ValueError:
+            raise ErrorArgumentos(f"{uso or nombre}: fecha no válida (usa AAAA-MM-DD, recibido: {token}).")
+
+    return Arg(nombre, _convertir, uso, **kwargs)
+
+
+def opcion(nombre: str, validos: Iterable[str], etiqueta: str, uso: Optional[str] = None, **kwargs) -> Arg:
+    """Token que debe pertenecer a un conjunto fijo (se compara en minúsculas)."""
+    conjunto = frozenset(validos)
+    lista = ", ".join(sorted(conjunto))
+
+    def _convertir(token: str) -> str:
+        valor = token.lower()
+        if valor not in conjunto:
+            raise ErrorArgumentos(f"{etiqueta} no válida: {token}. Usa: {lista}")
+        return valor
+
+    return Arg(nombre, _convertir, uso, **kwargs)
+
+
+def literal(nombre: str, valor: str, **kwargs) -> Arg:
+    """Palabra fija (p. ej. el '1' de /set_tasa 1 [tasa_cup], o un 'confirmar' opcional)."""
+    def _convertir(token: str) -> str:
+        if token.lower() != valor:
+            raise ErrorArgumentos(f"Se esperaba '{valor}' (recibido: {token}).")
+        return valor
+
+    return Arg(nombre, _convertir, valor, literal=True, **kwargs)
+
+
+def moneda(nombre: str = "moneda", etiqueta: str = "Moneda", **kwargs) -> Arg:
+    return opcion(nombre, MONEDAS, etiqueta, **kwargs)
+
+
+def caja(nombre: str = "caja", etiqueta: str = "Caja", **kwargs) -> Arg:
+    return opcion(nombre, CAJAS, etiqueta, **kwargs)
+
+
+def clave(nombre: str, uso: Optional[str] = None, **kwargs) -> Arg:
+    """Identificador normalizado a mayúsculas (código de producto, proveedor, vendedor)."""
+    return Arg(nombre, str.upper, uso, **kwargs)
+
+
+def texto(nombre: str, uso: Optional[str] = None, minimo: int = 1) -> Arg:
+    """El resto de los tokens unidos por espacios (descripción, motivo, nota)."""
+    return Arg(nombre, " ".join, f"{uso or nombre}...", resto=True, minimo=minimo)
+
+
+def tokens(nombre: str, uso: Optional[str] = None, minimo: int = 0) -> Arg:
+    """El resto de los tokens como lista (el handler los interpreta)."""
+    return Arg(nombre, list, f"{uso or nombre}...", resto=True, minimo=minimo)
+
+
+class Comando:
+    """
+    Gramática compilada de un comando: cuenta de argumentos, conversores en
+    orden, tupla de resultado y texto de uso se calculan una vez al crearla.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        args: Sequence[Arg],
+        ejemplo: Optional[str] = None,
+        validar: Optional[Callable[[Any], None]] = None,
+    ):
+        self.nombre = nombre
+        self._resto = args[-1] if args and args[-1].resto else None
+        self._fijos = tuple(a for a in args if not a.resto)
+        self._minimo = sum(1 for a in self._fijos if not a.opcional) + (self._resto.minimo if self._resto else 0)
+        self._maximo = None if self._resto else len(self._fijos)
+        self._validar = validar
+        self.Resultado = namedtuple(f"Args_{nombre}", [a.nombre for a in args])
+        self.uso = " ".join([f"/{nombre}"] + [a.uso if a.literal and not a.opcional else f"[{a.uso}]" for a in args])
+        self.ejemplo = ejemplo
+
+    def parsear(self, args: Optional[Sequence[str]]) -> Any:
+        """Valida y convierte context.args. Lanza ErrorArgumentos con un mensaje para el usuario."""
+        args = args or ()
+        n = len(args)
+        if n < self._minimo:
+            raise ErrorArgumentos("Faltan argumentos.")
+        if self._maximo is not None and n > self._maximo:
+            raise ErrorArgumentos("Demasiados argumentos.")
+
+        valores: List[Any] = []
+        usados = 0
+        saltado: Optional[ErrorArgumentos] = None  # Primer opcional que no encajó con el token
+        for i, arg in enumerate(self._fijos):
+            if usados >= n:
+                valores.append(arg.defecto)
+                continue
+            try:
+                valores.append(arg.convertir(args[usados]))
+                usados += 1
+                saltado = None
+            except ErrorArgumentos as e:
+                # Un opcional que no encaja deja el token para los siguientes
+                if not arg.opcional:
+                    raise
+                if i + 1 == len(self._fijos):
+                    raise saltado or e
+                saltado = saltado or e
+                valores.append(arg.defecto)
+        if self._resto is not None:
+            valores.append(self._resto.convertir(args[usados:]))
+        elif usados < n:
+            raise ErrorArgumentos(f"Argumento no reconocido: {args[usados]}")
+
+        resultado = self.Resultado._make(valores)
+        if self._validar is not None:
+            self._validar(resultado)
+        return resultado
+
+
+async def responder_error(update: Update, comando: Comando, error: Exception) -> None:
+    """Respuesta uniforme a un error de formato o validación (con el uso correcto del comando)."""
+    from handlers.envios import responder_html  # envios → metricas, que declara su gramática con este módulo
+
+    respuesta = (
+        f"<b>Error de formato o validación:</b> {html.escape(str(error))}\n"
+        f"Uso correcto: <code>{html.escape(comando.uso)}</code>"
+    )
+    if comando.ejemplo:
+        respuesta += f"\nEjemplo: <code>{html.escape(comando.ejemplo)}</code>"
+    await responder_html(update.message, respuesta)
@@ -1,68 +1,113 @@
 import csv
+import gzip
+import html
 import logging
+import os
 import sqlite3
+import tempfile
 from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
-from telegram import Update
+from datetime import date, datetime, timedelta
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 from config_secret import ADMIN_USER_IDS
-from config_vars import VALID_MONEDAS, VALID_CAJAS, TASA_USD_CUP
+from config_vars import (
+    DEUDAS_EXTRACTO_FILAS, EXPORT_BATCH_SIZE, HISTORIAL_CALLBACK, HISTORIAL_MAX_DIAS, HISTORIAL_PAGE_SIZE
+)
 
 
+from .respuestas import Respuesta, fragmento
+from .envios import responder, responder_html
+from .reportes import obtener_reporte, registrar_reporte
+from .argumentos import (
+    Arg, Comando, ErrorArgumentos, caja, clave, entero, fecha, literal, moneda, numero, opcion, responder_error, texto
+)
 from .db_utils import (
-    get_db_connection,
+    db_executor,
+    db_reportes,
+    lock_manager,
+    clave_caja,
+    clave_cierre,
+    CierreManager,
     DeudaManager,
-    MovimientoManager
+    MovimientoManager,
+    SaldoInsuficienteError,
+    TasaManager
 )
 
 logger = logging.getLogger(__name__)
 
+# Gramáticas de los comandos (se compilan una vez, al importar el módulo)
+ARGS_SET_TASA = Comando(
+    "set_tasa", [literal("base", "1"), numero("tasa_cup")], ejemplo="/set_tasa 1 410"
+)
+ARGS_INGRESO = Comando("ingreso", [numero("monto"), moneda(), caja()], ejemplo="/ingreso 100 usd cfg")
+ARGS_GASTO = Comando(
+    "gasto", [numero("monto"), moneda(), caja(), texto("descripcion")], ejemplo="/gasto 20 usd cfg transporte"
+)
+
+
+def _validar_cambio(a) -> None:
+    if a.caja_origen == a.caja_destino and a.moneda_origen == a.moneda_destino:
+        raise ErrorArgumentos("Las cajas y monedas de origen y destino no pueden ser iguales para un traspaso.")
+
+
+ARGS_CAMBIO = Comando(
+    "cambio",
+    [
+        numero("monto"),
+        moneda("moneda_origen", "Moneda de origen"), caja("caja_origen", "Caja de origen"),
+        moneda("moneda_destino", "Moneda de destino"), caja("caja_destino", "Caja de destino"),
+        texto("motivo"),
+    ],
+    ejemplo="/cambio 100 usd cfg cup sc cambio a cup",
+    validar=_validar_cambio,
+)
+ARGS_PAGO_VENDEDOR = Comando(
+    "pago_vendedor", [clave("vendedor"), numero("monto"), moneda(), caja(), texto("nota", minimo=0)]
+)
+ARGS_PAGO_PROVEEDOR = Comando(
+    "pago_proveedor", [clave("proveedor"), numero("monto"), moneda(), caja(), texto("motivo")]
+)
+ARGS_DEUDAS = Comando("deudas", [clave("actor", opcional=True)], ejemplo="/deudas PEDRO")
+ARGS_HISTORIAL = Comando(
+    "historial", [entero("dias", opcional=True, defecto=7, maximo=HISTORIAL_MAX_DIAS)], ejemplo="/historial 30"
+)
+ARGS_VERIFICAR_SALDOS = Comando("verificar_saldos", [literal("reparar", "reparar", opcional=True)])
+
 
 # handlers/contabilidad.py (Añadir al final)
 
 async def set_tasa_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Establece la tasa de cambio USD a CUP.
+    Establece la tasa de cambio USD a CUP (queda guardada en TasasCambio).
     Uso: /set_tasa 1 [tasa_cup]
     """
-    global TASA_USD_CUP # ¡IMPORTANTE! Para modificar la variable global
-
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
     try:
-        if len(context.args) != 2 or context.args[0] != '1':
-            raise ValueError("Faltan argumentos o formato incorrecto. Uso: /set_tasa 1 [tasa_cup] (ej: /set_tasa 1 410)")
-        
-        tasa_str = context.args[1]
-        try:
-            nueva_tasa = float(tasa_str)
-            if nueva_tasa <= 0: raise ValueError()
-        except ValueError:
-            await update.message.reply_text("Error: La tasa debe ser un número positivo.")
-            return
+        nueva_tasa = ARGS_SET_TASA.parsear(context.args).tasa_cup
 
-        # 1. Actualizar la variable global
-        global TASA_USD_CUP
-        TASA_USD_CUP = nueva_tasa
+        # 1. Registrar la nueva tasa y, ya confirmada, invalidar la caché
+        tasa_anterior = await db_executor.escribir((), TasaManager.registrar_tasa, nueva_tasa, user_id)
+        TasaManager.invalidar()
 
         # 2. Notificar al usuario
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"✅ <b>Tasa de Cambio Actualizada</b>\n\n"
-            f"Nueva Tasa: <b>1 USD = {TASA_USD_CUP:.2f} CUP</b>"
+            f"Nueva Tasa: <b>1 USD = {nueva_tasa:.2f} CUP</b>\n"
+            f"Anterior: 1 USD = {tasa_anterior:.2f} CUP"
         )
-        logger.info(f"Tasa de cambio actualizada a 1 USD = {TASA_USD_CUP} CUP por {user_id}")
+        logger.info(f"Tasa de cambio actualizada a 1 USD = {nueva_tasa} CUP por {user_id}")
 
     except ValueError as e:
-        await update.message.reply_html(
-            f"<b>Error de formato:</b> {e}\n"
-            "Uso correcto: <code>/set_tasa 1 [tasa_cup]</code>"
-        )
+        await responder_error(update, ARGS_SET_TASA, e)
     except Exception as e:
         logger.error(f"Error inesperado en /set_tasa: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al establecer la tasa.")
+        await responder(update.message, "Ocurrió un error inesperado al establecer la tasa.")
         
 
 async def ingreso_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -70,60 +115,37 @@ async def ingreso_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
 
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
     try:
-        if len(context.args) != 3:
-            raise ValueError("Formato incorrecto.")
+        monto, moneda, caja = ARGS_INGRESO.parsear(context.args)
 
-        monto_str = context.args[0]
-        moneda = context.args[1].lower()
-        caja = context.args[2].lower()
+        await db_executor.escribir((), _ingreso_db, monto, moneda, caja, user_id)
 
-        try:
-            monto = float(monto_str)
-            if monto <= 0: raise ValueError()
-        except ValueError:
-            await update.message.reply_text("Error: El monto debe ser un número positivo.")
-            return
-
-        if moneda not in VALID_MONEDAS:
-            await update.message.reply_text(f"Error: Moneda '{moneda}' no válida. Usa: {', '.join(VALID_MONEDAS)}")
-            return
-            
-        if caja not in VALID_CAJAS:
-            await update.message.reply_text(f"Error: Caja '{caja}' no válida. Usa: {', '.join(VALID_CAJAS)}")
-            return
-
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-        fecha_actual = datetime.now()
-        
-        cursor.execute(
-            "INSERT INTO Movimientos (fecha, tipo, monto, moneda, caja, user_id, descripcion) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (fecha_actual, 'ingreso', monto, moneda, caja, user_id, "Ingreso") # Añadimos "Ingreso" como descripción
-        )
-        
-        conn.commit()
-        conn.close()
-
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"✅ <b>¡Ingreso registrado!</b>\n\n"
             f"<b>Monto:</b> {monto:.2f} {moneda.upper()}\n"
             f"<b>Caja:</b> {caja.upper()}"
         )
         logger.info(f"Ingreso registrado: {monto} {moneda} en {caja} por {user_id}")
 
-    except ValueError:
-        await update.message.reply_html(
-            "<b>Error de formato.</b>\n"
-            "Uso correcto: <code>/ingreso [monto] [moneda] [caja]</code>\n"
-            "Ejemplo: <code>/ingreso 100 usd cfg</code>"
-        )
+    except ValueError as e:
+        await responder_error(update, ARGS_INGRESO, e)
     except Exception as e:
         logger.error(f"Error inesperado en /ingreso: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado.")
+        await responder(update.message, "Ocurrió un error inesperado.")
+
+
+def _ingreso_db(conn: sqlite3.Connection, monto: float, moneda: str, caja: str, user_id: int) -> None:
+    """Parte de BD de /ingreso (se ejecuta en el pool de BD)."""
+    fecha_actual = datetime.now()
+    
+    MovimientoManager.registrar_movimiento(
+        conn, 'ingreso', monto, moneda, caja, user_id,
+        "Ingreso", # Añadimos "Ingreso" como descripción
+        fecha=fecha_actual
+    )
 # ----------------------------------------------  
         
 # --- FASE 5: NUEVA FUNCIÓN PARA /gasto ---
@@ -137,54 +159,26 @@ async def gasto_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
     try:
         # 1. Capturar y validar argumentos (DENTRO del try)
-        if len(context.args) < 4:
-            raise ValueError("Faltan argumentos. Uso: /gasto [monto] [moneda] [caja] [descripcion...]")
+        monto, moneda, caja, descripcion = ARGS_GASTO.parsear(context.args)
 
-        monto_str = context.args[0]
-        moneda = context.args[1].lower()
-        caja = context.args[2].lower()
-        descripcion = " ".join(context.args[3:])
-        
+        # 2. Chequeo de saldo y registro en el pool de BD (fuera del event loop)
         try:
-            monto = float(monto_str)
-            if monto <= 0: raise ValueError()
-        except ValueError:
-            await update.message.reply_text("Error: El monto debe ser un número positivo.")
-            return
-
-        if moneda not in VALID_MONEDAS:
-            await update.message.reply_text(f"Error: Moneda no válida ({moneda}).")
-            return
-        
-        if caja not in VALID_CAJAS:
-            await update.message.reply_text(f"Error: Caja no válida ({caja}).")
-            return
-
-        # 2. Abrir conexión y realizar operaciones
-        with get_db_connection() as conn:
-            
-            # 🌟 CORRECCIÓN CLAVE: Chequeo de Saldo Negativo 🌟
-            # 'caja' y 'moneda' están ahora definidas aquí
-            saldo_actual = MovimientoManager.get_saldo_caja(conn, caja, moneda)
-            
-            if saldo_actual < monto:
-                await update.message.reply_html(
-                    f"⛔ <b>Saldo insuficiente</b> en caja {caja.upper()} ({moneda.upper()}). "
-                    f"Disponible: {saldo_actual:.2f} {moneda.upper()}."
-                )
-                return
-
-            # 3. Registrar Movimiento (Gasto)
-            MovimientoManager.registrar_movimiento(
-                conn, 'gasto', monto, moneda, caja, user_id, descripcion
+            await db_executor.escribir(
+                [clave_caja(caja, moneda)], _gasto_db, monto, moneda, caja, user_id, descripcion
+            )
+        except SaldoInsuficienteError as e:
+            await responder_html(update.message,
+                f"⛔ <b>Saldo insuficiente</b> en caja {caja.upper()} ({moneda.upper()}). "
+                f"Disponible: {e.disponible:.2f} {moneda.upper()}."
             )
+            return
         
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"💸 <b>Gasto Registrado!</b>\n\n"
             f"<b>Monto:</b> -{monto:.2f} {moneda.upper()} de {caja.upper()}\n"
             f"<b>Descripción:</b> {descripcion}"
@@ -193,71 +187,136 @@ async def gasto_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     except ValueError as e:
         # Este catch ahora solo maneja errores de formato de argumentos
-        # Se asegura de que el mensaje de error de formato muestre las variables relevantes
-        await update.message.reply_html(
-            f"<b>Error de formato:</b> {e}\n"
-            "Uso correcto: <code>/gasto [monto] [moneda] [caja] [descripcion...]</code>"
-        )
+        await responder_error(update, ARGS_GASTO, e)
     except Exception as e:
         logger.error(f"Error inesperado en /gasto: {e}", exc_info=True)
-        await update.message.reply_text("Ocurrió un error inesperado al registrar el gasto.")
+        await responder(update.message, "Ocurrió un error inesperado al registrar el gasto.")
+
+
+def _gasto_db(
+    conn: sqlite3.Connection, monto: float, moneda: str, caja: str, user_id: int, descripcion: str
+) -> None:
+    """Parte de BD de /gasto: valida saldo y registra el movimiento."""
+    # 🌟 CORRECCIÓN CLAVE: Chequeo de Saldo Negativo 🌟
+    saldo_actual = MovimientoManager.get_saldo_caja(conn, caja, moneda)
+    
+    if saldo_actual < monto:
+        raise SaldoInsuficienteError(caja, moneda, saldo_actual)
+
+    # 3. Registrar Movimiento (Gasto)
+    MovimientoManager.registrar_movimiento(
+        conn, 'gasto', monto, moneda, caja, user_id, descripcion
+    )
         
         
 # --- FASE 6: NUEVA FUNCIÓN PARA /balance ---
+def _reporte_balance(conn: sqlite3.Connection) -> Respuesta:
+    """Balance General: saldo de cada caja por moneda (se cachea en ReportesCache)."""
+    # 1. Saldos por caja y moneda, mantenidos en SaldosCaja por cada movimiento
+    # (ya no se suma todo el libro mayor en cada /balance)
+    resultados = conn.execute("""
+        SELECT caja, moneda, saldo as total
+        FROM SaldosCaja
+        ORDER BY caja, moneda
+    """).fetchall() # Obtiene todas las filas (ej: [('cfg', 'usd', 100.0), ('cfg', 'cup', 5000.0)])
+
+    if not resultados:
+        return Respuesta("No hay ningún movimiento registrado todavía.")
+
+    # 2. Agrupamos los resultados por caja
+    balances_por_caja = {}
+    for caja, moneda, total in resultados:
+        balances_por_caja.setdefault(caja, []).append(f"  • {total:,.2f} {moneda.upper()}")
+
+    # 3. Un bloque por caja (con un espacio antes de la siguiente)
+    respuesta = Respuesta("--- 📊 Balance General ---\n")
+    for caja, lineas in balances_por_caja.items():
+        respuesta.append(f"<b>CAJA: {caja.upper()}</b>\n" + "\n".join(lineas) + "\n")
+    return respuesta
+
+
+registrar_reporte("balance", ["saldos"], _reporte_balance)
+
+
 async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Manejador para el comando /balance."""
     user_id = update.effective_user.id
 
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
     
     try:
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-
-        # 1. La consulta SQL "Mágica"
-        # Suma todos los 'ingreso' y resta (ELSE -monto) todos los 'gasto'
-        # Agrupados por caja y moneda
-        cursor.execute("""
-            SELECT caja, moneda, SUM(CASE WHEN tipo = 'ingreso' THEN monto ELSE -monto END) as total
-            FROM Movimientos
-            GROUP BY caja, moneda
-            ORDER BY caja, moneda
-        """)
-        
-        resultados = cursor.fetchall() # Obtiene todas las filas (ej: [('cfg', 'usd', 100.0), ('cfg', 'cup', 5000.0)])
-        conn.close()
+        await (await obtener_reporte("balance")).enviar(update.message)
+
+    except Exception as e:
+        logger.error(f"Error inesperado en /balance: {e}")
+        await responder(update.message, "Ocurrió un error inesperado al calcular el balance.")
+# ----------------------------------------------
 
-        if not resultados:
-            await update.message.reply_text("No hay ningún movimiento registrado todavía.")
+# --- FASE 6.5: FUNCIÓN PARA /verificar_saldos (Cuadre de SaldosCaja) ---
+async def verificar_saldos_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Compara la tabla SaldosCaja contra el libro mayor (Movimientos) y
+    DeudasTotales contra la tabla Deudas.
+    Uso: /verificar_saldos [reparar]
+    """
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_USER_IDS:
+        await responder(update.message, "⛔ No tienes permiso.")
+        return
+
+    try:
+        reparar = ARGS_VERIFICAR_SALDOS.parsear(context.args).reparar is not None
+    except ValueError as e:
+        await responder_error(update, ARGS_VERIFICAR_SALDOS, e)
+        return
+
+    try:
+        # Recorren el libro completo: van por los hilos de reportes
+        diferencias = await db_reportes.ejecutar(MovimientoManager.verificar_saldos)
+        diferencias_deudas = await db_reportes.ejecutar(DeudaManager.verificar_totales)
+
+        if not diferencias and not diferencias_deudas:
+            await responder_html(update.message,
+                "✅ <b>SaldosCaja cuadra con el libro mayor y DeudasTotales con las deudas.</b>"
+            )
             return
 
-        # 2. Formatear la respuesta
-        respuesta = "--- 📊 Balance General ---\n\n"
-        
-        balances_por_caja = {} # Usamos un diccionario para agrupar
-        
-        # Agrupamos los resultados por caja
-        for caja, moneda, total in resultados:
-            if caja not in balances_por_caja:
-                balances_por_caja[caja] = []
-            
-            # Guardamos el texto formateado de la moneda
-            balances_por_caja[caja].append(f"  • {total:,.2f} {moneda.upper()}")
+        respuesta = ""
+        if diferencias:
+            respuesta += f"⚠️ <b>{len(diferencias)} descuadre(s) en SaldosCaja</b>\n\n"
+            for d in diferencias:
+                respuesta += (
+                    f"  • {d['caja'].upper()} {d['moneda'].upper()}: "
+                    f"tabla {d['saldo_tabla']:,.2f} vs libro {d['saldo_ledger']:,.2f}\n"
+                )
+        if diferencias_deudas:
+            respuesta += f"⚠️ <b>{len(diferencias_deudas)} descuadre(s) en DeudasTotales</b>\n\n"
+            for d in diferencias_deudas:
+                respuesta += (
+                    f"  • {d['tipo']} {d['moneda'].upper()}: "
+                    f"tabla {d['total_tabla']:,.2f} vs deudas {d['total_deudas']:,.2f}\n"
+                )
 
-        # 3. Construimos el texto final
-        for caja, lineas in balances_por_caja.items():
-            respuesta += f"<b>CAJA: {caja.upper()}</b>\n"
-            respuesta += "\n".join(lineas) # Unimos todas las líneas de esa caja
-            respuesta += "\n\n" # Añadimos un espacio antes de la siguiente caja
+        if reparar:
+            if diferencias:
+                await db_reportes.escribir((), MovimientoManager.reconstruir_saldos)
+                respuesta += "\n🔧 SaldosCaja reconstruida desde el libro mayor."
+                logger.warning(f"SaldosCaja reconstruida por {user_id} ({len(diferencias)} descuadres)")
+            if diferencias_deudas:
+                await db_reportes.escribir((), DeudaManager.reconstruir_totales)
+                respuesta += "\n🔧 DeudasTotales reconstruida desde las deudas."
+                logger.warning(f"DeudasTotales reconstruida por {user_id} ({len(diferencias_deudas)} descuadres)")
+        else:
+            respuesta += "\nUsa <code>/verificar_saldos reparar</code> para reconstruirlas."
 
-        await update.message.reply_html(respuesta)
+        await responder_html(update.message, respuesta)
 
     except Exception as e:
-        logger.error(f"Error inesperado en /balance: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al calcular el balance.")
-# ----------------------------------------------
+        logger.error(f"Error inesperado en /verificar_saldos: {e}", exc_info=True)
+        await responder(update.message, "Ocurrió un error inesperado al verificar los saldos.")
+
 
 # --- FASE 7 (REFACTORIZADA): FUNCIÓN PARA /cambio (Conversión Automática) ---
 # --- FASE 7 (CORREGIDA): FUNCIÓN PARA /cambio (Traspaso entre Cajas) ---
@@ -268,89 +327,29 @@ async def cambio_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
     try:
         # 1. Capturar y validar argumentos (DENTRO del try)
-        if len(context.args) < 6:
-            raise ValueError("Faltan argumentos. Uso: /cambio [monto] [moneda_origen] [caja_origen] [moneda_destino] [caja_destino] [motivo...]")
-
-        monto_str = context.args[0]
-        moneda_origen = context.args[1].lower()
-        caja_origen = context.args[2].lower()
-        moneda_destino = context.args[3].lower()
-        caja_destino = context.args[4].lower()
-        motivo = " ".join(context.args[5:])
+        monto, moneda_origen, caja_origen, moneda_destino, caja_destino, motivo = ARGS_CAMBIO.parsear(context.args)
 
-        # Validaciones de variables
+        # 2. Chequeo de saldo y registro en el pool de BD
         try:
-            monto = float(monto_str)
-            if monto <= 0: raise ValueError()
-        except ValueError:
-            await update.message.reply_text("Error: El monto debe ser un número positivo.")
-            return
-
-        if moneda_origen not in VALID_MONEDAS:
-            await update.message.reply_text(f"Error: Moneda de origen no válida ({moneda_origen}).")
-            return
-        
-        if caja_origen not in VALID_CAJAS:
-            await update.message.reply_text(f"Error: Caja de origen no válida ({caja_origen}).")
-            return
-
-        if moneda_destino not in VALID_MONEDAS:
-            await update.message.reply_text(f"Error: Moneda de destino no válida ({moneda_destino}).")
-            return
-
-        if caja_destino not in VALID_CAJAS:
-            await update.message.reply_text(f"Error: Caja de destino no válida ({caja_destino}).")
-            return
-        
-        if caja_origen == caja_destino and moneda_origen == moneda_destino:
-            await update.message.reply_html("⛔ Error: Las cajas y monedas de origen y destino no pueden ser iguales para un traspaso.")
-            return
-
-        # 2. Abrir conexión y realizar operaciones
-        with get_db_connection() as conn:
-            
-            # 🌟 CORRECCIÓN CLAVE: Chequeo de Saldo Negativo 🌟
-            saldo_actual = MovimientoManager.get_saldo_caja(conn, caja_origen, moneda_origen)
-            
-            if saldo_actual < monto:
-                await update.message.reply_html(
-                    f"⛔ <b>Saldo insuficiente</b> en caja de origen {caja_origen.upper()} ({moneda_origen.upper()}). "
-                    f"Disponible: {saldo_actual:.2f} {moneda_origen.upper()}. No se pudo realizar el traspaso."
-                )
-                return
-
-            # 3. Registrar Movimiento de Egreso (tipo='traspaso', gasto de origen)
-            MovimientoManager.registrar_movimiento(
-                conn, 'traspaso', monto, moneda_origen, caja_origen, user_id, 
-                f"TRASPASO (Egreso): A {caja_destino.upper()}/{moneda_destino.upper()} - Motivo: {motivo}"
+            monto_destino = await db_executor.escribir(
+                [clave_caja(caja_origen, moneda_origen), clave_caja(caja_destino, moneda_destino)],
+                _cambio_db, monto, moneda_origen, caja_origen,
+                moneda_destino, caja_destino, user_id, motivo
             )
-
-            # 4. Calcular el monto en la moneda de destino
-            if moneda_origen == moneda_destino:
-                monto_destino = monto
-            else:
-                tasa = TASA_USD_CUP # La tasa ya está definida en config_vars.py
-
-                if moneda_origen == 'usd' and moneda_destino in ['cup', 'cup-t']:
-                    monto_destino = monto * tasa
-                elif moneda_destino == 'usd' and moneda_origen in ['cup', 'cup-t']:
-                    monto_destino = monto / tasa
-                else: # Conversión entre CUP y CUP-T es 1:1, pero se registra si hay cambio de caja
-                    monto_destino = monto
-
-            # 5. Registrar Movimiento de Ingreso (tipo='traspaso', ingreso en destino)
-            MovimientoManager.registrar_movimiento(
-                conn, 'traspaso', monto_destino, moneda_destino, caja_destino, user_id, 
-                f"TRASPASO (Ingreso): Desde {caja_origen.upper()}/{moneda_origen.upper()} - Motivo: {motivo}"
+        except SaldoInsuficienteError as e:
+            await responder_html(update.message,
+                f"⛔ <b>Saldo insuficiente</b> en caja de origen {caja_origen.upper()} ({moneda_origen.upper()}). "
+                f"Disponible: {e.disponible:.2f} {moneda_origen.upper()}. No se pudo realizar el traspaso."
             )
+            return
         
         # 6. Mensaje de confirmación
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"✅ <b>Traspaso Registrado!</b>\n\n"
             f"<b>Origen:</b> -{monto:.2f} {moneda_origen.upper()} de {caja_origen.upper()}\n"
             f"<b>Destino:</b> +{monto_destino:.2f} {moneda_destino.upper()} a {caja_destino.upper()}\n"
@@ -359,14 +358,53 @@ async def cambio_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.info(f"Traspaso de {monto} {moneda_origen} a {monto_destino} {moneda_destino} registrado por {user_id}")
 
     except ValueError as e:
-        await update.message.reply_html(
-            f"<b>Error de formato o validación:</b> {e}\n"
-            "Uso correcto: <code>/cambio [monto] [moneda_origen] [caja_origen] [moneda_destino] [caja_destino] [motivo...]</code>"
-        )
+        await responder_error(update, ARGS_CAMBIO, e)
     except Exception as e:
         logger.error(f"Error inesperado en /cambio: {e}", exc_info=True)
-        await update.message.reply_text("Ocurrió un error inesperado al registrar el traspaso.")
-        
+        await responder(update.message, "Ocurrió un error inesperado al registrar el traspaso.")
+
+
+def _cambio_db(
+    conn: sqlite3.Connection, monto: float, moneda_origen: str, caja_origen: str,
+    moneda_destino: str, caja_destino: str, user_id: int, motivo: str
+) -> float:
+    """Parte de BD de /cambio. Retorna el monto acreditado en la moneda de destino."""
+    # 🌟 CORRECCIÓN CLAVE: Chequeo de Saldo Negativo 🌟
+    saldo_actual = MovimientoManager.get_saldo_caja(conn, caja_origen, moneda_origen)
+    
+    if saldo_actual < monto:
+        raise SaldoInsuficienteError(caja_origen, moneda_origen, saldo_actual)
+
+    # Ambas patas del traspaso usan (y guardan) la misma tasa
+    tasa = TasaManager.tasa_vigente(conn)
+
+    # 3. Registrar Movimiento de Egreso (tipo='traspaso', gasto de origen)
+    MovimientoManager.registrar_movimiento(
+        conn, 'traspaso', monto, moneda_origen, caja_origen, user_id, 
+        f"TRASPASO (Egreso): A {caja_destino.upper()}/{moneda_destino.upper()} - Motivo: {motivo}",
+        tasa_usd_cup=tasa
+    )
+
+    # 4. Calcular el monto en la moneda de destino
+    if moneda_origen == moneda_destino:
+        monto_destino = monto
+    else:
+        if moneda_origen == 'usd' and moneda_destino in ['cup', 'cup-t']:
+            monto_destino = monto * tasa
+        elif moneda_destino == 'usd' and moneda_origen in ['cup', 'cup-t']:
+            monto_destino = monto / tasa
+        else: # Conversión entre CUP y CUP-T es 1:1, pero se registra si hay cambio de caja
+            monto_destino = monto
+
+    # 5. Registrar Movimiento de Ingreso (tipo='traspaso_entrada', suma en destino)
+    MovimientoManager.registrar_movimiento(
+        conn, 'traspaso_entrada', monto_destino, moneda_destino, caja_destino, user_id, 
+        f"TRASPASO (Ingreso): Desde {caja_origen.upper()}/{moneda_origen.upper()} - Motivo: {motivo}",
+        tasa_usd_cup=tasa
+    )
+    return monto_destino
+
+
 async def pago_vendedor_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Registra el pago de un vendedor (liquidando una deuda POR COBRAR) e ingresa el monto en caja.
@@ -374,56 +412,19 @@ async def pago_vendedor_command(update: Update, context: ContextTypes.DEFAULT_TY
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
     try:
-        if len(context.args) < 4:
-            raise ValueError("Faltan argumentos. Uso: /pago_vendedor [vendedor] [monto] [moneda] [caja] [nota...]")
-
-        vendedor = context.args[0].upper()
-        monto_str = context.args[1]
-        moneda = context.args[2].lower()
-        caja = context.args[3].lower()
-        nota = " ".join(context.args[4:])
+        vendedor, monto, moneda, caja, nota = ARGS_PAGO_VENDEDOR.parsear(context.args)
 
-        try:
-            monto = float(monto_str)
-            if monto <= 0: raise ValueError()
-        except ValueError:
-            await update.message.reply_text("Error: El monto debe ser un número positivo.")
-            return
-
-        if moneda not in VALID_MONEDAS:
-            raise ValueError(f"Moneda no válida: {moneda}. Use una de: {', '.join(VALID_MONEDAS)}")
-        if caja not in VALID_CAJAS:
-            raise ValueError(f"Caja no válida: {caja.upper()}. Use una de: {', '.join(VALID_CAJAS).upper()}")
-
-        # ⭐️ USO CRÍTICO DEL CONTEXT MANAGER ⭐️
-        with get_db_connection() as conn:
-            
-            # 1. Reducir la deuda del vendedor (POR_COBRAR)
-            # El manager se encarga de la conversión de moneda a USD para el cálculo de la liquidación.
-            monto_liquidado_usd = DeudaManager.liquidar_deuda_con_pago(
-                conn=conn, 
-                actor_id=vendedor, 
-                monto_pagado=monto, 
-                moneda_pago=moneda,
-                tasa_cambio=TASA_USD_CUP
-            )
-            
-            # 2. Registrar el Ingreso en caja
-            MovimientoManager.registrar_movimiento(
-                conn=conn,
-                tipo='ingreso',
-                monto=monto,
-                moneda=moneda,
-                caja=caja,
-                user_id=user_id,
-                descripcion=f"PAGO VENDEDOR: {vendedor}. Liquidó deuda por {monto_liquidado_usd:.2f} USD. Nota: {nota}"
-            )
+        # ⭐️ Transacción en el pool de BD ⭐️
+        monto_liquidado_usd = await db_executor.escribir(
+            (),
+            _pago_vendedor_db, vendedor, monto, moneda, caja, user_id, nota
+        )
             
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"✅ <b>Pago Registrado!</b>\n\n"
             f"<b>Vendedor:</b> {vendedor}\n"
             f"<b>Ingreso en caja {caja.upper()}:</b> +{monto:.2f} {moneda.upper()}\n"
@@ -433,13 +434,41 @@ async def pago_vendedor_command(update: Update, context: ContextTypes.DEFAULT_TY
         logger.info(f"Pago de {vendedor} registrado por {user_id}")
 
     except ValueError as e:
-        await update.message.reply_html(
-            f"<b>Error de formato o validación:</b> {e}\n"
-            "Uso correcto: <code>/pago_vendedor [vendedor] [monto] [moneda] [caja] [nota...]</code>"
-        )
+        await responder_error(update, ARGS_PAGO_VENDEDOR, e)
     except Exception as e:
         logger.error(f"Error inesperado en /pago_vendedor: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al registrar el pago.")
+        await responder(update.message, "Ocurrió un error inesperado al registrar el pago.")
+
+
+def _pago_vendedor_db(
+    conn: sqlite3.Connection, vendedor: str, monto: float, moneda: str, caja: str, user_id: int, nota: str
+) -> float:
+    """Parte de BD de /pago_vendedor. Retorna el monto liquidado en USD."""
+    tasa = TasaManager.tasa_vigente(conn)
+
+    # 1. Reducir la deuda del vendedor (POR_COBRAR)
+    # El manager se encarga de la conversión de moneda a USD para el cálculo de la liquidación.
+    monto_liquidado_usd = DeudaManager.liquidar_deuda_con_pago(
+        conn=conn, 
+        actor_id=vendedor, 
+        monto_pagado=monto, 
+        moneda_pago=moneda,
+        tasa_cambio=tasa,
+        concepto=f"Pago {monto:.2f} {moneda.upper()}" + (f" - {nota}" if nota else "")
+    )
+    
+    # 2. Registrar el Ingreso en caja
+    MovimientoManager.registrar_movimiento(
+        conn=conn,
+        tipo='ingreso',
+        monto=monto,
+        moneda=moneda,
+        caja=caja,
+        user_id=user_id,
+        descripcion=f"PAGO VENDEDOR: {vendedor}. Liquidó deuda por {monto_liquidado_usd:.2f} USD. Nota: {nota}",
+        tasa_usd_cup=tasa
+    )
+    return monto_liquidado_usd
         
             
 # --- FASE 12 (CORREGIDA): FUNCIÓN PARA /pago_proveedor (Pago a Proveedor) ---
@@ -453,55 +482,30 @@ async def pago_proveedor_command(update: Update, context: ContextTypes.DEFAULT_T
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
     # conn = None # Ya no es necesario inicializar conn=None
 
     try:
-        if len(context.args) < 5:
-            raise ValueError("Faltan argumentos. Uso: /pago_proveedor [proveedor] [monto] [moneda] [caja] [motivo...]")
-
         # 1. Asignar y validar argumentos (fuera del bloque with)
-        proveedor = context.args[0].upper()
-        monto_str = context.args[1]
-        moneda = context.args[2].lower()
-        caja = context.args[3].lower()
-        motivo = " ".join(context.args[4:])
-
-        monto = float(monto_str)
-        if monto <= 0: raise ValueError("El monto debe ser positivo.")
-        if moneda not in VALID_MONEDAS: raise ValueError(f"Moneda no válida: {moneda}")
-        if caja not in VALID_CAJAS: raise ValueError(f"Caja no válida: {caja}")
+        proveedor, monto, moneda, caja, motivo = ARGS_PAGO_PROVEEDOR.parsear(context.args)
 
         fecha_actual = datetime.now()
         descripcion = f"PAGO a Proveedor: {proveedor} - Motivo: {motivo}"
 
-        # 2. Utilizar el manejador de contexto para la conexión (incluye commit/rollback)
-        with get_db_connection() as conn:
-            
-            # 🌟 2a. CHEQUEO DE SALDO NEGATIVO (CORRECCIÓN CLAVE) 🌟
-            # Aquí MovimientoManager.get_saldo_caja tiene acceso a 'conn', 'caja' y 'moneda'
-            saldo_actual = MovimientoManager.get_saldo_caja(conn, caja, moneda)
-            
-            if saldo_actual < monto:
-                await update.message.reply_html(
-                    f"⛔ <b>Saldo insuficiente</b> en caja {caja.upper()} ({moneda.upper()}). "
-                    f"Disponible: {saldo_actual:.2f} {moneda.upper()}. No se pudo realizar el pago."
-                )
-                # El return sale de la función, sin hacer commit.
-                return
-            
-            # 2b. Registro del GASTO (Movimientos)
-            # Usamos el método estático de MovimientoManager para mayor claridad y consistencia.
-            MovimientoManager.registrar_movimiento(
-                conn, 'gasto', monto, moneda, caja, user_id, descripcion
+        # 2. Transacción en el pool de BD (incluye commit/rollback)
+        try:
+            rows_updated = await db_executor.escribir(
+                [clave_caja(caja, moneda)], _pago_proveedor_db, proveedor, monto, moneda, caja, user_id, descripcion
             )
-            
-            # 2c. AJUSTE DE LA DEUDA (Lógica Mejorada)
-            rows_updated = DeudaManager.actualizar_deuda(
-                conn, proveedor, monto, moneda, 'POR_PAGAR', es_incremento=False
+        except SaldoInsuficienteError as e:
+            await responder_html(update.message,
+                f"⛔ <b>Saldo insuficiente</b> en caja {caja.upper()} ({moneda.upper()}). "
+                f"Disponible: {e.disponible:.2f} {moneda.upper()}. No se pudo realizar el pago."
             )
+            # La excepción provoca rollback, sin hacer commit.
+            return
 
         # 3. Confirmación mejorada (fuera del bloque with)
         if rows_updated > 0:
@@ -509,7 +513,7 @@ async def pago_proveedor_command(update: Update, context: ContextTypes.DEFAULT_T
         else:
             mensaje_deuda = "<b>Aviso:</b> No se encontró deuda 'POR PAGAR' para este proveedor."
 
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"💸 <b>Pago a Proveedor Registrado!</b>\n\n"
             f"<b>Proveedor:</b> {proveedor}\n"
             f"<b>Monto:</b> -{monto:.2f} {moneda.upper()} de {caja.upper()}\n"
@@ -519,232 +523,532 @@ async def pago_proveedor_command(update: Update, context: ContextTypes.DEFAULT_T
         logger.info(f"Pago a Proveedor {proveedor} registrado. Filas de deuda actualizadas: {rows_updated}")
 
     except ValueError as e:
-        # Se asegura que el mensaje de error de formato muestre las variables relevantes
-        # Solo mostrará e si es una de las excepciones de validación (ej. "El monto debe ser positivo.")
-        await update.message.reply_html(
-            f"<b>Error de formato o validación:</b> {e}\n"
-            "Uso correcto: <code>/pago_proveedor [proveedor] [monto] [moneda] [caja] [motivo...]</code>"
-        )
+        # Errores de la gramática del comando o de validación de la deuda
+        await responder_error(update, ARGS_PAGO_PROVEEDOR, e)
     except Exception as e:
         # Esto captura cualquier otro error inesperado, incluyendo si conn falla en conectarse
         logger.error(f"Error inesperado en /pago_proveedor: {e}", exc_info=True)
-        await update.message.reply_text("Ocurrió un error inesperado al registrar el pago.")
+        await responder(update.message, "Ocurrió un error inesperado al registrar el pago.")
     # finally ya no es necesario si se usa get_db_connection
+
+
+def _pago_proveedor_db(
+    conn: sqlite3.Connection, proveedor: str, monto: float, moneda: str, caja: str, user_id: int, descripcion: str
+) -> float:
+    """Parte de BD de /pago_proveedor. Retorna el saldo POR PAGAR resultante."""
+    # 🌟 2a. CHEQUEO DE SALDO NEGATIVO (CORRECCIÓN CLAVE) 🌟
+    saldo_actual = MovimientoManager.get_saldo_caja(conn, caja, moneda)
+    
+    if saldo_actual < monto:
+        raise SaldoInsuficienteError(caja, moneda, saldo_actual)
+    
+    # 2b. Registro del GASTO (Movimientos)
+    # Usamos el método estático de MovimientoManager para mayor claridad y consistencia.
+    MovimientoManager.registrar_movimiento(
+        conn, 'gasto', monto, moneda, caja, user_id, descripcion
+    )
+    
+    # 2c. AJUSTE DE LA DEUDA (Lógica Mejorada)
+    return DeudaManager.actualizar_deuda(
+        conn, proveedor, monto, moneda, 'POR_PAGAR', es_incremento=False, concepto=descripcion
+    )
             
 
 # --- FASE 13 : FUNCIÓN PARA /deudas_command (Consulta de Deudas) ---
 async def deudas_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Muestra el saldo actual de las cuentas por pagar (proveedores) y por cobrar (vendedores).
+    Muestra el saldo actual de las cuentas por pagar (proveedores) y por cobrar (vendedores),
+    o el estado de cuenta de un actor.
+    Uso: /deudas [actor]
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
-    conn = None
     try:
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-
-        # 1. Seleccionar todas las deudas activas (monto_pendiente > 0)
-        cursor.execute("""
-            SELECT actor_id, tipo, monto_pendiente, moneda
-            FROM Deudas
-            WHERE monto_pendiente > 0
-            ORDER BY tipo DESC, moneda, actor_id
-        """)
-        
-        resultados = cursor.fetchall()
-        
-        if not resultados:
-            await update.message.reply_text("✅ No hay deudas pendientes (por pagar o por cobrar).")
+        actor = ARGS_DEUDAS.parsear(context.args).actor
+    except ValueError as e:
+        await responder_error(update, ARGS_DEUDAS, e)
+        return
+
+    try:
+        if actor:
+            await (await _extracto_deudas(actor)).enviar(update.message)
             return
 
-        # 2. Estructurar el reporte
-        reporte_por_pagar = ""
-        reporte_por_cobrar = ""
-        total_por_pagar = {}
-        total_por_cobrar = {}
-        
-        for actor_id, tipo, monto, moneda in resultados:
-            moneda_upper = moneda.upper()
-            
-            if tipo == 'POR_PAGAR':
-                reporte_por_pagar += f"  • {actor_id}: -{monto:,.2f} {moneda_upper}\n"
-                total_por_pagar[moneda] = total_por_pagar.get(moneda, 0) + monto
-            
-            elif tipo == 'POR_COBRAR':
-                reporte_por_cobrar += f"  • {actor_id}: +{monto:,.2f} {moneda_upper}\n"
-                total_por_cobrar[moneda] = total_por_cobrar.get(moneda, 0) + monto
+        await (await obtener_reporte("deudas")).enviar(update.message)
 
-        # 3. Construir el mensaje final
-        respuesta = "📊 <b>ESTADO DE DEUDAS PENDIENTES</b> 📊\n\n"
-        
-        # --- A. Cuentas POR PAGAR (Proveedores) ---
-        respuesta += "❌ <b>CUENTAS POR PAGAR (Proveedores)</b>\n"
-        if reporte_por_pagar:
-            respuesta += reporte_por_pagar
-            respuesta += "  --- TOTALES POR PAGAR ---\n"
-            for moneda, total in total_por_pagar.items():
-                respuesta += f"  Total {moneda.upper()}: -{total:,.2f} {moneda.upper()}\n"
-        else:
-            respuesta += "  <i>No hay deudas con proveedores pendientes.</i>\n"
-            
-        respuesta += "\n"
-        
-        # --- B. Cuentas POR COBRAR (Vendedores) ---
-        respuesta += "✅ <b>CUENTAS POR COBRAR (Vendedores)</b>\n"
-        if reporte_por_cobrar:
-            respuesta += reporte_por_cobrar
-            respuesta += "  --- TOTALES POR COBRAR ---\n"
-            for moneda, total in total_por_cobrar.items():
-                respuesta += f"  Total {moneda.upper()}: +{total:,.2f} {moneda.upper()}\n"
+    except Exception as e:
+        logger.error(f"Error inesperado en /deudas: {e}")
+        await responder(update.message, "Ocurrió un error inesperado al generar el reporte de deudas.")
+
+
+def _reporte_deudas(conn: sqlite3.Connection) -> Respuesta:
+    """Deudas pendientes por pagar y por cobrar, con sus totales (se cachea en ReportesCache)."""
+    # 1. Deudas activas (índice parcial idx_deudas_pendientes, ya en el orden del reporte)
+    #    y totales mantenidos en DeudasTotales (sin sumar la tabla de deudas)
+    resultados = conn.execute("""
+        SELECT actor_id, tipo, monto_pendiente, moneda
+        FROM Deudas
+        WHERE monto_pendiente > 0
+        ORDER BY tipo DESC, moneda, actor_id
+    """).fetchall()
+
+    if not resultados:
+        return Respuesta("✅ No hay deudas pendientes (por pagar o por cobrar).")
+
+    totales = conn.execute("""
+        SELECT tipo, moneda, total, actores FROM DeudasTotales
+        WHERE actores > 0
+        ORDER BY tipo, moneda
+    """).fetchall()
+
+    # 2. Estructurar el reporte
+    lineas = {'POR_PAGAR': [], 'POR_COBRAR': []}
+    for actor_id, tipo, monto, moneda in resultados:
+        lineas[tipo].append(_linea_deuda(actor_id, tipo, monto, moneda))
+
+    # 3. Construir el mensaje final (partido en varios si no cabe en uno)
+    partes = Respuesta("📊 <b>ESTADO DE DEUDAS PENDIENTES</b> 📊\n")
+    secciones = (
+        ('POR_PAGAR', "❌ <b>CUENTAS POR PAGAR (Proveedores)</b>", "-", "No hay deudas con proveedores pendientes."),
+        ('POR_COBRAR', "✅ <b>CUENTAS POR COBRAR (Vendedores)</b>", "+", "No hay deudas de vendedores pendientes."),
+    )
+    for tipo, titulo, signo, vacio in secciones:
+        partes.append(titulo)
+        if lineas[tipo]:
+            partes.extend(lineas[tipo])
+            partes.append(f"  --- TOTALES {tipo.replace('_', ' ')} ---")
+            partes.extend(
+                f"  Total {moneda.upper()}: {signo}{total:,.2f} {moneda.upper()} ({n} actores)"
+                for tipo_total, moneda, total, n in totales if tipo_total == tipo
+            )
         else:
-            respuesta += "  <i>No hay deudas de vendedores pendientes.</i>\n"
+            partes.append(f"  <i>{vacio}</i>")
+        partes.append("")
+    partes.append("<i>Detalle de un actor: /deudas [actor]</i>")
 
-        await update.message.reply_html(respuesta)
+    return partes
+
+
+registrar_reporte("deudas", ["deudas"], _reporte_deudas)
+
+
+@fragmento
+def _linea_deuda(actor_id: str, tipo: str, monto: float, moneda: str) -> str:
+    """Línea de un actor en /deudas (memorizada por los valores de su fila)."""
+    signo = "-" if tipo == 'POR_PAGAR' else "+"
+    return f"  • {html.escape(actor_id)}: {signo}{monto:,.2f} {moneda.upper()}"
+
+
+@fragmento
+def _linea_asiento(fecha: str, tipo: str, moneda: str, monto: float, saldo: float, concepto: Optional[str]) -> str:
+    """Línea de un asiento en el estado de cuenta de /deudas [actor]."""
+    lado = "💸" if tipo == 'POR_PAGAR' else "🤝"
+    return (
+        f"{lado} {str(fecha)[:10]} {monto:+,.2f} {moneda.upper()} → {saldo:,.2f}"
+        + (f" · {html.escape(concepto)}" if concepto else "")
+    )
 
-    except Exception as e:
-        logger.error(f"Error inesperado en /deudas: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al generar el reporte de deudas.")
-    finally:
-        if conn:
-            conn.close()
+
+async def _extracto_deudas(actor: str) -> Respuesta:
+    """Estado de cuenta de un actor: saldos y últimos asientos del diario de deudas."""
+    extracto = await db_executor.ejecutar(DeudaManager.extracto, actor, DEUDAS_EXTRACTO_FILAS)
+    if not extracto['saldos'] and not extracto['asientos']:
+        return Respuesta(f"ℹ️ {html.escape(actor)} no tiene deudas registradas.")
+
+    partes = Respuesta(f"📒 <b>Estado de cuenta: {html.escape(actor)}</b>\n")
+    for tipo, moneda, saldo in extracto['saldos']:
+        etiqueta = "Por pagar" if tipo == 'POR_PAGAR' else "Por cobrar"
+        partes.append(f"<b>{etiqueta}:</b> {saldo:,.2f} {moneda.upper()}")
+
+    if extracto['asientos']:
+        partes.append(f"\n<b>Últimos {len(extracto['asientos'])} movimientos</b>")
+        partes.extend(_linea_asiento(*asiento) for asiento in extracto['asientos'])
+    return partes
 
 
 # --- FASE 13: FUNCIÓN PARA /historial_command ( Historial de Movimientos ) ---
+
+
+@fragmento
+def _formatear_movimiento(fecha_str: str, tipo: str, monto: float, moneda: str, caja: str, descripcion: str) -> str:
+    """Línea HTML de un movimiento dentro del historial (memorizada: las páginas vecinas se repiten)."""
+    # Formateo de monto (añadir signo y color)
+    simbolo = "+" if tipo in ('ingreso', 'pago', 'traspaso_entrada') else "-"
+    color = ""
+    if tipo in ('ingreso', 'pago'):
+        color = "🟢"
+    elif tipo in ('gasto', 'pago_proveedor'):
+        color = "🔴"
+    elif tipo == 'apertura': # Saldo arrastrado del periodo cerrado (ya lleva su signo)
+        color = "📌"
+        simbolo = ""
+    else: # Otros como 'traspaso'
+        color = "🔵"
+    
+    # Formateo de fecha
+    try:
+        fecha_dt = datetime.strptime(fecha_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
+        fecha_formateada = fecha_dt.strftime('%d/%m %H:%M')
+    except ValueError:
+        fecha_formateada = fecha_str[:10]
+    
+    descripcion = descripcion or ''
+    if len(descripcion) > 60:
+        descripcion = descripcion[:60] + "..."
+
+    return (
+        f"{color} <code>{fecha_formateada}</code> | "
+        f"<b>{simbolo}{monto:,.2f} {moneda.upper()}</b> en {caja.upper()}\n"
+        f"  Tipo: {tipo.upper()} ({html.escape(descripcion)})"
+    )
+
+
+def _callback_historial(dias: int, pagina: int, direccion: str, fila) -> str:
+    """
+    Codifica el cursor de una página en callback_data (máx. 64 bytes):
+    hist:<dias>:<pagina>:<s|a>:<id>:<fecha>. La fecha va al final porque contiene ':'.
+    """
+    return f"{HISTORIAL_CALLBACK}:{dias}:{pagina}:{direccion}:{fila['id']}:{fila['fecha']}"
+
+
+async def _pagina_historial(dias: int, pagina: int = 1, direccion: Optional[str] = None,
+                            cursor: Optional[tuple] = None):
+    """
+    Obtiene una página del historial con paginación por keyset sobre (fecha, id).
+    direccion 's' = siguiente (más antiguos que el cursor), 'a' = anterior (más recientes).
+    Retorna (reporte, teclado) o (None, None) si no hay movimientos. Una página
+    (HISTORIAL_PAGE_SIZE filas) cabe en un mensaje: los botones editan ese mensaje.
+    """
+    fecha_limite = (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+    columnas = "id, fecha, tipo, monto, moneda, caja, descripcion"
+    # MovimientosTodos incluye los periodos cerrados (BD de archivo); el rango por
+    # fecha se resuelve con el índice de cada tabla y un merge de ambas
+
+    # Se pide una fila de más para saber si hay otra página en esa dirección
+    if direccion == 'a':
+        filas = await db_executor.consultar(f"""
+            SELECT {columnas} FROM MovimientosTodos
+            WHERE fecha >= ? AND (fecha, id) > (?, ?)
+            ORDER BY fecha ASC, id ASC
+            LIMIT ?
+        """, (fecha_limite, cursor[1], cursor[0], HISTORIAL_PAGE_SIZE + 1))
+        hay_anterior = len(filas) > HISTORIAL_PAGE_SIZE
+        filas = list(reversed(filas[:HISTORIAL_PAGE_SIZE]))
+        hay_siguiente = True
+    elif direccion == 's':
+        filas = await db_executor.consultar(f"""
+            SELECT {columnas} FROM MovimientosTodos
+            WHERE fecha >= ? AND (fecha, id) < (?, ?)
+            ORDER BY fecha DESC, id DESC
+            LIMIT ?
+        """, (fecha_limite, cursor[1], cursor[0], HISTORIAL_PAGE_SIZE + 1))
+        hay_siguiente = len(filas) > HISTORIAL_PAGE_SIZE
+        filas = filas[:HISTORIAL_PAGE_SIZE]
+        hay_anterior = True
+    else:
+        filas = await db_executor.consultar(f"""
+            SELECT {columnas} FROM MovimientosTodos
+            WHERE fecha >= ?
+            ORDER BY fecha DESC, id DESC
+            LIMIT ?
+        """, (fecha_limite, HISTORIAL_PAGE_SIZE + 1))
+        hay_siguiente = len(filas) > HISTORIAL_PAGE_SIZE
+        filas = filas[:HISTORIAL_PAGE_SIZE]
+        hay_anterior = False
+
+    if not filas:
+        return None, None
+
+    reporte = Respuesta(f"⏳ <b>HISTORIAL DE MOVIMIENTOS ({dias} días)</b> 📜", f"<i>Página {pagina}</i>\n")
+    reporte.extend(
+        _formatear_movimiento(
+            fila['fecha'], fila['tipo'], fila['monto'], fila['moneda'], fila['caja'], fila['descripcion']
+        )
+        for fila in filas
+    )
+
+    botones = []
+    if hay_anterior and pagina > 1:
+        botones.append(InlineKeyboardButton(
+            "⬅️ Anterior", callback_data=_callback_historial(dias, pagina - 1, 'a', filas[0])
+        ))
+    if hay_siguiente:
+        botones.append(InlineKeyboardButton(
+            "Siguiente ➡️", callback_data=_callback_historial(dias, pagina + 1, 's', filas[-1])
+        ))
+    teclado = InlineKeyboardMarkup([botones]) if botones else None
+    return reporte, teclado
+
+
 async def historial_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Muestra el historial de movimientos de la base de datos de los últimos N días.
+    Muestra el historial de movimientos de la base de datos de los últimos N días,
+    paginado con botones de navegación.
     Uso: /historial [dias] (ej: /historial 30)
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
-    conn = None
-    dias = 7  # Valor por defecto: últimos 7 días
-    
     try:
-        # 1. Parsear el número de días
-        if context.args:
-            try:
-                dias = int(context.args[0])
-                if dias <= 0: raise ValueError
-            except ValueError:
-                await update.message.reply_text("El número de días debe ser un entero positivo.")
-                return
-
-        # 2. Calcular la fecha de inicio
-        fecha_limite = datetime.now() - timedelta(days=dias)
-        
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-
-        # 3. Consultar los movimientos dentro del rango de fechas
-        cursor.execute("""
-            SELECT fecha, tipo, monto, moneda, caja, descripcion
-            FROM Movimientos
-            WHERE fecha >= ?
-            ORDER BY fecha DESC
-        """, (fecha_limite.strftime('%Y-%m-%d %H:%M:%S'),))
-        
-        movimientos = cursor.fetchall()
-        
-        if not movimientos:
-            await update.message.reply_text(f"✅ No se encontraron movimientos registrados en los últimos {dias} días.")
+        # 1. Número de días (por defecto, los últimos 7)
+        try:
+            dias = ARGS_HISTORIAL.parsear(context.args).dias
+        except ValueError as e:
+            await responder_error(update, ARGS_HISTORIAL, e)
             return
 
-        # 4. Construir el reporte
-        reporte = f"⏳ <b>HISTORIAL DE MOVIMIENTOS ({dias} días)</b> 📜\n\n"
+        # 2. Consultar solo la primera página
+        reporte, teclado = await _pagina_historial(dias)
         
-        for fecha_str, tipo, monto, moneda, caja, descripcion in movimientos:
-            
-            # Formateo de monto (añadir signo y color)
-            simbolo = "+" if tipo in ('ingreso', 'pago') else "-"
-            color = ""
-            if tipo in ('ingreso', 'pago'):
-                color = "🟢"
-            elif tipo in ('gasto', 'pago_proveedor'):
-                color = "🔴"
-            else: # Otros como 'traspaso'
-                color = "🔵"
-            
-            # Formateo de fecha
-            try:
-                fecha_dt = datetime.strptime(fecha_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
-                fecha_formateada = fecha_dt.strftime('%d/%m %H:%M')
-            except:
-                fecha_formateada = fecha_str[:10]
-            
-            # Construir la línea del movimiento
-            reporte += (
-                f"{color} <code>{fecha_formateada}</code> | "
-                f"<b>{simbolo}{monto:,.2f} {moneda.upper()}</b> en {caja.upper()}\n"
-                f"  Tipo: {tipo.upper()} ({descripcion[:60]}...)\n"
-            )
+        if reporte is None:
+            await responder(update.message, f"✅ No se encontraron movimientos registrados en los últimos {dias} días.")
+            return
 
-        await update.message.reply_html(reporte)
+        await reporte.enviar(update.message, reply_markup=teclado)
         logger.info(f"Reporte histórico de {dias} días generado por {user_id}")
 
     except Exception as e:
         logger.error(f"Error inesperado en /historial: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al generar el historial.")
-    finally:
-        if conn:
-            conn.close()
+        await responder(update.message, "Ocurrió un error inesperado al generar el historial.")
+
+
+async def historial_pagina_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Maneja los botones Anterior/Siguiente del historial: edita el mensaje
+    con la página pedida, leyendo solo esas filas.
+    """
+    query = update.callback_query
+    if query.from_user.id not in ADMIN_USER_IDS:
+        await query.answer("⛔ No tienes permiso.", show_alert=True)
+        return
+
+    try:
+        _, dias, pagina, direccion, mov_id, fecha_cursor = query.data.split(':', 5)
+        dias = ARGS_HISTORIAL.parsear([dias]).dias
+        reporte, teclado = await _pagina_historial(
+            dias, int(pagina), direccion, (int(mov_id), fecha_cursor)
+        )
+        await query.answer()
+
+        if reporte is None:
+            await query.edit_message_text(f"✅ No hay más movimientos en los últimos {dias} días.")
+            return
+
+        await query.edit_message_text(reporte.texto(), parse_mode=ParseMode.HTML, reply_markup=teclado)
+
+    except Exception as e:
+        logger.error(f"Error inesperado en la paginación de /historial: {e}")
+        await query.answer("Ocurrió un error al cargar la página.", show_alert=True)
             
 # --- FASE 15: FUNCIÓN PARA /exportar_command ( Exportar CSV ) ---
+
+# Tablas exportables: nombre en el comando -> (tabla, columna de fecha, orden)
+TABLAS_EXPORTABLES = {
+    'movimientos': ('MovimientosTodos', 'fecha', 'fecha DESC, id DESC'),  # Incluye lo archivado por /cierre
+    'deudas': ('Deudas', 'fecha', 'id'),
+    'productos': ('Productos', None, 'id'),
+    'consignaciones': ('Consignaciones', 'fecha_consignacion', 'id'),
+}
+
+
+def _validar_exportar(a) -> None:
+    if a.desde and a.hasta and a.desde > a.hasta:
+        raise ErrorArgumentos("La fecha inicial no puede ser posterior a la final.")
+    if (a.desde or a.hasta) and TABLAS_EXPORTABLES[a.tabla][1] is None:
+        raise ErrorArgumentos(f"La tabla {a.tabla} no admite filtro por fecha.")
+
+
+ARGS_EXPORTAR = Comando(
+    "exportar",
+    [
+        fecha("desde", opcional=True), fecha("hasta", opcional=True),
+        opcion("tabla", TABLAS_EXPORTABLES, "Tabla", uso="|".join(TABLAS_EXPORTABLES),
+               opcional=True, defecto='movimientos'),
+    ],
+    ejemplo="/exportar 2025-11-01 2025-11-30 movimientos",
+    validar=_validar_exportar,
+)
+
+
 async def exportar_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Exporta todos los datos de la tabla Movimientos a un archivo CSV y lo envía. (RF11)
+    Exporta una tabla a un CSV comprimido (gzip) y lo envía. (RF11)
+    Uso: /exportar [desde] [hasta] [movimientos|deudas|productos|consignaciones]
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
-    conn = None
-    csv_file_path = 'movimientos_export.csv'
+    csv_file_path = None
     
     try:
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
+        desde, hasta, tabla = ARGS_EXPORTAR.parsear(context.args)
 
-        # 1. Obtener todos los datos de la tabla Movimientos
-        cursor.execute("SELECT * FROM Movimientos ORDER BY fecha DESC")
-        movimientos = cursor.fetchall()
+        # 1-3. Volcar el cursor por lotes a un archivo temporal propio de esta petición
+        # (memoria constante; dos exportaciones simultáneas no se pisan)
+        csv_file_path, filas = await db_reportes.ejecutar(_exportar_db, tabla, desde, hasta)
         
-        if not movimientos:
-            await update.message.reply_text("No hay movimientos registrados para exportar.")
+        if not filas:
+            await responder(update.message, f"No hay registros en {tabla} para exportar.")
             return
 
-        # 2. Obtener los nombres de las columnas
-        column_names = [description[0] for description in cursor.description]
-
-        # 3. Escribir los datos en el archivo CSV
-        with open(csv_file_path, 'w', newline='', encoding='utf-8') as csvfile:
-            csv_writer = csv.writer(csvfile)
-            csv_writer.writerow(column_names) # Escribir cabeceras
-            csv_writer.writerows(movimientos) # Escribir datos
-
         # 4. Enviar el archivo al usuario
+        rango = ""
+        if desde:
+            rango = f"_{desde:%Y%m%d}-{(hasta or datetime.now().date()):%Y%m%d}"
         with open(csv_file_path, 'rb') as f:
             await update.message.reply_document(
                 document=f,
-                filename=csv_file_path,
-                caption="✅ Exportación Completa: Todos los Movimientos Contables."
+                filename=f"{tabla}_export{rango}.csv.gz",
+                caption=f"✅ Exportación Completa: {filas} registros de {tabla}."
             )
         
-        logger.info(f"Exportación de movimientos completada y enviada a {user_id}")
+        logger.info(f"Exportación de {tabla} ({filas} filas) completada y enviada a {user_id}")
 
+    except ValueError as e:
+        await responder_error(update, ARGS_EXPORTAR, e)
     except Exception as e:
         logger.error(f"Error inesperado en /exportar: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al exportar los datos.")
+        await responder(update.message, "Ocurrió un error inesperado al exportar los datos.")
     finally:
-        if conn:
-            conn.close()
-        # Opcional: limpiar el archivo local después de enviarlo (aunque para pruebas es mejor dejarlo)
-        # os.remove(csv_file_path)
\ No newline at end of file
+        # Limpiar el archivo temporal después de enviarlo
+        if csv_file_path and os.path.exists(csv_file_path):
+            os.remove(csv_file_path)
+
+
+def _exportar_db(conn: sqlite3.Connection, tabla: str, desde, hasta):
+    """
+    Parte de BD de /exportar: escribe la tabla en un CSV gzip temporal leyendo
+    el cursor por lotes. Retorna (ruta_del_archivo, filas_exportadas).
+    """
+    nombre_tabla, columna_fecha, orden = TABLAS_EXPORTABLES[tabla]
+    condiciones = []
+    params = []
+    if desde:
+        condiciones.append(f"{columna_fecha} >= ?")
+        params.append(desde.isoformat())
+    if hasta:
+        # 'hasta' es inclusivo: todo lo anterior al día siguiente
+        condiciones.append(f"{columna_fecha} < ?")
+        params.append((hasta + timedelta(days=1)).isoformat())
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM {nombre_tabla} {where} ORDER BY {orden}", params)
+    column_names = [description[0] for description in cursor.description]
+
+    fd, csv_file_path = tempfile.mkstemp(prefix=f"{tabla}_", suffix=".csv.gz")
+    os.close(fd)
+    filas = 0
+    try:
+        with gzip.open(csv_file_path, 'wt', compresslevel=6, newline='', encoding='utf-8') as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow(column_names) # Escribir cabeceras
+            while True:
+                lote = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not lote:
+                    break
+                csv_writer.writerows(lote) # Escribir datos
+                filas += len(lote)
+    except Exception:
+        os.remove(csv_file_path)
+        raise
+    return csv_file_path, filas
+
+
+# --- FASE 17: FUNCIÓN PARA /cierre ( Cierre de periodo y archivo ) ---
+
+def _corte_periodo(token: str) -> date:
+    """
+    Periodo de /cierre: 'AAAA-MM' (cierra ese mes completo) o 'AAAA-MM-DD'
+    (cierra hasta ese día inclusive). Retorna el corte, el primer día que queda abierto.
+    """
+    try:
+        return datetime.strptime(token, '%Y-%m-%d').date() + timedelta(days=1)
+    except ValueError:
+        pass
+    try:
+        inicio_mes = datetime.strptime(token, '%Y-%m').date()
+    except ValueError:
+        raise ErrorArgumentos(f"Periodo no reconocido: {token} (usa AAAA-MM o AAAA-MM-DD)")
+    return (inicio_mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _validar_cierre(a) -> None:
+    if a.corte and a.corte > datetime.now().date():
+        raise ErrorArgumentos("Solo se pueden cerrar periodos que ya terminaron.")
+
+
+# Sin periodo se cierra el mes anterior (corte = primer día del mes en curso)
+ARGS_CIERRE = Comando(
+    "cierre",
+    [Arg("corte", _corte_periodo, "AAAA-MM | AAAA-MM-DD", opcional=True), literal("confirmar", "confirmar", opcional=True)],
+    ejemplo="/cierre 2025-10 confirmar",
+    validar=_validar_cierre,
+)
+
+
+async def cierre_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Cierra un periodo: sus movimientos pasan a la BD de archivo (siguen visibles
+    en /historial y /exportar) y Movimientos arranca con una apertura por caja y moneda.
+    Uso: /cierre [AAAA-MM | AAAA-MM-DD] [confirmar]
+    """
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_USER_IDS:
+        await responder(update.message, "⛔ No tienes permiso.")
+        return
+
+    try:
+        a = ARGS_CIERRE.parsear(context.args)
+        corte = (a.corte or datetime.now().date().replace(day=1)).isoformat()
+        confirmar = a.confirmar is not None
+        hasta = (datetime.strptime(corte, '%Y-%m-%d').date() - timedelta(days=1)).strftime('%d/%m/%Y')
+
+        async with lock_manager.bloquear(clave_cierre()):
+            resumen = await db_reportes.ejecutar(CierreManager.resumen, corte)
+            if resumen['ultimo_corte'] and corte <= resumen['ultimo_corte']:
+                await responder(update.message,
+                    f"ℹ️ Ese periodo ya está cerrado (último cierre: hasta el día anterior a {resumen['ultimo_corte']})."
+                )
+                return
+            if not resumen['movimientos']:
+                await responder(update.message, f"✅ No hay movimientos hasta el {hasta} para archivar.")
+                return
+
+            if not confirmar:
+                respuesta = (
+                    f"📦 <b>Cierre hasta el {hasta}</b>\n\n"
+                    f"Se archivarán {resumen['movimientos']:,} movimientos. Saldos de apertura:\n"
+                )
+                for caja, moneda, saldo in resumen['saldos']:
+                    respuesta += f"  • {caja.upper()} {moneda.upper()}: {saldo:,.2f}\n"
+                respuesta += f"\nPara aplicarlo: <code>{' '.join(['/cierre', *context.args, 'confirmar'])}</code>"
+                await responder_html(update.message, respuesta)
+                return
+
+            # Dos transacciones: copia al archivo y, ya confirmada, borrado + aperturas
+            await db_reportes.escribir((), CierreManager.copiar_al_archivo, corte)
+            resultado = await db_reportes.escribir((), CierreManager.cerrar, corte, user_id)
+
+        respuesta = (
+            f"✅ <b>Periodo cerrado hasta el {hasta}</b>\n\n"
+            f"Archivados: {resultado['movimientos']:,} movimientos ({resultado['ventas']:,} ventas).\n"
+            "Aperturas registradas:\n"
+        )
+        for caja, moneda, saldo in resultado['saldos']:
+            respuesta += f"  • {caja.upper()} {moneda.upper()}: {saldo:,.2f}\n"
+        await responder_html(update.message, respuesta)
+        logger.info(f"Cierre hasta {corte} por {user_id}: {resultado['movimientos']} movimientos archivados")
+
+    except ValueError as e:
+        await responder_error(update, ARGS_CIERRE, e)
+    except Exception as e:
+        logger.error(f"Error inesperado en /cierre: {e}", exc_info=True)
+        await responder(update.message, "Ocurrió un error inesperado al cerrar el periodo.")
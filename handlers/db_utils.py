@@ -1,91 +1,1079 @@
+import asyncio
+import contextvars
+import json
 import logging
+import os
+import queue
 import sqlite3
-from contextlib import contextmanager
-from typing import Optional, Union, List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Union, List, Dict, Any, Callable, Sequence
 from datetime import datetime
 
+from config_vars import (
+    DB_PATH, DB_MAX_WORKERS, DB_REPORTES_WORKERS, DB_POOL_SIZE, DB_CACHE_KIB, DB_MMAP_BYTES, DB_BUSY_TIMEOUT_MS,
+    TASA_USD_CUP, DB_ARCHIVO_SUFIJO, PROCESADOS_TTL_HORAS, PROCESADOS_PURGA_CADA,
+    NEGOCIOS_DIR, NEGOCIOS_ABIERTOS_MAX, NEGOCIOS_POOL_SIZE, NEGOCIOS_CACHE_KIB,
+)
+from handlers.metricas import medicion_actual
+from handlers.negocios import negocio_actual, ruta_negocio
+from handlers.idempotencia import UpdateDuplicado, UpdateEnCurso, update_en_curso, procesados
+
 logger = logging.getLogger(__name__)
 
+
+class SaldoInsuficienteError(Exception):
+    """Se lanza cuando una caja no tiene saldo para cubrir una salida."""
+
+    def __init__(self, caja: str, moneda: str, disponible: float):
+        self.caja = caja
+        self.moneda = moneda
+        self.disponible = disponible
+        super().__init__(
+            f"Saldo insuficiente en caja {caja.upper()} ({moneda.upper()}). "
+            f"Disponible: {disponible:.2f} {moneda.upper()}."
+        )
+
+
+class StockInsuficienteError(Exception):
+    """Se lanza cuando no hay stock suficiente de un producto para una salida."""
+
+    def __init__(self, codigo: str, disponible: float, solicitado: float):
+        self.codigo = codigo
+        self.disponible = disponible
+        self.solicitado = solicitado
+        super().__init__(
+            f"Stock insuficiente para {codigo}. "
+            f"Disponible: {disponible}, Solicitado: {solicitado}"
+        )
+
+
+class ConexionBD(sqlite3.Connection):
+    """
+    Conexión que permite diferir trabajo hasta que la transacción se confirme
+    (p. ej. actualizar cachés en memoria solo con datos ya escritos en disco).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._al_confirmar: List[Callable[[], None]] = []
+
+    def al_confirmar(self, func: Callable[[], None]) -> None:
+        """Ejecuta func después del próximo commit; se descarta si hay rollback."""
+        self._al_confirmar.append(func)
+
+    def commit(self) -> None:
+        pendientes, self._al_confirmar = self._al_confirmar, []
+        super().commit()
+        for func in pendientes:
+            try:
+                func()
+            except Exception as e:
+                logger.error(f"Error en acción posterior al commit: {e}", exc_info=True)
+
+    def rollback(self) -> None:
+        self._al_confirmar = []
+        super().rollback()
+
+
+def configurar_conexion(conn: sqlite3.Connection, cache_kib: int = DB_CACHE_KIB) -> sqlite3.Connection:
+    """Aplica los PRAGMAs de rendimiento a una conexión recién abierta."""
+    # WAL: los lectores no esperan a los escritores (ni al revés)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # En WAL, NORMAL sólo hace fsync en los checkpoints y sigue siendo seguro ante caídas del proceso
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{cache_kib}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    # Habilitar foreign keys
+    conn.execute("PRAGMA foreign_keys = ON")
+    # Retornar tuplas con nombres de columnas
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# Nombre con el que se adjunta la BD de archivo (periodos cerrados) a cada conexión
+ESQUEMA_ARCHIVO = "archivo"
+# Columnas que comparten las tablas calientes y las de archivo
+_COLUMNAS_MOVIMIENTOS = "id, fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup"
+_COLUMNAS_VENTA_DETALLE = "movimiento_id, codigo, unidades, vendedor, es_consignada, ingreso, moneda_ingreso, cmv, moneda_cmv"
+
+
+def ruta_archivo(db_path: str) -> str:
+    """Ruta de la BD de archivo que acompaña a db_path (contabilidad.db -> contabilidad_archivo.db)."""
+    if db_path == ":memory:":
+        return db_path
+    base, extension = os.path.splitext(db_path)
+    return f"{base}{DB_ARCHIVO_SUFIJO}{extension or '.db'}"
+
+
+def adjuntar_archivo(conn: sqlite3.Connection, db_path: str) -> sqlite3.Connection:
+    """
+    Adjunta la BD de archivo como 'archivo' y define las vistas temporales que
+    unen lo caliente con lo archivado (MovimientosTodos, VentaDetalleTodos),
+    para /historial y /exportar. Los saldos se calculan solo con Movimientos:
+    las filas 'apertura' ya resumen lo archivado.
+    """
+    conn.execute(f"ATTACH DATABASE ? AS {ESQUEMA_ARCHIVO}", (ruta_archivo(db_path),))
+    conn.execute(f"PRAGMA {ESQUEMA_ARCHIVO}.journal_mode = WAL")
+    conn.execute(f"PRAGMA {ESQUEMA_ARCHIVO}.synchronous = NORMAL")
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS MovimientosTodos AS
+        SELECT {_COLUMNAS_MOVIMIENTOS} FROM {ESQUEMA_ARCHIVO}.Movimientos
+        UNION ALL
+        SELECT {_COLUMNAS_MOVIMIENTOS} FROM main.Movimientos
+    """)
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS VentaDetalleTodos AS
+        SELECT {_COLUMNAS_VENTA_DETALLE} FROM {ESQUEMA_ARCHIVO}.VentaDetalle
+        UNION ALL
+        SELECT {_COLUMNAS_VENTA_DETALLE} FROM main.VentaDetalle
+    """)
+    return conn
+
+
+class CacheBD:
+    """
+    Copia en memoria de datos de una BD (la tasa vigente, el inventario): el
+    valor, una versión que sube con cada escritura o invalidación (para no
+    instalar una lectura que quedó vieja) y el lock que los protege.
+    """
+
+    __slots__ = ("valor", "version", "lock")
+
+    def __init__(self):
+        self.valor: Any = None
+        self.version = 0
+        self.lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones SQLite "calientes" compartido por los hilos de BD.
+    Cada conexión la usa un solo hilo a la vez, así que se abren con
+    check_same_thread=False y se devuelven al pool al terminar la transacción.
+    Las cachés en memoria de los managers (CacheBD) viven en el pool de su BD.
+    """
+
+    def __init__(self, size: int = DB_POOL_SIZE, db_path: Optional[str] = None, cache_kib: int = DB_CACHE_KIB):
+        self.size = size
+        self.db_path = db_path  # None = usar DB_PATH
+        self.cache_kib = cache_kib
+        self._libres: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._todas: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._caches: Dict[str, CacheBD] = {}
+
+    def _crear_conexion(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path or DB_PATH,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            factory=ConexionBD,
+        )
+        return adjuntar_archivo(configurar_conexion(conn, self.cache_kib), self.db_path or DB_PATH)
+
+    def cache(self, nombre: str) -> CacheBD:
+        """Caché en memoria `nombre` de esta BD (se crea vacía al pedirla)."""
+        cache = self._caches.get(nombre)
+        if cache is None:
+            with self._lock:
+                cache = self._caches.setdefault(nombre, CacheBD())
+        return cache
+
+    def invalidar_caches(self) -> None:
+        """Descarta el valor de todas las cachés de esta BD (la próxima lectura recarga)."""
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            with cache.lock:
+                cache.valor = None
+                cache.version += 1
+
+    def obtener(self) -> sqlite3.Connection:
+        """Toma una conexión libre; abre una nueva si no se alcanzó el tamaño máximo."""
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._todas) < self.size:
+                conn = self._crear_conexion()
+                primera = not self._todas
+                self._todas.append(conn)
+            else:
+                conn = None
+        if conn is not None:
+            if primera:
+                self._cargar_procesados(conn)
+            return conn
+
+        # Pool agotado: esperar a que otro hilo devuelva una conexión
+        return self._libres.get()
+
+    def _cargar_procesados(self, conn: sqlite3.Connection) -> None:
+        """
+        Con la primera conexión a la BD (no al arrancar el bot) suma al LRU de
+        idempotencia los updates procesados recientes. Es solo un atajo: si
+        falla, el INSERT en ProcesadosUpdates sigue descartando las reentregas.
+        """
+        try:
+            ProcesadosManager.cargar(conn)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.warning(f"No se pudieron cargar los updates procesados: {e}")
+
+    def devolver(self, conn: sqlite3.Connection) -> None:
+        """Devuelve la conexión al pool, descartando cualquier transacción abierta."""
+        if conn.in_transaction:
+            conn.rollback()
+        self._libres.put(conn)
+
+    def cerrar(self) -> None:
+        """Cierra todas las conexiones (p. ej. al apagar el bot o cambiar de BD) y descarta las cachés."""
+        with self._lock:
+            for conn in self._todas:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._todas.clear()
+            self._libres = queue.LifoQueue()
+        self.invalidar_caches()
+
+
+# Pool compartido por todos los handlers y managers
+db_pool = ConnectionPool()
+
+
+class PoolNegocios:
+    """
+    Pools de las BDs de los negocios (handlers/negocios.py), abiertos al
+    pedirlos y con un máximo de NEGOCIOS_ABIERTOS_MAX a la vez: al pasarlo se
+    cierran los menos usados recientemente que no tengan una transacción en
+    curso, así la memoria y los descriptores abiertos no crecen con la
+    cantidad de negocios. La primera vez que el proceso abre un negocio se
+    crea o actualiza su esquema con setup_database.
+    """
+
+    def __init__(self, maximo: int = NEGOCIOS_ABIERTOS_MAX, size: int = NEGOCIOS_POOL_SIZE,
+                 cache_kib: int = NEGOCIOS_CACHE_KIB):
+        self.maximo = maximo
+        self.size = size
+        self.cache_kib = cache_kib
+        self._abiertos: "OrderedDict[str, ConnectionPool]" = OrderedDict()
+        self._en_uso: Dict[str, int] = {}  # negocio -> conexiones tomadas
+        self._preparados: set = set()
+        self._preparando: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _preparar(self, nombre: str) -> None:
+        """Crea o actualiza el esquema de la BD del negocio (una vez por proceso)."""
+        if nombre in self._preparados:
+            return
+        with self._lock:
+            lock = self._preparando.setdefault(nombre, threading.Lock())
+        with lock:
+            if nombre in self._preparados:
+                return
+            # Import diferido: db_manager importa este módulo
+            from db_manager import setup_database
+            ruta = ruta_negocio(nombre)
+            os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+            setup_database(ruta)
+            with self._lock:
+                self._preparados.add(nombre)
+                self._preparando.pop(nombre, None)
+            logger.info(f"Negocio {nombre}: BD lista en {ruta}")
+
+    def _desalojar(self) -> List[ConnectionPool]:
+        """Saca del LRU los pools sobrantes sin conexiones tomadas (se cierran fuera del lock)."""
+        sobrantes = len(self._abiertos) - self.maximo
+        cerrar = []
+        for nombre in list(self._abiertos):
+            if sobrantes <= 0:
+                break
+            if not self._en_uso.get(nombre):
+                cerrar.append(self._abiertos.pop(nombre))
+                sobrantes -= 1
+        return cerrar
+
+    def tomar(self, nombre: str) -> ConnectionPool:
+        """Pool del negocio, abierto si hace falta; hay que devolverlo con soltar()."""
+        self._preparar(nombre)
+        with self._lock:
+            pool = self._abiertos.get(nombre)
+            if pool is None:
+                pool = self._abiertos[nombre] = ConnectionPool(self.size, ruta_negocio(nombre), self.cache_kib)
+            self._abiertos.move_to_end(nombre)
+            self._en_uso[nombre] = self._en_uso.get(nombre, 0) + 1
+            cerrar = self._desalojar()
+        for sobrante in cerrar:
+            sobrante.cerrar()
+        return pool
+
+    def soltar(self, nombre: str) -> None:
+        with self._lock:
+            self._en_uso[nombre] -= 1
+            if not self._en_uso[nombre]:
+                del self._en_uso[nombre]
+            cerrar = self._desalojar()
+        for sobrante in cerrar:
+            sobrante.cerrar()
+
+    def abierto(self, nombre: str) -> Optional[ConnectionPool]:
+        """Pool del negocio si está abierto (sin abrirlo ni contarlo como uso)."""
+        with self._lock:
+            return self._abiertos.get(nombre)
+
+    def abiertos(self) -> List[str]:
+        with self._lock:
+            return list(self._abiertos)
+
+    def cerrar(self) -> None:
+        """Cierra todos los pools de negocios (al apagar el bot)."""
+        with self._lock:
+            pools = list(self._abiertos.values())
+            self._abiertos.clear()
+        for pool in pools:
+            pool.cerrar()
+
+
+# Pools de las BDs de los negocios (vacío si NEGOCIOS no asigna ninguno)
+pool_negocios = PoolNegocios()
+
+
+def invalidar_caches(db_path: str) -> None:
+    """
+    Descarta las cachés en memoria de la BD en db_path: las del pool de su
+    negocio si está abierto o las del pool principal si es esa BD. Si no hay
+    un pool abierto sobre ella no hay nada que descartar.
+    """
+    ruta = os.path.abspath(db_path)
+    pools = [db_pool] + [p for p in map(pool_negocios.abierto, pool_negocios.abiertos()) if p is not None]
+    for pool in pools:
+        if os.path.abspath(pool.db_path or DB_PATH) == ruta:
+            pool.invalidar_caches()
+
+
+def cache_actual(nombre: str) -> CacheBD:
+    """
+    Caché en memoria `nombre` de la BD en curso (la del negocio del update o la
+    principal). Si el pool del negocio no está abierto se retorna una vacía y
+    descartable: el próximo acceso a la BD la carga en el pool.
+    """
+    negocio = negocio_actual()
+    pool = db_pool if negocio is None else pool_negocios.abierto(negocio)
+    return pool.cache(nombre) if pool is not None else CacheBD()
+
+
 @contextmanager
-def get_db_connection():
-    """Context manager para manejar conexiones a la base de datos de forma segura."""
+def get_db_connection(inmediata: bool = False):
+    """
+    Context manager para manejar conexiones a la base de datos de forma segura.
+    Toma una conexión del pool; commit al salir, rollback si hay excepción.
+    Con inmediata=True abre la transacción con BEGIN IMMEDIATE: toma el lock de
+    escritura antes de la primera lectura, así un chequeo de saldo/stock y la
+    escritura que depende de él no se intercalan con otro escritor.
+    """
     conn = None
+    medicion = medicion_actual()
+    negocio = negocio_actual()
+    pool = db_pool if negocio is None else pool_negocios.tomar(negocio)
     try:
-        conn = sqlite3.connect("contabilidad.db")
-        # Habilitar foreign keys
-        conn.execute("PRAGMA foreign_keys = ON")
-        # Retornar tuplas con nombres de columnas
-        conn.row_factory = sqlite3.Row
+        inicio = time.perf_counter()
+        conn = pool.obtener()
+        if medicion is not None:
+            # Dentro de un comando instrumentado: contar sentencias y filas leídas
+            contador = [0, 0]
+
+            def _sentencia(sql: str) -> None:
+                if not sql.startswith("--"):  # los cuerpos de triggers llegan como "-- ..."
+                    contador[0] += 1
+
+            def _fila(cursor: sqlite3.Cursor, fila: tuple) -> sqlite3.Row:
+                contador[1] += 1
+                return sqlite3.Row(cursor, fila)
+
+            conn.set_trace_callback(_sentencia)
+            conn.row_factory = _fila
+        if inmediata:
+            conn.execute("BEGIN IMMEDIATE")
         yield conn
         conn.commit()
-    except Exception as e:
+    except BaseException:
+        # BaseException: también UpdateDuplicado y las cancelaciones deshacen la transacción
         if conn:
             conn.rollback()
-        raise e
+        raise
     finally:
         if conn:
-            conn.close()
+            if medicion is not None:
+                conn.set_trace_callback(None)
+                conn.row_factory = sqlite3.Row
+                medicion.sumar_bd((time.perf_counter() - inicio) * 1000, contador[0], contador[1])
+            pool.devolver(conn)
+        if negocio is not None:
+            pool_negocios.soltar(negocio)
+
+
+def clave_caja(caja: str, moneda: str) -> tuple:
+    """Clave de bloqueo del saldo de una caja en una moneda."""
+    return ('caja', caja, moneda)
+
+
+def clave_producto(codigo: str) -> tuple:
+    """Clave de bloqueo del stock (general y consignado) de un producto."""
+    return ('producto', codigo)
+
+
+def clave_cierre() -> tuple:
+    """
+    Clave de bloqueo de /cierre en la BD en curso: dos cierres no se intercalan
+    entre la copia al archivo y el borrado (cada negocio cierra su propia BD).
+    """
+    negocio = negocio_actual()
+    return ('cierre',) if negocio is None else (negocio, 'cierre')
+
+
+class LockManager:
+    """
+    Locks asyncio por recurso (saldo de una caja/moneda, stock de un producto).
+    Serializa en el event loop las operaciones que leen-chequean-escriben el
+    mismo recurso, sin ocupar hilos de BD esperando el lock de SQLite; las que
+    tocan recursos distintos siguen en paralelo.
+    Los locks se crean al pedirlos y se descartan cuando nadie los usa.
+    """
+
+    def __init__(self):
+        self._locks: Dict[tuple, List[Any]] = {}  # clave -> [asyncio.Lock, usuarios]
+
+    def _tomar(self, clave: tuple) -> asyncio.Lock:
+        entrada = self._locks.setdefault(clave, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        return entrada[0]
+
+    def _soltar(self, clave: tuple) -> None:
+        entrada = self._locks[clave]
+        entrada[1] -= 1
+        if entrada[1] == 0:
+            del self._locks[clave]
+
+    @asynccontextmanager
+    async def bloquear(self, *claves: tuple):
+        """
+        Adquiere los locks de todas las claves. Siempre en el mismo orden
+        (ordenadas) para que dos operaciones con claves cruzadas no se bloqueen entre sí.
+        """
+        tomadas = []
+        try:
+            for clave in sorted(set(claves)):
+                lock = self._tomar(clave)
+                try:
+                    await lock.acquire()
+                except BaseException:
+                    # Cancelado mientras esperaba: no llegó a tomar este lock
+                    self._soltar(clave)
+                    raise
+                tomadas.append(clave)
+            yield
+        finally:
+            for clave in reversed(tomadas):
+                self._locks[clave][0].release()
+                self._soltar(clave)
+
+
+# Instancia compartida por todos los handlers
+lock_manager = LockManager()
+
+
+class ProcesadosManager:
+    """
+    Registro de los updates ya aplicados por los comandos que escriben
+    (ProcesadosUpdates). El chequeo caliente es el LRU `procesados` de
+    handlers.idempotencia; la tabla es la fuente de verdad y sobrevive a reinicios.
+    """
+
+    _registrados = 0
+    _lock = threading.Lock()
 
-class InventarioManager:
     @staticmethod
-    def actualizar_stock(
-        conn: sqlite3.Connection,
-        codigo: str,
-        cantidad: float,
-        es_entrada: bool = True
-    ) -> Dict[str, Any]:
+    def registrar(conn: sqlite3.Connection, estado: UpdateEnCurso) -> None:
         """
-        Actualiza el stock de un producto, validando existencias.
+        Inserta el update dentro de la transacción en curso. Si ya existía lanza
+        UpdateDuplicado (la transacción se deshace sin aplicar el comando).
         """
-        cursor = conn.cursor()
-        
-        # Verificar producto
-        cursor.execute(
-            "SELECT stock, costo_unitario, moneda_costo FROM Productos WHERE codigo = ?", 
-            (codigo,)
+        cursor = conn.execute(
+            """
+            INSERT INTO ProcesadosUpdates (update_id, chat_id, message_id, comando)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (update_id) DO NOTHING
+            """,
+            (estado.update_id, estado.chat_id, estado.message_id, estado.comando)
         )
-        producto = cursor.fetchone()
-        
-        if not producto:
-            raise ValueError(f"El producto {codigo} no existe en el inventario.")
-        
-        stock_actual = producto['stock']
-        if not es_entrada and stock_actual < cantidad:
-            raise ValueError(
-                f"Stock insuficiente para {codigo}. "
-                f"Disponible: {stock_actual}, Solicitado: {cantidad}"
-            )
-        
-        # Actualizar stock
-        nuevo_stock = stock_actual + cantidad if es_entrada else stock_actual - cantidad
-        cursor.execute(
-            "UPDATE Productos SET stock = ? WHERE codigo = ?",
-            (nuevo_stock, codigo)
+        if cursor.rowcount == 0:
+            procesados.agregar(estado.update_id)
+            raise UpdateDuplicado(estado.update_id)
+
+        def _confirmado():
+            estado.registrado = True
+            procesados.agregar(estado.update_id)
+
+        conn.al_confirmar(_confirmado)
+
+        with ProcesadosManager._lock:
+            ProcesadosManager._registrados += 1
+            purgar = ProcesadosManager._registrados % PROCESADOS_PURGA_CADA == 0
+        if purgar:
+            ProcesadosManager.purgar(conn)
+
+    @staticmethod
+    def purgar(conn: sqlite3.Connection) -> int:
+        """Borra los updates más viejos que PROCESADOS_TTL_HORAS (Telegram ya no los reentrega)."""
+        cursor = conn.execute(
+            "DELETE FROM ProcesadosUpdates WHERE fecha < datetime('now', ?)",
+            (f"-{PROCESADOS_TTL_HORAS} hours",)
         )
-        
+        if cursor.rowcount:
+            logger.info(f"ProcesadosUpdates: {cursor.rowcount} updates vencidos eliminados.")
+        return cursor.rowcount
+
+    @staticmethod
+    def cargar(conn: sqlite3.Connection) -> int:
+        """
+        Purga los vencidos y suma a la memoria los update_id más recientes (con
+        la primera conexión del pool de cada BD). Retorna cuántos cargó.
+        """
+        ProcesadosManager.purgar(conn)
+        filas = conn.execute(
+            "SELECT update_id FROM ProcesadosUpdates ORDER BY fecha DESC LIMIT ?",
+            (procesados.capacidad,)
+        ).fetchall()
+        procesados.extender(fila[0] for fila in reversed(filas))
+        return len(filas)
+
+
+class DBExecutor:
+    """
+    Ejecuta el trabajo de SQLite en un pool acotado de hilos para no bloquear
+    el event loop de la aplicación. Cada llamada abre su propia transacción
+    con get_db_connection (commit al terminar, rollback si hay excepción).
+    """
+
+    def __init__(self, max_workers: int = DB_MAX_WORKERS, nombre: str = "contabot-db"):
+        self.max_workers = max_workers
+        self.nombre = nombre
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix=self.nombre
+            )
+        return self._executor
+
+    async def ejecutar(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta func(conn, *args, **kwargs) dentro de una transacción en el pool de BD."""
+        def _tarea():
+            with get_db_connection() as conn:
+                return func(conn, *args, **kwargs)
+
+        # El contexto viaja al hilo para que la medición del comando (si hay) cuente este trabajo
+        # y la conexión salga de la BD de su negocio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, _tarea)
+
+    async def escribir(self, claves: Sequence[tuple], func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Ejecuta func(conn, *args, **kwargs) como transacción de escritura:
+        primero toma los locks de las claves (clave_caja / clave_producto) en el
+        event loop y luego corre en el pool con BEGIN IMMEDIATE.
+        """
+        estado = update_en_curso()
+
+        def _tarea():
+            with get_db_connection(inmediata=True) as conn:
+                if estado is not None and not estado.registrado:
+                    # Primera escritura de un comando idempotente: el update queda registrado
+                    # en la misma transacción (si ya estaba, UpdateDuplicado la deshace)
+                    ProcesadosManager.registrar(conn, estado)
+                return func(conn, *args, **kwargs)
+
+        negocio = negocio_actual()
+        if negocio is not None:
+            # Cada negocio tiene su BD: sus cajas y productos no compiten con los de otro
+            claves = [(negocio, *clave) for clave in claves]
+
+        async with lock_manager.bloquear(*claves):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, contextvars.copy_context().run, _tarea)
+
+    async def consultar(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        """Ejecuta una consulta de lectura y retorna todas las filas."""
+        return await self.ejecutar(lambda conn: conn.execute(sql, params).fetchall())
+
+    def cerrar(self) -> None:
+        """Espera a que terminen las tareas pendientes y libera los hilos."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+# Instancia compartida por todos los handlers
+db_executor = DBExecutor()
+# Trabajo largo (exportaciones, reportes por rango, verificación del libro, /cierre):
+# hilos propios, así nunca ocupa los de los comandos cortos
+db_reportes = DBExecutor(DB_REPORTES_WORKERS, "contabot-db-reportes")
+
+
+# Cantidades por debajo de esto se consideran 0 (errores de redondeo al consumir lotes)
+EPSILON_STOCK = 1e-9
+
+
+class InventarioManager:
+    """
+    Stock por producto, con sus capas de costo FIFO en LotesInventario (cada
+    /entrada es un lote con su costo y moneda; las salidas consumen el lote más
+    viejo primero). Productos guarda el costo promedio de las existencias.
+    Mantiene en memoria una copia de Productos: se carga una vez, cada escritura
+    la actualiza al confirmarse su transacción (write-through) y reconciliar()
+    la compara periódicamente con la BD. La BD sigue siendo la fuente de verdad:
+    los descuentos de stock son UPDATE condicionales, así que una caché
+    desactualizada nunca deja stock negativo. Cada BD (negocio) tiene su copia.
+    """
+    _COLUMNAS = "codigo, nombre, stock, costo_unitario, moneda_costo"
+
+    @staticmethod
+    def _fila(fila: Sequence[Any]) -> Dict[str, Any]:
+        """Convierte una fila con las columnas de _COLUMNAS (en ese orden) en dict."""
+        codigo, nombre, stock, costo_unitario, moneda_costo = fila
         return {
-            'stock_anterior': stock_actual,
-            'stock_nuevo': nuevo_stock,
-            'costo_unitario': producto['costo_unitario'],
-            'moneda_costo': producto['moneda_costo']
+            'codigo': codigo, 'nombre': nombre, 'stock': float(stock),
+            'costo_unitario': float(costo_unitario), 'moneda_costo': moneda_costo,
         }
 
+    @staticmethod
+    def _estado() -> CacheBD:
+        """Caché de la BD en curso: valor = codigo -> fila de Productos; version sube en cada escritura."""
+        return cache_actual('inventario')
+
+    @staticmethod
+    def _leer_todo(conn: sqlite3.Connection) -> Dict[str, Dict[str, Any]]:
+        return {
+            fila[0]: InventarioManager._fila(fila)
+            for fila in conn.execute(f"SELECT {InventarioManager._COLUMNAS} FROM Productos")
+        }
+
+    @staticmethod
+    def cargar(conn: sqlite3.Connection) -> bool:
+        """
+        Carga la caché desde la BD. Si una escritura se publicó mientras se leía,
+        no se instala la copia (quedaría vieja) y retorna False.
+        """
+        estado = InventarioManager._estado()
+        with estado.lock:
+            version = estado.version
+        productos = InventarioManager._leer_todo(conn)
+        with estado.lock:
+            if estado.version != version:
+                return False
+            estado.valor = productos
+            return True
+
+    @staticmethod
+    def _asegurar_cargada(conn: sqlite3.Connection) -> None:
+        if InventarioManager._estado().valor is None:
+            InventarioManager.cargar(conn)
+
+    @staticmethod
+    def producto(conn: sqlite3.Connection, codigo: str) -> Optional[Dict[str, Any]]:
+        """Retorna una copia de la fila cacheada del producto (None si no existe)."""
+        InventarioManager._asegurar_cargada(conn)
+        estado = InventarioManager._estado()
+        with estado.lock:
+            fila = (estado.valor or {}).get(codigo)
+            return dict(fila) if fila else None
+
+    @staticmethod
+    def listar_en_cache() -> Optional[List[Dict[str, Any]]]:
+        """
+        Productos con stock, ordenados por código, sin tocar la BD.
+        Retorna None si la caché no está cargada.
+        """
+        estado = InventarioManager._estado()
+        with estado.lock:
+            if estado.valor is None:
+                return None
+            productos = [dict(f) for f in estado.valor.values() if f['stock'] > 0]
+        return sorted(productos, key=lambda f: f['codigo'])
+
+    @staticmethod
+    def listar(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        """Como listar_en_cache(), cargando la caché si hace falta."""
+        InventarioManager._asegurar_cargada(conn)
+        return InventarioManager.listar_en_cache() or []
+
+    @staticmethod
+    def publicar(conn: sqlite3.Connection, filas: List[Dict[str, Any]]) -> None:
+        """
+        Actualiza la caché con filas de Productos escritas en la transacción de conn,
+        una vez confirmada. Con conexiones sin soporte de commit diferido se invalida.
+        """
+        estado = InventarioManager._estado()
+
+        def _aplicar():
+            with estado.lock:
+                estado.version += 1
+                if estado.valor is not None:
+                    for fila in filas:
+                        estado.valor[fila['codigo']] = dict(fila)
+
+        if isinstance(conn, ConexionBD):
+            conn.al_confirmar(_aplicar)
+        else:
+            InventarioManager.invalidar()
+
+    @staticmethod
+    def _releer(conn: sqlite3.Connection, codigo: str) -> Optional[Dict[str, Any]]:
+        """Lee un producto de la BD y corrige su entrada en caché (caché desactualizada)."""
+        fila = conn.execute(
+            f"SELECT {InventarioManager._COLUMNAS} FROM Productos WHERE codigo = ?", (codigo,)
+        ).fetchone()
+        if fila is None:
+            return None
+        producto = InventarioManager._fila(fila)
+        InventarioManager.publicar(conn, [producto])
+        return producto
+
+    # --- Capas de costo FIFO (LotesInventario) ---
+
+    @staticmethod
+    def lotes_abiertos(conn: sqlite3.Connection, codigo: str) -> List[Dict[str, Any]]:
+        """Lotes con existencias de un producto, del más viejo al más nuevo (índice idx_lotes_abiertos)."""
+        return [
+            {'id': fila[0], 'cantidad_restante': fila[1], 'costo_unitario': fila[2],
+             'moneda_costo': fila[3], 'tasa_usd_cup': fila[4]}
+            for fila in conn.execute("""
+                SELECT id, cantidad_restante, costo_unitario, moneda_costo, tasa_usd_cup
+                FROM LotesInventario
+                WHERE codigo = ? AND cantidad_restante > 0
+                ORDER BY fecha, id
+            """, (codigo,))
+        ]
+
+    @staticmethod
+    def consumir_fifo(lotes: List[Dict[str, Any]], cantidad: float) -> tuple:
+        """
+        Descuenta cantidad de los lotes (ordenados FIFO), modificándolos en el lugar.
+        Retorna ([(lote, cantidad_tomada)], faltante); faltante > 0 si los lotes no alcanzan.
+        """
+        consumidos = []
+        pendiente = cantidad
+        for lote in lotes:
+            if pendiente <= EPSILON_STOCK:
+                break
+            if lote['cantidad_restante'] <= EPSILON_STOCK:
+                continue
+            tomado = min(lote['cantidad_restante'], pendiente)
+            lote['cantidad_restante'] -= tomado
+            if lote['cantidad_restante'] <= EPSILON_STOCK:
+                lote['cantidad_restante'] = 0.0
+            consumidos.append((lote, tomado))
+            pendiente -= tomado
+        return consumidos, max(0.0, pendiente)
+
+    @staticmethod
+    def costo_consumido(consumidos: List[tuple], tasa_usd_cup: float) -> tuple:
+        """
+        CMV de lo consumido: (monto, moneda). Si todos los lotes están en la misma
+        moneda, en esa moneda; si se mezclan, en USD convirtiendo cada lote con la
+        tasa de su compra (tasa_usd_cup si el lote no la tiene).
+        """
+        monedas = {lote['moneda_costo'] for lote, _ in consumidos}
+        if len(monedas) == 1:
+            return sum(tomado * lote['costo_unitario'] for lote, tomado in consumidos), monedas.pop()
+        return sum(
+            TasaManager.a_usd(tomado * lote['costo_unitario'], lote['moneda_costo'], lote['tasa_usd_cup'] or tasa_usd_cup)
+            for lote, tomado in consumidos
+        ), 'usd'
+
+    @staticmethod
+    def costo_promedio(lotes: List[Dict[str, Any]], tasa_usd_cup: float) -> Optional[tuple]:
+        """
+        Costo unitario promedio de las existencias (lotes abiertos): (costo, moneda),
+        con la misma regla de monedas que costo_consumido. None si no quedan existencias.
+        """
+        abiertos = [(lote, lote['cantidad_restante']) for lote in lotes if lote['cantidad_restante'] > EPSILON_STOCK]
+        if not abiertos:
+            return None
+        total, moneda = InventarioManager.costo_consumido(abiertos, tasa_usd_cup)
+        return total / sum(cantidad for _, cantidad in abiertos), moneda
+
+    @staticmethod
+    def costear_salida(
+        lotes: List[Dict[str, Any]], cantidad: float, producto: Dict[str, Any], tasa_usd_cup: float
+    ) -> tuple:
+        """
+        Consume cantidad de los lotes (FIFO) y retorna (lotes_tocados, cmv, moneda_cmv).
+        Si los lotes no cubren la salida, el resto se costea al promedio del producto.
+        """
+        consumidos, faltante = InventarioManager.consumir_fifo(lotes, cantidad)
+        tocados = [lote for lote, _ in consumidos]
+        if faltante > 0:
+            # Stock sin lote que lo respalde (p. ej. editado fuera del bot)
+            logger.warning(f"{producto['codigo']}: {faltante} unidades sin lote de costo; se usa el costo promedio.")
+            consumidos.append(({
+                'costo_unitario': producto['costo_unitario'], 'moneda_costo': producto['moneda_costo'],
+                'tasa_usd_cup': tasa_usd_cup,
+            }, faltante))
+        cmv, moneda_cmv = InventarioManager.costo_consumido(consumidos, tasa_usd_cup)
+        return tocados, cmv, moneda_cmv
+
+    @staticmethod
+    def _salida_lotes(conn: sqlite3.Connection, producto: Dict[str, Any], cantidad: float) -> tuple:
+        """
+        Consume cantidad de los lotes del producto (ya descontada de Productos),
+        actualiza su costo promedio y retorna (fila_producto, cmv, moneda_cmv).
+        """
+        codigo = producto['codigo']
+        tasa = TasaManager.tasa_vigente(conn)
+        lotes = InventarioManager.lotes_abiertos(conn, codigo)
+        tocados, cmv, moneda_cmv = InventarioManager.costear_salida(lotes, cantidad, producto, tasa)
+        conn.executemany(
+            "UPDATE LotesInventario SET cantidad_restante = ? WHERE id = ?",
+            [(lote['cantidad_restante'], lote['id']) for lote in tocados]
+        )
+        return InventarioManager._actualizar_costo(conn, codigo, lotes, tasa), cmv, moneda_cmv
+
+    @staticmethod
+    def _actualizar_costo(
+        conn: sqlite3.Connection, codigo: str, lotes: List[Dict[str, Any]], tasa_usd_cup: float
+    ) -> Dict[str, Any]:
+        """Guarda en Productos el costo promedio de los lotes abiertos y publica la fila en la caché."""
+        promedio = InventarioManager.costo_promedio(lotes, tasa_usd_cup)
+        if promedio is None:
+            fila = conn.execute(
+                f"SELECT {InventarioManager._COLUMNAS} FROM Productos WHERE codigo = ?", (codigo,)
+            ).fetchone()
+        else:
+            fila = conn.execute(f"""
+                UPDATE Productos SET costo_unitario = ?, moneda_costo = ? WHERE codigo = ?
+                RETURNING {InventarioManager._COLUMNAS}
+            """, (promedio[0], promedio[1], codigo)).fetchone()
+        producto = InventarioManager._fila(fila)
+        InventarioManager.publicar(conn, [producto])
+        return producto
+
+    @staticmethod
+    def descontar_stock(conn: sqlite3.Connection, codigo: str, cantidad: float) -> Optional[Dict[str, Any]]:
+        """
+        Descuenta stock general de un producto consumiendo sus lotes en orden FIFO.
+        Retorna la fila actualizada más 'cmv' y 'moneda_cmv' (costo exacto de lo
+        retirado), None si el producto no existe, o lanza StockInsuficienteError.
+        La validación usa la caché: el caso común no hace ningún SELECT sobre Productos.
+        """
+        def _descontar() -> Optional[Dict[str, Any]]:
+            fila = conn.execute(f"""
+                UPDATE Productos SET stock = stock - ?
+                WHERE codigo = ? AND stock >= ?
+                RETURNING {InventarioManager._COLUMNAS}
+            """, (cantidad, codigo, cantidad)).fetchone()
+            if fila is None:
+                return None
+            producto, cmv, moneda_cmv = InventarioManager._salida_lotes(conn, InventarioManager._fila(fila), cantidad)
+            return {**producto, 'cmv': cmv, 'moneda_cmv': moneda_cmv}
+
+        cacheado = InventarioManager.producto(conn, codigo)
+        if cacheado is not None and cacheado['stock'] >= cantidad:
+            producto = _descontar()
+            if producto is not None:
+                return producto
+
+        # La caché dice que no alcanza (o quedó vieja): decide la BD
+        producto = InventarioManager._releer(conn, codigo)
+        if producto is None:
+            return None
+        if producto['stock'] < cantidad:
+            raise StockInsuficienteError(codigo, producto['stock'], cantidad)
+        return _descontar()
+
+    @staticmethod
+    def registrar_entrada(
+        conn: sqlite3.Connection, codigo: str, cantidad: float, costo_unitario: float, moneda_costo: str,
+        proveedor: Optional[str] = None, fecha: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """
+        Suma stock a un producto (lo crea si no existe) como un lote nuevo con su
+        propio costo y moneda, y recalcula el costo promedio de las existencias.
+        Retorna la fila actualizada.
+        """
+        tasa = TasaManager.tasa_vigente(conn)
+        conn.execute("""
+            INSERT INTO Productos (codigo, nombre, costo_unitario, moneda_costo, stock)
+            VALUES (:codigo, :codigo, :costo, :moneda, :cantidad)
+            ON CONFLICT(codigo) DO UPDATE SET stock = stock + :cantidad
+        """, {'codigo': codigo, 'costo': costo_unitario, 'moneda': moneda_costo, 'cantidad': cantidad})
+        conn.execute("""
+            INSERT INTO LotesInventario (
+                codigo, fecha, cantidad_inicial, cantidad_restante, costo_unitario, moneda_costo, tasa_usd_cup, proveedor
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (codigo, fecha or datetime.now(), cantidad, cantidad, costo_unitario, moneda_costo, tasa, proveedor))
+        lotes = InventarioManager.lotes_abiertos(conn, codigo)
+        return InventarioManager._actualizar_costo(conn, codigo, lotes, tasa)
+
+    @staticmethod
+    def reconciliar(conn: sqlite3.Connection) -> Optional[List[tuple]]:
+        """
+        Compara la caché con Productos y la reemplaza por la copia de la BD.
+        Retorna las diferencias [(codigo, stock_en_cache, stock_en_bd)], o None si
+        una escritura concurrente impidió instalar la copia (se reintenta en el próximo ciclo).
+        """
+        estado = InventarioManager._estado()
+        with estado.lock:
+            anterior = dict(estado.valor or {})
+        if not InventarioManager.cargar(conn):
+            return None
+        with estado.lock:
+            actual = estado.valor
+            return [
+                (codigo, (anterior.get(codigo) or {}).get('stock'), (actual.get(codigo) or {}).get('stock'))
+                for codigo in sorted(set(anterior) | set(actual))
+                if anterior.get(codigo) != actual.get(codigo)
+            ] if anterior else []
+
+    @staticmethod
+    def invalidar() -> None:
+        """Descarta la caché (la próxima lectura recarga Productos)."""
+        estado = InventarioManager._estado()
+        with estado.lock:
+            estado.valor = None
+            estado.version += 1
+
 class DeudaManager:
+    """
+    Cuentas por pagar (proveedores) y por cobrar (vendedores). Deudas guarda el
+    saldo de cada (actor, moneda, tipo); cada cambio deja además un asiento en
+    DeudaMovimientos (diario de solo inserción, leído por /deudas [actor]) y
+    actualiza DeudasTotales (total y actores con saldo por tipo y moneda), así
+    el resumen de /deudas no suma la tabla de deudas.
+    """
+
+    @staticmethod
+    def registrar_asientos(conn: sqlite3.Connection, asientos: List[Dict[str, Any]]) -> None:
+        """
+        Inserta asientos en DeudaMovimientos con executemany y aplica a DeudasTotales
+        un solo UPSERT por (tipo, moneda). Cada asiento es un dict con actor_id, tipo,
+        moneda, monto (positivo aumenta la deuda), saldo (pendiente después del
+        asiento), concepto y fecha (None = ahora). Deudas la actualiza quien llama.
+        """
+        if not asientos:
+            return
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO DeudaMovimientos (fecha, actor_id, tipo, moneda, monto, saldo, concepto)
+            VALUES (COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?)
+        """, [
+            (a.get('fecha'), a['actor_id'], a['tipo'], a['moneda'], a['monto'], a['saldo'], a.get('concepto'))
+            for a in asientos
+        ])
+
+        totales: Dict[tuple, list] = {}
+        for a in asientos:
+            acumulado = totales.setdefault((a['tipo'], a['moneda']), [0.0, 0])
+            acumulado[0] += a['monto']
+            # Un actor entra (o sale) del conteo cuando su saldo deja de ser (o pasa a ser) cero
+            acumulado[1] += (a['saldo'] > TOLERANCIA_SALDO) - (a['saldo'] - a['monto'] > TOLERANCIA_SALDO)
+        cursor.executemany("""
+            INSERT INTO DeudasTotales (tipo, moneda, total, actores)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(tipo, moneda) DO UPDATE SET
+                total = total + excluded.total,
+                actores = actores + excluded.actores
+        """, [(tipo, moneda, total, actores) for (tipo, moneda), (total, actores) in totales.items()])
+
+    @staticmethod
+    def aumentar(
+        conn: sqlite3.Connection, actor_id: str, tipo: str, moneda: str, monto: float,
+        concepto: Optional[str] = None, fecha: Optional[datetime] = None
+    ) -> float:
+        """Suma `monto` a la deuda (creándola si no existe) en un solo UPSERT. Retorna el saldo resultante."""
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO Deudas (fecha, actor_id, tipo, monto_pendiente, moneda)
+            VALUES (COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?)
+            ON CONFLICT(actor_id, moneda, tipo) DO UPDATE SET
+                monto_pendiente = monto_pendiente + excluded.monto_pendiente,
+                fecha = excluded.fecha
+            RETURNING monto_pendiente
+        """, (fecha, actor_id, tipo, monto, moneda))
+        saldo = cursor.fetchone()[0]
+        DeudaManager.registrar_asientos(conn, [{
+            'actor_id': actor_id, 'tipo': tipo, 'moneda': moneda, 'monto': monto,
+            'saldo': saldo, 'concepto': concepto, 'fecha': fecha,
+        }])
+        return saldo
+
+    @staticmethod
+    def reducir(
+        conn: sqlite3.Connection, actor_id: str, tipo: str, moneda: str, monto: float,
+        concepto: Optional[str] = None, limitar: bool = True
+    ) -> Optional[tuple]:
+        """
+        Resta `monto` de una deuda existente. Con limitar=True el saldo no baja de
+        cero (se aplica solo lo pendiente); sin limitar, un pago mayor que la deuda
+        viola el CHECK de Deudas y revierte la transacción.
+        Retorna (monto_aplicado, saldo) o None si el actor no tiene esa deuda.
+        """
+        cursor = conn.cursor()
+        # El asiento se calcula desde la fila de Deudas en la misma sentencia que lo inserta
+        aplicado_sql = "MIN(monto_pendiente, :monto)" if limitar else ":monto"
+        cursor.execute(f"""
+            INSERT INTO DeudaMovimientos (actor_id, tipo, moneda, monto, saldo, concepto)
+            SELECT actor_id, tipo, moneda, -{aplicado_sql}, monto_pendiente - {aplicado_sql}, :concepto
+            FROM Deudas
+            WHERE actor_id = :actor_id AND moneda = :moneda AND tipo = :tipo
+            RETURNING monto, saldo
+        """, {'actor_id': actor_id, 'tipo': tipo, 'moneda': moneda, 'monto': monto, 'concepto': concepto})
+        asiento = cursor.fetchone()
+        if asiento is None:
+            return None
+        delta, saldo = asiento[0], asiento[1]
+
+        cursor.execute("""
+            UPDATE Deudas SET monto_pendiente = ?, fecha = CURRENT_TIMESTAMP
+            WHERE actor_id = ? AND moneda = ? AND tipo = ?
+        """, (saldo, actor_id, moneda, tipo))
+        actores = (saldo > TOLERANCIA_SALDO) - (saldo - delta > TOLERANCIA_SALDO)
+        cursor.execute("""
+            INSERT INTO DeudasTotales (tipo, moneda, total, actores)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(tipo, moneda) DO UPDATE SET
+                total = total + excluded.total,
+                actores = actores + excluded.actores
+        """, (tipo, moneda, delta, actores))
+        return -delta, saldo
+
     @staticmethod
     def liquidar_deuda_con_pago(
         conn: sqlite3.Connection,
         actor_id: str,
         monto_pagado: float,
         moneda_pago: str,
-        tasa_cambio: float
+        tasa_cambio: float,
+        concepto: Optional[str] = None
     ) -> float:
         """
         Liquida una deuda POR COBRAR (vendedor) con un pago en efectivo, 
         convirtiendo la moneda de pago a la moneda de la deuda (USD). 
         Retorna el monto liquidado en USD.
         """
-        cursor = conn.cursor()
-        
         # 1. Convertir el monto pagado a USD (Moneda base de la deuda)
         if moneda_pago == 'cup' or moneda_pago == 'cup-t':
             monto_liquidado_usd = monto_pagado / tasa_cambio
@@ -95,15 +1083,13 @@ class DeudaManager:
             raise ValueError("Moneda de pago no soportada para liquidación.")
             
         # 2. Reducir la deuda POR_COBRAR (asumiendo que la deuda está en USD)
-        tipo_deuda = 'POR_COBRAR'
-        
-        cursor.execute("""
-            UPDATE Deudas 
-            SET monto_pendiente = monto_pendiente - ?
-            WHERE actor_id = ? AND tipo = ? AND moneda = 'usd'
-        """, (monto_liquidado_usd, actor_id, tipo_deuda))
+        if concepto is None:
+            concepto = f"Pago {monto_pagado:.2f} {moneda_pago.upper()}"
+        resultado = DeudaManager.reducir(
+            conn, actor_id, 'POR_COBRAR', 'usd', monto_liquidado_usd, concepto, limitar=False
+        )
 
-        if cursor.rowcount == 0:
+        if resultado is None:
             logger.warning(
                 f"No se pudo liquidar la deuda POR_COBRAR. "
                 f"Actor: {actor_id}, Monto liquidado: {monto_liquidado_usd} USD"
@@ -141,14 +1127,13 @@ class DeudaManager:
         monto_a_liquidar = cantidad_vendida * precio_unitario
         
         # 3. Descontar la deuda POR COBRAR
-        cursor.execute("""
-            UPDATE Deudas 
-            SET monto_pendiente = monto_pendiente - ?
-            WHERE actor_id = ? AND moneda = ? AND tipo = 'POR_COBRAR'
-        """, (monto_a_liquidar, vendedor, moneda_deuda))
+        resultado = DeudaManager.reducir(
+            conn, vendedor, 'POR_COBRAR', moneda_deuda, monto_a_liquidar,
+            f"Venta {cantidad_vendida:g} x {codigo}", limitar=False
+        )
 
         # 4. Verificar que se haya actualizado alguna fila
-        if cursor.rowcount == 0:
+        if resultado is None:
             logger.warning(f"No se pudo liquidar la deuda por venta. Vendedor: {vendedor}, Monto: {monto_a_liquidar} {moneda_deuda}")
             return 0.0
 
@@ -162,75 +1147,215 @@ class DeudaManager:
         monto: float,
         moneda: str,
         tipo: str,
-        es_incremento: bool = True
+        es_incremento: bool = True,
+        concepto: Optional[str] = None
     ) -> float:
         """
         Actualiza el saldo de una deuda, creándola si no existe.
         """
-        cursor = conn.cursor()
-        
         # Validar tipo de deuda
         if tipo not in ('POR_PAGAR', 'POR_COBRAR'):
             raise ValueError("Tipo de deuda inválido")
-        
-        # Buscar deuda existente
+
+        if es_incremento:
+            return DeudaManager.aumentar(conn, actor_id, tipo, moneda, monto, concepto)
+
+        # Reducir sin dejar saldo negativo
+        resultado = DeudaManager.reducir(conn, actor_id, tipo, moneda, monto, concepto)
+        if resultado is None:
+            raise ValueError(f"No existe deuda {tipo} para {actor_id} en {moneda}")
+        return resultado[1]
+
+    @staticmethod
+    def extracto(conn: sqlite3.Connection, actor_id: str, limite: int) -> Dict[str, Any]:
+        """
+        Estado de cuenta de un actor: saldos por (tipo, moneda) y sus últimos
+        `limite` asientos (el más reciente primero), leídos por índice.
+        """
+        cursor = conn.cursor()
         cursor.execute("""
-            SELECT monto_pendiente 
-            FROM Deudas 
-            WHERE actor_id = ? AND moneda = ? AND tipo = ?
-        """, (actor_id, moneda, tipo))
-        
-        deuda = cursor.fetchone()
-        
-        if deuda:
-            # Actualizar deuda existente
-            nuevo_monto = deuda['monto_pendiente']
-            if es_incremento:
-                nuevo_monto += monto
-            else:
-                nuevo_monto = max(0, nuevo_monto - monto)  # Evitar saldo negativo
-            
-            cursor.execute("""
-                UPDATE Deudas 
-                SET monto_pendiente = ?, 
-                    fecha = CURRENT_TIMESTAMP
-                WHERE actor_id = ? AND moneda = ? AND tipo = ?
-            """, (nuevo_monto, actor_id, moneda, tipo))
-        else:
-            # Crear nueva deuda
-            if not es_incremento:
-                raise ValueError(f"No existe deuda {tipo} para {actor_id} en {moneda}")
-            
-            nuevo_monto = monto
-            cursor.execute("""
-                INSERT INTO Deudas (actor_id, monto_pendiente, moneda, tipo, fecha)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """, (actor_id, nuevo_monto, moneda, tipo))
-        
-        return nuevo_monto
+            SELECT tipo, moneda, monto_pendiente FROM Deudas
+            WHERE actor_id = ?
+            ORDER BY tipo DESC, moneda
+        """, (actor_id,))
+        saldos = cursor.fetchall()
+        cursor.execute("""
+            SELECT fecha, tipo, moneda, monto, saldo, concepto FROM DeudaMovimientos
+            WHERE actor_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (actor_id, limite))
+        return {'saldos': saldos, 'asientos': cursor.fetchall()}
+
+    @staticmethod
+    def verificar_totales(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        """Compara DeudasTotales contra la tabla Deudas. Retorna las diferencias (vacía si cuadra)."""
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT tipo, moneda, SUM(monto_pendiente) AS total, SUM(monto_pendiente > ?) AS actores
+            FROM Deudas
+            GROUP BY tipo, moneda
+        """, (TOLERANCIA_SALDO,))
+        esperado = {(f['tipo'], f['moneda']): (f['total'] or 0.0, f['actores'] or 0) for f in cursor.fetchall()}
+        cursor.execute("SELECT tipo, moneda, total, actores FROM DeudasTotales")
+        tabla = {(f['tipo'], f['moneda']): (f['total'], f['actores']) for f in cursor.fetchall()}
+
+        diferencias = []
+        for clave in sorted(set(esperado) | set(tabla)):
+            total_deudas, actores_deudas = esperado.get(clave, (0.0, 0))
+            total_tabla, actores_tabla = tabla.get(clave, (0.0, 0))
+            if abs(total_deudas - total_tabla) > TOLERANCIA_SALDO or actores_deudas != actores_tabla:
+                diferencias.append({
+                    'tipo': clave[0], 'moneda': clave[1],
+                    'total_deudas': total_deudas, 'total_tabla': total_tabla,
+                })
+        return diferencias
+
+    @staticmethod
+    def reconstruir_totales(conn: sqlite3.Connection) -> int:
+        """Reconstruye DeudasTotales desde Deudas. Retorna la cantidad de pares (tipo, moneda) escritos."""
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM DeudasTotales")
+        cursor.execute("""
+            INSERT INTO DeudasTotales (tipo, moneda, total, actores)
+            SELECT tipo, moneda, SUM(monto_pendiente), SUM(monto_pendiente > ?)
+            FROM Deudas
+            GROUP BY tipo, moneda
+        """, (TOLERANCIA_SALDO,))
+        return cursor.rowcount
+
+    @staticmethod
+    def inicializar_diario(conn: sqlite3.Connection) -> int:
+        """
+        Migración: si el diario está vacío, abre un asiento 'Saldo inicial' por cada
+        deuda existente y calcula DeudasTotales. Retorna los asientos creados.
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM DeudaMovimientos)")
+        if cursor.fetchone()[0]:
+            return 0
+        cursor.execute("""
+            INSERT INTO DeudaMovimientos (fecha, actor_id, tipo, moneda, monto, saldo, concepto)
+            SELECT fecha, actor_id, tipo, moneda, monto_pendiente, monto_pendiente, 'Saldo inicial'
+            FROM Deudas
+            WHERE monto_pendiente > 0
+            ORDER BY fecha, id
+        """)
+        asientos = cursor.rowcount
+        DeudaManager.reconstruir_totales(conn)
+        return asientos
+
+# Signo de cada tipo de movimiento sobre el saldo de la caja.
+# Nota: 'venta' y 'consignacion_finalizada' son tipos de 'ingreso' de efectivo en caja.
+# 'gasto', 'traspaso' (salida) y 'pago_proveedor' (que usa gasto) son salidas.
+# 'traspaso_entrada' es la pata de un /cambio que entra en la caja destino.
+SIGNO_MOVIMIENTO = {
+    'ingreso': 1,
+    'venta': 1,
+    'consignacion_finalizada': 1,
+    'traspaso_entrada': 1,
+    'gasto': -1,
+    'traspaso': -1,
+    'apertura': 1,  # Saldo al cierre del periodo anterior (puede ser negativo)
+}
+
+# La misma regla expresada en SQL, para recalcular saldos desde el libro mayor
+SQL_MONTO_CON_SIGNO = """
+    CASE 
+        WHEN tipo IN ('ingreso', 'venta', 'consignacion_finalizada', 'traspaso_entrada', 'apertura') THEN monto 
+        WHEN tipo IN ('gasto', 'traspaso') THEN -monto 
+        ELSE 0 
+    END
+"""
+
+# Diferencia máxima tolerada entre SaldosCaja y el libro mayor (redondeo de floats)
+TOLERANCIA_SALDO = 0.005
+
+
+class TasaManager:
+    """
+    Tasa de cambio USD -> CUP versionada (tabla TasasCambio, una fila por /set_tasa).
+    La tasa vigente se cachea en memoria (una por BD); /set_tasa la invalida
+    después del commit.
+    """
+
+    @staticmethod
+    def tasa_vigente(conn: sqlite3.Connection) -> float:
+        """Retorna la tasa vigente (la última registrada), leyendo la BD solo si no está en caché."""
+        estado = cache_actual('tasa')
+        with estado.lock:
+            if estado.valor is not None:
+                return estado.valor
+            version = estado.version
+
+        fila = conn.execute("""
+            SELECT tasa FROM TasasCambio
+            ORDER BY vigente_desde DESC, id DESC
+            LIMIT 1
+        """).fetchone()
+        tasa = fila[0] if fila is not None else TASA_USD_CUP
+
+        with estado.lock:
+            # Si hubo un /set_tasa mientras se leía, no se cachea el valor viejo
+            if estado.version == version:
+                estado.valor = tasa
+        return tasa
+
+    @staticmethod
+    def tasa_en(conn: sqlite3.Connection, fecha: Union[str, datetime]) -> float:
+        """Retorna la tasa que estaba vigente en una fecha dada."""
+        fila = conn.execute("""
+            SELECT tasa FROM TasasCambio
+            WHERE vigente_desde <= ?
+            ORDER BY vigente_desde DESC, id DESC
+            LIMIT 1
+        """, (str(fecha),)).fetchone()
+        return fila[0] if fila is not None else TASA_USD_CUP
+
+    @staticmethod
+    def registrar_tasa(conn: sqlite3.Connection, tasa: float, user_id: Optional[int] = None) -> float:
+        """
+        Registra una nueva tasa vigente desde ahora. Retorna la tasa anterior.
+        El llamador debe invocar invalidar() una vez confirmada la transacción.
+        """
+        anterior = TasaManager.tasa_vigente(conn)
+        conn.execute(
+            "INSERT INTO TasasCambio (tasa, vigente_desde, user_id) VALUES (?, ?, ?)",
+            (tasa, datetime.now(), user_id)
+        )
+        return anterior
+
+    @staticmethod
+    def invalidar() -> None:
+        """Descarta la tasa cacheada (la próxima lectura va a la BD)."""
+        estado = cache_actual('tasa')
+        with estado.lock:
+            estado.valor = None
+            estado.version += 1
+
+    @staticmethod
+    def a_usd(monto: float, moneda: str, tasa: float) -> float:
+        """Convierte un monto a USD (CUP y CUP-T usan la misma tasa)."""
+        if moneda in ('cup', 'cup-t'):
+            return monto / tasa
+        return monto
+
 
 class MovimientoManager:
     # 🌟 NUEVO MÉTODO CRÍTICO: Obtener Saldo para evitar Negativos
     @staticmethod
     def get_saldo_caja(conn: sqlite3.Connection, caja: str, moneda: str) -> float:
-        """Calcula el saldo actual de una caja en una moneda específica."""
+        """
+        Retorna el saldo actual de una caja en una moneda específica.
+        Lee SaldosCaja (mantenida por registrar_movimiento), sin recorrer Movimientos.
+        """
         cursor = conn.cursor()
-        # Nota: 'venta' y 'consignacion_finalizada' son tipos de 'ingreso' de efectivo en caja.
-        # 'gasto', 'traspaso' (salida) y 'pago_proveedor' (que usa gasto) son salidas.
-        # Asumimos que los tipos en Movimientos reflejan correctamente el flujo (Ingreso=+, Gasto/-=).
-        cursor.execute("""
-            SELECT SUM(
-                CASE 
-                    WHEN tipo IN ('ingreso', 'venta', 'consignacion_finalizada') THEN monto 
-                    WHEN tipo IN ('gasto', 'traspaso') THEN -monto 
-                    ELSE 0 
-                END
-            ) 
-            FROM Movimientos 
-            WHERE caja = ? AND moneda = ?
-        """, (caja, moneda))
-        saldo = cursor.fetchone()[0]
-        return saldo if saldo is not None else 0.0
+        cursor.execute(
+            "SELECT saldo FROM SaldosCaja WHERE caja = ? AND moneda = ?",
+            (caja, moneda)
+        )
+        fila = cursor.fetchone()
+        return fila[0] if fila is not None else 0.0
 
     @staticmethod
     def registrar_movimiento(
@@ -240,22 +1365,448 @@ class MovimientoManager:
         moneda: str,
         caja: str,
         user_id: int,
-        descripcion: str
+        descripcion: str,
+        fecha: Optional[datetime] = None,
+        tasa_usd_cup: Optional[float] = None
     ) -> int:
         """
-        Registra un movimiento en la base de datos.
+        Registra un movimiento en la base de datos y actualiza SaldosCaja
+        en la misma transacción. Guarda la tasa USD/CUP usada (por defecto, la vigente).
         """
         cursor = conn.cursor()
+        if tasa_usd_cup is None:
+            tasa_usd_cup = TasaManager.tasa_vigente(conn)
         
+        if fecha is None:
+            cursor.execute("""
+                INSERT INTO Movimientos (
+                    fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup
+                ) VALUES (
+                    CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?, ?
+                )
+            """, (tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup))
+        else:
+            cursor.execute("""
+                INSERT INTO Movimientos (
+                    fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup))
+        movimiento_id = cursor.lastrowid
+
+        delta = SIGNO_MOVIMIENTO.get(tipo, 0) * monto
         cursor.execute("""
-            INSERT INTO Movimientos (
-                fecha, tipo, monto, moneda, caja, user_id, descripcion
-            ) VALUES (
-                CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?
-            )
-        """, (tipo, monto, moneda, caja, user_id, descripcion))
+            INSERT INTO SaldosCaja (caja, moneda, saldo, last_movimiento_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(caja, moneda) DO UPDATE SET
+                saldo = saldo + excluded.saldo,
+                last_movimiento_id = excluded.last_movimiento_id
+        """, (caja, moneda, delta, movimiento_id))
         
-        return cursor.lastrowid
+        return movimiento_id
+
+    @staticmethod
+    def calcular_saldos_ledger(conn: sqlite3.Connection) -> Dict[tuple, Dict[str, Any]]:
+        """
+        Recalcula los saldos recorriendo todo Movimientos (costoso).
+        Retorna {(caja, moneda): {'saldo': float, 'last_movimiento_id': int}}.
+        """
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT caja, moneda, SUM({SQL_MONTO_CON_SIGNO}) AS saldo, MAX(id) AS last_movimiento_id
+            FROM Movimientos
+            GROUP BY caja, moneda
+        """)
+        return {
+            (fila['caja'], fila['moneda']): {
+                'saldo': fila['saldo'] or 0.0,
+                'last_movimiento_id': fila['last_movimiento_id'],
+            }
+            for fila in cursor.fetchall()
+        }
+
+    @staticmethod
+    def verificar_saldos(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        """
+        Compara SaldosCaja contra el libro mayor.
+        Retorna la lista de diferencias (vacía si todo cuadra).
+        """
+        cursor = conn.cursor()
+        ledger = MovimientoManager.calcular_saldos_ledger(conn)
+        cursor.execute(
+            "SELECT caja, moneda, saldo, last_movimiento_id FROM SaldosCaja ORDER BY caja, moneda"
+        )
+        tabla = {
+            (fila['caja'], fila['moneda']): {
+                'saldo': fila['saldo'],
+                'last_movimiento_id': fila['last_movimiento_id'],
+            }
+            for fila in cursor.fetchall()
+        }
+
+        diferencias = []
+        for clave in sorted(set(ledger) | set(tabla)):
+            esperado = ledger.get(clave, {'saldo': 0.0, 'last_movimiento_id': None})
+            actual = tabla.get(clave, {'saldo': 0.0, 'last_movimiento_id': None})
+            if (abs(esperado['saldo'] - actual['saldo']) > TOLERANCIA_SALDO
+                    or esperado['last_movimiento_id'] != actual['last_movimiento_id']):
+                diferencias.append({
+                    'caja': clave[0],
+                    'moneda': clave[1],
+                    'saldo_ledger': esperado['saldo'],
+                    'saldo_tabla': actual['saldo'],
+                })
+        return diferencias
+
+    @staticmethod
+    def reconstruir_saldos(conn: sqlite3.Connection) -> int:
+        """
+        Reconstruye SaldosCaja desde el libro mayor.
+        Retorna la cantidad de pares (caja, moneda) escritos.
+        """
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM SaldosCaja")
+        cursor.execute(f"""
+            INSERT INTO SaldosCaja (caja, moneda, saldo, last_movimiento_id)
+            SELECT caja, moneda, COALESCE(SUM({SQL_MONTO_CON_SIGNO}), 0), MAX(id)
+            FROM Movimientos
+            GROUP BY caja, moneda
+        """)
+        return cursor.rowcount
+
+class CierreManager:
+    """
+    Cierre de periodos contables. Los movimientos anteriores al corte (y el
+    detalle de sus ventas) pasan a la BD de archivo y en Movimientos queda una
+    fila 'apertura' por caja y moneda con el saldo a esa fecha: los saldos, la
+    verificación y la reconstrucción de SaldosCaja siguen saliendo solo de la
+    tabla caliente, que crece con el periodo abierto y no con toda la historia.
+
+    Con WAL, una transacción que toca dos BDs adjuntas no es atómica entre
+    ambas ante una caída, así que el cierre va en dos transacciones: primero se
+    copia al archivo (idempotente) y luego se borra de la tabla caliente solo lo
+    que ya está copiado. Si se corta en medio, recuperar_interrumpido() descarta
+    la copia y el cierre se puede repetir.
+    """
+
+    @staticmethod
+    def ultimo_corte(conn: sqlite3.Connection) -> Optional[str]:
+        """Fecha de corte ('YYYY-MM-DD') del último cierre, o None si nunca se cerró."""
+        return conn.execute("SELECT MAX(corte) FROM Cierres").fetchone()[0]
+
+    @staticmethod
+    def resumen(conn: sqlite3.Connection, corte: str) -> Dict[str, Any]:
+        """Lo que archivaría un cierre en `corte`: cantidad de movimientos y saldos de apertura."""
+        movimientos = conn.execute(
+            "SELECT COUNT(*) FROM Movimientos WHERE fecha < ? AND tipo != 'apertura'", (corte,)
+        ).fetchone()[0]
+        saldos = conn.execute(f"""
+            SELECT caja, moneda, SUM({SQL_MONTO_CON_SIGNO}) AS saldo
+            FROM Movimientos
+            WHERE fecha < ?
+            GROUP BY caja, moneda
+            ORDER BY caja, moneda
+        """, (corte,)).fetchall()
+        return {
+            'ultimo_corte': CierreManager.ultimo_corte(conn),
+            'movimientos': movimientos,
+            'saldos': [(fila['caja'], fila['moneda'], fila['saldo']) for fila in saldos],
+        }
+
+    @staticmethod
+    def copiar_al_archivo(conn: sqlite3.Connection, corte: str) -> int:
+        """
+        Fase 1: copia al archivo los movimientos anteriores al corte y el detalle
+        de sus ventas, después de descartar lo que dejó un cierre cortado.
+        """
+        CierreManager.recuperar_interrumpido(conn)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO {ESQUEMA_ARCHIVO}.Movimientos ({_COLUMNAS_MOVIMIENTOS})
+            SELECT {_COLUMNAS_MOVIMIENTOS} FROM main.Movimientos
+            WHERE fecha < ? AND tipo != 'apertura'
+        """, (corte,))
+        copiados = cursor.rowcount
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO {ESQUEMA_ARCHIVO}.VentaDetalle ({_COLUMNAS_VENTA_DETALLE})
+            SELECT {', '.join('d.' + c for c in _COLUMNAS_VENTA_DETALLE.split(', '))}
+            FROM main.VentaDetalle d
+            JOIN main.Movimientos m ON m.id = d.movimiento_id
+            WHERE m.fecha < ? AND m.tipo = 'venta'
+        """, (corte,))
+        return copiados
+
+    @staticmethod
+    def cerrar(conn: sqlite3.Connection, corte: str, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Fase 2: borra de las tablas calientes lo ya copiado (y las aperturas
+        anteriores) y escribe las aperturas del nuevo periodo. SaldosCaja no
+        cambia: cada apertura suma exactamente lo que se borró de su caja/moneda.
+        """
+        cursor = conn.cursor()
+        # Solo lo que está en el archivo: un movimiento con fecha atrasada que
+        # llegó entre las dos fases se queda en la tabla caliente
+        archivado = f"""
+            fecha < :corte AND (
+                tipo = 'apertura'
+                OR EXISTS (SELECT 1 FROM {ESQUEMA_ARCHIVO}.Movimientos a WHERE a.id = Movimientos.id)
+            )
+        """
+        cursor.execute(f"""
+            SELECT caja, moneda, SUM({SQL_MONTO_CON_SIGNO}) AS saldo, SUM(tipo != 'apertura') AS archivados
+            FROM Movimientos
+            WHERE {archivado}
+            GROUP BY caja, moneda
+            ORDER BY caja, moneda
+        """, {'corte': corte})
+        saldos = cursor.fetchall()
+
+        cursor.execute(f"""
+            DELETE FROM VentaDetalle
+            WHERE movimiento_id IN (SELECT id FROM Movimientos WHERE tipo = 'venta' AND {archivado})
+        """, {'corte': corte})
+        ventas = cursor.rowcount
+        cursor.execute(f"DELETE FROM Movimientos WHERE {archivado}", {'corte': corte})
+
+        fecha_apertura = f"{corte} 00:00:00"
+        tasa = TasaManager.tasa_en(conn, fecha_apertura)
+        cursor.executemany("""
+            INSERT INTO Movimientos (fecha, tipo, monto, moneda, caja, user_id, descripcion, tasa_usd_cup)
+            VALUES (?, 'apertura', ?, ?, ?, ?, ?, ?)
+        """, [
+            (fecha_apertura, fila['saldo'], fila['moneda'], fila['caja'], user_id or 0,
+             f"APERTURA: saldo al cierre anterior a {corte}", tasa)
+            for fila in saldos
+        ])
+        # La apertura puede ser ahora el último movimiento de su caja/moneda
+        cursor.execute("""
+            UPDATE SaldosCaja SET last_movimiento_id = (
+                SELECT MAX(id) FROM Movimientos m
+                WHERE m.caja = SaldosCaja.caja AND m.moneda = SaldosCaja.moneda
+            )
+        """)
+
+        movimientos = sum(fila['archivados'] for fila in saldos)
+        cursor.execute(
+            "INSERT INTO Cierres (corte, user_id, movimientos, ventas) VALUES (?, ?, ?, ?)",
+            (corte, user_id, movimientos, ventas)
+        )
+        return {
+            'movimientos': movimientos,
+            'ventas': ventas,
+            'saldos': [(fila['caja'], fila['moneda'], fila['saldo']) for fila in saldos],
+        }
+
+    @staticmethod
+    def recuperar_interrumpido(conn: sqlite3.Connection) -> int:
+        """
+        Deshace la fase 1 de un cierre que no llegó a la fase 2: quita del
+        archivo las filas que siguen en la tabla caliente. Retorna cuántas quitó.
+        """
+        cursor = conn.cursor()
+        # Solo pueden estar duplicadas las filas a partir del menor id caliente
+        cursor.execute("SELECT MIN(id) FROM Movimientos WHERE tipo != 'apertura'")
+        desde = cursor.fetchone()[0]
+        if desde is None:
+            return 0
+        cursor.execute(f"""
+            DELETE FROM {ESQUEMA_ARCHIVO}.Movimientos
+            WHERE id >= ? AND EXISTS (SELECT 1 FROM main.Movimientos m WHERE m.id = {ESQUEMA_ARCHIVO}.Movimientos.id)
+        """, (desde,))
+        duplicados = cursor.rowcount
+        cursor.execute(f"""
+            DELETE FROM {ESQUEMA_ARCHIVO}.VentaDetalle
+            WHERE movimiento_id >= ? AND EXISTS (
+                SELECT 1 FROM main.VentaDetalle d WHERE d.movimiento_id = {ESQUEMA_ARCHIVO}.VentaDetalle.movimiento_id
+            )
+        """, (desde,))
+        return duplicados
+
+
+class VentaManager:
+    """Detalle estructurado de cada venta (VentaDetalle, 1:1 con el movimiento 'venta')."""
+
+    @staticmethod
+    def registrar_detalle(
+        conn: sqlite3.Connection,
+        movimiento_id: int,
+        codigo: str,
+        unidades: float,
+        ingreso: float,
+        moneda_ingreso: str,
+        cmv: float = 0.0,
+        moneda_cmv: Optional[str] = None,
+        vendedor: Optional[str] = None,
+        fecha: Optional[datetime] = None,
+        tasa_usd_cup: Optional[float] = None
+    ) -> None:
+        """
+        Guarda ingreso, CMV y producto de una venta ya registrada en Movimientos
+        y la acumula en el resumen diario GananciaDiaria (misma transacción).
+        Los montos en USD del resumen se calculan con la tasa de la venta
+        (la misma que se guardó en el movimiento).
+        """
+        if tasa_usd_cup is None:
+            tasa_usd_cup = TasaManager.tasa_vigente(conn)
+        conn.execute("""
+            INSERT INTO VentaDetalle (
+                movimiento_id, codigo, unidades, vendedor, es_consignada,
+                ingreso, moneda_ingreso, cmv, moneda_cmv
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            movimiento_id, codigo, unidades, vendedor, 1 if vendedor else 0,
+            ingreso, moneda_ingreso, cmv, moneda_cmv
+        ))
+
+        dia = (fecha or datetime.now()).date().isoformat()
+        conn.execute("""
+            INSERT INTO GananciaDiaria (
+                fecha, codigo, moneda_ingreso, moneda_cmv, ingreso, cmv,
+                ingreso_usd, cmv_usd, unidades, ventas
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT(fecha, codigo, moneda_ingreso, moneda_cmv) DO UPDATE SET
+                ingreso = ingreso + excluded.ingreso,
+                cmv = cmv + excluded.cmv,
+                ingreso_usd = ingreso_usd + excluded.ingreso_usd,
+                cmv_usd = cmv_usd + excluded.cmv_usd,
+                unidades = unidades + excluded.unidades,
+                ventas = ventas + 1
+        """, (
+            dia, codigo, moneda_ingreso, moneda_cmv or '', ingreso, cmv,
+            TasaManager.a_usd(ingreso, moneda_ingreso, tasa_usd_cup),
+            TasaManager.a_usd(cmv, moneda_cmv, tasa_usd_cup),
+            unidades
+        ))
+
+    @staticmethod
+    def parsear_descripcion(descripcion: str) -> Dict[str, Any]:
+        """
+        Extrae producto, unidades, vendedor y CMV de la descripción de una venta
+        con el formato histórico:
+          'VENTA: 2.0 x COD | REVENUE: ... | CMV: 10.00 USD | ...'
+          'VENTA_CONSIGNADA: 1.0 x COD | Vendedor: MARIA | REVENUE: ... | ...'
+        Lanza ValueError si la descripción no tiene ese formato.
+        """
+        partes = [p.strip() for p in descripcion.split(' | ')]
+        etiqueta, _, cabecera = partes[0].partition(':')
+        if etiqueta not in ('VENTA', 'VENTA_CONSIGNADA'):
+            raise ValueError(f"Descripción de venta no reconocida: {descripcion!r}")
+
+        unidades_str, _, codigo = cabecera.strip().partition(' x ')
+        datos = {
+            'codigo': codigo.strip(),
+            'unidades': float(unidades_str),
+            'vendedor': None,
+            'cmv': 0.0,
+            'moneda_cmv': None,
+        }
+        for parte in partes[1:]:
+            clave, _, valor = parte.partition(':')
+            if clave == 'Vendedor':
+                datos['vendedor'] = valor.strip()
+            elif clave == 'CMV':
+                costo_valor, costo_moneda = valor.split()
+                datos['cmv'] = float(costo_valor.replace(',', ''))
+                datos['moneda_cmv'] = costo_moneda.lower()
+        return datos
+
+    @staticmethod
+    def backfill_detalle(conn: sqlite3.Connection) -> int:
+        """
+        Crea el VentaDetalle de las ventas históricas que aún no lo tienen,
+        parseando su descripción. Retorna la cantidad de ventas procesadas.
+        """
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT m.id, m.monto, m.moneda, m.descripcion
+            FROM Movimientos m
+            LEFT JOIN VentaDetalle d ON d.movimiento_id = m.id
+            WHERE m.tipo = 'venta' AND d.movimiento_id IS NULL
+        """)
+        filas = []
+        mal_formadas = 0
+        for movimiento_id, monto, moneda, descripcion in cursor.fetchall():
+            try:
+                datos = VentaManager.parsear_descripcion(descripcion)
+            except ValueError:
+                # Se conserva el ingreso; sin producto ni CMV (igual que el parser anterior)
+                mal_formadas += 1
+                datos = {'codigo': '', 'unidades': 0.0, 'vendedor': None, 'cmv': 0.0, 'moneda_cmv': None}
+            filas.append((
+                movimiento_id, datos['codigo'], datos['unidades'], datos['vendedor'],
+                1 if datos['vendedor'] else 0, monto, moneda, datos['cmv'], datos['moneda_cmv']
+            ))
+
+        cursor.executemany("""
+            INSERT INTO VentaDetalle (
+                movimiento_id, codigo, unidades, vendedor, es_consignada,
+                ingreso, moneda_ingreso, cmv, moneda_cmv
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, filas)
+
+        if mal_formadas:
+            logger.warning(f"Backfill de VentaDetalle: {mal_formadas} ventas con descripción no reconocida (sin CMV).")
+        return len(filas)
+
+    @staticmethod
+    def reconstruir_ganancia_diaria(conn: sqlite3.Connection) -> int:
+        """
+        Reconstruye GananciaDiaria desde VentaDetalle (fecha y tasa del movimiento),
+        incluidas las ventas de periodos ya archivados.
+        Retorna la cantidad de filas (día, producto, monedas) escritas.
+        """
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM GananciaDiaria")
+        cursor.execute("""
+            INSERT INTO GananciaDiaria (
+                fecha, codigo, moneda_ingreso, moneda_cmv, ingreso, cmv,
+                ingreso_usd, cmv_usd, unidades, ventas
+            )
+            SELECT substr(m.fecha, 1, 10), d.codigo, d.moneda_ingreso, COALESCE(d.moneda_cmv, ''),
+                   SUM(d.ingreso), SUM(d.cmv),
+                   SUM(CASE WHEN d.moneda_ingreso IN ('cup', 'cup-t') THEN d.ingreso / COALESCE(m.tasa_usd_cup, :tasa) ELSE d.ingreso END),
+                   SUM(CASE WHEN d.moneda_cmv IN ('cup', 'cup-t') THEN d.cmv / COALESCE(m.tasa_usd_cup, :tasa) ELSE d.cmv END),
+                   SUM(d.unidades), COUNT(*)
+            FROM VentaDetalleTodos d
+            JOIN MovimientosTodos m ON m.id = d.movimiento_id
+            GROUP BY 1, 2, 3, 4
+        """, {'tasa': TasaManager.tasa_vigente(conn)})
+        return cursor.rowcount
+
+    @staticmethod
+    def totales_ganancia(
+        conn: sqlite3.Connection,
+        desde: Optional[str] = None,
+        hasta: Optional[str] = None
+    ) -> Optional[Dict[str, float]]:
+        """
+        Suma ingresos y CMV en USD (convertidos con la tasa de cada venta) a partir del resumen diario.
+        desde/hasta son fechas 'YYYY-MM-DD' inclusivas (None = sin límite).
+        Las ventas consignadas aportan el costo de los lotes que salieron al consignar.
+        Retorna None si no hay ventas en el rango.
+        """
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT
+                SUM(ventas) AS ventas,
+                SUM(unidades) AS unidades,
+                SUM(ingreso_usd) AS ingreso_usd,
+                SUM(cmv_usd) AS cmv_usd
+            FROM GananciaDiaria
+            WHERE fecha BETWEEN :desde AND :hasta
+        """, {
+            'desde': desde or '0000-01-01',
+            'hasta': hasta or '9999-12-31',
+        })
+        fila = cursor.fetchone()
+        if not fila['ventas']:
+            return None
+        return {
+            'ventas': fila['ventas'],
+            'unidades': fila['unidades'] or 0.0,
+            'ingreso_usd': fila['ingreso_usd'] or 0.0,
+            'cmv_usd': fila['cmv_usd'] or 0.0,
+        }
+
 
 class ConsignacionManager:
     @staticmethod
@@ -321,4 +1872,63 @@ class ConsignacionManager:
             'stock_nuevo': nuevo_stock,
             'precio_unitario': precio_unitario,
             'moneda': moneda
-        }
\ No newline at end of file
+        }
+
+class ReportesManager:
+    """
+    Reportes ya renderizados (ReportesCache). Cada reporte depende de uno o más
+    dominios de VersionesDatos, cuyos contadores suben por trigger con cada
+    escritura en sus tablas: el reporte guardado sirve mientras la suma de sus
+    contadores sea la misma que cuando se generó.
+    """
+
+    # Dominio -> tablas cuyas escrituras lo invalidan (db_manager crea los triggers;
+    # un cambio aquí necesita un paso en MIGRACIONES que llame a crear_triggers_versiones)
+    DOMINIOS = {
+        'saldos': ('SaldosCaja',),
+        'deudas': ('Deudas', 'DeudasTotales'),
+        'stock': ('Productos',),
+        'ganancia': ('GananciaDiaria', 'TasasCambio'),
+    }
+
+    @staticmethod
+    def leer(conn: sqlite3.Connection, reporte: str, dominios: Sequence[str]) -> tuple:
+        """
+        Retorna (version_actual, fragmentos) en una sola consulta; fragmentos es
+        None si no hay un render guardado con la versión actual.
+        """
+        marcas = ", ".join("?" * len(dominios))
+        fila = conn.execute(f"""
+            SELECT v.version, r.fragmentos
+            FROM (SELECT COALESCE(SUM(version), 0) AS version FROM VersionesDatos WHERE dominio IN ({marcas})) v
+            LEFT JOIN ReportesCache r ON r.reporte = ? AND r.version = v.version
+        """, (*dominios, reporte)).fetchone()
+        return fila[0], (json.loads(fila[1]) if fila[1] is not None else None)
+
+    @staticmethod
+    def guardar(conn: sqlite3.Connection, reporte: str, version: int, fragmentos: Sequence[str]) -> bool:
+        """
+        Guarda el render de un reporte con la versión leída ANTES de generarlo: si
+        los datos cambiaron mientras tanto, la versión guardada ya es vieja y la
+        próxima lectura lo regenera. Un render más viejo no pisa a uno más nuevo.
+        Es un caché: si otro escritor tiene la BD no se espera el lock (el
+        comando que lo pidió es una lectura) y retorna False sin guardar.
+        """
+        conn.execute("PRAGMA busy_timeout = 0")
+        try:
+            conn.execute("""
+                INSERT INTO ReportesCache (reporte, version, fragmentos, generado)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (reporte) DO UPDATE SET
+                    version = excluded.version,
+                    fragmentos = excluded.fragmentos,
+                    generado = excluded.generado
+                WHERE excluded.version >= ReportesCache.version
+            """, (reporte, version, json.dumps(list(fragmentos), ensure_ascii=False)))
+            return True
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            return False
+        finally:
+            conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
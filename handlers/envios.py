@@ -0,0 +1,253 @@
+"""
+Cola de envíos a Telegram.
+
+Los handlers no esperan a la Bot API: responder()/responder_html() (en lugar
+de Message.reply_text/reply_html) dejan el mensaje en la cola del chat con
+BotEncolado.encolar_mensaje y vuelven en el acto; un envío lento o un 429 ya
+no retiene el handler ni su cupo de CONCURRENT_UPDATES. Como no esperan, no
+retornan el Message enviado: send_message sigue siendo el de la Bot API
+(espera y lo retorna) para quien lo necesite.
+
+Cada chat con mensajes pendientes tiene una tarea que los envía en orden,
+respetando dos cubetas de fichas (token bucket) como los límites de Telegram:
+una por chat (~1 mensaje/s en privados, 20/min en grupos) y una global (~30
+mensajes/s para todo el bot). Ante RetryAfter (flood control) se pausa todo
+el envío el tiempo que pide Telegram y se reintenta el mismo mensaje; los
+errores de red se reintentan con espera creciente y los demás (BadRequest,
+Forbidden) se registran y se descarta ese mensaje.
+
+Los mensajes editados (botones del historial) y los documentos se siguen
+enviando directamente: el primero responde a un botón y el segundo lee un
+archivo temporal que el handler borra al terminar.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Union
+
+from telegram import Bot, Message
+from telegram.constants import ParseMode
+from telegram.error import NetworkError, RetryAfter
+from telegram.ext import ExtBot
+
+from config_vars import (
+    ENVIOS_GLOBAL_POR_SEG, ENVIOS_CHAT_POR_SEG, ENVIOS_CHAT_RAFAGA, ENVIOS_GRUPO_POR_MIN, ENVIOS_REINTENTOS,
+)
+from handlers.metricas import medicion_actual
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Cubeta de fichas: `tasa` fichas por segundo, hasta `capacidad` acumuladas.
+    reservar() toma una ficha (aunque la cubeta quede en negativo) y retorna
+    cuántos segundos hay que esperar para usarla: las reservas quedan en fila.
+    """
+
+    __slots__ = ("tasa", "capacidad", "fichas", "_ultimo")
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self._ultimo = time.monotonic()
+
+    def _recargar(self) -> None:
+        ahora = time.monotonic()
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def reservar(self) -> float:
+        self._recargar()
+        self.fichas -= 1
+        return 0.0 if self.fichas >= 0 else -self.fichas / self.tasa
+
+    def hasta_llena(self) -> float:
+        """Segundos hasta que la cubeta vuelva a estar llena."""
+        self._recargar()
+        return (self.capacidad - self.fichas) / self.tasa
+
+
+def _segundos(retry_after: Any) -> float:
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class _Chat:
+    __slots__ = ("pendientes", "cubeta", "tarea", "enviando")
+
+    def __init__(self, cubeta: TokenBucket):
+        self.pendientes: Deque[Callable[[], Awaitable[Any]]] = deque()
+        self.cubeta = cubeta
+        self.tarea: Optional[asyncio.Task] = None
+        self.enviando = False  # Hay un mensaje sacado de la cola que todavía no se envió
+
+
+class ColaEnvios:
+    """Envíos pendientes por chat, con límites por chat y global y reintento ante flood control."""
+
+    def __init__(
+        self,
+        global_por_seg: float = ENVIOS_GLOBAL_POR_SEG,
+        chat_por_seg: float = ENVIOS_CHAT_POR_SEG,
+        chat_rafaga: float = ENVIOS_CHAT_RAFAGA,
+        grupo_por_min: float = ENVIOS_GRUPO_POR_MIN,
+        reintentos: int = ENVIOS_REINTENTOS,
+    ):
+        # Sin ráfaga global: los envíos salen espaciados (1/global_por_seg) y ninguna ventana de 1 s pasa la cuota
+        self.global_ = TokenBucket(global_por_seg, 1)
+        self.chat_por_seg = chat_por_seg
+        self.chat_rafaga = chat_rafaga
+        self.grupo_por_min = grupo_por_min
+        self.reintentos = reintentos
+        self._chats: Dict[Union[int, str], _Chat] = {}
+        self._pausa_hasta = 0.0  # time.monotonic() hasta el que Telegram pidió no enviar nada
+        self.enviados = 0
+        self.descartados = 0
+        self.flood = 0
+
+    def _cubeta_chat(self, chat_id: Union[int, str]) -> TokenBucket:
+        # chat_id negativo (o @usuario) = grupo o canal: límite por minuto, sin ráfaga
+        if not isinstance(chat_id, int) or chat_id < 0:
+            return TokenBucket(self.grupo_por_min / 60, 1)
+        return TokenBucket(self.chat_por_seg, self.chat_rafaga)
+
+    def encolar(self, chat_id: Union[int, str], enviar: Callable[[], Awaitable[Any]]) -> None:
+        """Agrega un envío a la cola del chat (se hace en orden, en segundo plano)."""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self._cubeta_chat(chat_id))
+        chat.pendientes.append(enviar)
+        if chat.tarea is None:
+            # Contexto vacío: el envío no se cuenta en la medición del comando que lo encoló
+            chat.tarea = asyncio.get_running_loop().create_task(
+                self._enviar_chat(chat_id, chat), context=contextvars.Context()
+            )
+
+    def pendientes(self) -> int:
+        return sum(len(chat.pendientes) for chat in self._chats.values())
+
+    async def _respetar_pausa(self) -> None:
+        while (pausa := self._pausa_hasta - time.monotonic()) > 0:
+            await asyncio.sleep(pausa)
+
+    async def _esperar_turno(self, chat: _Chat) -> None:
+        """Ficha del chat, luego ficha global; sin enviar nada mientras dure un flood control."""
+        await asyncio.sleep(chat.cubeta.reservar())
+        while True:
+            await self._respetar_pausa()
+            await asyncio.sleep(self.global_.reservar())
+            # Si empezó una pausa mientras esperaba su turno, el turno se perdió: al terminar
+            # la pausa se pide otro (si no, todos los que esperaban saldrían juntos)
+            if self._pausa_hasta <= time.monotonic():
+                return
+
+    async def _enviar_uno(self, chat_id: Union[int, str], chat: _Chat, enviar: Callable[[], Awaitable[Any]]) -> None:
+        intento = 0
+        while True:
+            await self._esperar_turno(chat)
+            try:
+                await enviar()
+                self.enviados += 1
+                return
+            except RetryAfter as e:
+                espera = _segundos(e.retry_after)
+                self.flood += 1
+                self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + espera)
+                logger.warning(f"Flood control de Telegram: envíos pausados {espera:.1f} s (chat {chat_id})")
+            except NetworkError as e:
+                intento += 1
+                if intento > self.reintentos:
+                    raise
+                logger.warning(f"Error de red enviando al chat {chat_id} (intento {intento}): {e}")
+                await asyncio.sleep(min(2 ** intento, 30))
+
+    async def _enviar_chat(self, chat_id: Union[int, str], chat: _Chat) -> None:
+        try:
+            while True:
+                while chat.pendientes:
+                    enviar = chat.pendientes.popleft()
+                    chat.enviando = True
+                    try:
+                        await self._enviar_uno(chat_id, chat, enviar)
+                    except Exception as e:
+                        self.descartados += 1
+                        logger.error(f"No se pudo enviar un mensaje al chat {chat_id}: {e}")
+                    finally:
+                        chat.enviando = False
+                # La tarea (y la cubeta del chat) viven hasta que la cubeta se llena otra vez:
+                # un mensaje que llegue antes respeta el límite del chat
+                await asyncio.sleep(chat.cubeta.hasta_llena())
+                if not chat.pendientes:
+                    break
+        finally:
+            chat.tarea = None
+            if chat.pendientes:
+                self.descartados += len(chat.pendientes)
+                chat.pendientes.clear()
+            if self._chats.get(chat_id) is chat:
+                del self._chats[chat_id]
+
+    async def vaciar(self, timeout: float) -> bool:
+        """Espera a que se envíe todo lo pendiente (al detener el bot). Retorna False si venció el plazo."""
+        limite = time.monotonic() + timeout
+        while any(chat.pendientes or chat.enviando for chat in self._chats.values()):
+            if time.monotonic() >= limite:
+                logger.warning(f"Cola de envíos: {self.pendientes()} mensajes sin enviar al detener el bot")
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def cerrar(self) -> None:
+        """Cancela las tareas de envío (lo pendiente se descarta)."""
+        tareas = [chat.tarea for chat in self._chats.values() if chat.tarea is not None]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+
+class BotEncolado(ExtBot):
+    """ExtBot con una ColaEnvios: encolar_mensaje envía en segundo plano, send_message sigue esperando a Telegram."""
+
+    def __init__(self, *args, cola: Optional[ColaEnvios] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cola = cola or ColaEnvios()
+
+    @property
+    def cola(self) -> ColaEnvios:
+        return self._cola
+
+    def encolar_mensaje(self, chat_id: Union[int, str], text: str, **kwargs) -> None:
+        """Deja un send_message en la cola del chat y retorna sin esperarlo (no hay Message que retornar)."""
+        medicion = medicion_actual()
+        if medicion is not None:
+            medicion.bytes_respuesta += len(text.encode())
+        self._cola.encolar(chat_id, functools.partial(ExtBot.send_message, self, chat_id=chat_id, text=text, **kwargs))
+
+
+async def enviar_mensaje(bot: Bot, chat_id: Union[int, str], texto: str, **kwargs) -> None:
+    """Envía `texto` al chat por la cola si el bot la tiene (BotEncolado); si no, espera a la Bot API."""
+    if isinstance(bot, BotEncolado):
+        bot.encolar_mensaje(chat_id, texto, **kwargs)
+    else:
+        await bot.send_message(chat_id=chat_id, text=texto, **kwargs)
+
+
+async def responder(mensaje: Message, texto: str, **kwargs) -> None:
+    """Como mensaje.reply_text, pero por la cola de envíos: no espera a Telegram ni retorna el Message."""
+    bot = mensaje.get_bot() if isinstance(mensaje, Message) else None
+    if isinstance(bot, BotEncolado):
+        if mensaje.is_topic_message:
+            kwargs.setdefault("message_thread_id", mensaje.message_thread_id)
+        bot.encolar_mensaje(mensaje.chat_id, texto, **kwargs)
+    else:
+        await mensaje.reply_text(texto, **kwargs)
+
+
+async def responder_html(mensaje: Message, texto: str, **kwargs) -> None:
+    """responder() con parse_mode HTML (como reply_html)."""
+    await responder(mensaje, texto, parse_mode=ParseMode.HTML, **kwargs)
@@ -0,0 +1,135 @@
+"""
+Procesamiento idempotente de los comandos que escriben: si Telegram reentrega
+un update (timeout del webhook, reinicio antes de confirmar el offset), el
+comando no se aplica dos veces.
+
+Cada update atendido queda en ProcesadosUpdates, insertado en la misma
+transacción que la escritura del comando (ProcesadosManager en db_utils). Los
+update_id recientes se guardan además en memoria (LRU, cargado al arrancar con
+los que siguen vigentes): una reentrega se descarta sin tocar la BD y un update
+nuevo no paga ninguna consulta extra; el INSERT dentro de la transacción cubre
+lo que el LRU ya no recuerde.
+"""
+import contextvars
+import functools
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Callable, Any, Iterable
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config_vars import PROCESADOS_CACHE
+from handlers.envios import responder
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDuplicado(BaseException):
+    """
+    El update ya se había procesado. Hereda de BaseException para atravesar los
+    `except Exception` de los handlers hasta idempotente(), que responde en su lugar.
+    """
+
+
+class UpdateEnCurso:
+    """Update que se está atendiendo; `registrado` pasa a True al confirmarse su primera escritura."""
+
+    __slots__ = ("update_id", "chat_id", "message_id", "comando", "registrado")
+
+    def __init__(self, update_id: int, chat_id: Optional[int], message_id: Optional[int], comando: str):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.comando = comando
+        self.registrado = False
+
+
+_update_en_curso: contextvars.ContextVar[Optional[UpdateEnCurso]] = contextvars.ContextVar(
+    "update_en_curso", default=None
+)
+
+
+def update_en_curso() -> Optional[UpdateEnCurso]:
+    """Update idempotente en curso (None fuera de un comando que escribe)."""
+    return _update_en_curso.get()
+
+
+class Recientes:
+    """LRU de update_id ya procesados (se consulta desde el event loop y se llena desde los hilos de BD)."""
+
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self._ids: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contiene(self, update_id: int) -> bool:
+        with self._lock:
+            if update_id in self._ids:
+                self._ids.move_to_end(update_id)
+                return True
+            return False
+
+    def agregar(self, update_id: int) -> None:
+        with self._lock:
+            self._ids[update_id] = None
+            self._ids.move_to_end(update_id)
+            while len(self._ids) > self.capacidad:
+                self._ids.popitem(last=False)
+
+    def reemplazar(self, update_ids: Iterable[int]) -> None:
+        """Carga los ids (del más viejo al más reciente) descartando los anteriores."""
+        with self._lock:
+            self._ids = OrderedDict((update_id, None) for update_id in update_ids)
+            while len(self._ids) > self.capacidad:
+                self._ids.popitem(last=False)
+
+    def extender(self, update_ids: Iterable[int]) -> None:
+        """Agrega los ids (del más viejo al más reciente) sin descartar los que ya había."""
+        for update_id in update_ids:
+            self.agregar(update_id)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+# update_id procesados recientemente (frente en memoria de ProcesadosUpdates)
+procesados = Recientes(PROCESADOS_CACHE)
+
+
+async def _avisar_duplicado(update: Update, comando: str) -> None:
+    logger.info(f"/{comando}: update {update.update_id} reentregado, no se aplica de nuevo")
+    mensaje = update.effective_message
+    if mensaje is not None:
+        await responder(mensaje, "♻️ Este mensaje ya se había procesado; no se registró de nuevo.")
+
+
+def idempotente(comando: str, callback: Callable[..., Any]) -> Callable[..., Any]:
+    """Envuelve el callback de un comando que escribe para que cada update se aplique una sola vez."""
+
+    @functools.wraps(callback)
+    async def _idempotente(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        update_id = getattr(update, "update_id", None)
+        if update_id is None:
+            return await callback(update, context)
+        if procesados.contiene(update_id):
+            await _avisar_duplicado(update, comando)
+            return None
+
+        mensaje = update.effective_message
+        token = _update_en_curso.set(UpdateEnCurso(
+            update_id,
+            update.effective_chat.id if update.effective_chat else None,
+            mensaje.message_id if mensaje else None,
+            comando,
+        ))
+        try:
+            return await callback(update, context)
+        except UpdateDuplicado:
+            await _avisar_duplicado(update, comando)
+            return None
+        finally:
+            _update_en_curso.reset(token)
+
+    return _idempotente
@@ -1,15 +1,68 @@
+import asyncio
+import contextvars
+import html
 import logging
 import sqlite3
 import datetime
+from typing import Optional
 from telegram import Update
 from telegram.ext import ContextTypes
 # Asegúrate de importar los managers si los vas a usar
-from .db_utils import MovimientoManager, DeudaManager, InventarioManager 
+from .db_utils import (
+    MovimientoManager, DeudaManager, InventarioManager, VentaManager, TasaManager,
+    StockInsuficienteError, db_executor, db_reportes, clave_producto, pool_negocios
+)
+from .negocios import en_negocio
+from .argumentos import (
+    Comando, ErrorArgumentos, caja, clave, entero, fecha, literal, moneda, numero, responder_error, texto, tokens
+)
+from .respuestas import Respuesta, fragmento
+from .envios import responder, responder_html
+from .reportes import obtener_reporte, registrar_reporte
 from config_secret import ADMIN_USER_IDS 
-from config_vars import VALID_MONEDAS, VALID_CAJAS, TASA_USD_CUP
+from config_vars import INVENTARIO_RECONCILIAR_SEG
 
 logger = logging.getLogger(__name__)
 
+# Gramáticas de los comandos (se compilan una vez, al importar el módulo; /lote las reutiliza)
+ARGS_ENTRADA = Comando(
+    "entrada",
+    [
+        clave("codigo"), entero("cantidad"), numero("costo_unitario"), moneda("moneda_costo", uso="moneda"),
+        caja(), clave("proveedor"), texto("descripcion", uso="desc"),
+    ],
+    ejemplo="/entrada HUEVOS 100 0.5 usd cfg PEDRO Lote 45",
+)
+ARGS_VENTA = Comando(
+    "venta",
+    [
+        clave("codigo", uso="código"), numero("unidades"), numero("monto_total"), moneda(), caja(),
+        tokens("extra", uso="vendedor/nota"),
+    ],
+    ejemplo="/venta HUEVOS 10 8 usd sc cliente",
+)
+ARGS_CONSIGNAR = Comando(
+    "consignar",
+    [clave("codigo"), numero("cantidad"), clave("vendedor"), numero("precio_venta"), moneda(), texto("nota")],
+    ejemplo="/consignar HUEVOS 20 JUAN 0.8 usd semana 3",
+)
+ARGS_STOCK_CONSIGNADO = Comando("stock_consignado", [clave("vendedor")])
+
+
+def _validar_ganancia(a) -> None:
+    if a.mes and a.desde:
+        raise ErrorArgumentos("Usa 'mes' o un rango de fechas, no ambos.")
+    if a.desde and a.desde > (a.hasta or datetime.date.today()):
+        raise ErrorArgumentos("La fecha inicial no puede ser posterior a la final.")
+
+
+ARGS_GANANCIA = Comando(
+    "ganancia",
+    [literal("mes", "mes", opcional=True), fecha("desde", opcional=True), fecha("hasta", opcional=True)],
+    ejemplo="/ganancia 2025-11-01 2025-11-30",
+    validar=_validar_ganancia,
+)
+
 # --- FASE 9 (MODIFICADA): FUNCIÓN PARA /entrada (Registro de Compra/Stock) ---
 
 async def entrada_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -19,91 +72,24 @@ async def entrada_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
-    conn = None
     try:
         # Formato esperado: [código] [cantidad] [costo_unitario] [moneda_costo] [caja] [proveedor] [desc...]
-        if len(context.args) < 7:
-            raise ValueError("Faltan argumentos. Uso: /entrada [codigo] [cantidad] [costo_unitario] [moneda] [caja] [proveedor] [desc]")
-
-        codigo = context.args[0].upper()
-        cantidad = int(context.args[1])
-        costo_unitario = float(context.args[2])
-        moneda_costo = context.args[3].lower()
-        caja = context.args[4].lower()
-        
-        # El proveedor será el actor de la deuda. Usamos .upper() para estandarizar.
-        proveedor = context.args[5].upper() 
-        descripcion_extra = " ".join(context.args[6:])
-        
-        # Validaciones
-        if cantidad <= 0 or costo_unitario <= 0: raise ValueError("Cantidad y costo deben ser positivos.")
-        if moneda_costo not in VALID_MONEDAS: raise ValueError(f"Moneda no válida: {moneda_costo}")
-        if caja not in VALID_CAJAS: raise ValueError(f"Caja no válida: {caja}")
+        # El proveedor será el actor de la deuda (normalizado a mayúsculas por la gramática).
+        a = ARGS_ENTRADA.parsear(context.args)
+        codigo, cantidad, costo_unitario, moneda_costo, proveedor = (
+            a.codigo, a.cantidad, a.costo_unitario, a.moneda_costo, a.proveedor
+        )
 
-        fecha_actual = datetime.datetime.now()
         costo_total = cantidad * costo_unitario
         
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-
-        # 1. 🌟 ACTUALIZAR / INSERTAR PRODUCTO (Tabla Productos)
-        cursor.execute("SELECT stock, costo_unitario, moneda_costo FROM Productos WHERE codigo = ?", (codigo,))
-        producto_existente = cursor.fetchone()
-
-        if producto_existente:
-            # Producto existe: Calcular nuevo costo promedio ponderado
-            stock_anterior, costo_anterior, moneda_anterior = producto_existente
-            
-            # Nota: Esto asume que el nuevo costo unitario está en la misma moneda que el anterior.
-            nuevo_stock = stock_anterior + cantidad
-            costo_anterior_total = stock_anterior * costo_anterior
-            nuevo_costo_total = costo_anterior_total + costo_total
-            
-            nuevo_costo_unitario = nuevo_costo_total / nuevo_stock if nuevo_stock > 0 else 0
-
-            cursor.execute(
-                "UPDATE Productos SET stock = ?, costo_unitario = ?, moneda_costo = ? WHERE codigo = ?",
-                (nuevo_stock, nuevo_costo_unitario, moneda_costo, codigo)
-            )
-        else:
-            # Producto nuevo: Insertar
-            cursor.execute(
-                "INSERT INTO Productos (codigo, nombre, costo_unitario, moneda_costo, stock) VALUES (?, ?, ?, ?, ?)",
-                (codigo, codigo, costo_unitario, moneda_costo, cantidad)
-            )
-            
-        # 2. REGISTRAR DEUDA (Tabla Deudas)
-        # La entrada de mercancía genera una deuda POR PAGAR al proveedor.
-
-        # Intentar actualizar una deuda existente (si existe, se suma el costo total)
-        cursor.execute(
-            """
-            UPDATE Deudas 
-            SET monto_pendiente = monto_pendiente + ?
-            WHERE actor_id = ? AND moneda = ? AND tipo = 'POR_PAGAR'
-            """,
-            (costo_total, proveedor, moneda_costo)
+        await db_executor.escribir(
+            [clave_producto(codigo)], _entrada_db, codigo, cantidad, costo_unitario, moneda_costo, proveedor
         )
-        
-        # Si no se actualizó ninguna fila (deuda nueva), insertamos la deuda
-        if cursor.rowcount == 0:
-            cursor.execute(
-                """
-                INSERT INTO Deudas (fecha, actor_id, tipo, monto_pendiente, moneda)
-                VALUES (?, ?, 'POR_PAGAR', ?, ?)
-                """,
-                (fecha_actual, proveedor, costo_total, moneda_costo)
-            )
-            
-        # 3. ELIMINADO: REGISTRO DE MOVIMIENTO. Ya no es necesario registrar un movimiento de caja 0,
-        # la deuda se gestiona enteramente en la tabla Deudas.
-            
-        conn.commit()
 
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"📦 <b>Entrada de Mercancía Registrada!</b>\n\n"
             f"<b>Código:</b> {codigo}\n"
             f"<b>Cantidad:</b> +{cantidad} unidades\n"
@@ -114,80 +100,152 @@ async def entrada_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.info(f"Entrada de {cantidad} de {codigo} registrada por {user_id}. Deuda generada con {proveedor}.")
 
     except ValueError as e:
-        await update.message.reply_html(
-            f"<b>Error de formato o validación:</b> {e}\n"
-            "Uso correcto: <code>/entrada [codigo] [cantidad] [costo_unitario] [moneda] [caja] [proveedor] [desc...]</code>\n"
-            "Ejemplo: <code>/entrada HUEVOS 100 0.5 usd cfg PEDRO Lote 45</code>"
-        )
+        await responder_error(update, ARGS_ENTRADA, e)
     except Exception as e:
         logger.error(f"Error inesperado en /entrada: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al registrar la entrada.")
-    finally:
-        if conn:
-            conn.close()
+        await responder(update.message, "Ocurrió un error inesperado al registrar la entrada.")
 
-# --- FASE 9.5 (MODIFICADA): FUNCIÓN PARA /stock (Reporte de Inventario) ---
-async def stock_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Manejador para el comando /stock: Muestra el inventario actual con la moneda de costo correcta."""
-    user_id = update.effective_user.id
-    if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
-        return
 
-    try:
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
+def _entrada_db(
+    conn: sqlite3.Connection, codigo: str, cantidad: int, costo_unitario: float,
+    moneda_costo: str, proveedor: str
+) -> None:
+    """Parte de BD de /entrada (se ejecuta en el pool de BD)."""
+    fecha_actual = datetime.datetime.now()
+    costo_total = cantidad * costo_unitario
 
-        # Seleccionamos todos los campos relevantes, incluyendo moneda_costo
-        cursor.execute("""
-            SELECT codigo, nombre, stock, costo_unitario, moneda_costo
-            FROM Productos
-            WHERE stock > 0
-            ORDER BY codigo
-        """)
+    # 1. 🌟 ACTUALIZAR / INSERTAR PRODUCTO (Tabla Productos) + LOTE con su costo y moneda (LotesInventario)
+    InventarioManager.registrar_entrada(
+        conn, codigo, cantidad, costo_unitario, moneda_costo, proveedor=proveedor, fecha=fecha_actual
+    )
         
-        resultados = cursor.fetchall() 
-        conn.close()
+    # 2. REGISTRAR DEUDA (Tabla Deudas)
+    # La entrada de mercancía genera una deuda POR PAGAR al proveedor.
+
+    # Si ya existe la deuda se suma el costo total; el cambio queda en el diario de deudas
+    DeudaManager.aumentar(
+        conn, proveedor, 'POR_PAGAR', moneda_costo, costo_total,
+        f"Entrada {cantidad} x {codigo} a {costo_unitario:.2f}", fecha_actual
+    )
+        
+    # 3. ELIMINADO: REGISTRO DE MOVIMIENTO. Ya no es necesario registrar un movimiento de caja 0,
+    # la deuda se gestiona enteramente en la tabla Deudas.
 
-        if not resultados:
-            await update.message.reply_text("El inventario está actualmente vacío (stock = 0).")
-            return
+# --- FASE 9.4: CACHÉ DE INVENTARIO (carga inicial y reconciliación periódica) ---
+async def reconciliar_inventario_periodicamente(intervalo: float = INVENTARIO_RECONCILIAR_SEG) -> None:
+    """
+    Carga la caché de inventario y cada `intervalo` segundos la compara con
+    Productos. Las diferencias indican escrituras fuera del bot (otro proceso,
+    edición manual de la BD) y se corrigen tomando la BD como verdad.
+    Con varios negocios se reconcilian también los que tienen la BD abierta
+    (los demás cargan su caché de nuevo al abrirse).
+    """
+    await db_executor.ejecutar(InventarioManager.cargar)
+    while True:
+        await asyncio.sleep(intervalo)
+        for negocio in [None, *pool_negocios.abiertos()]:
+            with en_negocio(negocio):
+                try:
+                    diferencias = await db_executor.ejecutar(InventarioManager.reconciliar)
+                except Exception as e:
+                    logger.error(f"Error al reconciliar la caché de inventario: {e}", exc_info=True)
+                    continue
+            donde = f" ({negocio})" if negocio else ""
+            if diferencias is None:
+                logger.info(f"Reconciliación de inventario{donde} pospuesta (escritura concurrente).")
+            elif diferencias:
+                logger.warning(
+                    f"Caché de inventario{donde} corregida en {len(diferencias)} productos: "
+                    + ", ".join(f"{codigo} {cache} -> {bd}" for codigo, cache, bd in diferencias[:20])
+                )
+
+
+_reconciliacion: Optional[asyncio.Task] = None
+
+
+def iniciar_reconciliacion() -> None:
+    """
+    Arranca la reconciliación periódica si no está corriendo. Se llama al
+    importar este módulo, y bot.py lo importa recién con el primer comando de
+    inventario, /lote o reporte que lo usa: arrancar el bot no carga ni el
+    módulo ni la caché. Fuera de un event loop (scripts, tests) no hace nada.
+    """
+    global _reconciliacion
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _reconciliacion is None or _reconciliacion.done():
+        # Contexto vacío: no hereda el negocio ni la medición del comando que importó el módulo
+        _reconciliacion = loop.create_task(reconciliar_inventario_periodicamente(), context=contextvars.Context())
 
-        respuesta = "--- 📋 Inventario Actual (Costo Original) ---\n\n"
-        
-        # Diccionario para valorizar por moneda (opcional, para el resumen)
-        total_valor_costo_por_moneda = {}
 
-        for codigo, nombre, stock, costo_unitario, moneda_costo in resultados:
-            
-            valor_costo_articulo = stock * costo_unitario
-            moneda_upper = moneda_costo.upper()
-            
-            # Acumular el valor total por moneda
-            if moneda_upper not in total_valor_costo_por_moneda:
-                total_valor_costo_por_moneda[moneda_upper] = 0.0
-            total_valor_costo_por_moneda[moneda_upper] += valor_costo_articulo
-            
-            respuesta += (
-                f"📦 <b>{codigo}</b> ({nombre})\n"
-                f"  • Stock: {stock:,.0f} unidades\n"
-                f"  • Costo Unitario: {costo_unitario:,.2f} {moneda_upper}\n" 
-                f"  • Valor Total (Costo): {valor_costo_articulo:,.2f} {moneda_upper}\n\n"
-            )
+def detener_reconciliacion() -> None:
+    """Cancela la reconciliación periódica (al apagar el bot)."""
+    if _reconciliacion is not None:
+        _reconciliacion.cancel()
 
-        respuesta += "--------------------------------------\n"
-        respuesta += f"📊 <b>Resumen de Valor de Inventario:</b>\n"
-        
-        # Mostrar el resumen por cada moneda
-        for moneda, total in total_valor_costo_por_moneda.items():
-             respuesta += f"Total {moneda}: {total:,.2f} {moneda}\n"
+# --- FASE 9.5 (MODIFICADA): FUNCIÓN PARA /stock (Reporte de Inventario) ---
+@fragmento
+def _bloque_producto(codigo: str, nombre: str, stock: float, costo_unitario: float, moneda: str) -> str:
+    """Bloque de un producto en /stock (memorizado por los valores de su fila)."""
+    return (
+        f"📦 <b>{html.escape(codigo)}</b> ({html.escape(nombre)})\n"
+        f"  • Stock: {stock:,.0f} unidades\n"
+        f"  • Costo Unitario: {costo_unitario:,.2f} {moneda}\n"
+        f"  • Valor Total (Costo): {stock * costo_unitario:,.2f} {moneda}\n"
+    )
+
+
+def _reporte_stock(conn: sqlite3.Connection) -> Respuesta:
+    """Inventario con stock y su valor a costo por moneda (se cachea en ReportesCache)."""
+    # Productos con stock desde la caché de inventario (sin SQL salvo la primera carga)
+    productos = InventarioManager.listar(conn)
+    resultados = [
+        (p['codigo'], p['nombre'], p['stock'], p['costo_unitario'], p['moneda_costo'])
+        for p in productos
+    ]
+
+    if not resultados:
+        return Respuesta("El inventario está actualmente vacío (stock = 0).")
+
+    respuesta = Respuesta("--- 📋 Inventario Actual (Costo Original) ---\n")
+
+    # Valor del inventario por moneda (para el resumen)
+    total_valor_costo_por_moneda = {}
+
+    for codigo, nombre, stock, costo_unitario, moneda_costo in resultados:
+        moneda_upper = moneda_costo.upper()
+        total_valor_costo_por_moneda[moneda_upper] = (
+            total_valor_costo_por_moneda.get(moneda_upper, 0.0) + stock * costo_unitario
+        )
+        respuesta.append(_bloque_producto(codigo, nombre, stock, costo_unitario, moneda_upper))
+
+    respuesta.append("--------------------------------------")
+    respuesta.append("📊 <b>Resumen de Valor de Inventario:</b>")
+    respuesta.extend(
+        f"Total {moneda}: {total:,.2f} {moneda}" for moneda, total in total_valor_costo_por_moneda.items()
+    )
+
+    return respuesta
+
+
+registrar_reporte("stock", ["stock"], _reporte_stock)
 
 
-        await update.message.reply_html(respuesta)
+async def stock_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Manejador para el comando /stock: Muestra el inventario actual con la moneda de costo correcta."""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_USER_IDS:
+        await responder(update.message, "⛔ No tienes permiso.")
+        return
+
+    try:
+        await (await obtener_reporte("stock")).enviar(update.message)
 
     except Exception as e:
         logger.error(f"Error inesperado en /stock: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al generar el reporte de stock.")
+        await responder(update.message, "Ocurrió un error inesperado al generar el reporte de stock.")
 
 # --- FASE 10: FUNCIÓN PARA /venta (Ingreso y Consumo de Stock) - CORREGIDO ---
 
@@ -198,266 +256,256 @@ async def venta_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
-    conn = None
     try:
-        if len(context.args) < 5:
-            raise ValueError("Faltan argumentos. Uso: /venta [código] [unidades] [monto_total] [moneda] [caja] [vendedor/nota...]")
-
-        codigo = context.args[0].upper()
-        unidades = float(context.args[1])
-        monto_total = float(context.args[2])
-        moneda = context.args[3].lower()
-        caja = context.args[4].lower() 
+        codigo, unidades, monto_total, moneda, caja, extra = ARGS_VENTA.parsear(context.args)
+
+        mensaje_confirmacion = await db_executor.escribir(
+            [clave_producto(codigo)], _venta_db, codigo, unidades, monto_total, moneda, caja, user_id, extra
+        )
+        await responder_html(update.message, mensaje_confirmacion)
+
+    except ValueError as e:
+        await responder_error(update, ARGS_VENTA, e)
+    except Exception as e:
+        logger.error(f"Error inesperado en /venta: {e}", exc_info=True)
+        await responder(update.message, f"Ocurrió un error inesperado al registrar la venta: {str(e)}")
+
+
+def _descripcion_venta_estandar(
+    unidades: float, codigo: str, monto_total: float, moneda: str,
+    costo_total: float, moneda_costo: str, caja: str, nota: str
+) -> str:
+    """Descripción del movimiento de una venta estándar (formato que lee VentaManager.parsear_descripcion)."""
+    return (
+        f"VENTA: {unidades} x {codigo} | "
+        f"REVENUE: {monto_total:.2f} {moneda.upper()} | "
+        f"CMV: {costo_total:.2f} {moneda_costo.upper()} | " 
+        f"CAJA: {caja} | "
+        f"NOTA: {nota}"
+    )
+
+
+def _descripcion_venta_consignada(
+    unidades: float, codigo: str, vendedor: str, monto_total: float, moneda: str,
+    monto_a_liquidar: float, moneda_consignacion: str, costo_total: float, moneda_costo: str, caja: str, nota: str
+) -> str:
+    """Descripción del movimiento de una venta de stock consignado."""
+    return (
+        f"VENTA_CONSIGNADA: {unidades} x {codigo} | "
+        f"Vendedor: {vendedor} | "
+        f"REVENUE: {monto_total:.2f} {moneda.upper()} | "
+        f"DEUDA_LIQUIDADA: {monto_a_liquidar:.2f} {moneda_consignacion.upper()} | "
+        f"CMV: {costo_total:.2f} {moneda_costo.upper()} | "
+        f"CAJA: {caja} | "
+        f"NOTA: {nota}"
+    )
+
+
+def _venta_db(
+    conn: sqlite3.Connection, codigo: str, unidades: float, monto_total: float,
+    moneda: str, caja: str, user_id: int, extra_args: list
+) -> str:
+    """
+    Parte de BD de /venta (se ejecuta en el pool de BD).
+    Retorna el mensaje de confirmación en HTML.
+    """
+    cursor = conn.cursor()
+    fecha_actual = datetime.datetime.now()
+
+    # 1. 🔍 Detección de tipo de venta (consignada o estándar)
+    vendedor = None
+    nota = " ".join(extra_args) if extra_args else "Venta estándar"
+    is_consignada = False
+
+    if extra_args:
+        posible_vendedor = extra_args[0].upper()
+        # Verificamos si hay stock consignado para este vendedor
+        cursor.execute("""
+            SELECT stock FROM Consignaciones 
+            WHERE codigo = ? AND vendedor = ? AND stock > 0
+        """, (codigo, posible_vendedor))
+        stock_consignado = cursor.fetchone()
         
-        # Validaciones básicas
-        if unidades <= 0 or monto_total <= 0: raise ValueError("Unidades y monto total deben ser positivos.")
-        if moneda not in VALID_MONEDAS: raise ValueError(f"Moneda no válida: {moneda}")
-        if caja not in VALID_CAJAS: raise ValueError(f"Caja no válida: {caja}")
-
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-        fecha_actual = datetime.datetime.now()
-
-        # 1. 🔍 Detección de tipo de venta (consignada o estándar)
-        vendedor = None
-        nota = " ".join(context.args[5:]) if len(context.args) > 5 else "Venta estándar"
-        is_consignada = False
-
-        if len(context.args) > 5:
-            posible_vendedor = context.args[5].upper()
-            # Verificamos si hay stock consignado para este vendedor
-            cursor.execute("""
-                SELECT stock FROM Consignaciones 
-                WHERE codigo = ? AND vendedor = ? AND stock > 0
-            """, (codigo, posible_vendedor))
-            stock_consignado = cursor.fetchone()
-            
-            if stock_consignado and stock_consignado[0] >= unidades:
-                vendedor = posible_vendedor
-                is_consignada = True
-
-        # 2. Procesamiento según tipo de venta
-        if is_consignada:
-            # --- VENTA CONSIGNADA ---
-            logger.info(f"Procesando venta consignada para vendedor {vendedor}")
-            
-            # 🌟 CORRECCIÓN CLAVE: Seleccionar también la MONEDA 🌟
-            cursor.execute("""
-                SELECT stock, precio_unitario, moneda 
-                FROM Consignaciones 
-                WHERE codigo = ? AND vendedor = ?
-            """, (codigo, vendedor))
-            data_consignada = cursor.fetchone()
-            
-            if not data_consignada:
-                raise ValueError("Error al obtener datos de consignación. Reintente.")
-                
-            stock_consignado_actual = data_consignada[0]
-            precio_unitario_consignado = data_consignada[1]
-            moneda_consignacion = data_consignada[2] # 🌟 NUEVA ASIGNACIÓN
-            
-            # Actualizar stock consignado
-            nueva_cantidad_consignada = stock_consignado_actual - unidades
-            cursor.execute("""
-                UPDATE Consignaciones 
-                SET stock = ? 
-                WHERE codigo = ? AND vendedor = ?
-            """, (nueva_cantidad_consignada, codigo, vendedor))
-
-            # Liquidar deuda (en la moneda de la deuda consignada)
-            monto_a_liquidar = unidades * precio_unitario_consignado
-            cursor.execute("""
-                UPDATE Deudas 
-                SET monto_pendiente = CASE 
-                    WHEN monto_pendiente - ? < 0 THEN 0 
-                    ELSE monto_pendiente - ? 
-                END
-                WHERE actor_id = ? AND moneda = ? AND tipo = 'POR_COBRAR'
-            """, (monto_a_liquidar, monto_a_liquidar, vendedor, moneda_consignacion)) 
+        if stock_consignado and stock_consignado[0] >= unidades:
+            vendedor = posible_vendedor
+            is_consignada = True
+
+    # 2. Procesamiento según tipo de venta
+    if is_consignada:
+        # --- VENTA CONSIGNADA ---
+        logger.info(f"Procesando venta consignada para vendedor {vendedor}")
+        
+        # 🌟 CORRECCIÓN CLAVE: Seleccionar también la MONEDA 🌟
+        cursor.execute("""
+            SELECT stock, precio_unitario, moneda, costo_unitario, moneda_costo 
+            FROM Consignaciones 
+            WHERE codigo = ? AND vendedor = ?
+        """, (codigo, vendedor))
+        data_consignada = cursor.fetchone()
+        
+        if not data_consignada:
+            raise ValueError("Error al obtener datos de consignación. Reintente.")
             
-            # 🌟 CORRECCIÓN: Usar la nueva variable en la descripción
-            descripcion_mov = (
-                f"VENTA_CONSIGNADA: {unidades} x {codigo} | "
-                f"Vendedor: {vendedor} | "
-                f"REVENUE: {monto_total:.2f} {moneda.upper()} | "
-                f"DEUDA_LIQUIDADA: {monto_a_liquidar:.2f} {moneda_consignacion.upper()} | "
-                f"CAJA: {caja} | "
-                f"NOTA: {nota}"
-            )
+        stock_consignado_actual = data_consignada[0]
+        precio_unitario_consignado = data_consignada[1]
+        moneda_consignacion = data_consignada[2] # 🌟 NUEVA ASIGNACIÓN
+        # CMV: el costo de los lotes que salieron al consignar
+        costo_total = unidades * data_consignada[3]
+        moneda_costo = data_consignada[4]
+        
+        # Actualizar stock consignado
+        nueva_cantidad_consignada = stock_consignado_actual - unidades
+        cursor.execute("""
+            UPDATE Consignaciones 
+            SET stock = ? 
+            WHERE codigo = ? AND vendedor = ?
+        """, (nueva_cantidad_consignada, codigo, vendedor))
 
-            mensaje_confirmacion = (
-                f"✅ <b>Venta Consignada Liquidada!</b>\n\n"
-                f"<b>Vendedor:</b> {vendedor}\n"
-                f"<b>Producto:</b> {codigo} ({unidades} u.)\n"
-                f"<b>Caja de Ingreso:</b> {caja.upper()}\n"
-                f"<b>Ingreso Total:</b> {monto_total:.2f} {moneda.upper()}\n"
-                f"<b>Deuda Liquidada:</b> {monto_a_liquidar:.2f} {moneda_consignacion.upper()}" # 🌟 USAR NUEVA VARIABLE
-            )
+        # Liquidar deuda (en la moneda de la deuda consignada)
+        monto_a_liquidar = unidades * precio_unitario_consignado
+        DeudaManager.reducir(
+            conn, vendedor, 'POR_COBRAR', moneda_consignacion, monto_a_liquidar, f"Venta {unidades:g} x {codigo}"
+        )
+        
+        # 🌟 CORRECCIÓN: Usar la nueva variable en la descripción
+        descripcion_mov = _descripcion_venta_consignada(
+            unidades, codigo, vendedor, monto_total, moneda,
+            monto_a_liquidar, moneda_consignacion, costo_total, moneda_costo, caja, nota
+        )
 
-        else:
-            # --- VENTA ESTÁNDAR ---
-            logger.info("Procesando venta estándar")
-            
-            # Verificar y actualizar stock general
-            cursor.execute("SELECT stock, costo_unitario, moneda_costo FROM Productos WHERE codigo = ?", (codigo,))
-            producto = cursor.fetchone()
+        mensaje_confirmacion = (
+            f"✅ <b>Venta Consignada Liquidada!</b>\n\n"
+            f"<b>Vendedor:</b> {vendedor}\n"
+            f"<b>Producto:</b> {codigo} ({unidades} u.)\n"
+            f"<b>Caja de Ingreso:</b> {caja.upper()}\n"
+            f"<b>Ingreso Total:</b> {monto_total:.2f} {moneda.upper()}\n"
+            f"<b>Deuda Liquidada:</b> {monto_a_liquidar:.2f} {moneda_consignacion.upper()}\n" # 🌟 USAR NUEVA VARIABLE
+            f"<b>CMV (Costo):</b> {costo_total:.2f} {moneda_costo.upper()}"
+        )
 
-            if not producto:
-                raise ValueError(f"El producto {codigo} no existe en el inventario.")
+    else:
+        # --- VENTA ESTÁNDAR ---
+        logger.info("Procesando venta estándar")
+        
+        # Verificar y actualizar stock general (validación contra la caché de inventario)
+        try:
+            producto = InventarioManager.descontar_stock(conn, codigo, unidades)
+        except StockInsuficienteError as e:
+            raise ValueError(f"Stock insuficiente en inventario general. Solo quedan {e.disponible} unidades de {codigo}.")
+
+        if not producto:
+            raise ValueError(f"El producto {codigo} no existe en el inventario.")
+
+        # Costo de Mercancía Vendida exacto: lotes consumidos en orden FIFO
+        costo_total = producto['cmv']
+        moneda_costo = producto['moneda_cmv']
+
+        # Usar formato estricto para el parser de /ganancia
+        descripcion_mov = _descripcion_venta_estandar(
+            unidades, codigo, monto_total, moneda, costo_total, moneda_costo, caja, nota
+        )
 
-            stock_actual = producto[0]
-            if stock_actual < unidades:
-                raise ValueError(f"Stock insuficiente en inventario general. Solo quedan {stock_actual} unidades de {codigo}.")
+        mensaje_confirmacion = (
+            f"✅ <b>Venta Estándar Registrada!</b>\n\n"
+            f"<b>Producto:</b> {codigo} ({unidades} u.)\n"
+            f"<b>Caja de Ingreso:</b> {caja.upper()}\n"
+            f"<b>Ingreso Total:</b> {monto_total:.2f} {moneda.upper()}\n"
+            f"<b>CMV (Costo):</b> {costo_total:.2f} {moneda_costo.upper()}"
+        )
 
-            costo_unitario = producto[1]
-            moneda_costo = producto[2]
+    # El movimiento y su detalle se convierten a USD con la misma tasa
+    tasa = TasaManager.tasa_vigente(conn)
 
-            # Actualizar stock
-            nueva_cantidad = stock_actual - unidades
-            cursor.execute("UPDATE Productos SET stock = ? WHERE codigo = ?", (nueva_cantidad, codigo))
+    # Registrar el movimiento de ingreso de efectivo (tipo='venta')
+    movimiento_id = MovimientoManager.registrar_movimiento(
+        conn, 'venta', monto_total, moneda, caja, user_id, descripcion_mov,
+        fecha=fecha_actual, tasa_usd_cup=tasa
+    )
 
-            # Calcular el Costo de Mercancía Vendida (CMV)
-            costo_total = unidades * costo_unitario
-            
-            # Usar formato estricto para el parser de /ganancia
-            descripcion_mov = (
-                f"VENTA: {unidades} x {codigo} | "
-                f"REVENUE: {monto_total:.2f} {moneda.upper()} | "
-                f"CMV: {costo_total:.2f} {moneda_costo.upper()} | " 
-                f"CAJA: {caja} | "
-                f"NOTA: {nota}"
-            )
+    # Detalle estructurado para /ganancia (las consignadas con el costo guardado al consignar)
+    VentaManager.registrar_detalle(
+        conn, movimiento_id, codigo, unidades, monto_total, moneda,
+        cmv=costo_total, moneda_cmv=moneda_costo, vendedor=vendedor, fecha=fecha_actual, tasa_usd_cup=tasa
+    )
 
-            mensaje_confirmacion = (
-                f"✅ <b>Venta Estándar Registrada!</b>\n\n"
-                f"<b>Producto:</b> {codigo} ({unidades} u.)\n"
-                f"<b>Caja de Ingreso:</b> {caja.upper()}\n"
-                f"<b>Ingreso Total:</b> {monto_total:.2f} {moneda.upper()}\n"
-                f"<b>CMV (Costo):</b> {costo_total:.2f} {moneda_costo.upper()}"
-            )
+    return mensaje_confirmacion
 
-        # Registrar el movimiento de ingreso de efectivo (tipo='venta')
-        cursor.execute(
-            "INSERT INTO Movimientos (fecha, tipo, monto, moneda, caja, user_id, descripcion) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (fecha_actual, 'venta', monto_total, moneda, caja, user_id, descripcion_mov)
-        )
+# --- FASE 11: FUNCIÓN PARA /ganancia (Reporte de Utilidad) - CORREGIDO ---
 
-        conn.commit()
-        await update.message.reply_html(mensaje_confirmacion)
+def _reporte_ganancia(
+    conn: sqlite3.Connection, desde: Optional[str] = None, hasta: Optional[str] = None, titulo: str = "Acumulada"
+) -> Respuesta:
+    """Ganancia bruta de las ventas del período (sin fechas: acumulada, la que se cachea)."""
+    # 1-3. Suma de las filas del resumen diario del período, ya en USD (moneda base)
+    totales = VentaManager.totales_ganancia(conn, desde, hasta)
 
-    except ValueError as e:
-        await update.message.reply_html(
-            f"<b>Error de formato o validación:</b> {e}\n"
-            "Uso correcto: <code>/venta [código] [unidades] [monto_total] [moneda] [caja] [vendedor/nota...]</code>"
-        )
-    except Exception as e:
-        logger.error(f"Error inesperado en /venta: {e}", exc_info=True)
-        await update.message.reply_text(f"Ocurrió un error inesperado al registrar la venta: {str(e)}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+    if totales is None:
+        return Respuesta("No se encontraron ventas registradas para calcular la ganancia.")
+
+    total_ingreso_usd = totales['ingreso_usd']
+    total_costo_usd = totales['cmv_usd']
+
+    # 4. Cálculo del Margen Bruto
+    margen_bruto_usd = total_ingreso_usd - total_costo_usd
+
+    # 5. Generar el reporte
+    tasa_actual = TasaManager.tasa_vigente(conn)
+    return Respuesta(
+        f"📈 <b>Reporte de Ganancia Bruta {titulo}</b>\n"
+        f"<i>(Cada venta convertida con la tasa de su fecha; actual: 1 USD = {tasa_actual} CUP)</i>\n\n"
+        f"🧾 <b>Ventas:</b> {totales['ventas']} ({totales['unidades']:,.0f} unidades)\n"
+        f"💰 <b>Ingresos Totales por Ventas:</b> {total_ingreso_usd:,.2f} USD\n"
+        f"🛒 <b>Costo Total de Ventas (CMV):</b> {total_costo_usd:,.2f} USD\n"
+        f"--- \n"
+        f"💵 <b>GANANCIA BRUTA:</b> <b><u>{margen_bruto_usd:,.2f} USD</u></b>"
+    )
+
+
+registrar_reporte("ganancia", ["ganancia"], _reporte_ganancia)
 
-# --- FASE 11: FUNCIÓN PARA /ganancia (Reporte de Utilidad) - CORREGIDO ---
 
 async def ganancia_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Calcula y muestra el margen de ganancia bruta de las ventas registradas 
-    desde el inicio de las operaciones.
+    Calcula y muestra el margen de ganancia bruta de las ventas registradas,
+    desde el inicio de las operaciones o en un período.
+    Uso: /ganancia | /ganancia mes | /ganancia [desde] [hasta]
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS: 
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
     try:
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-
-        # 1. Buscar todas las transacciones de VENTA (tipo='venta' es el tipo correcto)
-        cursor.execute("""
-            SELECT monto, moneda, descripcion 
-            FROM Movimientos
-            WHERE tipo = 'venta' 
-        """)
-        
-        ventas = cursor.fetchall()
-        conn.close()
-
-        if not ventas:
-            await update.message.reply_text("No se encontraron ventas registradas para calcular la ganancia.")
-            return
+        a = ARGS_GANANCIA.parsear(context.args)
+        hoy = datetime.date.today()
+
+        if a.mes:
+            desde, hasta = hoy.replace(day=1), hoy
+            titulo = f"del Mes ({desde:%m/%Y})"
+        elif a.desde:
+            desde, hasta = a.desde, a.hasta or hoy
+            titulo = f"del {desde:%d/%m/%Y} al {hasta:%d/%m/%Y}"
+        else:
+            # Acumulada: la misma que se envía a diario, desde ReportesCache si no hubo ventas ni cambio de tasa
+            desde = hasta = None
+            titulo = "Acumulada"
 
-        # 2. Inicializar acumuladores
-        # Usaremos USD como moneda base para el resumen, aplicando la tasa de conversión.
-        total_ingreso_usd = 0.0
-        total_costo_usd = 0.0
-        
-        # 3. Procesar cada venta
-        for monto_ingreso, moneda_ingreso, descripcion in ventas:
-            
-            # 3a. Convertir el Ingreso (Revenue) a USD (moneda base)
-            ingreso_usd = monto_ingreso
-            if moneda_ingreso in ('cup', 'cup-t'):
-                # Si es CUP, lo dividimos por la tasa para llevarlo a USD
-                ingreso_usd /= TASA_USD_CUP 
-                
-            total_ingreso_usd += ingreso_usd
-
-            # 3b. Extraer el Costo de la descripción (CMV)
-            # 🌟 CORRECCIÓN: Usar el nuevo formato estricto: | CMV: X.XX MONEDA_COSTO |
-            try:
-                # Las ventas consignadas no tienen CMV que afecte la ganancia bruta general, 
-                # ya que el costo (precio de consignación) se resta de la deuda POR COBRAR.
-                if 'VENTA_CONSIGNADA' in descripcion:
-                    continue 
-
-                # Buscamos la etiqueta "CMV:"
-                costo_start_tag = "CMV:"
-                costo_start_index = descripcion.find(costo_start_tag)
-                
-                if costo_start_index != -1:
-                    # Extraer la subcadena que contiene el valor y la moneda
-                    # Busca el siguiente delimitador '|'
-                    sub_string = descripcion[costo_start_index + len(costo_start_tag):].strip().split(' | ')[0]
-                    
-                    # Separar el valor del Costo y la moneda
-                    costo_parts = sub_string.split()
-                    costo_valor = float(costo_parts[0].replace(',', ''))
-                    costo_moneda = costo_parts[1].lower()
-                    
-                    # 3c. Convertir el Costo (CMV) a USD (moneda base)
-                    costo_usd = costo_valor
-                    if costo_moneda in ('cup', 'cup-t'):
-                        costo_usd /= TASA_USD_CUP
-                        
-                    total_costo_usd += costo_usd
-
-            except Exception as e:
-                # Esto maneja errores si el formato de la descripción es incorrecto
-                logger.error(f"Error al parsear CMV en descripción '{descripcion}': {e}")
-                
-        # 4. Cálculo del Margen Bruto
-        margen_bruto_usd = total_ingreso_usd - total_costo_usd
-        
-        # 5. Generar el reporte
-        await update.message.reply_html(
-            f"📈 <b>Reporte de Ganancia Bruta Acumulada</b>\n"
-            f"<i>(Calculado usando Tasa Fija: 1 USD = {TASA_USD_CUP} CUP)</i>\n\n"
-            f"💰 <b>Ingresos Totales por Ventas:</b> {total_ingreso_usd:,.2f} USD\n"
-            f"🛒 <b>Costo Total de Ventas (CMV):</b> {total_costo_usd:,.2f} USD\n"
-            f"--- \n"
-            f"💵 <b>GANANCIA BRUTA ACUMULADA:</b> <b><u>{margen_bruto_usd:,.2f} USD</u></b>"
-        )
-        logger.info(f"Reporte de ganancias generado por {user_id}")
+        if desde is None:
+            respuesta = await obtener_reporte("ganancia")
+        else:
+            # Un rango recorre GananciaDiaria: hilos de reportes
+            respuesta = await db_reportes.ejecutar(_reporte_ganancia, desde.isoformat(), hasta.isoformat(), titulo)
+        await respuesta.enviar(update.message)
+        logger.info(f"Reporte de ganancias ({titulo}) generado por {user_id}")
 
+    except ValueError as e:
+        await responder_error(update, ARGS_GANANCIA, e)
     except Exception as e:
         logger.error(f"Error inesperado en /ganancia: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al calcular la ganancia.")
+        await responder(update.message, "Ocurrió un error inesperado al calcular la ganancia.")
         
 # --- FASE 13: FUNCIÓN PARA /consignar ( Consignacion de INventario ) - CORREGIDO ---
 
@@ -468,105 +516,22 @@ async def consignar_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
-    conn = None
     try:
         logger.info("Iniciando proceso de consignación...")
-        if len(context.args) < 6:
-            raise ValueError("Faltan argumentos. Uso: /consignar [codigo] [cantidad] [vendedor] [precio_venta] [moneda] [nota...]")
-
-        codigo = context.args[0].upper()
-        cantidad_str = context.args[1]
-        vendedor = context.args[2].upper()
-        precio_str = context.args[3]
-        moneda = context.args[4].lower()
-        nota_consignacion = " ".join(context.args[5:])
-
-        cantidad = float(cantidad_str)
-        precio_venta = float(precio_str)
-
-        if cantidad <= 0 or precio_venta <= 0: raise ValueError("Cantidad y precio deben ser positivos.")
-        if moneda not in VALID_MONEDAS: raise ValueError(f"Moneda no válida: {moneda}")
-
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-        fecha_actual = datetime.datetime.now()
-
-        # 1. ⬇️ Descontar del Stock General (Productos)
-        logger.info(f"Verificando stock del producto {codigo}...")
-        cursor.execute("SELECT stock, costo_unitario, moneda_costo FROM Productos WHERE codigo = ?", (codigo,))
-        producto = cursor.fetchone()
-
-        if not producto or producto[0] < cantidad:
-            stock_actual = producto[0] if producto else 0
-            logger.error(f"Stock insuficiente para {codigo}. Stock actual: {stock_actual}, Solicitado: {cantidad}")
-            await update.message.reply_text(f"Error: Stock insuficiente para consignar. Solo quedan {stock_actual} unidades de {codigo}.")
-            return
-        
-        costo_unitario = producto[1]
-        moneda_costo = producto[2]
-        
-        nueva_cantidad = producto[0] - cantidad
-        logger.info(f"Actualizando stock del producto {codigo} de {producto[0]} a {nueva_cantidad}...")
-        cursor.execute("UPDATE Productos SET stock = ? WHERE codigo = ?", (nueva_cantidad, codigo))
+        codigo, cantidad, vendedor, precio_venta, moneda, nota_consignacion = ARGS_CONSIGNAR.parsear(context.args)
 
-        # 2. 📝 Insertar/Actualizar en la nueva tabla Consignaciones
-        logger.info(f"Registrando consignación para vendedor {vendedor}...")
-        # Primero verificamos si ya existe una consignación para este vendedor y producto
-        cursor.execute("""
-            SELECT stock FROM Consignaciones 
-            WHERE codigo = ? AND vendedor = ?
-        """, (codigo, vendedor))
-        
-        consignacion_existente = cursor.fetchone()
-        
-        if consignacion_existente:
-            # Si existe, actualizamos
-            nuevo_stock = consignacion_existente[0] + cantidad
-            cursor.execute("""
-                UPDATE Consignaciones 
-                SET stock = ?, fecha_consignacion = ?
-                WHERE codigo = ? AND vendedor = ?
-            """, (nuevo_stock, fecha_actual, codigo, vendedor))
-        else:
-            # Si no existe, insertamos
-            cursor.execute("""
-                INSERT INTO Consignaciones 
-                (codigo, vendedor, stock, precio_unitario, moneda, fecha_consignacion)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (codigo, vendedor, cantidad, precio_venta, moneda, fecha_actual))
-
-        # 3. 💸 Actualizar/Crear Deuda POR COBRAR (Deudas)
-        monto_total_deuda = cantidad * precio_venta
-        
-        # Verificar si ya existe una deuda para este vendedor
-        cursor.execute("""
-            SELECT monto_pendiente FROM Deudas 
-            WHERE actor_id = ? AND moneda = ? AND tipo = 'POR_COBRAR'
-        """, (vendedor, moneda))
-        
-        deuda_existente = cursor.fetchone()
-        
-        if deuda_existente:
-            nuevo_monto = deuda_existente[0] + monto_total_deuda
-            cursor.execute("""
-                UPDATE Deudas 
-                SET monto_pendiente = ?, fecha = ?
-                WHERE actor_id = ? AND moneda = ? AND tipo = 'POR_COBRAR'
-            """, (nuevo_monto, fecha_actual, vendedor, moneda))
-        else:
-            cursor.execute("""
-                INSERT INTO Deudas (actor_id, monto_pendiente, moneda, tipo, fecha)
-                VALUES (?, ?, ?, 'POR_COBRAR', ?)
-            """, (vendedor, monto_total_deuda, moneda, fecha_actual))
-
-        # 4. ELIMINADO: Registro del Movimiento. Ya no es necesario registrar un movimiento de caja.
-
-        conn.commit()
+        try:
+            monto_total_deuda = await db_executor.escribir(
+                [clave_producto(codigo)], _consignar_db, codigo, cantidad, vendedor, precio_venta, moneda
+            )
+        except StockInsuficienteError as e:
+            await responder(update.message, f"Error: Stock insuficiente para consignar. Solo quedan {e.disponible} unidades de {codigo}.")
+            return
 
-        await update.message.reply_html(
+        await responder_html(update.message,
             f"✅ <b>Consignación Registrada!</b>\n\n"
             f"<b>Vendedor:</b> {vendedor}\n"
             f"<b>Producto:</b> {codigo} ({cantidad} u.)\n"
@@ -574,22 +539,87 @@ async def consignar_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
     except ValueError as e:
-        # ... (manejo de errores) ...
-        await update.message.reply_html(
-            f"<b>Error de formato o validación:</b> {e}\n"
-            "Uso correcto: <code>/consignar [codigo] [cantidad] [vendedor] [precio_venta] [moneda] [nota...]</code>"
-        )
+        await responder_error(update, ARGS_CONSIGNAR, e)
     except Exception as e:
         logger.error(f"Error inesperado en /consignar: {str(e)}")
         logger.error(f"Detalles completos del error:", exc_info=True)
-        await update.message.reply_text(f"Error al registrar la consignación: {str(e)}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+        await responder(update.message, f"Error al registrar la consignación: {str(e)}")
+
+
+def _consignar_db(
+    conn: sqlite3.Connection, codigo: str, cantidad: float, vendedor: str,
+    precio_venta: float, moneda: str
+) -> float:
+    """Parte de BD de /consignar. Retorna el monto de deuda POR COBRAR generado."""
+    cursor = conn.cursor()
+    fecha_actual = datetime.datetime.now()
+
+    # 1. ⬇️ Descontar del Stock General (Productos)
+    logger.info(f"Verificando stock del producto {codigo}...")
+    try:
+        producto = InventarioManager.descontar_stock(conn, codigo, cantidad)
+    except StockInsuficienteError as e:
+        logger.error(f"Stock insuficiente para {codigo}. Stock actual: {e.disponible}, Solicitado: {cantidad}")
+        raise
+    if not producto:
+        logger.error(f"Stock insuficiente para {codigo}. Stock actual: 0, Solicitado: {cantidad}")
+        raise StockInsuficienteError(codigo, 0, cantidad)
+
+    logger.info(f"Stock del producto {codigo} actualizado a {producto['stock']}...")
+
+    # Costo de lo consignado: el de los lotes consumidos (FIFO), que será el CMV al liquidarse
+    costo = {'cantidad_restante': cantidad, 'costo_unitario': producto['cmv'] / cantidad,
+             'moneda_costo': producto['moneda_cmv'], 'tasa_usd_cup': None}
+
+    # 2. 📝 Insertar/Actualizar en la nueva tabla Consignaciones
+    logger.info(f"Registrando consignación para vendedor {vendedor}...")
+    # Primero verificamos si ya existe una consignación para este vendedor y producto
+    cursor.execute("""
+        SELECT stock, costo_unitario, moneda_costo FROM Consignaciones 
+        WHERE codigo = ? AND vendedor = ?
+    """, (codigo, vendedor))
+    
+    consignacion_existente = cursor.fetchone()
+    
+    if consignacion_existente:
+        # Si existe, actualizamos (el costo pasa a ser el promedio de lo que tiene el vendedor)
+        nuevo_stock = consignacion_existente[0] + cantidad
+        costo_unitario, moneda_costo = InventarioManager.costo_promedio([
+            {'cantidad_restante': consignacion_existente[0], 'costo_unitario': consignacion_existente[1],
+             'moneda_costo': consignacion_existente[2], 'tasa_usd_cup': None},
+            costo,
+        ], TasaManager.tasa_vigente(conn))
+        cursor.execute("""
+            UPDATE Consignaciones 
+            SET stock = ?, fecha_consignacion = ?, costo_unitario = ?, moneda_costo = ?
+            WHERE codigo = ? AND vendedor = ?
+        """, (nuevo_stock, fecha_actual, costo_unitario, moneda_costo, codigo, vendedor))
+    else:
+        # Si no existe, insertamos
+        cursor.execute("""
+            INSERT INTO Consignaciones 
+            (codigo, vendedor, stock, precio_unitario, moneda, fecha_consignacion, costo_unitario, moneda_costo)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (codigo, vendedor, cantidad, precio_venta, moneda, fecha_actual,
+              costo['costo_unitario'], costo['moneda_costo']))
+
+    # 3. 💸 Actualizar/Crear Deuda POR COBRAR (Deudas)
+    monto_total_deuda = cantidad * precio_venta
+    
+    DeudaManager.aumentar(
+        conn, vendedor, 'POR_COBRAR', moneda, monto_total_deuda,
+        f"Consignación {cantidad:g} x {codigo} a {precio_venta:.2f}", fecha_actual
+    )
+
+    # 4. ELIMINADO: Registro del Movimiento. Ya no es necesario registrar un movimiento de caja.
+    return monto_total_deuda
 
 # --- FASE 14: FUNCIÓN PARA /stock_consignado ( Stock vendedor ) ---
+def _linea_consignada(codigo: str, unidades: int) -> str:
+    # Sin memorizar: formatearla cuesta menos que buscarla en la caché
+    return f"  • <b>{html.escape(codigo)}</b>: {unidades} unidades"
+
+
 async def stock_consignado_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Muestra el stock pendiente por vendedor consultando la tabla Consignaciones (RF6).
@@ -597,50 +627,40 @@ async def stock_consignado_command(update: Update, context: ContextTypes.DEFAULT
     """
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text("⛔ No tienes permiso.")
+        await responder(update.message, "⛔ No tienes permiso.")
         return
 
-    if not context.args:
-        await update.message.reply_html(
-            "<b>Error:</b> Debes especificar el nombre del vendedor.\n"
-            "Uso: <code>/stock_consignado [vendedor]</code>"
-        )
+    try:
+        vendedor = ARGS_STOCK_CONSIGNADO.parsear(context.args).vendedor
+    except ValueError as e:
+        await responder_error(update, ARGS_STOCK_CONSIGNADO, e)
         return
-        
-    vendedor = context.args[0].upper()
-    conn = None
     
     try:
-        conn = sqlite3.connect("contabilidad.db")
-        cursor = conn.cursor()
-        
         # 1. CONSULTAR DIRECTAMENTE LA TABLA CONSIGNACIONES
-        cursor.execute("""
+        stock_items = await db_executor.consultar("""
             SELECT codigo, stock
             FROM Consignaciones
             WHERE vendedor = ? AND stock > 0
         """, (vendedor,))
         
-        stock_items = cursor.fetchall()
-        
         # 2. Construir el reporte final
-        reporte = f"📦 <b>STOCK CONSIGNADO PENDIENTE: {vendedor}</b> 📦\n\n"
+        reporte = Respuesta(f"📦 <b>STOCK CONSIGNADO PENDIENTE: {html.escape(vendedor)}</b> 📦\n")
         stock_total_pendiente = 0
-        
-        if stock_items:
-            for codigo, stock_cantidad in stock_items:
-                reporte += f"  • <b>{codigo}</b>: {int(stock_cantidad)} unidades\n"
-                stock_total_pendiente += stock_cantidad
-        
+
+        for codigo, stock_cantidad in stock_items:
+            reporte.append(_linea_consignada(codigo, int(stock_cantidad)))
+            stock_total_pendiente += stock_cantidad
+
         if stock_total_pendiente == 0:
-            reporte += "  <i>El vendedor no tiene stock pendiente de liquidar.</i>"
+            reporte.append("  <i>El vendedor no tiene stock pendiente de liquidar.</i>")
 
-        await update.message.reply_html(reporte)
+        await reporte.enviar(update.message)
         logger.info(f"Reporte de stock consignado para {vendedor} generado por {user_id}")
 
     except Exception as e:
         logger.error(f"Error inesperado en /stock_consignado: {e}")
-        await update.message.reply_text("Ocurrió un error inesperado al generar el reporte de consignación.")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        await responder(update.message, "Ocurrió un error inesperado al generar el reporte de consignación.")
+
+
+iniciar_reconciliacion()
@@ -0,0 +1,285 @@
+"""
+Instrumentación de los comandos: tiempo total, tiempo en BD, sentencias SQL,
+filas leídas y tamaño de la respuesta de cada comando, acumulados en
+histogramas en memoria. Se consultan con /metrics (admins) y, si
+METRICAS_PUERTO está definido, en formato texto de Prometheus.
+
+La medición del comando en curso viaja en un ContextVar: get_db_connection la
+usa para contar sentencias y filas (DBExecutor copia el contexto al hilo de BD)
+y RequestMedido suma los bytes que se envían a Telegram.
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Optional, Dict, List, Sequence, Callable, Any
+
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.request import HTTPXRequest
+
+from config_secret import ADMIN_USER_IDS
+from config_vars import METRICAS_LENTO_MS
+from handlers.argumentos import Comando, literal, responder_error
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (inclusive) de las cubetas de cada histograma
+CUBETAS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+CUBETAS_SQL = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+CUBETAS_FILAS = (0, 1, 10, 100, 1000, 10000, 100000)
+CUBETAS_BYTES = (100, 500, 1000, 2000, 4096, 10000, 100000)
+
+
+class Medicion:
+    """Contadores de un comando en curso (se suman desde el event loop y desde los hilos de BD)."""
+
+    __slots__ = ("bd_ms", "sql", "filas", "bytes_respuesta", "_lock")
+
+    def __init__(self):
+        self.bd_ms = 0.0
+        self.sql = 0
+        self.filas = 0
+        self.bytes_respuesta = 0
+        self._lock = threading.Lock()
+
+    def sumar_bd(self, ms: float, sql: int, filas: int) -> None:
+        with self._lock:
+            self.bd_ms += ms
+            self.sql += sql
+            self.filas += filas
+
+
+_medicion_actual: contextvars.ContextVar[Optional[Medicion]] = contextvars.ContextVar("medicion", default=None)
+
+
+def medicion_actual() -> Optional[Medicion]:
+    """Medición del comando que se está atendiendo (None fuera de un comando instrumentado)."""
+    return _medicion_actual.get()
+
+
+class Histograma:
+    """Histograma de cubetas fijas, acumulable como los de Prometheus."""
+
+    def __init__(self, limites: Sequence[float]):
+        self.limites = tuple(limites)
+        self.cubetas = [0] * (len(self.limites) + 1)  # la última es +Inf
+        self.total = 0
+        self.suma = 0.0
+        self.minimo = 0.0
+        self.maximo = 0.0
+
+    def observar(self, valor: float) -> None:
+        self.cubetas[bisect_left(self.limites, valor)] += 1
+        self.total += 1
+        self.suma += valor
+        self.minimo = valor if self.total == 1 else min(self.minimo, valor)
+        self.maximo = max(self.maximo, valor)
+
+    def promedio(self) -> float:
+        return self.suma / self.total if self.total else 0.0
+
+    def percentil(self, p: float) -> float:
+        """Estimación del percentil p (0-1) interpolando dentro de la cubeta, como histogram_quantile."""
+        if not self.total:
+            return 0.0
+        rango = p * self.total
+        acumulado = 0
+        for i, n in enumerate(self.cubetas):
+            if n and acumulado + n >= rango:
+                if i == len(self.limites):
+                    return self.maximo
+                inferior = max(self.limites[i - 1] if i else 0.0, self.minimo)
+                superior = min(self.limites[i], self.maximo)
+                return inferior + (superior - inferior) * (rango - acumulado) / n
+            acumulado += n
+        return self.maximo
+
+
+class MetricasComando:
+    """Histogramas de un comando."""
+
+    def __init__(self):
+        self.tiempo_ms = Histograma(CUBETAS_MS)
+        self.bd_ms = Histograma(CUBETAS_MS)
+        self.sql = Histograma(CUBETAS_SQL)
+        self.filas = Histograma(CUBETAS_FILAS)
+        self.bytes_respuesta = Histograma(CUBETAS_BYTES)
+        self.errores = 0
+
+
+# Serie de Prometheus, atributo de MetricasComando, ayuda y divisor (ms -> s)
+_SERIES_PROMETHEUS = (
+    ("contabot_comando_segundos", "tiempo_ms", "Tiempo total del comando", 1000),
+    ("contabot_comando_bd_segundos", "bd_ms", "Tiempo del comando dentro de la BD", 1000),
+    ("contabot_comando_sql", "sql", "Sentencias SQL ejecutadas por el comando", 1),
+    ("contabot_comando_filas", "filas", "Filas leídas de la BD por el comando", 1),
+    ("contabot_comando_respuesta_bytes", "bytes_respuesta", "Bytes enviados a Telegram por el comando", 1),
+)
+
+
+class Metricas:
+    """Registro en memoria de las métricas por comando (se actualiza solo desde el event loop)."""
+
+    def __init__(self):
+        self._comandos: Dict[str, MetricasComando] = {}
+        self.desde = time.time()
+
+    def registrar(self, comando: str, medicion: Medicion, tiempo_ms: float, error: bool = False) -> None:
+        m = self._comandos.get(comando)
+        if m is None:
+            m = self._comandos[comando] = MetricasComando()
+        m.tiempo_ms.observar(tiempo_ms)
+        m.bd_ms.observar(medicion.bd_ms)
+        m.sql.observar(medicion.sql)
+        m.filas.observar(medicion.filas)
+        m.bytes_respuesta.observar(medicion.bytes_respuesta)
+        if error:
+            m.errores += 1
+
+    def comandos(self) -> Dict[str, MetricasComando]:
+        return dict(self._comandos)
+
+    def reiniciar(self) -> None:
+        self._comandos.clear()
+        self.desde = time.time()
+
+    def prometheus(self) -> str:
+        """Exporta los histogramas en el formato de texto de Prometheus (tiempos en segundos)."""
+        lineas: List[str] = []
+        comandos = sorted(self._comandos.items())
+        for serie, atributo, ayuda, divisor in _SERIES_PROMETHEUS:
+            lineas.append(f"# HELP {serie} {ayuda}")
+            lineas.append(f"# TYPE {serie} histogram")
+            for comando, m in comandos:
+                h: Histograma = getattr(m, atributo)
+                acumulado = 0
+                for limite, n in zip(h.limites, h.cubetas):
+                    acumulado += n
+                    lineas.append(f'{serie}_bucket{{comando="{comando}",le="{limite / divisor:g}"}} {acumulado}')
+                lineas.append(f'{serie}_bucket{{comando="{comando}",le="+Inf"}} {h.total}')
+                lineas.append(f'{serie}_sum{{comando="{comando}"}} {h.suma / divisor:g}')
+                lineas.append(f'{serie}_count{{comando="{comando}"}} {h.total}')
+        lineas.append("# HELP contabot_comando_errores_total Comandos que terminaron con una excepción")
+        lineas.append("# TYPE contabot_comando_errores_total counter")
+        for comando, m in comandos:
+            lineas.append(f'contabot_comando_errores_total{{comando="{comando}"}} {m.errores}')
+        return "\n".join(lineas) + "\n"
+
+
+# Registro compartido por todos los comandos
+metricas = Metricas()
+
+
+def instrumentar(comando: str, callback: Callable[..., Any]) -> Callable[..., Any]:
+    """Envuelve el callback de un handler para medirlo bajo el nombre `comando`."""
+
+    @functools.wraps(callback)
+    async def _medido(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        medicion = Medicion()
+        token = _medicion_actual.set(medicion)
+        inicio = time.perf_counter()
+        error = False
+        try:
+            return await callback(update, context)
+        except Exception:
+            error = True
+            raise
+        finally:
+            _medicion_actual.reset(token)
+            tiempo_ms = (time.perf_counter() - inicio) * 1000
+            metricas.registrar(comando, medicion, tiempo_ms, error)
+            if tiempo_ms >= METRICAS_LENTO_MS:
+                logger.warning(
+                    f"/{comando} lento: {tiempo_ms:.0f} ms (BD {medicion.bd_ms:.0f} ms, "
+                    f"{medicion.sql} SQL, {medicion.filas} filas, {medicion.bytes_respuesta} B)"
+                )
+
+    return _medido
+
+
+class RequestMedido(HTTPXRequest):
+    """HTTPXRequest que suma a la medición en curso los bytes enviados a la Bot API."""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        medicion = _medicion_actual.get()
+        if medicion is not None and request_data is not None:
+            enviados = len(request_data.json_payload)
+            if request_data.contains_files:
+                enviados += sum(
+                    len(valor[1]) for valor in request_data.multipart_data.values()
+                    if isinstance(valor, tuple) and isinstance(valor[1], (bytes, bytearray))
+                )
+            medicion.bytes_respuesta += enviados
+        return await super().do_request(url, method, request_data, *args, **kwargs)
+
+
+async def iniciar_servidor_metricas(host: str, puerto: int):
+    """Levanta GET /metrics en formato Prometheus (puerto propio, no expuesto como el webhook)."""
+    # Import diferido: aiohttp solo hace falta si se exporta a Prometheus
+    from aiohttp import web
+
+    async def _metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metricas.prometheus(), content_type="text/plain", charset="utf-8")
+
+    app_web = web.Application()
+    app_web.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app_web)
+    await runner.setup()
+    await web.TCPSite(runner, host, puerto).start()
+    logger.info(f"Métricas Prometheus en http://{host}:{puerto}/metrics")
+    return runner
+
+
+def _formatear_resumen(comandos: Dict[str, MetricasComando]) -> str:
+    filas = sorted(comandos.items(), key=lambda item: item[1].tiempo_ms.suma, reverse=True)
+    lineas = [f"{'comando':<17}{'n':>5}{'p50':>7}{'p95':>7}{'máx':>7}{'BD':>6}{'SQL':>5}{'filas':>7}{'B':>6}"]
+    for comando, m in filas:
+        lineas.append(
+            f"{comando[:16]:<17}{m.tiempo_ms.total:>5}"
+            f"{m.tiempo_ms.percentil(0.5):>7.0f}{m.tiempo_ms.percentil(0.95):>7.0f}{m.tiempo_ms.maximo:>7.0f}"
+            f"{m.bd_ms.promedio():>6.0f}{m.sql.promedio():>5.0f}{m.filas.promedio():>7.0f}"
+            f"{m.bytes_respuesta.promedio():>6.0f}"
+            + (f" ⚠️{m.errores}" if m.errores else "")
+        )
+    return "\n".join(lineas)
+
+
+ARGS_METRICS = Comando("metrics", [literal("reiniciar", "reiniciar", opcional=True)])
+
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Muestra las métricas de los comandos desde el arranque (o el último reinicio).
+    Uso: /metrics [reiniciar]
+    """
+    from handlers.envios import responder, responder_html  # envios importa este módulo
+
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await responder(update.message, "⛔ No tienes permiso.")
+        return
+
+    try:
+        reiniciar = ARGS_METRICS.parsear(context.args).reiniciar is not None
+    except ValueError as e:
+        await responder_error(update, ARGS_METRICS, e)
+        return
+
+    if reiniciar:
+        metricas.reiniciar()
+        await responder(update.message, "🔄 Métricas reiniciadas.")
+        return
+
+    comandos = metricas.comandos()
+    if not comandos:
+        await responder(update.message, "📊 Todavía no hay comandos medidos.")
+        return
+
+    minutos = (time.time() - metricas.desde) / 60
+    await responder_html(update.message,
+        f"📊 <b>Métricas por comando</b> (últimos {minutos:.0f} min)\n"
+        "<i>tiempos en ms; BD, SQL, filas y bytes de respuesta son promedios</i>\n\n"
+        f"<pre>{_formatear_resumen(comandos)}</pre>"
+    )
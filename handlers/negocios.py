@@ -0,0 +1,87 @@
+"""
+Varios negocios en un mismo bot, cada uno con su propia BD.
+
+NEGOCIOS (config_vars) asigna chats o usuarios a un negocio; cada negocio
+guarda su contabilidad en NEGOCIOS_DIR/<nombre>.db, con el mismo esquema que
+la BD principal (DB_PATH), que sigue siendo la de quien no tenga negocio
+asignado. con_negocio() marca el negocio del update en curso y
+get_db_connection (db_utils) toma la conexión del pool de esa BD, así los
+handlers y managers no cambian.
+
+El negocio se busca primero por chat (un grupo del negocio) y después por
+usuario (sus chats privados).
+"""
+import contextlib
+import contextvars
+import functools
+import os
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config_secret import ADMIN_USER_IDS
+from config_vars import NEGOCIOS, NEGOCIOS_DIR
+
+# Nombres válidos: se usan como nombre de archivo
+_NOMBRE_VALIDO = re.compile(r"^\w[\w.-]*$")
+
+_negocio_en_curso: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "negocio_en_curso", default=None
+)
+
+
+def negocio_actual() -> Optional[str]:
+    """Negocio del update en curso (None = BD principal)."""
+    return _negocio_en_curso.get()
+
+
+def ruta_negocio(nombre: str) -> str:
+    """Ruta de la BD de un negocio."""
+    if not _NOMBRE_VALIDO.match(nombre):
+        raise ValueError(f"Nombre de negocio inválido: {nombre!r}")
+    return os.path.join(NEGOCIOS_DIR, f"{nombre}.db")
+
+
+def negocio_de(update: Update) -> Optional[str]:
+    """Negocio al que pertenece el update, por chat y si no por usuario."""
+    for entidad in (update.effective_chat, update.effective_user):
+        if entidad is not None and entidad.id in NEGOCIOS:
+            return NEGOCIOS[entidad.id]
+    return None
+
+
+@contextlib.contextmanager
+def en_negocio(nombre: Optional[str]) -> Iterator[None]:
+    """Ejecuta el bloque sobre la BD del negocio (None = BD principal), fuera de un update."""
+    token = _negocio_en_curso.set(nombre)
+    try:
+        yield
+    finally:
+        _negocio_en_curso.reset(token)
+
+
+def con_negocio(callback: Callable[..., Any]) -> Callable[..., Any]:
+    """Envuelve un handler para que trabaje sobre la BD del negocio del update."""
+
+    @functools.wraps(callback)
+    async def _con_negocio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        with en_negocio(negocio_de(update)):
+            return await callback(update, context)
+
+    return _con_negocio
+
+
+def destinatarios() -> Dict[Optional[str], List[int]]:
+    """
+    Chats que reciben los reportes programados de cada BD: los asignados a cada
+    negocio y, para la principal (None), los admins sin negocio.
+    """
+    por_negocio: Dict[Optional[str], List[int]] = {}
+    sin_negocio = [admin_id for admin_id in ADMIN_USER_IDS if admin_id not in NEGOCIOS]
+    if sin_negocio:
+        por_negocio[None] = sin_negocio
+    for chat_id, nombre in NEGOCIOS.items():
+        por_negocio.setdefault(nombre, []).append(chat_id)
+    return por_negocio
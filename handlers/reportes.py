@@ -0,0 +1,106 @@
+"""
+Reportes cacheados y programados.
+
+/balance, /deudas, /stock y /ganancia (sin argumentos) registran aquí la función
+que genera su respuesta a partir de una conexión. obtener_reporte() la sirve
+desde ReportesCache si ninguna tabla de la que sale cambió desde que se generó
+(un solo SELECT) y si no, la genera y la guarda; todo en un solo paso por el
+pool de BD, así un reporte no hace cola varias veces detrás de las escrituras.
+
+Con JobQueue (python-telegram-bot[job-queue]) los reportes de
+REPORTES_PROGRAMADOS se generan a las REPORTES_HORAS y se envían a cada admin
+(con varios negocios, los de cada uno a sus chats); la misma generación deja
+el caché listo para los comandos de la mañana.
+"""
+import datetime
+import importlib
+import logging
+import sqlite3
+from typing import Callable, Dict, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+from telegram.ext import Application, ContextTypes
+
+from config_vars import REPORTES_PROGRAMADOS, REPORTES_HORAS, REPORTES_ZONA_HORARIA
+from .db_utils import ReportesManager, db_executor
+from .negocios import destinatarios, en_negocio
+from .respuestas import Respuesta
+
+logger = logging.getLogger(__name__)
+
+# nombre -> (dominios de VersionesDatos, función que genera la respuesta)
+_REPORTES: Dict[str, Tuple[Tuple[str, ...], Callable[[sqlite3.Connection], Respuesta]]] = {}
+# Módulos que registran sus reportes al importarse (bot.py los importa con el primer comando)
+_MODULOS_REPORTES = ("handlers.contabilidad", "handlers.inventario")
+
+
+def registrar_reporte(
+    nombre: str, dominios: Sequence[str], generar: Callable[[sqlite3.Connection], Respuesta]
+) -> None:
+    """Declara un reporte cacheable y los dominios (ReportesManager.DOMINIOS) de los que depende."""
+    desconocidos = set(dominios) - set(ReportesManager.DOMINIOS)
+    if desconocidos:
+        raise ValueError(f"Reporte {nombre}: dominios desconocidos {sorted(desconocidos)}")
+    _REPORTES[nombre] = (tuple(dominios), generar)
+
+
+def _obtener(conn: sqlite3.Connection, nombre: str) -> Respuesta:
+    dominios, generar = _REPORTES[nombre]
+    version, fragmentos = ReportesManager.leer(conn, nombre, dominios)
+    if fragmentos is not None:
+        return Respuesta(*fragmentos)
+
+    respuesta = generar(conn)
+    # Sin locks ni BEGIN IMMEDIATE: guardar el caché no hace esperar al comando detrás de las escrituras
+    if not ReportesManager.guardar(conn, nombre, version, respuesta.fragmentos):
+        logger.debug(f"Reporte {nombre}: BD ocupada, no se guardó en caché")
+    return respuesta
+
+
+async def obtener_reporte(nombre: str) -> Respuesta:
+    """La respuesta del reporte: la guardada si sus datos no cambiaron, o una nueva (que se guarda)."""
+    if nombre not in _REPORTES:
+        for modulo in _MODULOS_REPORTES:
+            importlib.import_module(modulo)
+    return await db_executor.ejecutar(_obtener, nombre)
+
+
+async def enviar_reportes_programados(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Job diario: genera (o toma del caché) cada reporte programado de cada BD y
+    lo envía a sus destinatarios (los admins, o los chats de cada negocio).
+    """
+    for negocio, chats in destinatarios().items():
+        with en_negocio(negocio):
+            for nombre in REPORTES_PROGRAMADOS:
+                try:
+                    respuesta = await obtener_reporte(nombre)
+                except Exception as e:
+                    logger.error(f"Error generando el reporte programado {nombre} ({negocio or 'principal'}): {e}")
+                    continue
+                for chat_id in chats:
+                    try:
+                        await respuesta.enviar_a(context.bot, chat_id)
+                    except Exception as e:
+                        logger.error(f"Error enviando el reporte {nombre} a {chat_id}: {e}")
+    logger.info(f"Reportes programados enviados: {', '.join(REPORTES_PROGRAMADOS)}")
+
+
+def programar_reportes(application: Application) -> int:
+    """Agenda los envíos diarios en la JobQueue de la aplicación. Retorna cuántos se agendaron."""
+    if not REPORTES_HORAS or not REPORTES_PROGRAMADOS:
+        return 0
+    if application.job_queue is None:
+        logger.warning(
+            "Reportes programados desactivados: falta la JobQueue (pip install \"python-telegram-bot[job-queue]\")."
+        )
+        return 0
+
+    zona = ZoneInfo(REPORTES_ZONA_HORARIA)
+    for hora in REPORTES_HORAS:
+        horas, minutos = (int(parte) for parte in hora.split(":"))
+        application.job_queue.run_daily(
+            enviar_reportes_programados, time=datetime.time(horas, minutos, tzinfo=zona), name=f"reportes {hora}"
+        )
+    logger.info(f"Reportes programados a las {', '.join(REPORTES_HORAS)} ({REPORTES_ZONA_HORARIA}).")
+    return len(REPORTES_HORAS)
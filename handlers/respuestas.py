@@ -0,0 +1,153 @@
+"""
+Armado y envío de las respuestas HTML largas (reportes).
+
+Un reporte se arma como una lista de fragmentos (una línea o un bloque
+autocontenido: cada etiqueta que abre, cierra dentro del mismo fragmento) y se
+une una sola vez con join, en vez de concatenar con += en un bucle. Al
+enviarlo se parte en mensajes de hasta 4096 caracteres cortando solo entre
+fragmentos, así ninguna etiqueta ni entidad HTML queda partida.
+
+Los fragmentos de una fila (un producto, una deuda, un movimiento) se
+memorizan con @fragmento: la clave son los valores de la fila, de modo que una
+fila que no cambió desde el último reporte no se vuelve a formatear y una que
+cambió genera una clave nueva.
+
+    r = Respuesta("📋 <b>Inventario</b>\n")
+    r.extend(_linea_producto(codigo, nombre, stock) for ...)
+    await r.enviar(update.message)
+"""
+import functools
+import re
+from typing import Callable, Iterable, List, Optional, TypeVar
+
+from telegram import Bot, Message
+from telegram.constants import MessageLimit, ParseMode
+
+from config_vars import RESPUESTAS_CACHE_FRAGMENTOS
+from handlers.envios import enviar_mensaje, responder_html
+
+LIMITE_MENSAJE = MessageLimit.MAX_TEXT_LENGTH
+
+# Posiciones donde no se puede cortar una línea: dentro de una etiqueta o de una entidad
+_ETIQUETA_O_ENTIDAD = re.compile(r"<[^>]*>|&[#\w]+;")
+_ETIQUETA = re.compile(r"<(/?)(\w+)[^>]*>")
+# Margen para cerrar y reabrir etiquetas al partir una línea
+_MARGEN_ETIQUETAS = 64
+
+F = TypeVar("F", bound=Callable[..., str])
+
+
+def fragmento(func: F) -> F:
+    """Memoriza el fragmento HTML de una fila por sus valores (deben ser hashables)."""
+    return functools.lru_cache(maxsize=RESPUESTAS_CACHE_FRAGMENTOS)(func)
+
+
+def _etiquetas_abiertas(texto: str) -> List[re.Match]:
+    """Etiquetas que quedan abiertas al final del texto, de la más externa a la más interna."""
+    abiertas: List[re.Match] = []
+    for m in _ETIQUETA.finditer(texto):
+        if not m.group(1):
+            abiertas.append(m)
+        elif abiertas and abiertas[-1].group(2) == m.group(2):
+            abiertas.pop()
+    return abiertas
+
+
+def _cortar_linea(linea: str, limite: int) -> List[str]:
+    """
+    Parte una línea más larga que el límite (caso raro) sin cortar etiquetas ni
+    entidades; las etiquetas abiertas se cierran al final de un trozo y se
+    reabren al principio del siguiente.
+    """
+    trozos = []
+    util = max(limite - _MARGEN_ETIQUETAS, 1)
+    while len(linea) > limite:
+        corte = util
+        for m in _ETIQUETA_O_ENTIDAD.finditer(linea):
+            if m.start() >= util:
+                break
+            if util < m.end():
+                corte = m.start()
+                break
+        espacio = linea.rfind(" ", 0, corte)
+        if espacio > corte // 2:
+            corte = espacio
+        if corte <= 0:  # Una sola etiqueta más larga que el límite: no hay corte limpio
+            corte = util
+        trozo, resto = linea[:corte], linea[corte:].lstrip(" ")
+        abiertas = _etiquetas_abiertas(trozo)
+        trozos.append(trozo + "".join(f"</{m.group(2)}>" for m in reversed(abiertas)))
+        linea = "".join(m.group(0) for m in abiertas) + resto
+    trozos.append(linea)
+    return trozos
+
+
+def partir(fragmentos: Iterable[str], separador: str = "\n", limite: int = LIMITE_MENSAJE) -> List[str]:
+    """
+    Une los fragmentos con el separador en mensajes de hasta `limite` caracteres,
+    cortando entre fragmentos (un fragmento que no cabe solo se parte por líneas).
+    """
+    mensajes: List[str] = []
+    actual: List[str] = []
+    largo = 0
+    for frag in fragmentos:
+        piezas = [frag] if len(frag) <= limite else [
+            trozo for linea in frag.split("\n") for trozo in _cortar_linea(linea, limite)
+        ]
+        for pieza in piezas:
+            extra = len(pieza) + (len(separador) if actual else 0)
+            if actual and largo + extra > limite:
+                mensajes.append(separador.join(actual))
+                actual, largo = [], 0
+                extra = len(pieza)
+            if not actual and not pieza.strip():
+                continue  # Un mensaje no puede empezar (ni ser solo) espacio en blanco
+            actual.append(pieza)
+            largo += extra
+    if actual:
+        mensajes.append(separador.join(actual))
+    return mensajes
+
+
+class Respuesta:
+    """Reporte HTML en construcción: fragmentos que se unen y parten al enviar."""
+
+    __slots__ = ("fragmentos", "separador")
+
+    def __init__(self, *fragmentos: str, separador: str = "\n"):
+        self.fragmentos: List[str] = list(fragmentos)
+        self.separador = separador
+
+    def append(self, fragmento: str) -> None:
+        self.fragmentos.append(fragmento)
+
+    def extend(self, fragmentos: Iterable[str]) -> None:
+        self.fragmentos.extend(fragmentos)
+
+    def __bool__(self) -> bool:
+        return bool(self.fragmentos)
+
+    def texto(self) -> str:
+        """El reporte completo en un solo string (para editar un mensaje que ya cabe)."""
+        return self.separador.join(self.fragmentos)
+
+    def mensajes(self, limite: int = LIMITE_MENSAJE) -> List[str]:
+        return partir(self.fragmentos, self.separador, limite)
+
+    async def enviar(self, mensaje: Message, reply_markup: Optional[object] = None) -> int:
+        """
+        Responde con uno o más mensajes HTML; el teclado (si hay) va en el último.
+        Retorna cuántos mensajes se enviaron.
+        """
+        partes = self.mensajes()
+        for i, parte in enumerate(partes):
+            ultimo = i == len(partes) - 1
+            await responder_html(mensaje, parte, reply_markup=reply_markup if ultimo else None)
+        return len(partes)
+
+    async def enviar_a(self, bot: Bot, chat_id: int) -> int:
+        """Como enviar(), pero sin un mensaje al que responder (reportes programados)."""
+        partes = self.mensajes()
+        for parte in partes:
+            await enviar_mensaje(bot, chat_id, parte, parse_mode=ParseMode.HTML)
+        return len(partes)
@@ -0,0 +1,137 @@
+"""
+Modo webhook: un servidor aiohttp embebido recibe los updates de Telegram por
+HTTP y los encola en la Application (la misma cola que llena el polling).
+
+Telegram llama a WEBHOOK_URL_PUBLICA + WEBHOOK_RUTA; detrás de un proxy con
+TLS basta con que éste reenvíe a WEBHOOK_HOST:WEBHOOK_PUERTO. Con
+WEBHOOK_URL_PUBLICA vacía no se registra el webhook en Telegram: sirve para
+probar localmente enviando updates grabados con POST (ver benchmarks/modos_servicio.py).
+
+Cada POST debe traer el secreto en CABECERA_SECRETO: sin él cualquiera que
+conozca la URL podría inyectar comandos. Si no se configuró uno, al registrar
+el webhook se genera uno para esa ejecución; sin URL pública no se arranca.
+"""
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config_vars import (
+    WEBHOOK_HOST, WEBHOOK_PUERTO, WEBHOOK_RUTA, WEBHOOK_URL_PUBLICA, WEBHOOK_MAX_CONEXIONES
+)
+
+logger = logging.getLogger(__name__)
+
+# Cabecera con la que Telegram envía el secret_token registrado en setWebhook
+CABECERA_SECRETO = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def crear_app_web(application: Application, ruta: str = WEBHOOK_RUTA, secreto: Optional[str] = None) -> web.Application:
+    """
+    App aiohttp con el endpoint del webhook y un /salud para monitoreo.
+    Lanza ValueError si no hay secreto: el endpoint nunca queda abierto.
+    """
+    if not secreto:
+        raise ValueError("El webhook necesita un secreto (WEBHOOK_SECRET en config_secret.py).")
+    esperado = secreto.encode()
+
+    async def recibir_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(CABECERA_SECRETO, "").encode(), esperado):
+            return web.Response(status=403)
+        try:
+            datos = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="JSON inválido")
+        update = Update.de_json(datos, application.bot)
+        if update is None:
+            return web.Response(status=400, text="Update vacío")
+        # Se responde enseguida; el update se procesa en la Application (concurrent_updates)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def salud(request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "pendientes": application.update_queue.qsize()})
+
+    app_web = web.Application()
+    app_web.router.add_post(ruta, recibir_update)
+    app_web.router.add_get("/salud", salud)
+    return app_web
+
+
+async def iniciar_webhook(
+    application: Application,
+    host: str = WEBHOOK_HOST,
+    puerto: int = WEBHOOK_PUERTO,
+    ruta: str = WEBHOOK_RUTA,
+    url_publica: str = WEBHOOK_URL_PUBLICA,
+    secreto: Optional[str] = None,
+) -> web.AppRunner:
+    """
+    Inicializa y arranca la Application, levanta el servidor HTTP y (si hay
+    url_publica) registra el webhook en Telegram con el secreto. Sin secreto
+    se genera uno si hay url_publica; si no, lanza ValueError antes de arrancar.
+    Retorna el runner para detener_webhook().
+    """
+    if not secreto:
+        if not url_publica:
+            raise ValueError(
+                "El webhook necesita un secreto (WEBHOOK_SECRET en config_secret.py) "
+                "para aceptar updates sin registrarlo en Telegram."
+            )
+        # Telegram acepta 1-256 caracteres A-Z, a-z, 0-9, _ y -
+        secreto = secrets.token_urlsafe(32)
+        logger.info("Sin WEBHOOK_SECRET: se generó un secreto para esta ejecución del webhook.")
+
+    await application.initialize()
+    # post_init/post_shutdown solo los invoca run_polling/run_webhook: aquí se llaman a mano
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    runner = web.AppRunner(crear_app_web(application, ruta, secreto))
+    await runner.setup()
+    await web.TCPSite(runner, host, puerto).start()
+
+    if url_publica:
+        await application.bot.set_webhook(
+            url=url_publica.rstrip("/") + ruta,
+            secret_token=secreto,
+            max_connections=WEBHOOK_MAX_CONEXIONES,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Webhook registrado en {url_publica.rstrip('/')}{ruta}")
+    logger.info(f"Servidor webhook escuchando en http://{host}:{puerto}{ruta}")
+    return runner
+
+
+async def detener_webhook(application: Application, runner: web.AppRunner) -> None:
+    """Deja de aceptar updates, termina los pendientes y cierra la Application."""
+    await runner.cleanup()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+async def ejecutar_webhook(application: Application, secreto: Optional[str] = None) -> None:
+    """Corre el bot en modo webhook hasta recibir SIGINT/SIGTERM."""
+    runner = await iniciar_webhook(application, secreto=secreto)
+    detener = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(senal, detener.set)
+        except NotImplementedError:  # Windows: CTRL+C llega como KeyboardInterrupt
+            pass
+    try:
+        await detener.wait()
+    finally:
+        await detener_webhook(application, runner)
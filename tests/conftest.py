@@ -0,0 +1,31 @@
+"""
+Configuración común de los tests (python -m pytest desde la raíz del repositorio).
+
+Reutilizan los objetos Update/Context falsos de benchmarks/comun.py, que
+además cubre config_secret (no versionado) para poder importar los handlers.
+"""
+import os
+import sys
+
+import pytest
+
+_BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if _BENCHMARKS not in sys.path:
+    sys.path.insert(0, _BENCHMARKS)
+
+from comun import cerrar_bd, usar_bd  # noqa: E402
+
+
+@pytest.fixture
+def bd(tmp_path):
+    """
+    Apunta los handlers a una BD nueva en tmp_path: bd(pool=None) crea el
+    esquema y retorna la ruta. Al terminar el test se cierran pool y executors.
+    """
+    def _usar(pool=None, nombre: str = "contabilidad.db") -> str:
+        db_path = str(tmp_path / nombre)
+        usar_bd(db_path, pool)
+        return db_path
+
+    yield _usar
+    cerrar_bd()
@@ -0,0 +1,39 @@
+"""
+Arranque con el esquema al día: setup_database no toca los datos y los
+updates procesados se cargan con la primera conexión del pool.
+"""
+import sqlite3
+
+from db_manager import setup_database
+from handlers import db_utils
+from handlers.idempotencia import procesados
+
+
+def test_setup_database_al_dia_conserva_los_reportes(bd):
+    db_path = bd()
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO ReportesCache (reporte, version, fragmentos) VALUES ('balance', 1, '[]')")
+    conn.commit()
+    conn.close()
+
+    assert setup_database(db_path) == 0
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM ReportesCache").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def test_primera_conexion_carga_los_updates_procesados(bd):
+    db_path = bd()
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO ProcesadosUpdates (update_id, chat_id, message_id, comando) VALUES (777, 1, 1, 'gasto')")
+    conn.commit()
+    conn.close()
+    procesados.reemplazar([])
+
+    with db_utils.get_db_connection():
+        pass
+
+    assert procesados.contiene(777)
@@ -0,0 +1,83 @@
+"""
+Chequeos de saldo y stock bajo concurrencia.
+
+Sobre una BD nueva:
+  - caja CFG con 1000 USD; se disparan a la vez /gasto de 10 USD mezclados con
+    /cambio de 10 USD de CFG a SC (ambos compiten por el mismo saldo)
+  - producto ESTRES01 con STOCK unidades; se disparan a la vez /venta de 1 unidad
+
+Como el saldo alcanza para exactamente 100 débitos y el stock para STOCK
+ventas, el resultado correcto es determinista: saldo y stock terminan en 0,
+nunca negativos, y el número de operaciones aplicadas es exacto.
+"""
+import asyncio
+import sqlite3
+
+import pytest
+
+from comun import contexto_falso, update_falso, cerrar_bd
+from handlers import db_utils
+from handlers.contabilidad import ingreso_command, gasto_command, cambio_command
+from handlers.inventario import entrada_command, venta_command
+
+SALDO_INICIAL = 1000.0
+MONTO = 10.0
+PRODUCTO = "ESTRES01"
+DEBITOS = 200  # Gastos y cambios sobre CFG/USD: el doble de los que alcanza el saldo
+VENTAS = 120
+STOCK = 50
+
+
+async def _disparar() -> None:
+    await ingreso_command(update_falso(), contexto_falso([str(SALDO_INICIAL), "usd", "cfg"]))
+    await entrada_command(update_falso(), contexto_falso([PRODUCTO, str(STOCK), "1", "usd", "cfg", "PROV", "estrés"]))
+
+    tareas = []
+    for i in range(DEBITOS):
+        if i % 4 == 3:
+            tareas.append(cambio_command(update_falso(), contexto_falso([str(MONTO), "usd", "cfg", "usd", "sc", "estrés"])))
+        else:
+            tareas.append(gasto_command(update_falso(), contexto_falso([str(MONTO), "usd", "cfg", f"estrés {i}"])))
+    for i in range(VENTAS):
+        tareas.append(venta_command(update_falso(), contexto_falso([PRODUCTO, "1", "5", "usd", "sc", f"cliente {i}"])))
+    await asyncio.gather(*tareas)
+
+
+@pytest.fixture
+def estres(bd):
+    """Dispara todas las operaciones a la vez y retorna una conexión a la BD resultante."""
+    db_path = bd()
+    asyncio.run(_disparar())
+    cerrar_bd()
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def test_debitos_concurrentes_no_dejan_saldo_negativo(estres):
+    debitos = estres.execute(
+        "SELECT COUNT(*) FROM Movimientos WHERE caja = 'cfg' AND moneda = 'usd' AND tipo IN ('gasto', 'traspaso')"
+    ).fetchone()[0]
+    saldo_cfg = estres.execute("SELECT saldo FROM SaldosCaja WHERE caja = 'cfg' AND moneda = 'usd'").fetchone()[0]
+
+    assert saldo_cfg >= -db_utils.TOLERANCIA_SALDO
+    assert saldo_cfg == pytest.approx(0.0)
+    assert debitos == int(SALDO_INICIAL // MONTO)
+
+
+def test_cambios_concurrentes_suman_en_la_caja_destino(estres):
+    entradas = estres.execute(
+        "SELECT COUNT(*) FROM Movimientos WHERE caja = 'sc' AND moneda = 'usd' AND tipo = 'traspaso_entrada'"
+    ).fetchone()[0]
+    saldo_sc = estres.execute("SELECT saldo FROM SaldosCaja WHERE caja = 'sc' AND moneda = 'usd'").fetchone()[0]
+
+    assert entradas > 0
+    assert saldo_sc == pytest.approx(entradas * MONTO + STOCK * 5)
+
+
+def test_ventas_concurrentes_no_dejan_stock_negativo(estres):
+    ventas = estres.execute("SELECT COUNT(*) FROM VentaDetalle WHERE codigo = ?", (PRODUCTO,)).fetchone()[0]
+    stock_final = estres.execute("SELECT stock FROM Productos WHERE codigo = ?", (PRODUCTO,)).fetchone()[0]
+
+    assert stock_final == pytest.approx(0.0)
+    assert ventas == STOCK
@@ -0,0 +1,45 @@
+"""
+Costo de lo consignado: /consignar guarda el costo de los lotes que salen
+(FIFO) y la venta consignada lo registra como su CMV.
+"""
+import asyncio
+import sqlite3
+
+import pytest
+
+from comun import contexto_falso, update_falso, cerrar_bd
+from handlers.inventario import consignar_command, entrada_command, venta_command
+
+
+async def _ejecutar(*comandos) -> None:
+    for handler, args in comandos:
+        await handler(update_falso(), contexto_falso(args.split()))
+
+
+def test_venta_consignada_registra_el_costo_de_los_lotes(bd):
+    db_path = bd()
+    asyncio.run(_ejecutar(
+        (entrada_command, "CONS01 10 2 usd cfg PEDRO lote 1"),
+        (entrada_command, "CONS01 10 4 usd cfg PEDRO lote 2"),
+        # 8 del lote a 2 USD; después 2 a 2 USD y 2 a 4 USD: 28 USD por 12 unidades
+        (consignar_command, "CONS01 8 MARIA 9 usd semana 1"),
+        (consignar_command, "CONS01 4 MARIA 9 usd semana 2"),
+        (venta_command, "CONS01 6 60 usd sc MARIA"),
+    ))
+    cerrar_bd()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        costo, moneda_costo, stock = conn.execute(
+            "SELECT costo_unitario, moneda_costo, stock FROM Consignaciones WHERE codigo = 'CONS01' AND vendedor = 'MARIA'"
+        ).fetchone()
+        cmv, moneda_cmv, es_consignada = conn.execute(
+            "SELECT cmv, moneda_cmv, es_consignada FROM VentaDetalle WHERE codigo = 'CONS01'"
+        ).fetchone()
+        cmv_usd = conn.execute("SELECT SUM(cmv_usd) FROM GananciaDiaria WHERE codigo = 'CONS01'").fetchone()[0]
+    finally:
+        conn.close()
+
+    assert (costo, moneda_costo, stock) == (pytest.approx(28 / 12), 'usd', 6)
+    assert (cmv, moneda_cmv, es_consignada) == (pytest.approx(14.0), 'usd', 1)
+    assert cmv_usd == pytest.approx(14.0)
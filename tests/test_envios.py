@@ -0,0 +1,44 @@
+"""
+Respuestas por la cola de envíos: responder() encola sin esperar a Telegram y
+BotEncolado.send_message conserva el contrato de la Bot API (retorna el Message).
+"""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from telegram import Chat, Message
+from telegram.constants import ParseMode
+from telegram.ext import ExtBot
+
+from handlers.envios import BotEncolado, responder, responder_html
+
+
+def _bot_y_cola() -> tuple:
+    encolados = []
+    cola = SimpleNamespace(encolar=lambda chat_id, enviar: encolados.append((chat_id, enviar.keywords)))
+    return BotEncolado(token="123456:TEST", cola=cola), encolados
+
+
+def _mensaje(bot) -> Message:
+    mensaje = Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type=Chat.PRIVATE))
+    mensaje.set_bot(bot)
+    return mensaje
+
+
+def test_send_message_sigue_siendo_el_de_la_bot_api():
+    assert BotEncolado.send_message is ExtBot.send_message
+
+
+def test_responder_encola_en_el_chat_del_mensaje():
+    bot, encolados = _bot_y_cola()
+
+    async def _responder():
+        await responder(_mensaje(bot), "hola")
+        await responder_html(_mensaje(bot), "<b>hola</b>")
+
+    asyncio.run(_responder())
+
+    assert encolados == [
+        (42, {"chat_id": 42, "text": "hola"}),
+        (42, {"chat_id": 42, "text": "<b>hola</b>", "parse_mode": ParseMode.HTML}),
+    ]
@@ -0,0 +1,117 @@
+"""
+Gramáticas de los comandos (handlers/argumentos.py): casos válidos e inválidos
+de cada comando, sin abrir la BD.
+"""
+from datetime import date
+
+import pytest
+
+from handlers.argumentos import ErrorArgumentos
+from handlers.contabilidad import (
+    ARGS_SET_TASA, ARGS_INGRESO, ARGS_GASTO, ARGS_CAMBIO, ARGS_PAGO_VENDEDOR, ARGS_PAGO_PROVEEDOR, ARGS_HISTORIAL,
+    ARGS_VERIFICAR_SALDOS, ARGS_EXPORTAR, ARGS_CIERRE,
+)
+from handlers.inventario import ARGS_ENTRADA, ARGS_VENTA, ARGS_CONSIGNAR, ARGS_STOCK_CONSIGNADO, ARGS_GANANCIA
+from handlers.lote import parsear_lote
+from handlers.metricas import ARGS_METRICS
+
+# (gramática, argumentos, campos esperados)
+VALIDOS = [
+    (ARGS_SET_TASA, "1 410", (("base", "1"), ("tasa_cup", 410.0))),
+    (ARGS_INGRESO, "100 USD cfg", (("monto", 100.0), ("moneda", "usd"), ("caja", "cfg"))),
+    (ARGS_GASTO, "20 usd cfg taxi al puerto", (("descripcion", "taxi al puerto"),)),
+    (ARGS_CAMBIO, "100 usd cfg cup sc cambio", (("moneda_destino", "cup"), ("motivo", "cambio"))),
+    (ARGS_PAGO_VENDEDOR, "juan 50 usd sc", (("vendedor", "JUAN"), ("nota", ""))),
+    (ARGS_HISTORIAL, "", (("dias", 7),)),
+    (ARGS_HISTORIAL, "36500", (("dias", 36500),)),
+    (ARGS_ENTRADA, "huevos 100 0.5 usd cfg pedro lote 45", (("codigo", "HUEVOS"), ("cantidad", 100), ("proveedor", "PEDRO"))),
+    (ARGS_VENTA, "huevos 10 8 usd sc juan", (("unidades", 10.0), ("extra", ["juan"]))),
+    (ARGS_CONSIGNAR, "huevos 20 juan 0.8 usd semana", (("vendedor", "JUAN"), ("precio_venta", 0.8))),
+    (ARGS_STOCK_CONSIGNADO, "maria", (("vendedor", "MARIA"),)),
+    (ARGS_GANANCIA, "", (("mes", None), ("desde", None), ("hasta", None))),
+    (ARGS_GANANCIA, "MES", (("mes", "mes"), ("desde", None))),
+    (ARGS_GANANCIA, "2025-11-01", (("mes", None), ("desde", date(2025, 11, 1)), ("hasta", None))),
+    (ARGS_GANANCIA, "2025-11-01 2025-11-30", (("desde", date(2025, 11, 1)), ("hasta", date(2025, 11, 30)))),
+    (ARGS_VERIFICAR_SALDOS, "", (("reparar", None),)),
+    (ARGS_VERIFICAR_SALDOS, "REPARAR", (("reparar", "reparar"),)),
+    (ARGS_EXPORTAR, "", (("desde", None), ("hasta", None), ("tabla", "movimientos"))),
+    (ARGS_EXPORTAR, "2025-11-01 2025-11-30 deudas",
+     (("desde", date(2025, 11, 1)), ("hasta", date(2025, 11, 30)), ("tabla", "deudas"))),
+    (ARGS_EXPORTAR, "2025-11-01", (("desde", date(2025, 11, 1)), ("hasta", None))),
+    (ARGS_EXPORTAR, "productos", (("desde", None), ("tabla", "productos"))),
+    (ARGS_CIERRE, "", (("corte", None), ("confirmar", None))),
+    (ARGS_CIERRE, "2025-10", (("corte", date(2025, 11, 1)), ("confirmar", None))),
+    (ARGS_CIERRE, "2024-12 confirmar", (("corte", date(2025, 1, 1)), ("confirmar", "confirmar"))),
+    (ARGS_CIERRE, "2025-10-15 confirmar", (("corte", date(2025, 10, 16)),)),
+    (ARGS_CIERRE, "confirmar", (("corte", None), ("confirmar", "confirmar"))),
+    (ARGS_METRICS, "", (("reiniciar", None),)),
+    (ARGS_METRICS, "Reiniciar", (("reiniciar", "reiniciar"),)),
+]
+
+INVALIDOS = [
+    (ARGS_SET_TASA, "2 410"),
+    (ARGS_SET_TASA, "1 410 extra"),
+    (ARGS_INGRESO, "100 usd"),
+    (ARGS_INGRESO, "-5 usd cfg"),
+    (ARGS_INGRESO, "cien usd cfg"),
+    (ARGS_INGRESO, "inf usd cfg"),
+    (ARGS_INGRESO, "nan usd cfg"),
+    (ARGS_GASTO, "20 usd cfg"),
+    (ARGS_GASTO, "20 eur cfg taxi"),
+    (ARGS_GASTO, "1e400 usd cfg taxi"),
+    (ARGS_CAMBIO, "100 usd cfg usd cfg cambio"),
+    (ARGS_PAGO_PROVEEDOR, "pedro 50 usd sc"),
+    (ARGS_HISTORIAL, "0"),
+    (ARGS_HISTORIAL, "36501"),
+    (ARGS_HISTORIAL, "999999999999"),
+    (ARGS_ENTRADA, "huevos 1.5 0.5 usd cfg pedro lote"),
+    (ARGS_VENTA, "huevos 10 8 usd"),
+    (ARGS_VENTA, "huevos inf 8 usd sc"),
+    (ARGS_CONSIGNAR, "huevos 20 juan 0.8 usd"),
+    (ARGS_STOCK_CONSIGNADO, ""),
+    (ARGS_GANANCIA, "semana"),
+    (ARGS_GANANCIA, "mes 2025-11-01"),
+    (ARGS_GANANCIA, "2025-11-30 2025-11-01"),
+    (ARGS_GANANCIA, "2999-01-01"),
+    (ARGS_GANANCIA, "2025-11-01 2025-11-30 extra"),
+    (ARGS_VERIFICAR_SALDOS, "arreglar"),
+    (ARGS_VERIFICAR_SALDOS, "reparar ya"),
+    (ARGS_EXPORTAR, "2025-11-30 2025-11-01"),
+    (ARGS_EXPORTAR, "2025-11-01 productos"),
+    (ARGS_EXPORTAR, "2025-13-01"),
+    (ARGS_EXPORTAR, "ventas"),
+    (ARGS_EXPORTAR, "2025-11-01 2025-11-30 deudas extra"),
+    (ARGS_CIERRE, "2025-13"),
+    (ARGS_CIERRE, "2999-01"),
+    (ARGS_CIERRE, "2025-10 ya"),
+    (ARGS_METRICS, "foo"),
+    (ARGS_METRICS, "reiniciar ya"),
+]
+
+
+@pytest.mark.parametrize("gramatica, texto, esperado", VALIDOS, ids=lambda v: getattr(v, "nombre", None))
+def test_acepta_argumentos_validos(gramatica, texto, esperado):
+    resultado = gramatica.parsear(texto.split())
+    assert {campo: getattr(resultado, campo) for campo, _ in esperado} == dict(esperado)
+
+
+@pytest.mark.parametrize("gramatica, texto", INVALIDOS, ids=lambda v: getattr(v, "nombre", None))
+def test_rechaza_argumentos_invalidos(gramatica, texto):
+    with pytest.raises(ValueError):
+        gramatica.parsear(texto.split())
+
+
+def test_opcional_que_no_encaja_reporta_su_error():
+    with pytest.raises(ErrorArgumentos, match="Periodo no reconocido"):
+        ARGS_CIERRE.parsear(["2025-13", "confirmar"])
+
+
+def test_uso_muestra_los_literales_opcionales_entre_corchetes():
+    assert ARGS_VERIFICAR_SALDOS.uso == "/verificar_saldos [reparar]"
+    assert ARGS_CIERRE.uso == "/cierre [AAAA-MM | AAAA-MM-DD] [confirmar]"
+    assert ARGS_SET_TASA.uso == "/set_tasa 1 [tasa_cup]"
+
+
+def test_lote_usa_las_mismas_gramaticas():
+    with pytest.raises(ValueError, match="Línea 1"):
+        parsear_lote([["gasto", "20", "usd", "cfg"]])
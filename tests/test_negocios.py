@@ -0,0 +1,40 @@
+"""
+Cada negocio tiene su BD: sus cachés en memoria y el lock de /cierre son
+propios y no se cruzan con los de la BD principal ni con los de otro negocio.
+"""
+import pytest
+
+from db_manager import setup_database
+from handlers import db_utils, negocios
+from handlers.negocios import en_negocio, ruta_negocio
+
+
+@pytest.fixture
+def pool_negocios(bd, tmp_path, monkeypatch):
+    bd()
+    monkeypatch.setattr(negocios, "NEGOCIOS_DIR", str(tmp_path / "negocios"))
+    pool = db_utils.PoolNegocios()
+    monkeypatch.setattr(db_utils, "pool_negocios", pool)
+    yield pool
+    pool.cerrar()
+
+
+def test_clave_cierre_por_negocio():
+    with en_negocio("bodega"):
+        bodega = db_utils.clave_cierre()
+    with en_negocio("cafeteria"):
+        cafeteria = db_utils.clave_cierre()
+    assert len({bodega, cafeteria, db_utils.clave_cierre()}) == 3
+
+
+def test_setup_database_invalida_las_caches_del_negocio(pool_negocios):
+    with en_negocio("bodega"):
+        pool = pool_negocios.tomar("bodega")
+        pool_negocios.soltar("bodega")
+        db_utils.cache_actual('tasa').valor = 400.0
+    db_utils.db_pool.cache('tasa').valor = 300.0
+
+    setup_database(ruta_negocio("bodega"))
+
+    assert pool.cache('tasa').valor is None
+    assert db_utils.db_pool.cache('tasa').valor == 300.0
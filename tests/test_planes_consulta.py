@@ -0,0 +1,143 @@
+"""
+Regresión de planes de consulta.
+
+Ejecuta una sesión con todos los comandos del bot sobre una BD temporal,
+captura cada sentencia SQL que emiten los handlers y corre
+EXPLAIN QUERY PLAN sobre ella: falla si alguna consulta recorre una tabla
+completa sin índice ("SCAN <tabla>").
+"""
+import asyncio
+import re
+import sqlite3
+
+from comun import contexto_falso, update_falso, cerrar_bd
+from handlers import db_utils
+from handlers import contabilidad, inventario
+
+# Sesión que recorre todas las ramas de los handlers con acceso a BD
+SESION = [
+    (contabilidad.set_tasa_command, "1 410"),
+    (contabilidad.ingreso_command, "500 usd cfg"),
+    (contabilidad.ingreso_command, "100000 cup sc"),
+    (contabilidad.gasto_command, "30 usd cfg renta"),
+    (contabilidad.gasto_command, "9999 usd cfg sin saldo"),
+    (inventario.entrada_command, "ZAP01 10 5 usd cfg PEDRO lote 1"),
+    (inventario.entrada_command, "ZAP01 5 6 usd cfg PEDRO lote 2"),
+    (inventario.venta_command, "ZAP01 2 30 usd sc cliente"),
+    (inventario.consignar_command, "ZAP01 3 MARIA 8 usd nota"),
+    (inventario.consignar_command, "ZAP01 1 MARIA 8 usd nota"),
+    (inventario.venta_command, "ZAP01 1 10 usd sc MARIA"),
+    (contabilidad.cambio_command, "10 usd cfg cup trd cambio"),
+    (contabilidad.pago_proveedor_command, "PEDRO 20 usd cfg pago"),
+    (contabilidad.pago_vendedor_command, "MARIA 2 usd cfg nota"),
+    (contabilidad.balance_command, ""),
+    (contabilidad.verificar_saldos_command, "reparar"),
+    (contabilidad.deudas_command, ""),
+    (contabilidad.deudas_command, "MARIA"),
+    (inventario.stock_command, ""),
+    (inventario.stock_consignado_command, "MARIA"),
+    (contabilidad.historial_command, "30"),
+    (contabilidad.historial_pagina_callback, "hist:30:2:s:4000:2099-01-01 00:00:00"),
+    (contabilidad.historial_pagina_callback, "hist:30:1:a:10:2000-01-01 00:00:00"),
+    (inventario.ganancia_command, ""),
+    (contabilidad.exportar_command, ""),
+    (contabilidad.exportar_command, "2020-01-01 2099-12-31 movimientos"),
+    (contabilidad.cierre_command, "2020-01"),
+    (contabilidad.cierre_command, "2020-01 confirmar"),
+]
+
+# Sentencias sin plan interesante (escrituras puntuales, PRAGMAs, control de transacción)
+_IGNORAR = re.compile(r"^\s*(PRAGMA|BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|CREATE|INSERT\s+INTO\s+\w+\s*\([^)]*\)\s*VALUES)", re.I)
+# Un paso "SCAN <tabla>" sin índice es un recorrido completo de la tabla
+_SCAN_COMPLETO = re.compile(r"^SCAN ([\w.]+)(?: AS \w+)?$")
+# ...salvo si es el resultado de una subconsulta (ej. la fila de versiones de ReportesManager.leer)
+_SUBCONSULTA = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)$")
+# Recorridos completos a propósito: carga y reconciliación de la caché de inventario,
+# DeudasTotales (a lo sumo una fila por tipo y moneda) y su verificación contra Deudas
+_RECORRIDOS_ESPERADOS = {
+    "SELECT codigo, nombre, stock, costo_unitario, moneda_costo FROM Productos",
+    "SELECT tipo, moneda, total, actores FROM DeudasTotales",
+    "SELECT tipo, moneda, total, actores FROM DeudasTotales WHERE actores > 0 ORDER BY tipo, moneda",
+    "SELECT tipo, moneda, SUM(monto_pendiente) AS total, SUM(monto_pendiente > 0.005) AS actores "
+    "FROM Deudas GROUP BY tipo, moneda",
+}
+
+
+class PoolTrazado(db_utils.ConnectionPool):
+    """Pool que registra cada sentencia SQL ejecutada por los handlers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sentencias = []
+
+    def _crear_conexion(self) -> sqlite3.Connection:
+        conn = super()._crear_conexion()
+        conn.set_trace_callback(self.sentencias.append)
+        return conn
+
+
+def _poblar(db_path: str) -> None:
+    """Carga volumen suficiente para que el planificador elija como en producción."""
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO Movimientos (tipo, monto, moneda, caja, user_id, descripcion) VALUES (?, ?, ?, ?, ?, ?)",
+        [(('ingreso', 'gasto', 'venta')[i % 3], 1.0, 'usd', ('cfg', 'sc', 'trd')[i % 3], 1, 'carga')
+         for i in range(5000)]
+    )
+    conn.executemany(
+        "INSERT INTO Productos (codigo, nombre, costo_unitario, moneda_costo, stock) VALUES (?, ?, 1, 'usd', ?)",
+        [(f"P{i:05d}", f"P{i:05d}", i % 2) for i in range(2000)]
+    )
+    conn.executemany(
+        "INSERT INTO Deudas (actor_id, tipo, monto_pendiente, moneda) VALUES (?, ?, ?, 'usd')",
+        [(f"A{i:05d}", ('POR_PAGAR', 'POR_COBRAR')[i % 2], i % 3) for i in range(2000)]
+    )
+    conn.executemany(
+        "INSERT INTO Consignaciones (codigo, vendedor, stock, precio_unitario, moneda) VALUES (?, ?, ?, 1, 'usd')",
+        [(f"P{i:05d}", f"V{i % 50:03d}", i % 2) for i in range(2000)]
+    )
+    db_utils.MovimientoManager.reconstruir_saldos(conn)
+    db_utils.DeudaManager.inicializar_diario(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def _plan(conn: sqlite3.Connection, sentencia: str) -> list:
+    return [fila[3] for fila in conn.execute(f"EXPLAIN QUERY PLAN {sentencia}")]
+
+
+
+def test_ninguna_consulta_recorre_una_tabla_completa(bd):
+    pool = PoolTrazado()
+    db_path = bd(pool)
+    _poblar(db_path)
+
+    async def _sesion():
+        for handler, args in SESION:
+            if args.startswith(f"{contabilidad.HISTORIAL_CALLBACK}:"):
+                await handler(update_falso(callback_data=args), contexto_falso([]))
+            else:
+                await handler(update_falso(), contexto_falso(args.split()))
+
+    asyncio.run(_sesion())
+    cerrar_bd()
+
+    conn = db_utils.adjuntar_archivo(sqlite3.connect(db_path), db_path)
+    vistas = set()
+    fallos = []
+    try:
+        for sentencia in pool.sentencias:
+            normalizada = " ".join(sentencia.split())
+            if normalizada in vistas or _IGNORAR.match(normalizada) or normalizada in _RECORRIDOS_ESPERADOS:
+                continue
+            vistas.add(normalizada)
+            plan = _plan(conn, normalizada)
+            subconsultas = {m.group(1) for paso in plan if (m := _SUBCONSULTA.match(paso))}
+            if any((m := _SCAN_COMPLETO.match(paso)) and m.group(1) not in subconsultas for paso in plan):
+                fallos.append(f"{normalizada}\n    " + "\n    ".join(plan))
+    finally:
+        conn.close()
+
+    assert vistas, "la sesión no ejecutó ninguna consulta"
+    assert not fallos, f"{len(fallos)} de {len(vistas)} consultas recorren una tabla completa:\n" + "\n".join(fallos)
@@ -0,0 +1,38 @@
+"""
+El endpoint del webhook solo acepta POST con el secreto en CABECERA_SECRETO.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from servidor_webhook import CABECERA_SECRETO, crear_app_web, iniciar_webhook
+
+SECRETO = "secreto-test"
+UPDATE = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "/balance"}}
+
+
+async def _post(cabeceras: dict) -> tuple:
+    application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+    async with TestClient(TestServer(crear_app_web(application, "/telegram", SECRETO))) as cliente:
+        respuesta = await cliente.post("/telegram", json=UPDATE, headers=cabeceras)
+        return respuesta.status, application.update_queue.qsize()
+
+
+@pytest.mark.parametrize("cabeceras", [{}, {CABECERA_SECRETO: ""}, {CABECERA_SECRETO: "otro"}])
+def test_rechaza_post_sin_el_secreto(cabeceras):
+    assert asyncio.run(_post(cabeceras)) == (403, 0)
+
+
+def test_acepta_post_con_el_secreto():
+    assert asyncio.run(_post({CABECERA_SECRETO: SECRETO})) == (200, 1)
+
+
+@pytest.mark.parametrize("secreto", [None, ""])
+def test_no_arranca_sin_secreto(secreto):
+    with pytest.raises(ValueError):
+        crear_app_web(SimpleNamespace(), "/telegram", secreto)
+    # Sin URL pública no hay dónde registrar uno generado: no arranca
+    with pytest.raises(ValueError):
+        asyncio.run(iniciar_webhook(SimpleNamespace(), url_publica="", secreto=secreto))